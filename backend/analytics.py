@@ -0,0 +1,239 @@
+"""Columnar snapshots for offline reporting.
+
+An export job writes each finished UTC day of transactions, orders, reseller orders and
+gift card orders to `<ANALYTICS_DIR>/<collection>/date=YYYY-MM-DD/part.parquet`, with the
+column types fixed by `SNAPSHOTS`. Days are exported once they are `SETTLE_HOURS` old,
+so late status changes (expiry, refunds) are included.
+
+The reports below are computed from those files with pandas, so heavy admin reporting
+reads disk instead of competing with purchases for Mongo. They cover whole days up to
+the last exported one; run them off the event loop (`asyncio.to_thread`).
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import archive
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_DIR = Path(os.environ.get('ANALYTICS_DIR', Path(__file__).parent / 'analytics_snapshots'))
+EXPORT_INTERVAL_SECONDS = int(os.environ.get('ANALYTICS_EXPORT_INTERVAL_SECONDS', 3600))
+BACKFILL_DAYS = int(os.environ.get('ANALYTICS_BACKFILL_DAYS', 30))
+SETTLE_HOURS = 1
+
+DATETIME = 'datetime64[ns, UTC]'
+DEPOSIT_TYPES = ['deposit_ngn', 'deposit_usd', 'crypto_deposit', 'bank_deposit', 'card_deposit']
+REFUNDED_STATUSES = ['cancelled', 'refunded']
+
+# {collection: {column: (Mongo projection expression, dtype)}}
+SNAPSHOTS: Dict[str, Dict[str, Tuple[object, str]]] = {
+    'transactions': {
+        'id': ('$id', 'string'),
+        'user_id': ('$user_id', 'string'),
+        'type': ('$type', 'string'),
+        'amount': ('$amount', 'Float64'),
+        'currency': ('$currency', 'string'),
+        'status': ('$status', 'string'),
+        'reference': ('$reference', 'string'),
+        'service': ('$metadata.service', 'string'),
+        'provider': ('$metadata.provider', 'string'),
+        'created_at': ('$created_at', DATETIME),
+    },
+    'sms_orders': {
+        'id': ('$id', 'string'),
+        'user_id': ('$user_id', 'string'),
+        'provider': ('$provider', 'string'),
+        'server': ('$server', 'string'),
+        'service': ('$service', 'string'),
+        'country': ('$country', 'string'),
+        'status': ('$status', 'string'),
+        'has_otp': ({'$gt': ['$otp', None]}, 'boolean'),
+        'cost_usd': ('$cost_usd', 'Float64'),
+        'provider_cost': ('$provider_cost', 'Float64'),
+        'charged_amount': ('$charged_amount', 'Float64'),
+        'charged_currency': ('$charged_currency', 'string'),
+        'created_at': ('$created_at', DATETIME),
+    },
+    'reseller_orders': {
+        'id': ('$id', 'string'),
+        'reseller_id': ('$reseller_id', 'string'),
+        'user_id': ('$user_id', 'string'),
+        'provider': ('$provider', 'string'),
+        'service': ('$service', 'string'),
+        'country': ('$country', 'string'),
+        'status': ('$status', 'string'),
+        'has_otp': ({'$gt': ['$otp', None]}, 'boolean'),
+        'cost_ngn': ('$cost_ngn', 'Float64'),
+        'provider_cost': ('$provider_cost', 'Float64'),
+        'created_at': ('$created_at', DATETIME),
+    },
+    'giftcard_orders': {
+        'transaction_id': ('$transaction_id', 'string'),
+        'user_id': ('$user_id', 'string'),
+        'product_id': ('$product_id', 'string'),
+        'brand_name': ('$brand_name', 'string'),
+        'quantity': ('$quantity', 'Int64'),
+        'unit_price': ('$unit_price', 'Float64'),
+        'total_usd': ('$total_usd', 'Float64'),
+        'total_ngn': ('$total_ngn', 'Float64'),
+        'status': ('$status', 'string'),
+        'created_at': ('$created_at', DATETIME),
+    },
+}
+
+
+def _partition(collection: str, day: date) -> Path:
+    return ANALYTICS_DIR / collection / f'date={day.isoformat()}' / 'part.parquet'
+
+
+def to_frame(collection: str, rows: List[dict]) -> pd.DataFrame:
+    """Rows as a DataFrame with the snapshot's column types"""
+    spec = SNAPSHOTS[collection]
+    df = pd.DataFrame.from_records(rows, columns=list(spec))
+    for column, (_, dtype) in spec.items():
+        if dtype == DATETIME:
+            df[column] = pd.to_datetime(df[column], utc=True, errors='coerce', format='ISO8601')
+        elif dtype in ('Float64', 'Int64'):
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(dtype)
+        elif dtype == 'string':
+            df[column] = df[column].map(lambda v: None if v is None else str(v)).astype('string')
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _write(path: Path, df: pd.DataFrame):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write aside and rename so readers never see a half-written file
+    tmp = path.with_name(f'.{uuid.uuid4().hex}.tmp')
+    df.to_parquet(tmp, engine='pyarrow', compression='zstd', index=False)
+    os.replace(tmp, path)
+
+
+async def export_day(db, collection: str, day: date) -> int:
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    match = {'created_at': {'$gte': start.isoformat(), '$lt': (start + timedelta(days=1)).isoformat()}}
+    stages = [{'$project': {'_id': 0, **{column: expr for column, (expr, _) in SNAPSHOTS[collection].items()}}}]
+    if collection in archive.RULES:
+        rows = await archive.aggregate(db, collection, match, stages, start)
+    else:
+        rows = await db[collection].aggregate([{'$match': match}, *stages]).to_list(None)
+    df = await asyncio.to_thread(to_frame, collection, rows)
+    await asyncio.to_thread(_write, _partition(collection, day), df)
+    return len(df)
+
+
+def _pending_days(collection: str) -> List[date]:
+    last = (datetime.now(timezone.utc) - timedelta(days=1, hours=SETTLE_HOURS)).date()
+    days = [last - timedelta(days=offset) for offset in range(BACKFILL_DAYS)]
+    return [day for day in reversed(days) if not _partition(collection, day).exists()]
+
+
+async def run_exports(db):
+    while True:
+        for collection in SNAPSHOTS:
+            for day in _pending_days(collection):
+                try:
+                    rows = await export_day(db, collection, day)
+                    logger.info(f"Exported {rows} {collection} rows for {day}")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Analytics export of {collection} for {day} failed: {e}")
+        await asyncio.sleep(EXPORT_INTERVAL_SECONDS)
+
+
+def load(collection: str, start: date, end: date) -> pd.DataFrame:
+    """Snapshot rows created from `start` to `end` (inclusive days)"""
+    frames = []
+    day = start
+    while day <= end:
+        path = _partition(collection, day)
+        if path.exists():
+            frames.append(pd.read_parquet(path, engine='pyarrow'))
+        day += timedelta(days=1)
+    if not frames:
+        return to_frame(collection, [])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _flag(mask: pd.Series) -> pd.Series:
+    """Nullable boolean mask as plain bools, missing values False"""
+    return mask.fillna(False).astype(bool)
+
+
+def _to_ngn(amount: pd.Series, currency: pd.Series, ngn_rate: float) -> pd.Series:
+    amount = amount.fillna(0).astype(float)
+    return amount.mask(_flag(currency == 'USD'), amount * ngn_rate)
+
+
+def cohort_deposits(start: date, end: date, ngn_rate: float) -> List[dict]:
+    """Deposits per month, grouped by the month of each user's first deposit in the range"""
+    txns = load('transactions', start, end)
+    deposits = txns[_flag(txns['type'].isin(DEPOSIT_TYPES) & (txns['status'] == 'completed'))].copy()
+    if deposits.empty:
+        return []
+    deposits['amount_ngn'] = _to_ngn(deposits['amount'], deposits['currency'], ngn_rate)
+    deposits['month'] = deposits['created_at'].dt.strftime('%Y-%m')
+    deposits['cohort'] = deposits.groupby('user_id')['created_at'].transform('min').dt.strftime('%Y-%m')
+    table = (
+        deposits.groupby(['cohort', 'month'])
+        .agg(depositors=('user_id', 'nunique'), deposits=('id', 'size'), deposits_ngn=('amount_ngn', 'sum'))
+        .reset_index()
+    )
+    return table.astype({'depositors': int, 'deposits': int, 'deposits_ngn': float}).to_dict('records')
+
+
+def service_revenue(start: date, end: date, ngn_rate: float) -> List[dict]:
+    """Orders, revenue, provider cost and margin per service; refunded orders earn nothing"""
+    orders = load('sms_orders', start, end)
+    if orders.empty:
+        return []
+    kept = ~_flag(orders['status'].isin(REFUNDED_STATUSES))
+    orders['revenue_ngn'] = _to_ngn(orders['charged_amount'], orders['charged_currency'], ngn_rate).where(kept, 0.0)
+    orders['provider_cost_ngn'] = (orders['provider_cost'].fillna(0) * ngn_rate).where(kept, 0.0)
+    table = (
+        orders.groupby('service')
+        .agg(orders=('id', 'size'), delivered=('has_otp', 'sum'),
+             revenue_ngn=('revenue_ngn', 'sum'), provider_cost_ngn=('provider_cost_ngn', 'sum'))
+        .reset_index()
+    )
+    table['margin_ngn'] = table['revenue_ngn'] - table['provider_cost_ngn']
+    table = table.sort_values('revenue_ngn', ascending=False)
+    return table.astype({'orders': int, 'delivered': int, 'revenue_ngn': float,
+                         'provider_cost_ngn': float, 'margin_ngn': float}).to_dict('records')
+
+
+def refund_rates(start: date, end: date, ngn_rate: float) -> List[dict]:
+    """Share of orders refunded per provider and service, worst first"""
+    orders = load('sms_orders', start, end)
+    if orders.empty:
+        return []
+    orders['refunded'] = _flag(orders['status'].isin(REFUNDED_STATUSES))
+    table = (
+        orders.groupby(['provider', 'service'])
+        .agg(orders=('id', 'size'), refunded=('refunded', 'sum'))
+        .reset_index()
+    )
+    table['refund_rate'] = (table['refunded'] / table['orders']).round(4)
+    table = table.sort_values(['refund_rate', 'orders'], ascending=False)
+    return table.astype({'orders': int, 'refunded': int, 'refund_rate': float}).to_dict('records')
+
+
+REPORTS: Dict[str, Callable[[date, date, float], List[dict]]] = {
+    'cohort-deposits': cohort_deposits,
+    'service-revenue': service_revenue,
+    'refund-rates': refund_rates,
+}
+
+
+def last_exported_day(collection: str) -> Optional[date]:
+    days = sorted((ANALYTICS_DIR / collection).glob('date=*'))
+    return date.fromisoformat(days[-1].name[len('date='):]) if days else None
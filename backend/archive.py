@@ -0,0 +1,134 @@
+"""Hot/cold archival of finished records.
+
+Finished orders, settled transactions and user notifications older than
+`ARCHIVE_AFTER_DAYS` are moved in batches from their hot collection into
+`<collection>_archive`. The hot collections (and their indexes) then only hold recent
+and still-open records. Archive collections are created with zstd block compression.
+
+A batch is upserted into the archive before it is deleted from the hot collection, so a
+worker dying mid-batch leaves duplicates for the next run to settle, never losses. For
+the same reason `after_archive` hooks may see a record more than once.
+
+Queries over a date range use `aggregate` / `count` below, which only read the archive
+when the range reaches back past the archive horizon.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReplaceOne
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 3600))
+BATCH_SIZE = 500
+BATCH_PAUSE_SECONDS = 0.5       # let foreground traffic through between batches
+SUFFIX = '_archive'
+
+FINISHED_ORDER_STATUSES = ['completed', 'cancelled', 'refunded', 'expired', 'failed']
+
+# Which records of each collection may be archived once they are old enough
+RULES: Dict[str, dict] = {
+    'sms_orders': {'status': {'$in': FINISHED_ORDER_STATUSES}},
+    'reseller_orders': {'status': {'$in': FINISHED_ORDER_STATUSES}},
+    'transactions': {'status': {'$nin': ['pending', 'processing']}},
+    # Broadcasts (no user_id) stay; they are few and shown to everyone
+    'notifications': {'user_id': {'$exists': True}},
+}
+
+AfterArchive = Callable[[List[dict]], Awaitable[None]]
+
+
+def archive_name(collection: str) -> str:
+    return collection + SUFFIX
+
+
+def horizon() -> datetime:
+    """Everything in an archive collection was created before this"""
+    return datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def reaches_archive(start: Optional[datetime]) -> bool:
+    if start is not None and start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    return start is None or start < horizon()
+
+
+async def aggregate(db, collection: str, match: dict, stages: List[dict], start: Optional[datetime], length: Optional[int] = None) -> List[dict]:
+    """`$match` + `stages` over the hot collection, plus its archive if `start` needs it"""
+    pipeline = [{'$match': match}]
+    if reaches_archive(start):
+        pipeline.append({'$unionWith': {'coll': archive_name(collection), 'pipeline': [{'$match': match}]}})
+    return await db[collection].aggregate(pipeline + stages).to_list(length)
+
+
+async def count(db, collection: str, query: dict, start: Optional[datetime]) -> int:
+    total = await db[collection].count_documents(query)
+    if reaches_archive(start):
+        total += await db[archive_name(collection)].count_documents(query)
+    return total
+
+
+class Archiver:
+    def __init__(self, db, after_archive: Optional[Dict[str, AfterArchive]] = None, batch_size: int = BATCH_SIZE):
+        self.db = db
+        self.after_archive = after_archive or {}
+        self.batch_size = batch_size
+
+    async def ensure_collections(self):
+        for collection in RULES:
+            name = archive_name(collection)
+            try:
+                # The collection's own database handle: `db` may be a proxy that only knows collections
+                await self.db[name].database.create_collection(
+                    name, storageEngine={'wiredTiger': {'configString': 'block_compressor=zstd'}}
+                )
+            except CollectionInvalid:
+                pass  # already exists
+            await self.db[name].create_index('created_at')
+            await self.db[name].create_index('id')
+
+    async def archive_batch(self, collection: str) -> int:
+        """Move one batch of archivable records. Returns how many were moved"""
+        query = {**RULES[collection], 'created_at': {'$lt': horizon().isoformat()}}
+        docs = await self.db[collection].find(query).limit(self.batch_size).to_list(self.batch_size)
+        if not docs:
+            return 0
+        await self.db[archive_name(collection)].bulk_write(
+            [ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in docs], ordered=False
+        )
+        await self.db[collection].delete_many({'_id': {'$in': [doc['_id'] for doc in docs]}})
+        hook = self.after_archive.get(collection)
+        if hook:
+            await hook(docs)
+        return len(docs)
+
+    async def archive_all(self):
+        for collection in RULES:
+            moved = 0
+            while True:
+                batch = await self.archive_batch(collection)
+                moved += batch
+                if batch < self.batch_size:
+                    break
+                await asyncio.sleep(BATCH_PAUSE_SECONDS)
+            if moved:
+                logger.info(f"Archived {moved} {collection} records")
+
+    async def run(self):
+        try:
+            await self.ensure_collections()
+        except Exception as e:
+            logger.error(f"Archive collection setup error: {e}")
+        while True:
+            try:
+                await self.archive_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Archive run error: {e}")
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
@@ -0,0 +1,107 @@
+"""Run the pricing benchmarks and report them against the stored baseline.
+
+   cd backend && python -m benchmarks.compare                  # report; exit 1 on a regression
+   cd backend && python -m benchmarks.compare --save-baseline  # store this run as the baseline
+
+benchmarks/baseline.json is pytest-benchmark's JSON of the baseline run plus the fixture
+set it ran on (see `fixtures.describe`). Against a different fixture set, CPU or Python
+the report is printed but not judged; save a new baseline after recording fixtures.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict
+
+from benchmarks import fixtures
+
+BENCHMARKS_DIR = Path(__file__).parent
+BASELINE = BENCHMARKS_DIR / 'baseline.json'
+REGRESSION_THRESHOLD = 0.15     # slowdown of the fastest round that fails the comparison
+
+
+def run() -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / 'run.json'
+        subprocess.run(
+            [sys.executable, '-m', 'pytest', str(BENCHMARKS_DIR), '-q', f'--benchmark-json={out}'],
+            cwd=BENCHMARKS_DIR.parent, check=True,
+        )
+        result = json.loads(out.read_text())
+    # CPU flags say nothing about the timings, and the host name is nobody's business
+    result['machine_info'].get('cpu', {}).pop('flags', None)
+    result['machine_info'].pop('node', None)
+    for bench in result['benchmarks']:
+        bench['stats'].pop('data', None)     # per-round timings; the summary stats are kept
+    result['fixtures'] = fixtures.describe()
+    return result
+
+
+def _fastest(result: dict) -> Dict[str, float]:
+    return {bench['name']: bench['stats']['min'] for bench in result['benchmarks']}
+
+
+def _machine(result: dict) -> tuple:
+    info = result['machine_info']
+    return info.get('cpu', {}).get('brand_raw') or info.get('processor'), info['python_version']
+
+
+def _describe_run(result: dict) -> str:
+    cpu = result['machine_info'].get('cpu', {}).get('brand_raw') or result['machine_info'].get('processor')
+    commit = (result.get('commit_info') or {}).get('id', '')[:10]
+    return f"{result['datetime'][:19]}, commit {commit or '?'}, {cpu}, Python {result['machine_info']['python_version']}"
+
+
+def report(baseline: dict, current: dict, threshold: float) -> bool:
+    """Print the comparison. Returns False when a benchmark regressed beyond `threshold`"""
+    base, now = _fastest(baseline), _fastest(current)
+    print(f"Baseline: {_describe_run(baseline)}")
+    print(f"Current:  {_describe_run(current)}")
+    # The fastest round is the least disturbed by other load on the machine
+    print(f"\nFastest round per benchmark\n{'benchmark':<45}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    regressions = []
+    for name in sorted(base.keys() | now.keys()):
+        if name not in base or name not in now:
+            print(f"{name:<45}{'new' if name not in base else 'removed':>38}")
+            continue
+        change = now[name] / base[name] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<45}{base[name] * 1000:>14.3f}{now[name] * 1000:>14.3f}{change:>+10.1%}{flag}")
+
+    if baseline.get('fixtures') != current['fixtures']:
+        print(f"\nFixture sets differ (baseline {baseline.get('fixtures')}, current {current['fixtures']}); not judged")
+        return True
+    if _machine(baseline) != _machine(current):
+        print("\nBaseline was taken on another CPU or Python; not judged. Save a baseline on this machine to compare")
+        return True
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {threshold:.0%}")
+        return False
+    print(f"\nNo benchmark slower than the baseline by more than {threshold:.0%}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='allowed slowdown (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    current = run()
+    if args.save_baseline:
+        BASELINE.write_text(json.dumps(current, indent=1) + '\n')
+        print(f"✓ Baseline saved to {BASELINE}")
+        return
+    if not BASELINE.exists():
+        sys.exit(f"No baseline at {BASELINE}; run with --save-baseline first")
+    if not report(json.loads(BASELINE.read_text()), current, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
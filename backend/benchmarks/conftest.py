@@ -0,0 +1,41 @@
+"""Micro-benchmarks for the catalog pricing and admin stats hot paths.
+
+Needs pytest-benchmark. The baseline is committed as benchmarks/baseline.json;
+compare a run against it, or store a new one, with
+
+   cd backend && python -m benchmarks.compare
+   cd backend && python -m benchmarks.compare --save-baseline
+"""
+import pytest
+
+from benchmarks import fixtures
+
+
+@pytest.fixture(scope='session')
+def smspool_pricing():
+    return fixtures.load('smspool_pricing_us')
+
+
+@pytest.fixture(scope='session')
+def fivesim_prices():
+    return fixtures.load('fivesim_prices')
+
+
+@pytest.fixture(scope='session')
+def daisysms_prices():
+    return fixtures.load('daisysms_prices')
+
+
+@pytest.fixture(scope='session')
+def tigersms_prices():
+    return fixtures.load('tigersms_prices')
+
+
+@pytest.fixture(scope='session')
+def admin_period():
+    return fixtures.admin_period()
+
+
+@pytest.fixture
+def reseller():
+    return {'id': 'bench', 'plan_name': 'Pro', 'custom_markup_multiplier': None}
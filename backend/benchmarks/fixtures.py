@@ -0,0 +1,131 @@
+"""Provider payload fixtures for the pricing benchmarks.
+
+Recorded payloads (see record_fixtures.py) are read from benchmarks/fixtures/ when
+present. Otherwise a synthetic payload of the same shape and real-world size is
+generated from a fixed seed, so runs stay comparable across machines.
+"""
+import gzip
+import hashlib
+import json
+import random
+import string
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+
+# Sizes observed on the live APIs
+SMSPOOL_SERVICES = 1800        # services priced in the largest country (US)
+SMSPOOL_POOLS_PER_SERVICE = 4
+FIVESIM_COUNTRIES = 150
+FIVESIM_PRODUCTS = 600
+FIVESIM_OPERATORS = 4
+DAISYSMS_SERVICES = 800
+TIGERSMS_COUNTRIES = 180
+TIGERSMS_SERVICES = 700
+ADMIN_USERS = 5000             # the stats endpoint reads up to 5000 new and 5000 old users
+ADMIN_TRANSACTIONS = 20000     # ... and up to 20000 deposits and purchases
+
+
+def _names(rng: random.Random, count: int, length: int = 8) -> List[str]:
+    names = set()
+    while len(names) < count:
+        names.add(''.join(rng.choices(string.ascii_lowercase, k=length)))
+    return sorted(names)
+
+
+def _smspool_pricing(rng: random.Random) -> List[dict]:
+    return [
+        {'service': service_id, 'service_name': f'Service {service_id}', 'country': 1,
+         'pool': pool, 'price': f'{rng.uniform(0.02, 3.0):.2f}'}
+        for service_id in range(1, SMSPOOL_SERVICES + 1)
+        for pool in rng.sample(range(1, 12), SMSPOOL_POOLS_PER_SERVICE)
+    ]
+
+
+def _fivesim_prices(rng: random.Random) -> Dict[str, Any]:
+    countries = _names(rng, FIVESIM_COUNTRIES)
+    products = _names(rng, FIVESIM_PRODUCTS, 6)
+    operators = [f'virtual{i}' for i in range(1, 40)]
+    return {
+        country: {
+            product: {
+                op: {'cost': round(rng.uniform(0.01, 2.5), 4), 'count': rng.randint(0, 5000), 'rate': 90.0}
+                for op in rng.sample(operators, FIVESIM_OPERATORS)
+            }
+            for product in products
+        }
+        for country in countries
+    }
+
+
+def _daisysms_prices(rng: random.Random) -> Dict[str, Any]:
+    return {
+        code: {'187': {'name': code.title(), 'cost': round(rng.uniform(0.1, 3.0), 2),
+                       'retail_price': round(rng.uniform(0.1, 3.0), 2), 'count': rng.randint(0, 900)}}
+        for code in _names(rng, DAISYSMS_SERVICES, 5)
+    }
+
+
+def _tigersms_prices(rng: random.Random) -> Dict[str, Any]:
+    services = _names(rng, TIGERSMS_SERVICES, 3)
+    return {
+        str(country): {code: {'cost': round(rng.uniform(5, 150), 2), 'count': rng.randint(0, 2000)} for code in services}
+        for country in range(TIGERSMS_COUNTRIES)
+    }
+
+
+GENERATORS: Dict[str, Callable[[random.Random], Any]] = {
+    'smspool_pricing_us': _smspool_pricing,
+    'fivesim_prices': _fivesim_prices,
+    'daisysms_prices': _daisysms_prices,
+    'tigersms_prices': _tigersms_prices,
+}
+
+
+def load(name: str) -> Any:
+    path = FIXTURES_DIR / f'{name}.json.gz'
+    if path.exists():
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    return GENERATORS[name](random.Random(name))
+
+
+def describe() -> Dict[str, str]:
+    """Which payloads a run uses: 'synthetic', or 'recorded:<sha256 prefix>' of the recording"""
+    sources = {}
+    for name in GENERATORS:
+        path = FIXTURES_DIR / f'{name}.json.gz'
+        sources[name] = f'recorded:{hashlib.sha256(path.read_bytes()).hexdigest()[:12]}' if path.exists() else 'synthetic'
+    return sources
+
+
+def save(name: str, payload: Any):
+    FIXTURES_DIR.mkdir(exist_ok=True)
+    with gzip.open(FIXTURES_DIR / f'{name}.json.gz', 'wt', encoding='utf-8') as f:
+        json.dump(payload, f)
+
+
+def admin_period(seed: int = 1) -> Dict[str, Any]:
+    """Users and transactions shaped like the admin stats queries return them"""
+    rng = random.Random(seed)
+    new_user_ids = {f'new-{i}' for i in range(ADMIN_USERS)}
+    old_user_ids = {f'old-{i}' for i in range(ADMIN_USERS)}
+    everyone = sorted(new_user_ids | old_user_ids)
+    services = ['wa', 'tg', 'signal', 'go', 'fb', 'ig', 'sg']
+    deposit_txs = [
+        {'user_id': rng.choice(everyone), 'currency': rng.choice(['NGN', 'NGN', 'USD']),
+         'amount': round(rng.uniform(500, 50000), 2)}
+        for _ in range(ADMIN_TRANSACTIONS)
+    ]
+    purchase_txs = [
+        {'user_id': rng.choice(everyone), 'currency': rng.choice(['NGN', 'NGN', 'USD']),
+         'amount': round(rng.uniform(200, 8000), 2), 'metadata': {'service': rng.choice(services)}}
+        for _ in range(ADMIN_TRANSACTIONS)
+    ]
+    return {
+        'deposit_txs': deposit_txs,
+        'purchase_txs': purchase_txs,
+        'new_user_ids': new_user_ids,
+        'old_user_ids': old_user_ids,
+    }
@@ -0,0 +1,84 @@
+"""Record live provider payloads into benchmarks/fixtures/.
+
+Uses the same API keys as the server (read from backend/.env or the environment):
+
+   cd backend && python -m benchmarks.record_fixtures
+
+Payloads are scrubbed before they are written: account fields are dropped and the API
+keys must not appear anywhere in what is saved, so the recordings can be committed.
+
+Re-record when a provider's catalog grows noticeably, and save a new benchmark
+baseline afterwards (`python -m benchmarks.compare --save-baseline`) since the numbers
+are no longer comparable.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, List
+
+import requests
+from dotenv import load_dotenv
+
+from benchmarks.fixtures import save
+
+load_dotenv(Path(__file__).parent.parent / '.env')
+
+SMSPOOL_BASE_URL = os.environ.get('SMSPOOL_BASE_URL', 'https://api.smspool.net')
+FIVESIM_BASE_URL = os.environ.get('FIVESIM_BASE_URL', 'https://5sim.net/v1')
+DAISYSMS_BASE_URL = os.environ.get('DAISYSMS_BASE_URL', 'https://daisysms.com')
+TIGERSMS_BASE_URL = os.environ.get('TIGERSMS_BASE_URL', 'https://api.tiger-sms.com')
+
+
+# Account-level fields some endpoints include next to the prices
+SCRUBBED_FIELDS = {'api_key', 'apikey', 'token', 'key', 'balance', 'email', 'phone', 'user', 'user_id', 'username'}
+
+
+def scrub(payload: Any, secrets: List[str]) -> Any:
+    if isinstance(payload, dict):
+        return {k: scrub(v, secrets) for k, v in payload.items() if str(k).lower() not in SCRUBBED_FIELDS}
+    if isinstance(payload, list):
+        return [scrub(item, secrets) for item in payload]
+    if isinstance(payload, str) and any(secret in payload for secret in secrets):
+        return '[scrubbed]'
+    return payload
+
+
+def _secrets() -> List[str]:
+    names = ('SMSPOOL_API_KEY', 'DAISYSMS_API_KEY', 'TIGERSMS_API_KEY', 'FIVESIM_API_KEY')
+    return [os.environ[name] for name in names if os.environ.get(name)]
+
+
+def record(name: str, response: requests.Response):
+    response.raise_for_status()
+    secrets = _secrets()
+    payload = scrub(response.json(), secrets)
+    dumped = json.dumps(payload)
+    if any(secret in dumped for secret in secrets):
+        raise RuntimeError(f"{name}: an API key is still present after scrubbing; not saved")
+    save(name, payload)
+    print(f"✓ {name}: {len(payload)} top-level entries, {len(response.content) / 1024:.0f} KB")
+
+
+def main():
+    smspool_key = os.environ.get('SMSPOOL_API_KEY', '')
+    record('smspool_pricing_us', requests.post(
+        f'{SMSPOOL_BASE_URL}/request/pricing',
+        data={'country': '1'},
+        headers={'Authorization': f'Bearer {smspool_key}'},
+        timeout=60,
+    ))
+    record('fivesim_prices', requests.get(f'{FIVESIM_BASE_URL}/guest/prices', timeout=120))
+    record('daisysms_prices', requests.get(
+        f'{DAISYSMS_BASE_URL}/stubs/handler_api.php',
+        params={'api_key': os.environ.get('DAISYSMS_API_KEY', ''), 'action': 'getPricesVerification'},
+        timeout=60,
+    ))
+    record('tigersms_prices', requests.get(
+        f'{TIGERSMS_BASE_URL}/stubs/handler_api.php',
+        params={'api_key': os.environ.get('TIGERSMS_API_KEY', ''), 'action': 'getPrices'},
+        timeout=120,
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Catalog aggregation, reseller pricing and admin stats over full-size payloads"""
+import copy
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import pricing  # noqa: E402
+
+NGN_RATE = 1500.0
+MARKUP = 50.0
+
+
+def _largest_country(fivesim_prices):
+    return max(fivesim_prices.values(), key=len)
+
+
+def _products_view(country_block):
+    """5sim /guest/products/{country}/any shape, derived from the prices dump"""
+    return {
+        product: {'Category': 'activation', 'Qty': sum(op.get('count', 0) for op in operators.values()),
+                  'Price': min(op['cost'] for op in operators.values())}
+        for product, operators in country_block.items() if operators
+    }
+
+
+# ============ User catalogs ============
+
+def test_smspool_aggregation(benchmark, smspool_pricing):
+    services_map = {str(item['service']): item['service_name'] for item in smspool_pricing}
+    pools_map = {str(i): f'Pool {i}' for i in range(1, 20)}
+    services = benchmark(pricing.aggregate_smspool_pricing, smspool_pricing, services_map, pools_map, MARKUP, NGN_RATE)
+    assert services
+
+
+def test_5sim_aggregation(benchmark, fivesim_prices):
+    services = benchmark(pricing.aggregate_5sim_prices, _largest_country(fivesim_prices), MARKUP, NGN_RATE)
+    assert services
+
+
+def test_daisysms_services(benchmark, daisysms_prices):
+    services = benchmark(pricing.daisysms_services, daisysms_prices, MARKUP, NGN_RATE)
+    assert services
+
+
+def test_tigersms_conversion(benchmark, tigersms_prices):
+    # Conversion rewrites the payload, so every round gets a fresh copy
+    benchmark.pedantic(
+        pricing.convert_tigersms_prices,
+        setup=lambda: ((copy.deepcopy(tigersms_prices), 0.010), {}),
+        rounds=10,
+    )
+
+
+# ============ Reseller catalogs ============
+
+def test_reseller_daisysms(benchmark, daisysms_prices, reseller):
+    services = benchmark(pricing.reseller_daisysms_services, daisysms_prices, MARKUP, NGN_RATE, reseller)
+    assert len(services) == len(daisysms_prices)
+
+
+def test_reseller_smspool(benchmark, smspool_pricing, reseller):
+    services = benchmark(pricing.reseller_smspool_services, smspool_pricing, MARKUP, NGN_RATE, reseller)
+    assert services
+
+
+def test_reseller_5sim(benchmark, fivesim_prices, reseller):
+    products = _products_view(_largest_country(fivesim_prices))
+    services = benchmark(pricing.reseller_5sim_services, products, MARKUP, NGN_RATE, reseller)
+    assert len(services) == len(products)
+
+
+def test_calculate_reseller_price_full_catalog(benchmark, fivesim_prices, reseller):
+    base_prices = [
+        op['cost'] * NGN_RATE
+        for block in fivesim_prices.values() for operators in block.values() for op in operators.values()
+    ]
+
+    def price_all():
+        return [pricing.calculate_reseller_price(base, MARKUP, reseller, {}) for base in base_prices]
+
+    assert len(benchmark(price_all)) == len(base_prices)
+
+
+# ============ Admin stats ============
+
+def test_admin_period_metrics(benchmark, admin_period):
+    result = benchmark(
+        pricing.period_user_metrics,
+        admin_period['deposit_txs'], admin_period['purchase_txs'],
+        admin_period['new_user_ids'], admin_period['old_user_ids'], NGN_RATE,
+    )
+    assert result['buyers_all']
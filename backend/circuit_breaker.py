@@ -0,0 +1,181 @@
+"""Circuit breakers for provider API calls.
+
+Each provider endpoint (`provider`, `action`) and each provider as a whole has a breaker
+driven by the calls of the last `CIRCUIT_WINDOW_SECONDS`:
+
+- closed: calls go through. Once at least `CIRCUIT_MIN_CALLS` were made and the share of
+  failures (transport errors, 5xx/429 answers and calls slower than
+  `CIRCUIT_SLOW_CALL_SECONDS`) reaches `CIRCUIT_FAILURE_RATE`, the breaker opens.
+- open: calls fail immediately for `open_seconds`, doubling on every consecutive trip up
+  to `CIRCUIT_MAX_OPEN_SECONDS`.
+- half-open: one probe call is let through per `CIRCUIT_PROBE_INTERVAL_SECONDS`; a success
+  closes the breaker, a failure opens it again.
+
+A call is allowed only if both the endpoint's and the provider's breaker allow it. State
+is per worker process, like the metrics.
+"""
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+WINDOW_SECONDS = float(os.environ.get('CIRCUIT_WINDOW_SECONDS', 60))
+MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', 10))
+FAILURE_RATE = float(os.environ.get('CIRCUIT_FAILURE_RATE', 0.5))
+SLOW_CALL_SECONDS = float(os.environ.get('CIRCUIT_SLOW_CALL_SECONDS', 8))
+OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', 30))
+MAX_OPEN_SECONDS = float(os.environ.get('CIRCUIT_MAX_OPEN_SECONDS', 300))
+PROBE_INTERVAL_SECONDS = float(os.environ.get('CIRCUIT_PROBE_INTERVAL_SECONDS', 5))
+
+ALL_ACTIONS = '*'
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str, action: str):
+        self.provider = provider
+        self.action = action
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self.open_seconds = OPEN_SECONDS
+        self.trips = 0
+        self._next_probe = 0.0
+        self._calls: Deque[Tuple[float, bool, float]] = deque()   # (at, failed, latency)
+        self._set_gauge()
+
+    def _set_gauge(self):
+        metrics.CIRCUIT_STATE.labels(self.provider, self.action).set(_STATE_VALUES[self.state])
+
+    def _prune(self, now: float):
+        cutoff = now - WINDOW_SECONDS
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def _refresh_state(self, now: float):
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self._next_probe = now
+            self._set_gauge()
+
+    def is_open(self, now: Optional[float] = None) -> bool:
+        """True while calls are being refused outright (no probe is due)"""
+        now = time.monotonic() if now is None else now
+        self._refresh_state(now)
+        return self.state == OPEN or (self.state == HALF_OPEN and now < self._next_probe)
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self._refresh_state(now)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and now >= self._next_probe:
+            self._next_probe = now + PROBE_INTERVAL_SECONDS
+            return True
+        return False
+
+    def record(self, failed: bool, latency: float, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        failed = failed or latency >= SLOW_CALL_SECONDS
+        if self.state == HALF_OPEN:
+            if failed:
+                self._open(now, backoff=True)
+            else:
+                self._close()
+            return
+        self._calls.append((now, failed, latency))
+        self._prune(now)
+        if self.state == CLOSED and len(self._calls) >= MIN_CALLS and self.failure_rate() >= FAILURE_RATE:
+            self._open(now, backoff=False)
+
+    def _open(self, now: float, backoff: bool):
+        self.open_seconds = min(self.open_seconds * 2, MAX_OPEN_SECONDS) if backoff else OPEN_SECONDS
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+        self._calls.clear()
+        self._set_gauge()
+
+    def _close(self):
+        self.state = CLOSED
+        self.opened_at = None
+        self.open_seconds = OPEN_SECONDS
+        self._calls.clear()
+        self._set_gauge()
+
+    def failure_rate(self) -> float:
+        return sum(1 for _, failed, _ in self._calls if failed) / len(self._calls) if self._calls else 0.0
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        self._refresh_state(now)
+        self._prune(now)
+        latencies = sorted(latency for _, _, latency in self._calls)
+        retry_in = None
+        if self.state == OPEN:
+            retry_in = round(self.opened_at + self.open_seconds - now, 1)
+        return {
+            'state': self.state,
+            'calls': len(self._calls),
+            'failure_rate': round(self.failure_rate(), 3),
+            'latency_p50': round(latencies[len(latencies) // 2], 3) if latencies else None,
+            'latency_p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None,
+            'trips': self.trips,
+            'retry_in_seconds': retry_in,
+        }
+
+
+class BreakerBoard:
+    """All breakers of a process, created on first use"""
+
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, provider: str, action: str = ALL_ACTIONS) -> CircuitBreaker:
+        breaker = self._breakers.get((provider, action))
+        if breaker is None:
+            breaker = self._breakers[(provider, action)] = CircuitBreaker(provider, action)
+        return breaker
+
+    def allow(self, provider: str, action: str) -> bool:
+        # Check the provider-wide breaker first so an open provider doesn't use up endpoint probes
+        return self.get(provider).allow() and self.get(provider, action).allow()
+
+    def is_open(self, provider: str, action: Optional[str] = None) -> bool:
+        if self.get(provider).is_open():
+            return True
+        return action is not None and self.get(provider, action).is_open()
+
+    def record(self, provider: str, action: str, failed: bool, latency: float):
+        self.get(provider).record(failed, latency)
+        self.get(provider, action).record(failed, latency)
+
+    def health(self) -> Dict[str, dict]:
+        """{provider: {...provider breaker, 'score', 'endpoints': {action: {...}}}}"""
+        result: Dict[str, dict] = {}
+        for (provider, action), breaker in sorted(self._breakers.items()):
+            if action == ALL_ACTIONS:
+                snapshot = breaker.snapshot()
+                snapshot['score'] = health_score(snapshot)
+                result.setdefault(provider, {'endpoints': {}}).update(snapshot)
+            else:
+                result.setdefault(provider, {'endpoints': {}})['endpoints'][action] = breaker.snapshot()
+        return result
+
+
+def health_score(snapshot: dict) -> float:
+    """0 (down) .. 1 (healthy): success share, discounted for latency close to the slow-call limit"""
+    if snapshot['state'] == OPEN:
+        return 0.0
+    success = 1.0 - snapshot['failure_rate']
+    p95 = snapshot.get('latency_p95') or 0.0
+    score = success * max(0.0, 1.0 - 0.5 * min(p95 / SLOW_CALL_SECONDS, 1.0))
+    return round(score * (0.5 if snapshot['state'] == HALF_OPEN else 1.0), 3)
+
+
+board = BreakerBoard()
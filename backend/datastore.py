@@ -0,0 +1,34 @@
+"""Transactional and analytical database handles.
+
+Wallet, order and webhook code uses the primary through the main client: it has to read
+its own writes. Analytical reads (admin dashboards and listings, snapshot exports) go
+through a second client that prefers secondaries, accepts bounded staleness and has its
+own, smaller connection pool, so a slow aggregation never holds a primary connection a
+purchase is waiting for.
+
+Per deployment:
+- ANALYTICS_MONGO_URL: connection string for analytical reads (default: MONGO_URL)
+- ANALYTICS_READ_PREFERENCE: e.g. secondaryPreferred (default), secondary, nearest, primary
+- ANALYTICS_MAX_STALENESS_SECONDS: how far behind a secondary may be (default 120, minimum 90, 0 for no bound)
+- ANALYTICS_MAX_POOL_SIZE: connections for analytical reads (default 10)
+"""
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+READ_PREFERENCE = os.environ.get('ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+MAX_STALENESS_SECONDS = int(os.environ.get('ANALYTICS_MAX_STALENESS_SECONDS', 120))
+MIN_STALENESS_SECONDS = 90          # the smallest bound MongoDB accepts
+MAX_POOL_SIZE = int(os.environ.get('ANALYTICS_MAX_POOL_SIZE', 10))
+
+
+def analytics_client_options() -> dict:
+    options = {'readPreference': READ_PREFERENCE, 'maxPoolSize': MAX_POOL_SIZE}
+    # A staleness bound is only valid when secondaries may be read
+    if READ_PREFERENCE != 'primary' and MAX_STALENESS_SECONDS > 0:
+        options['maxStalenessSeconds'] = max(MAX_STALENESS_SECONDS, MIN_STALENESS_SECONDS)
+    return options
+
+
+def analytics_client(default_url: str, **kwargs) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(os.environ.get('ANALYTICS_MONGO_URL', default_url), **kwargs, **analytics_client_options())
@@ -0,0 +1,239 @@
+"""Local mirror of the Reloadly gift-card catalog.
+
+Products are synced periodically from Reloadly into the `giftcard_catalog` collection and
+held in memory with indexes by country, brand and name-word prefix, so browsing,
+searching and paging never wait on Reloadly. NGN prices are precomputed per product and
+only recomputed when the FX snapshot or the gift-card rate/markup settings change.
+"""
+import asyncio
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo import ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+SYNC_PAGE_SIZE = 200
+MAX_PREFIX_LENGTH = 20
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def compute_ngn_pricing(product: dict, usd_rates: dict, admin_usd_to_ngn: float, markup_percent: float) -> dict:
+    """NGN price fields for a product: recipient currency -> USD (live FX) -> NGN (admin rate + markup)"""
+    recipient_currency = product.get("recipientCurrencyCode", "USD")
+
+    # usd_rates contains how many units of currency per 1 USD
+    # e.g., EUR: 0.92 means 1 USD = 0.92 EUR, so 1 EUR = 1/0.92 USD
+    if recipient_currency == "USD":
+        currency_to_usd = 1.0
+    elif usd_rates.get(recipient_currency, 0) > 0:
+        currency_to_usd = 1.0 / usd_rates[recipient_currency]
+    else:
+        # Fallback: assume 1:1 with USD
+        currency_to_usd = 1.0
+
+    final_ngn_rate = currency_to_usd * admin_usd_to_ngn * (1 + markup_percent / 100)
+
+    pricing = {
+        "currency_to_usd_rate": round(currency_to_usd, 4),
+        "admin_usd_to_ngn_rate": admin_usd_to_ngn,
+        "final_ngn_rate": round(final_ngn_rate, 2),
+        "markup_percent": markup_percent,
+    }
+    if product.get("fixedRecipientDenominations"):
+        pricing["denominations_ngn"] = [round(d * final_ngn_rate, 2) for d in product["fixedRecipientDenominations"]]
+    if product.get("minRecipientDenomination"):
+        pricing["min_ngn"] = round(product["minRecipientDenomination"] * final_ngn_rate, 2)
+    if product.get("maxRecipientDenomination"):
+        pricing["max_ngn"] = round(product["maxRecipientDenomination"] * final_ngn_rate, 2)
+    return pricing
+
+
+def _words(text: Optional[str]) -> List[str]:
+    return _WORD_RE.findall((text or "").lower())
+
+
+class GiftCardCatalog:
+    def __init__(self, collection, meta_collection):
+        self.collection = collection
+        self.meta = meta_collection
+        self.products: Dict[int, dict] = {}
+        self.order: List[int] = []                 # product ids sorted by name
+        self.by_country: Dict[str, List[int]] = {}
+        self.by_brand: Dict[str, List[int]] = {}
+        self.by_prefix: Dict[str, Set[int]] = {}
+        self.pricing_key: Optional[tuple] = None
+        self.synced_at: Optional[str] = None
+        self.source: Optional[str] = None
+        self._lock = asyncio.Lock()
+        self._persist_task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.products)
+
+    # ---- indexing ----
+
+    def _rebuild_indexes(self):
+        products = self.products
+        self.order = sorted(products, key=lambda pid: (products[pid].get("productName") or "").lower())
+        by_country: Dict[str, List[int]] = {}
+        by_brand: Dict[str, List[int]] = {}
+        by_prefix: Dict[str, Set[int]] = {}
+        for pid in self.order:
+            p = products[pid]
+            country = ((p.get("country") or {}).get("isoName") or "").upper()
+            if country:
+                by_country.setdefault(country, []).append(pid)
+            brand = ((p.get("brand") or {}).get("brandName") or "").lower()
+            if brand:
+                by_brand.setdefault(brand, []).append(pid)
+            for word in set(_words(p.get("productName")) + _words(brand)):
+                for i in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                    by_prefix.setdefault(word[:i], set()).add(pid)
+        self.by_country, self.by_brand, self.by_prefix = by_country, by_brand, by_prefix
+
+    def _load(self, docs: List[dict]):
+        self.products = {d["productId"]: d for d in docs if d.get("productId") is not None}
+        self.pricing_key = None
+        self._rebuild_indexes()
+
+    async def load_from_db(self):
+        docs = await self.collection.find({}, {"_id": 0}).to_list(None)
+        meta = await self.meta.find_one({"id": "sync"}, {"_id": 0}) or {}
+        self._load(docs)
+        self.synced_at = meta.get("last_synced_at")
+        self.source = meta.get("source")
+        # Prices persisted by another worker for the same FX/config state can be reused as-is
+        if meta.get("pricing_key") and all(p.get("pricing") for p in self.products.values()):
+            self.pricing_key = tuple(meta["pricing_key"])
+        logger.info(f"Gift card catalog loaded {len(self.products)} products")
+
+    # ---- pricing ----
+
+    def ensure_pricing(self, usd_rates: dict, admin_usd_to_ngn: float, markup_percent: float, fx_version) -> bool:
+        """Recompute NGN prices if FX or pricing config changed. Returns True if anything was repriced"""
+        key = (fx_version, float(admin_usd_to_ngn), float(markup_percent))
+        if key == self.pricing_key:
+            return False
+        for product in self.products.values():
+            product["pricing"] = compute_ngn_pricing(product, usd_rates, admin_usd_to_ngn, markup_percent)
+        self.pricing_key = key
+        return True
+
+    def schedule_persist_pricing(self):
+        """Write the current precomputed prices back in the background (one write-back at a time)"""
+        if self._persist_task and not self._persist_task.done():
+            return
+        self._persist_task = asyncio.create_task(self._persist_pricing())
+
+    async def _persist_pricing(self):
+        key = self.pricing_key
+        try:
+            ops = [UpdateOne({"productId": pid}, {"$set": {"pricing": p.get("pricing")}}) for pid, p in self.products.items()]
+            for i in range(0, len(ops), 500):
+                await self.collection.bulk_write(ops[i:i + 500], ordered=False)
+            await self.meta.update_one({"id": "sync"}, {"$set": {"pricing_key": list(key) if key else None}})
+        except Exception as e:
+            logger.error(f"Failed to persist gift card pricing: {e}")
+
+    # ---- queries ----
+
+    def get(self, product_id: int) -> Optional[dict]:
+        return self.products.get(product_id)
+
+    def search(self, country_code: Optional[str] = None, product_name: Optional[str] = None,
+               brand: Optional[str] = None, page: int = 1, size: int = 50) -> dict:
+        ids: Optional[List[int]] = None
+        if country_code:
+            ids = self.by_country.get(country_code.upper(), [])
+        if brand:
+            brand_ids = set(self.by_brand.get(brand.lower(), []))
+            ids = [pid for pid in (ids if ids is not None else self.order) if pid in brand_ids]
+        if product_name:
+            matches: Optional[Set[int]] = None
+            for word in _words(product_name):
+                hits = self.by_prefix.get(word[:MAX_PREFIX_LENGTH], set())
+                matches = hits if matches is None else matches & hits
+            matches = matches or set()
+            ids = [pid for pid in (ids if ids is not None else self.order) if pid in matches]
+        if ids is None:
+            ids = self.order
+
+        page = max(page, 1)
+        size = max(size, 1)
+        total = len(ids)
+        start = (page - 1) * size
+        content = []
+        for pid in ids[start:start + size]:
+            product = dict(self.products[pid])
+            product.update(product.pop("pricing", None) or {})
+            content.append(product)
+        return {
+            "content": content,
+            "totalElements": total,
+            "totalPages": (total + size - 1) // size,
+        }
+
+    # ---- sync ----
+
+    async def sync(self, fetch_page: Callable[[int, int], Awaitable[dict]], source: Optional[str] = None) -> int:
+        """Pull every product page from Reloadly and replace the local catalog"""
+        async with self._lock:
+            synced_at = datetime.now(timezone.utc).isoformat()
+            products: List[dict] = []
+            page = 1
+            while True:
+                data = await fetch_page(page, SYNC_PAGE_SIZE)
+                content = data.get("content", []) or []
+                products.extend(content)
+                total_pages = data.get("totalPages") or 0
+                if not content or page >= total_pages:
+                    break
+                page += 1
+
+            if not products:
+                logger.warning("Gift card catalog sync returned no products; keeping the current catalog")
+                return 0
+
+            for p in products:
+                p["synced_at"] = synced_at
+            ops = [ReplaceOne({"productId": p["productId"]}, p, upsert=True) for p in products if p.get("productId") is not None]
+            for i in range(0, len(ops), 500):
+                await self.collection.bulk_write(ops[i:i + 500], ordered=False)
+            await self.collection.delete_many({"synced_at": {"$ne": synced_at}})
+            await self.meta.update_one(
+                {"id": "sync"},
+                {"$set": {"id": "sync", "last_synced_at": synced_at, "product_count": len(products),
+                          "source": source, "pricing_key": None}},
+                upsert=True
+            )
+
+            docs = [{k: v for k, v in p.items() if k != "_id"} for p in products]
+            self._load(docs)
+            self.synced_at = synced_at
+            self.source = source
+            logger.info(f"Gift card catalog synced {len(products)} products")
+            return len(products)
+
+    async def acquire_sync_lease(self, owner: str, lease_seconds: int, interval_seconds: int, force: bool = False) -> bool:
+        """Let one worker sync per interval; the others reload from Mongo. `force` ignores the interval"""
+        now = datetime.now(timezone.utc)
+        now_iso = now.isoformat()
+        due_before = datetime.fromtimestamp(now.timestamp() - interval_seconds, timezone.utc).isoformat()
+        lease_until = datetime.fromtimestamp(now.timestamp() + lease_seconds, timezone.utc).isoformat()
+        conditions = [{"$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now_iso}}]}]
+        if not force:
+            conditions.append({"$or": [{"last_synced_at": {"$exists": False}}, {"last_synced_at": {"$lt": due_before}}]})
+        try:
+            res = await self.meta.update_one(
+                {"id": "sync", "$and": conditions},
+                {"$set": {"lease_owner": owner, "lease_until": lease_until}},
+                upsert=True,
+            )
+        except Exception:
+            # Upsert raced with another worker holding the document
+            return False
+        return bool(res.modified_count or res.upserted_id)
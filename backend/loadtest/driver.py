@@ -0,0 +1,221 @@
+"""Load driver: N simulated users running the number-purchase flow against the API.
+
+Each user loops over catalog -> calculate price -> purchase -> wait for OTP, and
+cancels the order if no OTP arrives within --otp-timeout. Run it against a backend
+that points at loadtest/mock_providers.py, never at real providers.
+
+Users are registered for the run and funded through the admin API, so an admin
+account is required:
+
+   python -m loadtest.driver --base-url http://127.0.0.1:8001 \
+       --admin-email admin@example.com --admin-password ... \
+       --users 50 --duration 300 --servers us_server,server1,server2 --json-out run.json
+
+The report lists throughput and p50/p95/p99 latency per step. With --json-out the
+same numbers are written to a file so releases can be compared.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+# Catalog queries per server; mirrors the user-facing service endpoints
+CATALOGS = {
+    'us_server': ('/api/services/daisysms', {}, '187'),
+    'server1': ('/api/services/smspool', {'country': '1'}, '1'),
+    'server2': ('/api/services/5sim', {'country': 'usa'}, 'usa'),
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self.otp_waits: List[float] = []
+
+    def report(self, elapsed: float) -> dict:
+        flows = sum(self.outcomes.values())
+        requests_total = sum(len(v) for v in self.latencies.values())
+        steps = {}
+        for step, values in sorted(self.latencies.items()):
+            steps[step] = {
+                'count': len(values),
+                'errors': self.errors.get(step, 0),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': max(values) * 1000,
+                'mean_ms': statistics.fmean(values) * 1000,
+            }
+        return {
+            'elapsed_seconds': elapsed,
+            'flows': flows,
+            'flows_per_second': flows / elapsed if elapsed else 0.0,
+            'requests': requests_total,
+            'requests_per_second': requests_total / elapsed if elapsed else 0.0,
+            'outcomes': dict(self.outcomes),
+            'otp_wait_p50_seconds': percentile(self.otp_waits, 50),
+            'otp_wait_p95_seconds': percentile(self.otp_waits, 95),
+            'steps': steps,
+        }
+
+
+async def timed(stats: Stats, step: str, request) -> Optional[httpx.Response]:
+    start = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError:
+        stats.latencies[step].append(time.perf_counter() - start)
+        stats.errors[step] += 1
+        return None
+    stats.latencies[step].append(time.perf_counter() - start)
+    if response.status_code >= 400:
+        stats.errors[step] += 1
+    return response
+
+
+async def create_users(client: httpx.AsyncClient, args) -> List[str]:
+    """Register and fund the run's users; returns their tokens"""
+    login = await client.post('/api/auth/login', json={'email': args.admin_email, 'password': args.admin_password})
+    login.raise_for_status()
+    admin_headers = {'Authorization': f"Bearer {login.json()['token']}"}
+
+    run_id = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(20)
+
+    async def create(i: int) -> str:
+        async with semaphore:
+            resp = await client.post('/api/auth/register', json={
+                'email': f'loadtest-{run_id}-{i}@example.com',
+                'password': uuid.uuid4().hex,
+                'full_name': f'Load Test {i}',
+                'phone': f'080{random.randint(10_000_000, 19_999_999)}',
+            })
+            resp.raise_for_status()
+            body = resp.json()
+            fund = await client.put(f"/api/admin/users/{body['user']['id']}",
+                                    json={'ngn_balance': args.balance}, headers=admin_headers)
+            fund.raise_for_status()
+            return body['token']
+
+    return await asyncio.gather(*(create(i) for i in range(args.users)))
+
+
+async def run_flow(client: httpx.AsyncClient, headers: dict, server: str, stats: Stats, args):
+    path, params, country = CATALOGS[server]
+    resp = await timed(stats, 'catalog', client.get(path, params=params, headers=headers))
+    services = (resp.json().get('services') or []) if resp is not None and resp.status_code == 200 else []
+    if not services:
+        stats.outcomes['catalog_failed'] += 1
+        return
+    service = random.choice(services)
+    order_request = {'server': server, 'service': service['value'], 'country': country}
+    if server == 'server2' and service.get('operators'):
+        order_request['operator'] = random.choice(service['operators'])['name']
+
+    resp = await timed(stats, 'price', client.post('/api/orders/calculate-price', json=order_request, headers=headers))
+    if resp is None or resp.status_code != 200:
+        stats.outcomes['price_failed'] += 1
+        return
+
+    resp = await timed(stats, 'purchase', client.post('/api/orders/purchase', json=order_request, headers=headers))
+    if resp is None or resp.status_code != 200:
+        stats.outcomes['purchase_failed'] += 1
+        return
+    order_id = resp.json()['order']['id']
+
+    # Wait for the backend's poller to pick up the OTP
+    purchased_at = time.perf_counter()
+    while time.perf_counter() - purchased_at < args.otp_timeout:
+        await asyncio.sleep(args.poll_interval)
+        resp = await timed(stats, 'poll', client.get(f'/api/orders/{order_id}', headers=headers))
+        if resp is None or resp.status_code != 200:
+            continue
+        order = resp.json()
+        if order.get('otp') or order.get('otp_code'):
+            stats.otp_waits.append(time.perf_counter() - purchased_at)
+            stats.outcomes['otp_received'] += 1
+            return
+        if order.get('status') != 'active':
+            stats.outcomes[f"ended_{order.get('status')}"] += 1
+            return
+
+    resp = await timed(stats, 'cancel', client.post(f'/api/orders/{order_id}/cancel', headers=headers))
+    stats.outcomes['cancelled' if resp is not None and resp.status_code == 200 else 'cancel_failed'] += 1
+
+
+async def simulate_user(client: httpx.AsyncClient, token: str, stats: Stats, deadline: float, args):
+    headers = {'Authorization': f'Bearer {token}'}
+    servers = args.servers.split(',')
+    # Stagger starts so users don't all hit the catalog in the same instant
+    await asyncio.sleep(random.uniform(0, args.ramp_up))
+    flows = 0
+    while time.perf_counter() < deadline and (not args.flows_per_user or flows < args.flows_per_user):
+        await run_flow(client, headers, random.choice(servers), stats, args)
+        flows += 1
+        await asyncio.sleep(random.uniform(0, args.think_time))
+
+
+def print_report(report: dict):
+    print(f"\n{report['flows']} flows in {report['elapsed_seconds']:.1f}s "
+          f"({report['flows_per_second']:.2f} flows/s, {report['requests_per_second']:.1f} req/s)")
+    print('Outcomes: ' + ', '.join(f'{k}={v}' for k, v in sorted(report['outcomes'].items())))
+    print(f"OTP wait: p50 {report['otp_wait_p50_seconds']:.1f}s, p95 {report['otp_wait_p95_seconds']:.1f}s\n")
+    print(f"{'step':<10}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, s in report['steps'].items():
+        print(f"{step:<10}{s['count']:>8}{s['errors']:>8}{s['p50_ms']:>10.1f}"
+              f"{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+
+
+async def main(args):
+    random.seed(args.seed)
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        tokens = await create_users(client, args)
+        stats = Stats()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(simulate_user(client, t, stats, deadline, args) for t in tokens))
+        report = stats.report(time.perf_counter() - start)
+
+    report['config'] = {k: v for k, v in vars(args).items() if k != 'admin_password'}
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the number purchase flow')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8001')
+    parser.add_argument('--admin-email', required=True)
+    parser.add_argument('--admin-password', required=True)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=120, help='seconds before users stop starting new flows')
+    parser.add_argument('--flows-per-user', type=int, default=0, help='stop each user after this many flows (0 = no limit)')
+    parser.add_argument('--servers', default='us_server,server1,server2')
+    parser.add_argument('--balance', type=float, default=1_000_000, help='NGN balance given to each user')
+    parser.add_argument('--otp-timeout', type=float, default=60, help='seconds to wait for an OTP before cancelling')
+    parser.add_argument('--poll-interval', type=float, default=3)
+    parser.add_argument('--think-time', type=float, default=2, help='max pause between a user\'s flows')
+    parser.add_argument('--ramp-up', type=float, default=10)
+    parser.add_argument('--timeout', type=float, default=30, help='HTTP timeout per request')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json-out')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,354 @@
+"""Local mock of the SMS providers, for load tests.
+
+One app serves all four provider protocols the backend speaks:
+
+- DaisySMS: GET /stubs/handler_api.php?action=...
+- TigerSMS: GET /tiger/stubs/handler_api.php?action=...
+- SMS-pool: POST /request/pricing, /purchase/sms, /sms/check, ...
+- 5sim: /v1/guest/prices, /v1/user/buy/activation/..., /v1/user/orders, ...
+
+Latency, error rate and OTP timing are configurable so runs are repeatable.
+
+HOW TO USE:
+
+1) Start the mocks (from backend/):
+
+   python -m loadtest.mock_providers --port 9000 --latency-ms 150 --jitter-ms 50 \
+       --error-rate 0.01 --otp-delay 15 --no-otp-rate 0.2
+
+2) Start the backend pointed at them:
+
+   DAISYSMS_BASE_URL=http://127.0.0.1:9000 \
+   TIGERSMS_BASE_URL=http://127.0.0.1:9000/tiger \
+   SMSPOOL_BASE_URL=http://127.0.0.1:9000 \
+   FIVESIM_BASE_URL=http://127.0.0.1:9000/v1 \
+   uvicorn server:app --port 8001 --workers 4
+
+   Provider API keys can be any non-empty value; the mocks don't check them.
+
+3) Run the driver (see loadtest/driver.py).
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+import uvicorn
+
+SERVICES = {
+    'wa': 'WhatsApp', 'tg': 'Telegram', 'go': 'Google', 'fb': 'Facebook',
+    'ig': 'Instagram', 'tw': 'Twitter', 'ds': 'Discord', 'am': 'Amazon',
+    'ub': 'Uber', 'mm': 'Microsoft', 'oi': 'Tinder', 'lf': 'TikTok',
+}
+FIVESIM_COUNTRIES = ['usa', 'england', 'canada', 'nigeria', 'germany']
+FIVESIM_ISO = {'usa': 'us', 'england': 'gb', 'canada': 'ca', 'nigeria': 'ng', 'germany': 'de'}
+FIVESIM_OPERATORS = ['virtual21', 'virtual34', 'virtual40']
+SMSPOOL_COUNTRIES = [
+    {'ID': 1, 'name': 'United States', 'short_name': 'US', 'region': 'North America'},
+    {'ID': 2, 'name': 'United Kingdom', 'short_name': 'GB', 'region': 'Europe'},
+    {'ID': 3, 'name': 'Canada', 'short_name': 'CA', 'region': 'North America'},
+]
+SMSPOOL_POOLS = [{'ID': 1, 'name': 'Foxtrot'}, {'ID': 2, 'name': 'Alpha'}, {'ID': 7, 'name': 'Bravo'}]
+TIGERSMS_COUNTRIES = ['0', '12', '16', '187']
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 100.0
+    jitter_ms: float = 30.0
+    error_rate: float = 0.0
+    otp_delay: float = 20.0      # seconds from purchase until the SMS "arrives"
+    otp_jitter: float = 10.0
+    no_otp_rate: float = 0.1     # share of numbers that never receive an SMS
+    seed: int = 1
+
+
+def _price(*parts: str, low: float = 0.05, high: float = 1.5) -> float:
+    """Stable pseudo-random price, so catalogs are identical between runs"""
+    digest = hashlib.sha256(':'.join(parts).encode()).digest()
+    return round(low + (high - low) * digest[0] / 255, 2)
+
+
+class Activations:
+    """Numbers handed out by the mocks and when their OTP becomes visible"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self._ids = itertools.count(10_000_000)
+        self._items: Dict[str, dict] = {}
+
+    def create(self, provider: str, service: str, price: float) -> dict:
+        activation_id = str(next(self._ids))
+        now = time.monotonic()
+        otp_at = None
+        if self.rng.random() >= self.config.no_otp_rate:
+            otp_at = now + max(self.config.otp_delay + self.rng.uniform(-1, 1) * self.config.otp_jitter, 0)
+        item = {
+            'id': activation_id,
+            'provider': provider,
+            'service': service,
+            'phone': f'1{self.rng.randint(200_000_0000, 999_999_9999)}',
+            'price': price,
+            'code': f'{self.rng.randint(0, 999_999):06d}',
+            'otp_at': otp_at,
+            'status': 'active',
+        }
+        self._items[activation_id] = item
+        return item
+
+    def get(self, activation_id: str) -> Optional[dict]:
+        return self._items.get(str(activation_id))
+
+    def code_if_ready(self, item: dict) -> Optional[str]:
+        if item['status'] != 'active' or item['otp_at'] is None:
+            return None
+        return item['code'] if time.monotonic() >= item['otp_at'] else None
+
+    def cancel(self, activation_id: str) -> bool:
+        item = self.get(activation_id)
+        if not item or item['status'] != 'active':
+            return False
+        item['status'] = 'cancelled'
+        return True
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title='Mock SMS providers')
+    activations = Activations(config)
+    rng = random.Random(config.seed + 1)
+
+    @app.middleware('http')
+    async def simulate_network(request: Request, call_next):
+        delay = max(config.latency_ms + rng.uniform(-1, 1) * config.jitter_ms, 0) / 1000
+        await asyncio.sleep(delay)
+        if config.error_rate and rng.random() < config.error_rate:
+            return PlainTextResponse('Service temporarily unavailable', status_code=503)
+        return await call_next(request)
+
+    # ============ DaisySMS / TigerSMS (handler_api.php) ============
+
+    def handler_api(request: Request, tiger: bool):
+        params = request.query_params
+        action = params.get('action')
+
+        if action == 'getPricesVerification':
+            return {
+                code: {'187': {
+                    'name': name,
+                    'cost': _price('daisysms', code),
+                    'retail_price': _price('daisysms', code),
+                    'count': 500,
+                }}
+                for code, name in SERVICES.items()
+            }
+        if action == 'getPrices':
+            return {
+                country: {code: {'name': name, 'cost': _price('tigersms', country, code, low=5, high=120), 'count': 300}
+                          for code, name in SERVICES.items()}
+                for country in TIGERSMS_COUNTRIES
+            }
+        if action == 'getNumber':
+            service = params.get('service', '')
+            if service not in SERVICES:
+                return PlainTextResponse('BAD_SERVICE')
+            price = _price('daisysms', service)
+            max_price = params.get('max_price')
+            if max_price and float(max_price) < price:
+                return PlainTextResponse('MAX_PRICE_EXCEEDED')
+            item = activations.create('tigersms' if tiger else 'daisysms', service, price)
+            text = f"ACCESS_NUMBER:{item['id']}:{item['phone']}"
+            if tiger:
+                return JSONResponse(text)
+            return PlainTextResponse(text, headers={'X-Price': str(price)})
+        if action == 'getStatus':
+            item = activations.get(params.get('id', ''))
+            if not item:
+                return PlainTextResponse('NO_ACTIVATION')
+            if item['status'] == 'cancelled':
+                return PlainTextResponse('STATUS_CANCEL')
+            code = activations.code_if_ready(item)
+            if code:
+                return PlainTextResponse(f'STATUS_OK:{code}', headers={'X-Text': f'Your code is {code}'})
+            return PlainTextResponse('STATUS_WAIT_CODE')
+        if action == 'setStatus':
+            activation_id = params.get('id', '')
+            if params.get('status') == '8':
+                return PlainTextResponse('ACCESS_CANCEL' if activations.cancel(activation_id) else 'BAD_STATUS')
+            item = activations.get(activation_id)
+            if item:
+                item['status'] = 'done'
+            return PlainTextResponse('ACCESS_ACTIVATION')
+        if action == 'getBalance':
+            return PlainTextResponse('ACCESS_BALANCE:1000.00')
+        return PlainTextResponse('BAD_ACTION')
+
+    @app.get('/stubs/handler_api.php')
+    async def daisysms_handler_api(request: Request):
+        return handler_api(request, tiger=False)
+
+    @app.get('/tiger/stubs/handler_api.php')
+    async def tigersms_handler_api(request: Request):
+        # Same protocol, but getNumber answers in JSON
+        return handler_api(request, tiger=True)
+
+    # ============ SMS-pool ============
+
+    @app.post('/request/pricing')
+    async def smspool_pricing(request: Request):
+        form = await request.form()
+        countries = [str(form['country'])] if form.get('country') else [str(c['ID']) for c in SMSPOOL_COUNTRIES]
+        return [
+            {'service': i, 'service_name': name, 'country': int(country), 'pool': pool['ID'],
+             'price': str(_price('smspool', country, code, str(pool['ID'])))}
+            for country in countries
+            for i, (code, name) in enumerate(SERVICES.items(), start=1)
+            for pool in SMSPOOL_POOLS
+        ]
+
+    @app.post('/service/retrieve_all')
+    async def smspool_services():
+        return [{'ID': i, 'name': name} for i, name in enumerate(SERVICES.values(), start=1)]
+
+    @app.post('/pool/retrieve_all')
+    async def smspool_pools():
+        return SMSPOOL_POOLS
+
+    @app.post('/country/retrieve_all')
+    async def smspool_countries():
+        return SMSPOOL_COUNTRIES
+
+    @app.post('/purchase/sms')
+    async def smspool_purchase(request: Request):
+        params = request.query_params
+        service, country = params.get('service', ''), params.get('country', '1')
+        pool = params.get('pool') or str(SMSPOOL_POOLS[0]['ID'])
+        codes = list(SERVICES)
+        if not service.isdigit() or not 1 <= int(service) <= len(codes):
+            return JSONResponse({'success': 0, 'message': 'This service is not available'}, status_code=422)
+        price = _price('smspool', country, codes[int(service) - 1], pool)
+        item = activations.create('smspool', service, price)
+        return {'success': 1, 'order_id': item['id'], 'number': item['phone'], 'price': price, 'pool': int(pool)}
+
+    @app.post('/sms/check')
+    async def smspool_check(request: Request):
+        item = activations.get(request.query_params.get('orderid', ''))
+        if not item:
+            return {'status': 0, 'message': 'Order not found'}
+        code = activations.code_if_ready(item)
+        return {'status': 3 if code else 1, 'sms': code, 'full_sms': f'Your code is {code}' if code else None}
+
+    @app.post('/request/cancel')
+    @app.post('/sms/cancel')
+    async def smspool_cancel(request: Request):
+        form = await request.form()
+        activation_id = request.query_params.get('orderid') or form.get('orderid') or ''
+        return {'success': 1 if activations.cancel(str(activation_id)) else 0}
+
+    @app.get('/request/balance')
+    @app.post('/request/balance')
+    async def smspool_balance():
+        return {'balance': '1000.00'}
+
+    # ============ 5sim ============
+
+    @app.get('/v1/guest/prices')
+    async def fivesim_prices(country: Optional[str] = None, product: Optional[str] = None):
+        countries = [country] if country else FIVESIM_COUNTRIES
+        return {
+            c: {
+                p: {op: {'cost': _price('5sim', c, p, op), 'count': 200, 'rate': 90.0} for op in FIVESIM_OPERATORS}
+                for p in SERVICES if not product or p == product
+            }
+            for c in countries if c in FIVESIM_COUNTRIES
+        }
+
+    @app.get('/v1/user/buy/activation/{country}/{operator}/{product}')
+    async def fivesim_buy(country: str, operator: str, product: str):
+        if country not in FIVESIM_COUNTRIES or product not in SERVICES:
+            return PlainTextResponse('no free phones', status_code=400)
+        operator = operator if operator in FIVESIM_OPERATORS else FIVESIM_OPERATORS[0]
+        item = activations.create('5sim', product, _price('5sim', country, product, operator))
+        return {'id': int(item['id']), 'phone': f"+{item['phone']}", 'operator': operator,
+                'product': product, 'price': item['price'], 'status': 'PENDING', 'sms': []}
+
+    def _fivesim_order(item: dict) -> dict:
+        code = activations.code_if_ready(item)
+        return {
+            'id': int(item['id']),
+            'phone': f"+{item['phone']}",
+            'status': 'RECEIVED' if code else ('CANCELED' if item['status'] == 'cancelled' else 'PENDING'),
+            'sms': [{'code': code, 'text': f'Your code is {code}'}] if code else [],
+        }
+
+    @app.get('/v1/user/orders')
+    async def fivesim_orders(limit: int = 50):
+        items = [i for i in activations._items.values() if i['provider'] == '5sim'][-limit:]
+        return {'Data': [_fivesim_order(i) for i in reversed(items)], 'Total': len(items)}
+
+    @app.get('/v1/user/check/{activation_id}')
+    async def fivesim_check(activation_id: str):
+        item = activations.get(activation_id)
+        if not item:
+            return PlainTextResponse('order not found', status_code=404)
+        return _fivesim_order(item)
+
+    @app.get('/v1/user/cancel/{activation_id}')
+    async def fivesim_cancel(activation_id: str):
+        if not activations.cancel(activation_id):
+            return PlainTextResponse('order not found', status_code=400)
+        return _fivesim_order(activations.get(activation_id))
+
+    @app.get('/v1/guest/countries')
+    async def fivesim_countries():
+        return {c: {'iso': {FIVESIM_ISO[c]: 1}, 'text_en': c.title()} for c in FIVESIM_COUNTRIES}
+
+    @app.get('/v1/guest/products/{country}/{operator}')
+    async def fivesim_products(country: str, operator: str):
+        if country not in FIVESIM_COUNTRIES:
+            return {}
+        return {
+            p: {'Category': 'activation', 'Qty': 200,
+                'Price': min(_price('5sim', country, p, op) for op in FIVESIM_OPERATORS)}
+            for p in SERVICES
+        }
+
+    @app.get('/v1/user/profile')
+    async def fivesim_profile():
+        return {'id': 1, 'email': 'loadtest@example.com', 'balance': 1000.0, 'rating': 96}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock SMS providers for load testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=MockConfig.latency_ms)
+    parser.add_argument('--jitter-ms', type=float, default=MockConfig.jitter_ms)
+    parser.add_argument('--error-rate', type=float, default=MockConfig.error_rate,
+                        help='share of requests answered with HTTP 503')
+    parser.add_argument('--otp-delay', type=float, default=MockConfig.otp_delay,
+                        help='seconds until a purchased number receives its SMS')
+    parser.add_argument('--otp-jitter', type=float, default=MockConfig.otp_jitter)
+    parser.add_argument('--no-otp-rate', type=float, default=MockConfig.no_otp_rate,
+                        help='share of numbers that never receive an SMS (exercises cancel)')
+    parser.add_argument('--seed', type=int, default=MockConfig.seed)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        otp_delay=args.otp_delay, otp_jitter=args.otp_jitter, no_otp_rate=args.no_otp_rate, seed=args.seed,
+    )
+    # A single worker: activations live in process memory
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+A small registry of counters, gauges and histograms (no client library needed) plus
+the instrumentation hooks used by the server:
+
+- `observe_upstream(provider, action)` around provider HTTP calls
+- `instrument_database(db)` wraps the Motor database so every collection operation is timed
+- `track(gauge)` for in-flight work such as OTP pollers and purchases
+- `cache_lookup(cache, hit)` for cache hit rates
+
+Values are per worker process; Prometheus aggregates across workers by instance.
+"""
+import functools
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+import httpx
+
+import request_timing
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default()
+        REGISTRY.append(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        # Unlabelled metrics keep a single child under the empty key
+        return self.labels()
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = float(value)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {child.value}']
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def _render_child(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(child.buckets, child.counts):
+            cumulative += count
+            le = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+            lines.append(f'{self.name}_bucket{le} {cumulative}')
+        le = _format_labels(self.labelnames, key, 'le="+Inf"')
+        lines.append(f'{self.name}_bucket{le} {child.count}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {child.sum}')
+        lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {child.count}')
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ============ Metrics ============
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'API request latency by route', ('method', 'route', 'status'))
+UPSTREAM_REQUEST_DURATION = Histogram(
+    'upstream_request_duration_seconds', 'Provider API call latency', ('provider', 'action'))
+UPSTREAM_ERRORS = Counter(
+    'upstream_errors_total', 'Provider API calls that raised (timeouts included)', ('provider', 'action'))
+UPSTREAM_TIMEOUTS = Counter(
+    'upstream_timeouts_total', 'Provider API calls that timed out', ('provider', 'action'))
+MONGO_OPERATION_DURATION = Histogram(
+    'mongo_operation_duration_seconds', 'MongoDB operation latency', ('collection', 'operation'),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+OTP_POLLERS_ACTIVE = Gauge('otp_pollers_active', 'OTP polling tasks currently running')
+PURCHASES_IN_FLIGHT = Gauge('purchases_in_flight', 'Number purchases currently being processed')
+WEBHOOK_QUEUE_DEPTH = Gauge('webhook_queue_depth', 'Webhook events waiting to be processed')
+OUTBOX_QUEUE_DEPTH = Gauge('outbox_queue_depth', 'Writes queued in the in-process outbox')
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by result', ('cache', 'result'))
+CIRCUIT_STATE = Gauge(
+    'provider_circuit_state', 'Provider circuit breaker state (0 closed, 1 half-open, 2 open)', ('provider', 'action'))
+RATE_BUDGET_QUEUE_DEPTH = Gauge(
+    'provider_budget_queue_depth', 'Provider calls waiting for rate budget by lane', ('provider', 'lane'))
+RATE_BUDGET_WAIT = Histogram(
+    'provider_budget_wait_seconds', 'Time provider calls waited for rate budget', ('provider', 'lane'))
+PURCHASE_ATTEMPTS = Counter(
+    'purchase_attempts_total', 'Number purchase attempts by provider and outcome', ('provider', 'outcome'))
+
+
+# ============ Instrumentation helpers ============
+
+@asynccontextmanager
+async def observe_upstream(provider: str, action: str):
+    """Time a provider call and count its errors and timeouts"""
+    start = time.perf_counter()
+    try:
+        yield
+    except httpx.TimeoutException:
+        UPSTREAM_TIMEOUTS.labels(provider, action).inc()
+        UPSTREAM_ERRORS.labels(provider, action).inc()
+        raise
+    except Exception:
+        UPSTREAM_ERRORS.labels(provider, action).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        UPSTREAM_REQUEST_DURATION.labels(provider, action).observe(elapsed)
+        request_timing.record('upstream', f'{provider}.{action}', elapsed)
+
+
+@contextmanager
+def track(gauge: Gauge):
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+def in_flight(gauge: Gauge):
+    """Decorator counting concurrent executions of an async function (endpoints keep their signature)"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track(gauge):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+# ============ MongoDB instrumentation ============
+
+_TIMED_COLLECTION_METHODS = {
+    'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one',
+    'delete_one', 'delete_many', 'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete',
+    'count_documents', 'estimated_document_count', 'distinct', 'bulk_write', 'create_index',
+}
+_CURSOR_METHODS = {'find', 'aggregate'}
+
+
+def _observe_mongo(collection: str, operation: str, elapsed: float):
+    MONGO_OPERATION_DURATION.labels(collection, operation).observe(elapsed)
+    request_timing.record('mongo', f'{collection}.{operation}', elapsed)
+
+
+class _TimedCursor:
+    """Wraps a Motor cursor; the time spent fetching results is attributed to the query"""
+
+    def __init__(self, cursor, collection: str, operation: str):
+        self._cursor = cursor
+        self._collection = collection
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # sort/skip/limit/... return the cursor itself; keep it wrapped
+            return self if result is self._cursor else result
+        return chained
+
+    async def to_list(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.to_list(*args, **kwargs)
+        finally:
+            _observe_mongo(self._collection, self._operation, time.perf_counter() - start)
+
+    def __aiter__(self):
+        return self._cursor.__aiter__()
+
+
+class _TimedCollection:
+    def __init__(self, collection):
+        self._collection = collection
+        self._name = collection.name
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in _CURSOR_METHODS:
+            def cursor_method(*args, **kwargs):
+                return _TimedCursor(attr(*args, **kwargs), self._name, name)
+            return cursor_method
+        if name not in _TIMED_COLLECTION_METHODS:
+            return attr
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                _observe_mongo(self._name, name, time.perf_counter() - start)
+        return timed
+
+
+class _TimedDatabase:
+    def __init__(self, database):
+        self._database = database
+        self._collections: Dict[str, _TimedCollection] = {}
+
+    def _get(self, name: str) -> _TimedCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = _TimedCollection(self._database[name])
+        return collection
+
+    def __getitem__(self, name: str) -> _TimedCollection:
+        return self._get(name)
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._get(name)
+
+
+def instrument_database(database):
+    """Proxy a Motor database so collection operations are recorded per collection and operation"""
+    return _TimedDatabase(database)
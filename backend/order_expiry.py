@@ -0,0 +1,88 @@
+"""Expiry sweeper for number orders.
+
+Orders carry an `expires_at`. A sweeper periodically claims a batch of orders that are
+still `active` past that time, using the (status, expires_at) index, and hands the batch
+to an expiry handler that releases the numbers upstream and refunds. The claim flips the
+orders to `expiring` under a lease, so several workers can sweep the same collection
+without handling an order twice. A batch whose worker died mid-way is claimed again once
+its lease runs out, so handlers must be idempotent (keyed wallet credits, upserted
+transactions). After the handler ran, the orders are moved to the sweeper's final status.
+The same goes for a cancel that claimed an order (`cancelling`) and never finished.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL_SECONDS = 15.0
+BATCH_SIZE = 100
+LEASE_SECONDS = 180
+
+Handler = Callable[[List[dict]], Awaitable[None]]
+
+
+class ExpirySweeper:
+    def __init__(self, name: str, collection, handler: Handler, final_status: str,
+                 interval: float = SWEEP_INTERVAL_SECONDS, batch_size: int = BATCH_SIZE):
+        self.name = name
+        self.collection = collection
+        self.handler = handler
+        self.final_status = final_status
+        self.interval = interval
+        self.batch_size = batch_size
+
+    def _due(self, now: datetime) -> dict:
+        now_iso = now.isoformat()
+        return {'$or': [
+            {'status': 'active', 'expires_at': {'$lte': now_iso}, 'otp': None},
+            {'status': 'expiring', 'expiry_lease_until': {'$lt': now_iso}},
+            {'status': 'cancelling', 'cancel_started_at': {'$lt': (now - timedelta(seconds=LEASE_SECONDS)).isoformat()}},
+        ]}
+
+    async def _claim(self) -> List[dict]:
+        now = datetime.now(timezone.utc)
+        candidates = await self.collection.find(self._due(now), {'_id': 0, 'id': 1}).to_list(self.batch_size)
+        if not candidates:
+            return []
+        claim = str(uuid.uuid4())
+        # Re-check the due condition in the update itself so a concurrent sweeper or a
+        # user cancel that got there first keeps the order
+        await self.collection.update_many(
+            {'id': {'$in': [c['id'] for c in candidates]}, **self._due(now)},
+            {'$set': {
+                'status': 'expiring',
+                'expiry_claim': claim,
+                'expiry_lease_until': (now + timedelta(seconds=LEASE_SECONDS)).isoformat(),
+            }},
+        )
+        return await self.collection.find({'expiry_claim': claim, 'status': 'expiring'}, {'_id': 0}).to_list(self.batch_size)
+
+    async def sweep_once(self) -> int:
+        """Expire one batch. Returns the number of orders expired"""
+        orders = await self._claim()
+        if not orders:
+            return 0
+        await self.handler(orders)
+        claims = list({order['expiry_claim'] for order in orders})
+        result = await self.collection.update_many(
+            {'expiry_claim': {'$in': claims}, 'status': 'expiring'},
+            {'$set': {'status': self.final_status, 'can_cancel': False, 'expired_at': datetime.now(timezone.utc).isoformat()},
+             '$unset': {'expiry_lease_until': ''}},
+        )
+        logger.info(f"Expired {result.modified_count} {self.name} orders")
+        return result.modified_count
+
+    async def run(self):
+        while True:
+            try:
+                # Drain the backlog batch by batch, then wait for the next round
+                while await self.sweep_once() >= self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.name} expiry sweep error: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,124 @@
+"""Adaptive OTP polling cadence.
+
+How long codes take to arrive is learned per (provider, service) as a histogram in the
+`otp_arrival_stats` collection (plus a per-provider histogram under service "*" for
+services with little history). A poller asks for a `PollSchedule`, which polls every
+`FAST_INTERVAL` seconds until the point where most codes have usually arrived, then backs
+off exponentially up to `MAX_INTERVAL`.
+
+Providers' rate-limit signals (`Retry-After`, HTTP 429) put the whole provider on hold,
+so every poller for it waits rather than just the one that got the answer.
+"""
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds since purchase
+BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 300, 420, 600)
+MIN_SAMPLES = 20
+PROFILE_TTL_SECONDS = 600
+ALL_SERVICES = '*'
+
+FAST_INTERVAL = 3.0
+MAX_INTERVAL = 60.0
+BACKOFF = 1.6
+FAST_WINDOW_QUANTILE = 0.8          # poll fast until this share of codes usually arrived
+FIRST_POLL_QUANTILE = 0.05
+DEFAULT_FAST_WINDOW = 60.0
+MIN_FAST_WINDOW, MAX_FAST_WINDOW = 20.0, 240.0
+MAX_FIRST_POLL = 15.0
+
+
+def _bucket(seconds: float) -> int:
+    for edge in BUCKETS:
+        if seconds <= edge:
+            return edge
+    return BUCKETS[-1]
+
+
+def quantile(buckets: Dict[int, int], q: float) -> Optional[float]:
+    """Upper bound of the bucket holding the q-th arrival"""
+    total = sum(buckets.values())
+    if not total:
+        return None
+    running = 0
+    for edge in BUCKETS:
+        running += buckets.get(edge, 0)
+        if running >= q * total:
+            return float(edge)
+    return float(BUCKETS[-1])
+
+
+class PollSchedule:
+    """Delays between polls for one order"""
+
+    def __init__(self, fast_window: float = DEFAULT_FAST_WINDOW, first_poll: float = FAST_INTERVAL):
+        self.fast_window = fast_window
+        self.first_poll = first_poll
+        self._interval = FAST_INTERVAL
+        self._polls = 0
+
+    @classmethod
+    def from_histogram(cls, buckets: Optional[Dict[int, int]]) -> 'PollSchedule':
+        if not buckets or sum(buckets.values()) < MIN_SAMPLES:
+            return cls()
+        fast_window = min(max(quantile(buckets, FAST_WINDOW_QUANTILE), MIN_FAST_WINDOW), MAX_FAST_WINDOW)
+        # Don't poll before the earliest codes usually show up
+        first_poll = min(max(quantile(buckets, FIRST_POLL_QUANTILE) * 0.8, FAST_INTERVAL), MAX_FIRST_POLL)
+        return cls(fast_window, first_poll)
+
+    def next_delay(self, elapsed: float) -> float:
+        self._polls += 1
+        if self._polls == 1:
+            return self.first_poll
+        if elapsed < self.fast_window:
+            return FAST_INTERVAL
+        self._interval = min(self._interval * BACKOFF, MAX_INTERVAL)
+        return self._interval
+
+
+class OtpCadence:
+    def __init__(self, collection):
+        self.collection = collection
+        self._profiles: Dict[Tuple[str, str], Tuple[float, Optional[Dict[int, int]]]] = {}
+        self._hold_until: Dict[str, float] = {}
+
+    async def _histogram(self, provider: str, service: str) -> Optional[Dict[int, int]]:
+        cached = self._profiles.get((provider, service))
+        if cached and time.monotonic() - cached[0] < PROFILE_TTL_SECONDS:
+            return cached[1]
+        doc = await self.collection.find_one({'provider': provider, 'service': service}, {'_id': 0, 'buckets': 1})
+        buckets = {int(edge): n for edge, n in (doc or {}).get('buckets', {}).items()} or None
+        self._profiles[(provider, service)] = (time.monotonic(), buckets)
+        return buckets
+
+    async def schedule(self, provider: str, service: str) -> PollSchedule:
+        for key in (service, ALL_SERVICES):
+            buckets = await self._histogram(provider, key)
+            if buckets and sum(buckets.values()) >= MIN_SAMPLES:
+                return PollSchedule.from_histogram(buckets)
+        return PollSchedule()
+
+    async def record_arrival(self, provider: str, service: str, seconds: float):
+        edge = _bucket(max(seconds, 0.0))
+        now = datetime.now(timezone.utc).isoformat()
+        for key in (service, ALL_SERVICES):
+            await self.collection.update_one(
+                {'provider': provider, 'service': key},
+                {'$inc': {f'buckets.{edge}': 1, 'count': 1}, '$set': {'updated_at': now}},
+                upsert=True,
+            )
+
+    async def arrival_counts(self) -> Dict[str, int]:
+        """{provider: OTP arrivals recorded so far}"""
+        docs = await self.collection.find({'service': ALL_SERVICES}, {'_id': 0, 'provider': 1, 'count': 1}).to_list(None)
+        return {doc['provider']: int(doc.get('count', 0)) for doc in docs}
+
+    def hold(self, provider: str, seconds: float):
+        """Pause polling a provider after it asked us to slow down"""
+        until = time.monotonic() + seconds
+        if until > self._hold_until.get(provider, 0.0):
+            self._hold_until[provider] = until
+
+    def hold_remaining(self, provider: str) -> float:
+        return max(0.0, self._hold_until.get(provider, 0.0) - time.monotonic())
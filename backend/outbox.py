@@ -0,0 +1,148 @@
+"""In-process outbox for non-critical writes.
+
+Request handlers enqueue documents (notifications, audit logs) and small follow-up
+updates such as unread counters without awaiting Mongo.
+A single writer task batches whatever is queued and flushes it per collection with one
+`bulk_write` every few milliseconds, or as soon as a batch is full.
+
+`put()` is fire-and-forget. `put_durable()` waits until the batch containing the
+document has been written, for events that must not be lost if the process dies
+right after the request returns. `stop()` drains the queue before shutdown.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = 0.005
+MAX_BATCH_SIZE = 200
+MAX_QUEUE_SIZE = 10000
+
+
+class Outbox:
+    def __init__(self, db, flush_interval: float = FLUSH_INTERVAL_SECONDS,
+                 batch_size: int = MAX_BATCH_SIZE, max_queue: int = MAX_QUEUE_SIZE):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        if self._writer and not self._writer.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = False
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued and stop the writer"""
+        self._stopping = True
+        if self._queue is not None:
+            await self._queue.join()
+        if self._writer:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+
+    def put(self, collection: str, document: dict):
+        """Queue an insert without waiting for it to be written"""
+        self._enqueue(collection, InsertOne(document), None)
+
+    def put_update(self, collection: str, filter: dict, update: dict, upsert: bool = False):
+        """Queue an update (e.g. a counter `$inc`) without waiting for it to be written"""
+        self._enqueue(collection, UpdateOne(filter, update, upsert=upsert), None)
+
+    async def put_durable(self, collection: str, document: dict):
+        """Queue an insert and return only once it has been persisted"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(collection, InsertOne(document), future)
+        await future
+
+    def _enqueue(self, collection: str, operation, future: Optional[asyncio.Future]):
+        if self._stopping or self._writer is None or self._writer.done():
+            if not self._stopping:
+                self.start()
+            else:
+                # Shutting down: write directly instead of queueing behind the drain
+                asyncio.create_task(self._write_direct(collection, operation, future))
+                return
+        try:
+            self._queue.put_nowait((collection, operation, future))
+        except asyncio.QueueFull:
+            logger.warning(f"Outbox full ({self.max_queue}), writing {collection} event directly")
+            asyncio.create_task(self._write_direct(collection, operation, future))
+
+    async def _write_direct(self, collection: str, operation, future: Optional[asyncio.Future]):
+        try:
+            await self.db[collection].bulk_write([operation], ordered=False)
+            if future and not future.done():
+                future.set_result(None)
+        except Exception as e:
+            logger.error(f"Outbox direct write to {collection} failed: {e}")
+            if future and not future.done():
+                future.set_exception(e)
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            batch = [first]
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[Tuple[str, object, Optional[asyncio.Future]]]):
+        grouped: Dict[str, list] = {}
+        for collection, operation, future in batch:
+            grouped.setdefault(collection, []).append((operation, future))
+
+        for collection, items in grouped.items():
+            error = None
+            for attempt in range(2):
+                try:
+                    await self.db[collection].bulk_write([op for op, _ in items], ordered=False)
+                    error = None
+                    break
+                except BulkWriteError as e:
+                    # A retry re-sends documents the first attempt already wrote
+                    write_errors = e.details.get('writeErrors', [])
+                    if all(err.get('code') == 11000 for err in write_errors):
+                        error = None
+                        break
+                    error = e
+                    logger.error(f"Outbox flush to {collection} failed (attempt {attempt + 1}, {len(items)} events): {e}")
+                except Exception as e:
+                    error = e
+                    logger.error(f"Outbox flush to {collection} failed (attempt {attempt + 1}, {len(items)} events): {e}")
+            for _, future in items:
+                if future is None or future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
@@ -0,0 +1,76 @@
+"""Side storage for raw provider payloads.
+
+Webhook bodies and provider API responses are kept for support and audits, but are
+never needed when listing transactions or payments. They are written to the
+`provider_payloads` collection (zlib-compressed when large) and referenced from the
+hot documents by id, so transactions, payments and invoices stay small.
+"""
+import json
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from bson import Binary
+
+COMPRESS_THRESHOLD_BYTES = 1024
+
+
+class PayloadStore:
+    def __init__(self, collection, outbox):
+        self.collection = collection
+        self.outbox = outbox
+
+    def _document(self, kind: str, payload: Any, ref: Optional[str]) -> dict:
+        raw = json.dumps(payload, default=str, separators=(',', ':')).encode('utf-8')
+        doc = {
+            'id': str(uuid.uuid4()),
+            'kind': kind,
+            'ref': ref,
+            'size': len(raw),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        }
+        if len(raw) >= COMPRESS_THRESHOLD_BYTES:
+            doc['encoding'] = 'zlib'
+            doc['data'] = Binary(zlib.compress(raw))
+        else:
+            doc['encoding'] = 'json'
+            doc['data'] = raw.decode('utf-8')
+        return doc
+
+    def put(self, kind: str, payload: Any, ref: Optional[str] = None) -> Optional[str]:
+        """Queue a payload for storage and return its id (None for empty payloads)"""
+        if payload is None:
+            return None
+        doc = self._document(kind, payload, ref)
+        self.outbox.put(self.collection.name, doc)
+        return doc['id']
+
+    async def save(self, kind: str, payload: Any, ref: Optional[str] = None) -> str:
+        """Store a payload now (used by migrations, where the write must land before the reference)"""
+        doc = self._document(kind, payload, ref)
+        await self.collection.insert_one(doc)
+        return doc['id']
+
+    @staticmethod
+    def _decode(doc: dict) -> Any:
+        data = doc['data']
+        if doc.get('encoding') == 'zlib':
+            data = zlib.decompress(bytes(data)).decode('utf-8')
+        return json.loads(data)
+
+    async def get(self, payload_id: str) -> Optional[dict]:
+        doc = await self.collection.find_one({'id': payload_id}, {'_id': 0})
+        if not doc:
+            return None
+        doc['payload'] = self._decode(doc)
+        del doc['data']
+        return doc
+
+    async def get_many(self, payload_ids) -> dict:
+        """Decoded payloads keyed by id"""
+        ids = [i for i in payload_ids if i]
+        if not ids:
+            return {}
+        docs = await self.collection.find({'id': {'$in': ids}}, {'_id': 0}).to_list(len(ids))
+        return {doc['id']: self._decode(doc) for doc in docs}
@@ -0,0 +1,95 @@
+"""In-memory index of live provider prices for cross-provider comparison.
+
+Every retail provider's full price list (SMS-pool pools and 5sim operators included) is
+pulled in the background and indexed by (normalised service name, ISO country), so a
+best-price lookup is a dict hit plus a sort of a handful of entries. A provider whose
+refresh fails keeps its previous prices until the next successful one.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import providers
+from routing import ROUTABLE_PROVIDERS, normalise_name, service_keys
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class IndexedPrice:
+    provider: str
+    service: str               # provider's own service code
+    service_name: Optional[str]
+    country: str               # provider's own country code
+    iso: str
+    option: Optional[str]      # SMS-pool pool / 5sim operator
+    price_usd: float
+    stock: Optional[int]
+    keys: Tuple[str, ...] = ()  # normalised names the service is known by
+
+
+class PriceIndex:
+    def __init__(self, provider_names: Iterable[str] = ROUTABLE_PROVIDERS):
+        self.provider_names = tuple(provider_names)
+        self._entries: Dict[str, List[IndexedPrice]] = {}
+        self._country_aliases: Dict[str, Dict[str, str]] = {}
+        self._by_key: Dict[Tuple[str, str], List[IndexedPrice]] = {}
+        self._aliases: Dict[str, str] = {}
+        self.refreshed_at: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._entries)
+
+    async def _load(self, name: str) -> Tuple[List[IndexedPrice], Dict[str, str]]:
+        provider = providers.get_provider(name)
+        country_iso, entries = await asyncio.gather(provider.country_iso(), provider.prices())
+        indexed = [
+            IndexedPrice(name, e.service, e.name, str(e.country), country_iso[str(e.country)], e.option, e.price,
+                         e.stock, tuple(service_keys(e)))
+            for e in entries
+            if e.price > 0 and str(e.country) in country_iso
+        ]
+        # Non-numeric provider country codes ("usa", "england") also work as lookup aliases
+        aliases = {normalise_name(code): iso for code, iso in country_iso.items() if not code.isdigit()}
+        return indexed, aliases
+
+    async def refresh(self):
+        async with self._lock:
+            results = await asyncio.gather(*(self._load(name) for name in self.provider_names), return_exceptions=True)
+            for name, result in zip(self.provider_names, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Price index refresh failed for {name}: {result}")
+                    continue
+                self._entries[name], self._country_aliases[name] = result
+                self.refreshed_at[name] = time.time()
+            self._rebuild()
+
+    async def ensure_ready(self):
+        if not self.ready:
+            await self.refresh()
+
+    def _rebuild(self):
+        by_key: Dict[Tuple[str, str], List[IndexedPrice]] = {}
+        for entries in self._entries.values():
+            for entry in entries:
+                for key in entry.keys:
+                    by_key.setdefault((key, entry.iso), []).append(entry)
+        aliases = {}
+        for provider_aliases in self._country_aliases.values():
+            aliases.update(provider_aliases)
+        self._by_key, self._aliases = by_key, aliases
+
+    def resolve_country(self, country: str) -> Optional[str]:
+        """ISO code for an ISO code or a named provider country code"""
+        country = (country or '').strip()
+        if len(country) == 2 and country.isalpha():
+            return country.upper()
+        return self._aliases.get(normalise_name(country))
+
+    def lookup(self, service: str, iso: str) -> List[IndexedPrice]:
+        """Every indexed price for a service in a country, in no particular order"""
+        return list(self._by_key.get((normalise_name(service), iso), ()))
@@ -0,0 +1,303 @@
+"""Catalog pricing and stats aggregation.
+
+Pure functions over provider payloads and query results, kept out of the endpoints
+so they can be benchmarked (see benchmarks/). They run on the event loop for every
+catalog request, so their CPU time is added directly to request latency.
+"""
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+RESELLER_PLAN_MULTIPLIERS = {
+    'Free': 1.0,      # Same as normal users (100% markup)
+    'Basic': 0.5,     # 50% of normal markup
+    'Pro': 0.3,       # 30% of normal markup
+    'Enterprise': 0.2 # 20% of normal markup (custom)
+}
+
+WHATSAPP_CODES = {'wa', 'whatsapp'}
+SIGNAL_CODES = {'signal', 'sg', 'si'}
+
+
+# ============ User catalogs ============
+
+def aggregate_smspool_pricing(
+    pricing_list: Iterable[Any],
+    services_map: Dict[str, str],
+    pools_map: Dict[str, str],
+    markup_percent: float,
+    ngn_rate: float,
+) -> List[Dict[str, Any]]:
+    """Group SMS-pool pricing entries per service, with all pools and the cheapest price
+
+    pricing_list format: [{service: 846, service_name: "Snapchat", country: 20, price: "0.02", pool: 7}, ...]
+    """
+    factor = 1 + markup_percent / 100
+    aggregated: Dict[str, Dict[str, Any]] = {}
+
+    for item in pricing_list:
+        if not isinstance(item, dict):
+            continue
+        service_id_raw = item.get('service')
+        if service_id_raw is None:
+            continue
+        service_id = str(service_id_raw)
+        base_price_usd = float(item.get('price', 0) or 0)
+        if base_price_usd <= 0:
+            continue
+
+        pool_id_raw = item.get('pool')
+        pool_id = str(pool_id_raw) if pool_id_raw is not None else None
+
+        final_price_usd = base_price_usd * factor
+        final_price_ngn = final_price_usd * ngn_rate
+
+        svc = aggregated.get(service_id)
+        if svc is None:
+            service_name = services_map.get(service_id) or item.get('service_name', f'Service {service_id}')
+            svc = aggregated[service_id] = {
+                'value': service_id,
+                'label': service_name,
+                'name': service_name,
+                'price_usd': final_price_usd,
+                'price_ngn': final_price_ngn,
+                'base_price': base_price_usd,
+                'pools': [],
+            }
+        elif final_price_ngn < svc['price_ngn']:
+            svc['price_ngn'] = final_price_ngn
+            svc['price_usd'] = final_price_usd
+            svc['base_price'] = base_price_usd
+
+        if pool_id:
+            svc['pools'].append({
+                'id': pool_id,
+                'name': pools_map.get(pool_id, f'Pool {pool_id}'),
+                'base_price': base_price_usd,
+                'price_usd': final_price_usd,
+                'price_ngn': final_price_ngn,
+            })
+
+    services = list(aggregated.values())
+    services.sort(key=lambda x: x['name'])
+    return services
+
+
+def aggregate_5sim_prices(country_block: Dict[str, Any], markup: float, ngn_rate: float) -> List[Dict[str, Any]]:
+    """Services with per-operator prices from one country of 5sim /guest/prices
+
+    Structure: product -> operator -> {cost, count, rate}; cost is already in USD.
+    """
+    factor = 1 + markup / 100
+    services: Dict[str, Dict[str, Any]] = {}
+
+    for product, operators in country_block.items():
+        for operator_name, info in operators.items():
+            try:
+                base_price_usd = float(info.get('cost', 0) or 0)
+            except Exception:
+                base_price_usd = 0.0
+            if base_price_usd <= 0:
+                continue
+
+            final_price_usd = base_price_usd * factor
+            final_price_ngn = final_price_usd * ngn_rate
+
+            svc = services.get(product)
+            if svc is None:
+                service_label = product.upper()
+                svc = services[product] = {
+                    'value': product,
+                    'label': service_label,
+                    'name': service_label,
+                    'price_usd': final_price_usd,
+                    'price_ngn': final_price_ngn,
+                    'base_price_usd': base_price_usd,
+                    'operators': [],
+                }
+            elif final_price_usd < svc['price_usd']:
+                svc['price_usd'] = final_price_usd
+                svc['price_ngn'] = final_price_usd * ngn_rate
+                svc['base_price_usd'] = base_price_usd
+
+            svc['operators'].append({
+                'name': operator_name,
+                'base_price_usd': base_price_usd,
+                'price_usd': final_price_usd,
+                'price_ngn': final_price_ngn,
+            })
+
+    result = list(services.values())
+    result.sort(key=lambda x: x['name'])
+    return result
+
+
+def daisysms_services(prices_data: Dict[str, Any], markup_percent: float, ngn_rate: float) -> List[Dict[str, Any]]:
+    """US services from DaisySMS getPricesVerification, with markup applied"""
+    factor = 1 + markup_percent / 100
+    services = []
+    for service_code, countries in prices_data.items():
+        if '187' not in countries:  # USA country code
+            continue
+        usa_data = countries['187']
+        base_price = float(usa_data.get('retail_price', usa_data.get('cost', 1.0)))
+        final_price = base_price * factor
+        name = usa_data.get('name', service_code)
+        services.append({
+            'value': service_code,
+            'label': f"{name} - ${final_price:.2f}",
+            'name': name,
+            'base_price': base_price,
+            'final_price': final_price,
+            'final_price_ngn': final_price * ngn_rate,
+            'count': usa_data.get('count', 0),
+        })
+    services.sort(key=lambda x: x['name'])
+    return services
+
+
+def convert_tigersms_prices(data: Dict[str, Any], rub_to_usd: float) -> Dict[str, Any]:
+    """Rewrite TigerSMS getPrices costs (RUB) to USD in place, keeping the RUB label"""
+    for services in data.values():
+        for info in services.values():
+            price_rub = float(info.get('cost', 0))
+            info['cost'] = str(round(price_rub * rub_to_usd, 2))
+            info['cost_rub'] = f"{price_rub} ₽"
+    return data
+
+
+# ============ Reseller catalogs ============
+
+def reseller_markup_multiplier(reseller: dict) -> float:
+    multiplier = reseller.get('custom_markup_multiplier')
+    if multiplier is None:
+        multiplier = RESELLER_PLAN_MULTIPLIERS.get(reseller.get('plan_name', 'Free'), 1.0)
+    return multiplier
+
+
+def calculate_reseller_price(base_price_ngn: float, markup_percent: float, reseller: dict, pricing_config: dict) -> float:
+    """Calculate the price for a reseller based on their plan"""
+    # base_price + (markup * multiplier)
+    markup_amount = base_price_ngn * (markup_percent / 100)
+    return base_price_ngn + markup_amount * reseller_markup_multiplier(reseller)
+
+
+def _reseller_services(entries: Iterable[Tuple[str, str, float]], markup: float, ngn_rate: float, reseller: dict) -> List[Dict[str, Any]]:
+    # Same result as calculate_reseller_price per entry, with the plan lookup done once
+    factor = 1 + (markup / 100) * reseller_markup_multiplier(reseller)
+    services = []
+    for code, name, base_usd in entries:
+        reseller_price = base_usd * ngn_rate * factor
+        services.append({
+            'code': code,
+            'name': name,
+            'price_ngn': round(reseller_price, 2),
+            'price_usd': round(reseller_price / ngn_rate, 4),
+            'available': True,
+        })
+    return services
+
+
+def reseller_daisysms_services(data: Dict[str, Any], markup: float, ngn_rate: float, reseller: dict) -> List[Dict[str, Any]]:
+    """DaisySMS format: {"service_code": {"187": {...}}, ...}"""
+    entries = (
+        (code, country_data['187'].get('name', code), float(country_data['187'].get('cost', 0)))
+        for code, country_data in data.items()
+        if isinstance(country_data, dict) and '187' in country_data
+    )
+    return _reseller_services(entries, markup, ngn_rate, reseller)
+
+
+def reseller_smspool_services(pricing_list: Iterable[dict], markup: float, ngn_rate: float, reseller: dict) -> List[Dict[str, Any]]:
+    """Lowest price per service from an SMS-pool pricing list"""
+    service_prices: Dict[str, Tuple[str, float]] = {}
+    for item in pricing_list:
+        service_id = str(item.get('service', ''))
+        price = float(item.get('price', 0) or 0)
+        if service_id and price > 0:
+            current = service_prices.get(service_id)
+            if current is None or price < current[1]:
+                service_prices[service_id] = (item.get('service_name', f'Service {service_id}'), price)
+    entries = ((service_id, name, price) for service_id, (name, price) in service_prices.items())
+    return _reseller_services(entries, markup, ngn_rate, reseller)
+
+
+def reseller_5sim_services(data: Dict[str, Any], markup: float, ngn_rate: float, reseller: dict) -> List[Dict[str, Any]]:
+    """5sim /guest/products/{country}/any; Price is already in USD"""
+    entries = (
+        (code, code.replace('_', ' ').title(), float(info.get('Price', 0)))
+        for code, info in data.items()
+    )
+    return _reseller_services(entries, markup, ngn_rate, reseller)
+
+
+# ============ Admin stats ============
+
+def _to_ngn(tx: dict, ngn_rate: float) -> float:
+    amt = float(tx.get('amount', 0) or 0)
+    return amt * ngn_rate if tx.get('currency') == 'USD' else amt
+
+
+def period_user_metrics(
+    deposit_txs: List[dict],
+    purchase_txs: List[dict],
+    new_user_ids: Set[str],
+    old_user_ids: Set[str],
+    ngn_rate: float,
+) -> Dict[str, Any]:
+    """Depositor/buyer sets and NGN sales splits for the admin dashboard period"""
+    depositors_all: Set[str] = set()
+    new_depositors: Set[str] = set()
+    old_depositors: Set[str] = set()
+    new_deposits_ngn = 0.0
+    old_deposits_ngn = 0.0
+
+    for tx in deposit_txs:
+        uid = tx.get('user_id')
+        if not uid:
+            continue
+        depositors_all.add(uid)
+        amt_ngn = _to_ngn(tx, ngn_rate)
+        if uid in new_user_ids:
+            new_depositors.add(uid)
+            new_deposits_ngn += amt_ngn
+        elif uid in old_user_ids:
+            old_depositors.add(uid)
+            old_deposits_ngn += amt_ngn
+
+    buyers_all: Set[str] = set()
+    sales_by_user: Dict[str, float] = {}
+    whatsapp_sales_ngn = 0.0
+    signal_sales_ngn = 0.0
+    total_sales_ngn = 0.0
+
+    for tx in purchase_txs:
+        uid = tx.get('user_id')
+        if not uid:
+            continue
+        buyers_all.add(uid)
+        amt_ngn = _to_ngn(tx, ngn_rate)
+        total_sales_ngn += amt_ngn
+        sales_by_user[uid] = sales_by_user.get(uid, 0.0) + amt_ngn
+        service_code = str((tx.get('metadata') or {}).get('service', '')).lower()
+        if service_code in WHATSAPP_CODES:
+            whatsapp_sales_ngn += amt_ngn
+        if service_code in SIGNAL_CODES:
+            signal_sales_ngn += amt_ngn
+
+    old_buyers = buyers_all & old_user_ids
+    old_buyers_without_deposit = old_buyers - depositors_all
+
+    return {
+        'depositors_all': depositors_all,
+        'new_depositors': new_depositors,
+        'old_depositors': old_depositors,
+        'new_deposits_ngn': new_deposits_ngn,
+        'old_deposits_ngn': old_deposits_ngn,
+        'buyers_all': buyers_all,
+        'new_buyers': buyers_all & new_user_ids,
+        'old_buyers': old_buyers,
+        'old_buyers_without_deposit': old_buyers_without_deposit,
+        'old_buyers_without_deposit_sales_ngn': sum(sales_by_user[uid] for uid in old_buyers_without_deposit),
+        'whatsapp_sales_ngn': whatsapp_sales_ngn,
+        'signal_sales_ngn': signal_sales_ngn,
+        'total_sales_ngn': total_sales_ngn,
+    }
@@ -0,0 +1,67 @@
+"""SMS number providers behind one adapter interface (see providers/base.py).
+
+Provider modules are imported the first time a provider is used, so a worker only
+loads the adapters it actually needs:
+
+    provider = provider_for_server('server1')
+    purchase = await provider.buy('wa', '1', pool='7')
+"""
+import importlib
+from typing import Dict, Optional
+
+from providers.base import (
+    ApiKeyLookup, OtpStatus, PriceEntry, ProviderError, Purchase, SmsProvider,
+)
+
+# Server keys shown to users and resellers -> provider
+RETAIL_SERVERS = {'us_server': 'daisysms', 'server1': 'smspool', 'server2': '5sim'}
+RESELLER_SERVERS = {'usa': 'daisysms', 'all_country_1': 'smspool', 'all_country_2': '5sim'}
+SERVER_PROVIDERS = {**RETAIL_SERVERS, **RESELLER_SERVERS}
+
+# provider -> (module, class)
+_ADAPTERS = {
+    'daisysms': ('providers.daisysms', 'DaisySMS'),
+    'tigersms': ('providers.tigersms', 'TigerSMS'),
+    'smspool': ('providers.smspool', 'SMSPool'),
+    '5sim': ('providers.fivesim', 'FiveSim'),
+}
+PROVIDER_NAMES = tuple(_ADAPTERS)
+
+_instances: Dict[str, SmsProvider] = {}
+_api_key_lookup: Optional[ApiKeyLookup] = None
+
+
+def configure(api_key_lookup: ApiKeyLookup):
+    """Set how adapters resolve their API key (called once by the server at import)"""
+    global _api_key_lookup
+    _api_key_lookup = api_key_lookup
+
+
+def get_provider(name: str) -> SmsProvider:
+    provider = _instances.get(name)
+    if provider is None:
+        if name not in _ADAPTERS:
+            raise KeyError(f'Unknown provider: {name}')
+        if _api_key_lookup is None:
+            raise RuntimeError('providers.configure() has not been called')
+        module_name, class_name = _ADAPTERS[name]
+        cls = getattr(importlib.import_module(module_name), class_name)
+        provider = _instances[name] = cls(_api_key_lookup)
+    return provider
+
+
+def provider_for_server(server: str) -> SmsProvider:
+    return get_provider(SERVER_PROVIDERS[server])
+
+
+async def close_all():
+    for provider in list(_instances.values()):
+        await provider.aclose()
+    _instances.clear()
+
+
+__all__ = [
+    'OtpStatus', 'PriceEntry', 'ProviderError', 'Purchase', 'SmsProvider',
+    'RETAIL_SERVERS', 'RESELLER_SERVERS', 'SERVER_PROVIDERS', 'PROVIDER_NAMES',
+    'configure', 'get_provider', 'provider_for_server', 'close_all',
+]
@@ -0,0 +1,182 @@
+"""The adapter interface every SMS number provider implements.
+
+Callers talk to `SmsProvider`, never to a provider's HTTP API:
+
+- `prices(country)`: normalised `PriceEntry` list (one per service/option)
+- `raw_prices(country)`: the provider's own catalog payload, for the catalog endpoints
+- `buy(service, country, **options)`: a `Purchase`, or raises `ProviderError`
+- `status(activation_id)` / `status_many(ids)`: `OtpStatus` per activation
+- `cancel(activation_id)`: True if the provider released the number
+- `balance()`: our account balance with the provider, if it reports one
+- `country_iso()`: {provider country code: ISO 3166 alpha-2}, to match countries across providers
+
+Options a provider doesn't understand are ignored, so one call site can pass the
+DaisySMS filters, the SMS-pool pool and the 5sim operator together.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Protocol
+
+import httpx
+
+import rate_budget
+from circuit_breaker import board as breakers
+from metrics import observe_upstream
+
+DEFAULT_TIMEOUT = 15.0
+STATUS_CONCURRENCY = 10
+DEFAULT_RETRY_AFTER = 30.0
+
+# ProviderError codes
+NO_NUMBERS = 'no_numbers'
+MAX_PRICE = 'max_price'
+TOO_MANY_ACTIVE = 'too_many_active'
+NO_BALANCE = 'no_balance'
+NOT_CONFIGURED = 'not_configured'
+UNAVAILABLE = 'unavailable'
+CIRCUIT_OPEN = 'circuit_open'     # refused locally, the provider was not called
+FAILED = 'failed'
+
+# OtpStatus states
+WAITING = 'waiting'
+RECEIVED = 'received'
+CANCELLED = 'cancelled'
+UNKNOWN = 'unknown'
+
+ApiKeyLookup = Callable[[str], Awaitable[Optional[str]]]
+
+
+class ProviderError(Exception):
+    def __init__(self, code: str, message: str = ''):
+        super().__init__(message or code)
+        self.code = code
+        self.message = message
+
+
+@dataclass
+class PriceEntry:
+    service: str
+    country: str
+    price: float
+    currency: str = 'USD'
+    option: Optional[str] = None       # SMS-pool pool / 5sim operator
+    stock: Optional[int] = None
+    name: Optional[str] = None
+
+
+@dataclass
+class Purchase:
+    activation_id: str
+    phone_number: str
+    price_usd: Optional[float] = None
+    option: Optional[str] = None
+    raw: Any = field(default=None, repr=False)
+
+
+@dataclass
+class OtpStatus:
+    state: str
+    code: Optional[str] = None
+    text: Optional[str] = None
+    retry_after: Optional[float] = None  # seconds the provider asked us to wait before polling again
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds to back off from a `Retry-After` header (or a bare 429)"""
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    return DEFAULT_RETRY_AFTER if response.status_code == 429 else None
+
+
+class SmsProvider(Protocol):
+    name: str
+
+    async def prices(self, country: Optional[str] = None) -> List[PriceEntry]: ...
+
+    async def raw_prices(self, country: Optional[str] = None) -> Any: ...
+
+    async def buy(self, service: str, country: str, **options) -> Purchase: ...
+
+    async def status(self, activation_id: str) -> OtpStatus: ...
+
+    async def status_many(self, activation_ids: Iterable[str]) -> Dict[str, OtpStatus]: ...
+
+    async def cancel(self, activation_id: str) -> bool: ...
+
+    async def balance(self) -> Optional[float]: ...
+
+    async def country_iso(self) -> Dict[str, str]: ...
+
+
+class HttpProvider:
+    """Shared plumbing: one pooled HTTP client per provider, timed calls, API key lookup"""
+
+    name = ''
+
+    def __init__(self, base_url: str, api_key: ApiKeyLookup):
+        self.base_url = base_url.rstrip('/')
+        self._api_key = api_key
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT)
+        return self._client
+
+    async def api_key(self) -> str:
+        key = await self._api_key(self.name)
+        if not key:
+            raise ProviderError(NOT_CONFIGURED, f'{self.name} API key not configured')
+        return key
+
+    async def request(self, action: str, method: str, path: str, **kwargs) -> httpx.Response:
+        if not breakers.allow(self.name, action):
+            raise ProviderError(CIRCUIT_OPEN, f'{self.name} is temporarily unavailable')
+        budget = rate_budget.budget(self.name)
+        await budget.acquire(rate_budget.lane_for(action))
+        started = time.monotonic()
+        try:
+            async with observe_upstream(self.name, action):
+                response = await self.client.request(method, f'{self.base_url}{path}', **kwargs)
+        except httpx.HTTPError:
+            breakers.record(self.name, action, True, time.monotonic() - started)
+            raise
+        finally:
+            budget.release()
+        # Business errors (4xx) are the provider working; 5xx and rate limiting are not
+        failed = response.status_code >= 500 or response.status_code == 429
+        breakers.record(self.name, action, failed, time.monotonic() - started)
+        return response
+
+    async def status_many(self, activation_ids: Iterable[str]) -> Dict[str, OtpStatus]:
+        semaphore = asyncio.Semaphore(STATUS_CONCURRENCY)
+        results: Dict[str, OtpStatus] = {}
+
+        async def check(activation_id: str):
+            async with semaphore:
+                try:
+                    results[activation_id] = await self.status(activation_id)
+                except Exception:
+                    results[activation_id] = OtpStatus(UNKNOWN)
+
+        await asyncio.gather(*(check(str(i)) for i in activation_ids))
+        return results
+
+    async def country_iso(self) -> Dict[str, str]:
+        return {}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
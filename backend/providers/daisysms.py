@@ -0,0 +1,50 @@
+"""DaisySMS: US numbers only (country 187), prices in USD"""
+import os
+from typing import Any, Dict, List, Optional
+
+from providers.base import PriceEntry, Purchase
+from providers.handler_api import HandlerApiProvider
+
+DAISYSMS_BASE_URL = os.environ.get('DAISYSMS_BASE_URL', 'https://daisysms.com')
+USA = '187'
+
+
+class DaisySMS(HandlerApiProvider):
+    name = 'daisysms'
+
+    def __init__(self, api_key):
+        super().__init__(DAISYSMS_BASE_URL, api_key)
+
+    async def raw_prices(self, country: Optional[str] = None) -> Any:
+        """{service_code: {"187": {name, cost, retail_price, count}}}"""
+        response = await self.call('getPricesVerification', 'prices')
+        response.raise_for_status()
+        return response.json()
+
+    async def prices(self, country: Optional[str] = None) -> List[PriceEntry]:
+        entries = []
+        for service, countries in (await self.raw_prices()).items():
+            info = countries.get(USA) if isinstance(countries, dict) else None
+            if not info:
+                continue
+            price = float(info.get('retail_price', info.get('cost', 0)) or 0)
+            if price > 0:
+                entries.append(PriceEntry(service, USA, price, stock=info.get('count'), name=info.get('name', service)))
+        return entries
+
+    async def country_iso(self) -> Dict[str, str]:
+        return {USA: 'US'}
+
+    async def buy(self, service: str, country: str = USA, max_price: Optional[float] = None,
+                  area_codes: Optional[str] = None, carrier: Optional[str] = None,
+                  preferred_number: Optional[str] = None, **_) -> Purchase:
+        params = {}
+        if max_price:
+            params['max_price'] = max_price  # Refuse unexpected price increases
+        if area_codes:
+            params['areas'] = area_codes
+        if carrier:
+            params['carriers'] = carrier
+        if preferred_number:
+            params['number'] = preferred_number
+        return await self._buy(service, **params)
@@ -0,0 +1,138 @@
+"""5sim: REST API, prices in USD, several operators per service"""
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+from providers.base import (
+    CANCELLED, FAILED, NO_BALANCE, NO_NUMBERS, RECEIVED, UNAVAILABLE, UNKNOWN, WAITING,
+    HttpProvider, OtpStatus, PriceEntry, ProviderError, Purchase, retry_after,
+)
+
+FIVESIM_BASE_URL = os.environ.get('FIVESIM_BASE_URL', 'https://5sim.net/v1')
+ORDER_LISTING_LIMIT = 100
+CLOSED_STATES = {'CANCELED', 'TIMEOUT', 'BANNED'}
+_CODE_PATTERN = re.compile(r"\b(\d{4,8})\b")
+
+
+def _order_status(order: dict) -> OtpStatus:
+    sms_list = order.get('sms') or []
+    if sms_list:
+        sms = sms_list[0]
+        code = sms.get('code')
+        text = sms.get('text') or ''
+        if not code:
+            match = _CODE_PATTERN.search(text)
+            code = match.group(1) if match else None
+        if code:
+            return OtpStatus(RECEIVED, str(code), text or None)
+    if order.get('status') in CLOSED_STATES:
+        return OtpStatus(CANCELLED)
+    return OtpStatus(WAITING)
+
+
+class FiveSim(HttpProvider):
+    name = '5sim'
+
+    def __init__(self, api_key):
+        super().__init__(FIVESIM_BASE_URL, api_key)
+
+    async def get(self, label: str, path: str, authenticated: bool = True, **params) -> httpx.Response:
+        headers = {'Accept': 'application/json'}
+        if authenticated:
+            headers['Authorization'] = f'Bearer {await self.api_key()}'
+        return await self.request(label, 'GET', path, headers=headers, params=params or None)
+
+    async def raw_prices(self, country: Optional[str] = None, product: Optional[str] = None) -> Any:
+        """{country: {product: {operator: {cost, count, rate}}}}"""
+        params = {k: v for k, v in (('country', country), ('product', product)) if v}
+        response = await self.get('prices', '/guest/prices', authenticated=False, **params)
+        response.raise_for_status()
+        return response.json() or {}
+
+    async def prices(self, country: Optional[str] = None) -> List[PriceEntry]:
+        entries = []
+        for country_code, products in (await self.raw_prices(country)).items():
+            for product, operators in products.items():
+                for operator, info in operators.items():
+                    price = float(info.get('cost', 0) or 0)
+                    if price > 0:
+                        entries.append(PriceEntry(product, country_code, price, option=operator,
+                                                  stock=info.get('count'), name=product.upper()))
+        return entries
+
+    async def products(self, country: str) -> Dict[str, Any]:
+        """{product: {Category, Qty, Price}} for any operator in a country"""
+        response = await self.get('prices', f'/guest/products/{country}/any', authenticated=False)
+        response.raise_for_status()
+        return response.json() or {}
+
+    async def countries(self) -> Dict[str, Any]:
+        response = await self.get('countries', '/guest/countries', authenticated=False)
+        response.raise_for_status()
+        return response.json() or {}
+
+    async def country_iso(self) -> Dict[str, str]:
+        # {"usa": {"iso": {"us": 1}, "text_en": "USA", ...}}
+        return {
+            code: next(iter(info['iso'])).upper()
+            for code, info in (await self.countries()).items()
+            if isinstance(info, dict) and info.get('iso')
+        }
+
+    async def buy(self, service: str, country: str, operator: Optional[str] = None, **_) -> Purchase:
+        operator = operator or 'any'
+        try:
+            response = await self.get('getNumber', f'/user/buy/activation/{country}/{operator}/{service}')
+        except httpx.HTTPError as e:
+            raise ProviderError(UNAVAILABLE, str(e))
+        if response.status_code != 200:
+            text = response.text
+            if 'no free phones' in text.lower():
+                raise ProviderError(NO_NUMBERS, text)
+            if 'not enough user balance' in text.lower():
+                raise ProviderError(NO_BALANCE, text)
+            raise ProviderError(FAILED, f'HTTP {response.status_code}: {text[:200]}')
+        try:
+            data = response.json()
+        except ValueError:
+            raise ProviderError(FAILED, 'Unexpected response')
+        return Purchase(str(data.get('id')), str(data.get('phone')), float(data.get('price') or 0) or None,
+                        option=data.get('operator', operator), raw=data)
+
+    async def status(self, activation_id: str) -> OtpStatus:
+        response = await self.get('getStatus', f'/user/check/{activation_id}')
+        if response.status_code != 200:
+            return OtpStatus(UNKNOWN, retry_after=retry_after(response))
+        return _order_status(response.json())
+
+    async def status_many(self, activation_ids: Iterable[str]) -> Dict[str, OtpStatus]:
+        # One listing call covers most recent orders; only ids missing from it are checked one by one
+        remaining = {str(i) for i in activation_ids}
+        results: Dict[str, OtpStatus] = {}
+        try:
+            response = await self.get('getStatus', '/user/orders', category='activation',
+                                      limit=ORDER_LISTING_LIMIT, order='id', reverse='true')
+            if response.status_code == 200:
+                for order in response.json().get('Data', []) or []:
+                    order_id = str(order.get('id'))
+                    if order_id in remaining:
+                        remaining.discard(order_id)
+                        results[order_id] = _order_status(order)
+        except (httpx.HTTPError, ProviderError):
+            pass
+        if remaining:
+            results.update(await super().status_many(remaining))
+        return results
+
+    async def cancel(self, activation_id: str) -> bool:
+        response = await self.get('cancel', f'/user/cancel/{activation_id}')
+        return response.status_code == 200
+
+    async def balance(self) -> Optional[float]:
+        response = await self.get('balance', '/user/profile')
+        if response.status_code != 200:
+            return None
+        value = response.json().get('balance')
+        return float(value) if value is not None else None
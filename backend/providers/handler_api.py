@@ -0,0 +1,74 @@
+"""The sms-activate style `handler_api.php` protocol shared by DaisySMS and TigerSMS"""
+from typing import Optional
+
+import httpx
+
+from providers.base import (
+    CANCELLED, FAILED, MAX_PRICE, NO_BALANCE, NO_NUMBERS, RECEIVED, TOO_MANY_ACTIVE, UNAVAILABLE,
+    UNKNOWN, WAITING, HttpProvider, OtpStatus, ProviderError, Purchase, retry_after,
+)
+
+HANDLER_PATH = '/stubs/handler_api.php'
+
+PURCHASE_ERRORS = {
+    'MAX_PRICE_EXCEEDED': MAX_PRICE,
+    'NO_NUMBERS': NO_NUMBERS,
+    'TOO_MANY_ACTIVE_RENTALS': TOO_MANY_ACTIVE,
+    'NO_MONEY': NO_BALANCE,
+    'NO_BALANCE': NO_BALANCE,
+}
+
+
+class HandlerApiProvider(HttpProvider):
+    async def call(self, action: str, label: str, **params) -> httpx.Response:
+        params = {'api_key': await self.api_key(), 'action': action, **params}
+        return await self.request(label, 'GET', HANDLER_PATH, params=params)
+
+    def _number_text(self, response: httpx.Response) -> str:
+        return response.text
+
+    async def _buy(self, service: str, **params) -> Purchase:
+        try:
+            response = await self.call('getNumber', 'getNumber', service=service, **params)
+        except httpx.HTTPError as e:
+            raise ProviderError(UNAVAILABLE, str(e))
+        if response.status_code != 200:
+            raise ProviderError(FAILED, f'HTTP {response.status_code}')
+
+        text = self._number_text(response).strip()
+        if text.startswith('ACCESS_NUMBER'):
+            # ACCESS_NUMBER:activation_id:phone_number
+            parts = text.split(':')
+            if len(parts) >= 3:
+                price = response.headers.get('X-Price')
+                return Purchase(parts[1].strip(), parts[2].strip(), float(price) if price else None, raw=text)
+        for marker, code in PURCHASE_ERRORS.items():
+            if marker in text:
+                raise ProviderError(code, text)
+        raise ProviderError(FAILED, text)
+
+    async def status(self, activation_id: str) -> OtpStatus:
+        response = await self.call('getStatus', 'getStatus', id=activation_id)
+        if response.status_code != 200:
+            return OtpStatus(UNKNOWN, retry_after=retry_after(response))
+        text = response.text.strip()
+        if text.startswith('STATUS_OK'):
+            parts = text.split(':', 1)
+            if len(parts) > 1:
+                return OtpStatus(RECEIVED, parts[1].strip(), response.headers.get('X-Text') or None)
+        if 'STATUS_CANCEL' in text:
+            return OtpStatus(CANCELLED)
+        if text.startswith('STATUS_WAIT'):
+            return OtpStatus(WAITING)
+        return OtpStatus(UNKNOWN, text=text)
+
+    async def cancel(self, activation_id: str) -> bool:
+        response = await self.call('setStatus', 'cancel', id=activation_id, status=8)
+        return 'ACCESS_CANCEL' in response.text
+
+    async def balance(self) -> Optional[float]:
+        response = await self.call('getBalance', 'balance')
+        text = response.text.strip()
+        if response.status_code == 200 and text.startswith('ACCESS_BALANCE'):
+            return float(text.split(':', 1)[1])
+        return None
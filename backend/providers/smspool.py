@@ -0,0 +1,132 @@
+"""SMS-pool: REST API, prices in USD, several pools per service"""
+import os
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from providers.base import (
+    FAILED, NO_BALANCE, NO_NUMBERS, RECEIVED, UNAVAILABLE, UNKNOWN, WAITING,
+    HttpProvider, OtpStatus, PriceEntry, ProviderError, Purchase, retry_after,
+)
+
+SMSPOOL_BASE_URL = os.environ.get('SMSPOOL_BASE_URL', 'https://api.smspool.net')
+
+
+class SMSPool(HttpProvider):
+    name = 'smspool'
+
+    def __init__(self, api_key):
+        super().__init__(SMSPOOL_BASE_URL, api_key)
+
+    async def post(self, label: str, path: str, data: Optional[dict] = None, **params) -> httpx.Response:
+        key = await self.api_key()
+        return await self.request(label, 'POST', path, data=data, params={'key': key, **params},
+                                  headers={'Authorization': f'Bearer {key}'})
+
+    async def raw_prices(self, country: Optional[str] = None) -> Any:
+        """[{service, service_name, country, price, pool}, ...]"""
+        response = await self.post('prices', '/request/pricing', data={'country': country} if country else None)
+        response.raise_for_status()
+        return response.json() or []
+
+    async def prices(self, country: Optional[str] = None) -> List[PriceEntry]:
+        entries = []
+        for item in await self.raw_prices(country):
+            if not isinstance(item, dict) or item.get('service') is None:
+                continue
+            price = float(item.get('price', 0) or 0)
+            if price > 0:
+                pool = item.get('pool')
+                entries.append(PriceEntry(
+                    str(item['service']), str(item.get('country', country)), price,
+                    option=str(pool) if pool is not None else None, name=item.get('service_name'),
+                ))
+        return entries
+
+    async def service_names(self, country: Optional[str] = None) -> Dict[str, str]:
+        response = await self.post('services', '/service/retrieve_all', data={'country': country} if country else None)
+        response.raise_for_status()
+        names = {}
+        for s in response.json() or []:
+            if isinstance(s, dict):
+                sid = str(s.get('ID') or s.get('id') or '')
+                if sid:
+                    names[sid] = s.get('name') or f'Service {sid}'
+        return names
+
+    async def pool_names(self) -> Dict[str, str]:
+        response = await self.post('pools', '/pool/retrieve_all')
+        response.raise_for_status()
+        names = {}
+        for p in response.json() or []:
+            if isinstance(p, dict):
+                pid = str(p.get('id') or p.get('ID') or p.get('pool') or '')
+                if pid:
+                    names[pid] = p.get('name') or p.get('label') or f'Pool {pid}'
+        return names
+
+    async def countries(self) -> List[dict]:
+        """[{ID, name, short_name, region}, ...]"""
+        response = await self.post('countries', '/country/retrieve_all')
+        response.raise_for_status()
+        return response.json() or []
+
+    async def country_iso(self) -> Dict[str, str]:
+        return {
+            str(c['ID']): str(c['short_name']).upper()
+            for c in await self.countries()
+            if isinstance(c, dict) and c.get('ID') is not None and c.get('short_name')
+        }
+
+    async def buy(self, service: str, country: str, pool: Optional[str] = None, **_) -> Purchase:
+        params = {'service': service, 'country': country}
+        if pool:
+            params['pool'] = pool
+        try:
+            response = await self.post('getNumber', '/purchase/sms', **params)
+        except httpx.HTTPError as e:
+            raise ProviderError(UNAVAILABLE, str(e))
+        try:
+            data = response.json()
+        except ValueError:
+            raise ProviderError(FAILED, f'HTTP {response.status_code}: {response.text[:200]}')
+
+        if response.status_code == 200 and data.get('success') == 1:
+            phone = data.get('number') or data.get('phonenumber')
+            price = data.get('price')
+            pool_used = data.get('pool', pool)
+            return Purchase(str(data.get('order_id')), str(phone), float(price) if price else None,
+                            option=str(pool_used) if pool_used is not None else None, raw=data)
+
+        message = str(data.get('message') or data)
+        lowered = message.lower()
+        if 'balance' in lowered:
+            raise ProviderError(NO_BALANCE, message)
+        if 'stock' in lowered or 'not available' in lowered or 'no numbers' in lowered:
+            raise ProviderError(NO_NUMBERS, message)
+        raise ProviderError(FAILED, message)
+
+    async def status(self, activation_id: str) -> OtpStatus:
+        response = await self.post('getStatus', '/sms/check', orderid=activation_id)
+        if response.status_code != 200:
+            return OtpStatus(UNKNOWN, retry_after=retry_after(response))
+        data = response.json()
+        if data.get('sms'):
+            return OtpStatus(RECEIVED, str(data['sms']), data.get('full_sms'))
+        return OtpStatus(WAITING)
+
+    async def cancel(self, activation_id: str) -> bool:
+        response = await self.post('cancel', '/sms/cancel', orderid=activation_id)
+        if response.status_code != 200:
+            return False
+        try:
+            return response.json().get('success') == 1
+        except ValueError:
+            return False
+
+    async def balance(self) -> Optional[float]:
+        response = await self.post('balance', '/request/balance')
+        if response.status_code != 200:
+            return None
+        value = response.json().get('balance')
+        return float(value) if value is not None else None
@@ -0,0 +1,44 @@
+"""TigerSMS: handler_api.php protocol, prices in RUB"""
+import os
+from typing import Any, List, Optional
+
+import httpx
+
+from providers.base import PriceEntry, Purchase
+from providers.handler_api import HandlerApiProvider
+
+TIGERSMS_BASE_URL = os.environ.get('TIGERSMS_BASE_URL', 'https://api.tiger-sms.com')
+
+
+class TigerSMS(HandlerApiProvider):
+    name = 'tigersms'
+
+    def __init__(self, api_key):
+        super().__init__(TIGERSMS_BASE_URL, api_key)
+
+    def _number_text(self, response: httpx.Response) -> str:
+        # getNumber answers with a JSON string
+        try:
+            return str(response.json())
+        except ValueError:
+            return response.text
+
+    async def raw_prices(self, country: Optional[str] = None) -> Any:
+        """{country: {service_code: {cost (RUB), count}}}"""
+        params = {'country': country} if country else {}
+        response = await self.call('getPrices', 'prices', **params)
+        response.raise_for_status()
+        return response.json()
+
+    async def prices(self, country: Optional[str] = None) -> List[PriceEntry]:
+        entries = []
+        for country_code, services in (await self.raw_prices(country)).items():
+            for service, info in services.items():
+                price = float(info.get('cost', 0) or 0)
+                if price > 0:
+                    entries.append(PriceEntry(service, country_code, price, currency='RUB',
+                                              stock=info.get('count'), name=info.get('name', service)))
+        return entries
+
+    async def buy(self, service: str, country: str, **_) -> Purchase:
+        return await self._buy(service, country=country)
@@ -0,0 +1,145 @@
+"""Per-provider request budgets with priority lanes.
+
+Every call made with a provider's API key goes through that provider's `RateBudget`: a
+token bucket (requests per second, with a small burst) plus a cap on concurrent calls.
+Calls wait in one of three lanes and are released strictly in lane order:
+
+- purchase: buying and cancelling numbers
+- status: OTP polls
+- catalog: price lists, countries, balances
+
+Lower lanes also leave `RESERVED` tokens and concurrency slots untouched, so a purchase
+never queues behind a burst of polls already in flight.
+
+Budgets are per worker process. Configure them per worker with
+`RATE_BUDGET_<PROVIDER>=<requests per second>/<concurrency>` (e.g. `RATE_BUDGET_5SIM=5/4`),
+falling back to `RATE_BUDGET_RPS` / `RATE_BUDGET_CONCURRENCY`.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import metrics
+
+PURCHASE, STATUS, CATALOG = 0, 1, 2
+LANES = ('purchase', 'status', 'catalog')
+ACTION_LANES = {'getNumber': PURCHASE, 'cancel': PURCHASE, 'getStatus': STATUS}
+
+DEFAULT_RPS = float(os.environ.get('RATE_BUDGET_RPS', 8))
+DEFAULT_CONCURRENCY = int(os.environ.get('RATE_BUDGET_CONCURRENCY', 8))
+RESERVED = 1                      # tokens and slots only the purchase lane may use
+
+
+def lane_for(action: str) -> int:
+    return ACTION_LANES.get(action, CATALOG)
+
+
+class RateBudget:
+    def __init__(self, provider: str, rate: float, concurrency: int):
+        self.provider = provider
+        self.rate = max(rate, 0.1)
+        self.concurrency = max(concurrency, RESERVED + 1)
+        self.burst = max(self.rate, RESERVED + 1.0)
+        self.tokens = self.burst
+        self.in_flight = 0
+        self._updated = time.monotonic()
+        self._queues: List[Deque[asyncio.Future]] = [deque() for _ in LANES]
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _can_start(self, lane: int) -> bool:
+        reserve = 0 if lane == PURCHASE else RESERVED
+        return self.in_flight < self.concurrency - reserve and self.tokens >= 1 + reserve
+
+    def _start(self):
+        self.tokens -= 1
+        self.in_flight += 1
+
+    async def acquire(self, lane: int):
+        self._refill()
+        if not any(self._queues[:lane + 1]) and self._can_start(lane):
+            self._start()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[lane].append(waiter)
+        self._set_gauges()
+        queued_at = time.monotonic()
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._queues[lane]:
+                self._queues[lane].remove(waiter)
+                self._set_gauges()
+            elif waiter.done() and not waiter.cancelled():
+                self.release()  # the slot was granted just before we were cancelled
+            raise
+        metrics.RATE_BUDGET_WAIT.labels(self.provider, LANES[lane]).observe(time.monotonic() - queued_at)
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        self._refill()
+        for lane, queue in enumerate(self._queues):
+            while queue and self._can_start(lane):
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                self._start()
+                waiter.set_result(None)
+            if queue:
+                break  # strict priority: lower lanes wait until this one is drained
+        self._set_gauges()
+        head = next((lane for lane, queue in enumerate(self._queues) if queue), None)
+        if head is None or self._timer is not None:
+            return
+        needed = 1 + (0 if head == PURCHASE else RESERVED)
+        if self.tokens < needed:
+            # Short of tokens rather than slots: wake up when enough have refilled
+            delay = (needed - self.tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def snapshot(self) -> dict:
+        self._refill()
+        return {
+            'rate': self.rate,
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'tokens': round(self.tokens, 2),
+            'queued': {LANES[lane]: len(queue) for lane, queue in enumerate(self._queues)},
+        }
+
+    def _set_gauges(self):
+        for lane, queue in enumerate(self._queues):
+            metrics.RATE_BUDGET_QUEUE_DEPTH.labels(self.provider, LANES[lane]).set(len(queue))
+
+
+def _configured(provider: str) -> RateBudget:
+    value = os.environ.get(f'RATE_BUDGET_{provider.upper()}', '')
+    rate, _, concurrency = value.partition('/')
+    return RateBudget(
+        provider,
+        float(rate) if rate else DEFAULT_RPS,
+        int(concurrency) if concurrency else DEFAULT_CONCURRENCY,
+    )
+
+
+_budgets: Dict[str, RateBudget] = {}
+
+
+def budget(provider: str) -> RateBudget:
+    if provider not in _budgets:
+        _budgets[provider] = _configured(provider)
+    return _budgets[provider]
@@ -0,0 +1,92 @@
+"""Per-request wall-time breakdown.
+
+The timing middleware puts a `RequestTiming` into a context variable. The Mongo
+proxy and `observe_upstream` in metrics.py add every operation they time to it,
+so a request's wall time can be split into:
+
+- mongo: time awaiting MongoDB
+- upstream: time awaiting provider APIs
+- app: the remainder, i.e. CPU work such as serialization and pricing loops, plus
+  event-loop contention
+- queue: time before the app saw the request, from the proxy's `X-Request-Start` header
+
+Concurrent awaits (asyncio.gather) can make mongo + upstream exceed the wall time;
+app is clamped at zero in that case.
+"""
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+_current: ContextVar[Optional['RequestTiming']] = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    def __init__(self, queue_seconds: float = 0.0):
+        self.start = time.perf_counter()
+        self.queue_seconds = queue_seconds
+        self.totals: Dict[str, float] = {'mongo': 0.0, 'upstream': 0.0}
+        self.counts: Dict[str, int] = {'mongo': 0, 'upstream': 0}
+        self.details: Dict[str, List[float]] = {}   # "mongo:users.find_one" -> [seconds, count]
+        self.principal: Optional[str] = None        # "user:<id>" or "reseller:<id>"
+        self.expose = False                         # admins get the Server-Timing header
+
+    def record(self, kind: str, detail: str, seconds: float):
+        self.totals[kind] = self.totals.get(kind, 0.0) + seconds
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        entry = self.details.setdefault(f'{kind}:{detail}', [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def breakdown(self) -> Dict[str, float]:
+        total = time.perf_counter() - self.start
+        return {
+            'total': total,
+            'mongo': self.totals['mongo'],
+            'upstream': self.totals['upstream'],
+            'app': max(total - self.totals['mongo'] - self.totals['upstream'], 0.0),
+            'queue': self.queue_seconds,
+        }
+
+    def top(self, n: int = 5) -> List[Tuple[str, float, int]]:
+        ranked = sorted(self.details.items(), key=lambda item: item[1][0], reverse=True)[:n]
+        return [(name, seconds, count) for name, (seconds, count) in ranked]
+
+    def server_timing_header(self) -> str:
+        parts = []
+        for name, seconds in self.breakdown().items():
+            desc = f';desc="{self.counts[name]} calls"' if name in self.counts else ''
+            parts.append(f'{name};dur={seconds * 1000:.1f}{desc}')
+        for name, seconds, count in self.top(3):
+            token = name.replace(':', '-').replace('.', '-').replace(' ', '_')
+            parts.append(f'{token};dur={seconds * 1000:.1f};desc="{count}x"')
+        return ', '.join(parts)
+
+
+def begin(queue_seconds: float = 0.0) -> RequestTiming:
+    timing = RequestTiming(queue_seconds)
+    _current.set(timing)
+    return timing
+
+
+def current() -> Optional[RequestTiming]:
+    return _current.get()
+
+
+def record(kind: str, detail: str, seconds: float):
+    timing = _current.get()
+    if timing is not None:
+        timing.record(kind, detail, seconds)
+
+
+def queue_seconds_from_header(value: Optional[str]) -> float:
+    """Parse `X-Request-Start` (`t=<epoch>` in s, ms or µs) into seconds spent queued"""
+    if not value:
+        return 0.0
+    try:
+        raw = float(value.strip().lstrip('t='))
+    except ValueError:
+        return 0.0
+    # Normalise to seconds whatever unit the proxy uses
+    while raw > 1e11:
+        raw /= 1000.0
+    return max(time.time() - raw, 0.0)
@@ -0,0 +1,174 @@
+"""Purchase routing across providers, pools and operators.
+
+With auto-routing a purchase is not tied to the pool, operator or provider the user
+picked: `find_routes` lists every priced way to buy the same service in the same
+country (the other pools/operators of the chosen provider and, where the service name
+and the country's ISO code match, the other retail providers) and `rank_routes` orders
+them by price, recent success rate and recent latency.
+
+Success rate and latency come from `stats`, fed by `record_attempt` on every purchase
+attempt. Like the other in-process caches they are per worker.
+"""
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+import providers
+from providers import PriceEntry
+
+logger = logging.getLogger(__name__)
+
+ROUTABLE_PROVIDERS = tuple(providers.RETAIL_SERVERS.values())
+PRICES_TTL_SECONDS = 60
+COUNTRIES_TTL_SECONDS = 3600
+STATS_WINDOW = 50                  # attempts kept per route
+STATS_MAX_AGE_SECONDS = 1800
+MIN_ROUTE_SAMPLES = 5              # below this a route is judged by its provider's record
+LATENCY_REFERENCE_SECONDS = 5.0
+LATENCY_WEIGHT = 0.25
+_NAME_RE = re.compile(r"[^a-z0-9]+")
+
+
+@dataclass
+class Route:
+    provider: str
+    service: str
+    country: str
+    option: Optional[str] = None       # SMS-pool pool / 5sim operator
+    base_price_usd: float = 0.0
+    price: Optional[float] = None      # what the user would be charged, set by the caller
+    stock: Optional[int] = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.provider, self.option or 'any'
+
+    def as_dict(self) -> dict:
+        return {k: v for k, v in asdict(self).items() if k in ('provider', 'service', 'country', 'option')}
+
+
+class RouteStats:
+    """Rolling purchase outcomes per route and per provider"""
+
+    def __init__(self, window: int = STATS_WINDOW, max_age: float = STATS_MAX_AGE_SECONDS):
+        self.window = window
+        self.max_age = max_age
+        self._samples: Dict[Tuple[str, str], Deque[Tuple[float, bool, float]]] = {}
+
+    def record(self, provider: str, option: Optional[str], ok: bool, latency: float):
+        sample = (time.monotonic(), ok, latency)
+        for key in ((provider, option or 'any'), (provider, '*')):
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(sample)
+
+    def _recent(self, key: Tuple[str, str]) -> List[Tuple[float, bool, float]]:
+        cutoff = time.monotonic() - self.max_age
+        return [s for s in self._samples.get(key, ()) if s[0] >= cutoff]
+
+    def summary(self, provider: str, option: Optional[str]) -> Tuple[float, Optional[float]]:
+        """(success rate, mean latency in seconds or None)"""
+        samples = self._recent((provider, option or 'any'))
+        if len(samples) < MIN_ROUTE_SAMPLES:
+            samples = self._recent((provider, '*'))
+        successes = sum(1 for _, ok, _ in samples if ok)
+        # Laplace smoothing: a route we know nothing about starts at 50%
+        success_rate = (successes + 1) / (len(samples) + 2)
+        latency = sum(s[2] for s in samples) / len(samples) if samples else None
+        return success_rate, latency
+
+
+stats = RouteStats()
+
+
+def record_attempt(route: Route, error_code: Optional[str], latency: float):
+    stats.record(route.provider, route.option, error_code is None, latency)
+    metrics.PURCHASE_ATTEMPTS.labels(route.provider, error_code or 'ok').inc()
+
+
+def score(route: Route, route_stats: RouteStats = stats) -> float:
+    """Expected price of one successful purchase, penalised for slow routes (lower is better)"""
+    success_rate, latency = route_stats.summary(route.provider, route.option)
+    price = route.price if route.price is not None else route.base_price_usd
+    return price / success_rate * (1 + LATENCY_WEIGHT * (latency or 0.0) / LATENCY_REFERENCE_SECONDS)
+
+
+def rank_routes(routes: Iterable[Route], route_stats: RouteStats = stats) -> List[Route]:
+    return sorted(routes, key=lambda r: score(r, route_stats))
+
+
+# ============ Route discovery ============
+
+_cache: Dict[tuple, Tuple[float, object]] = {}
+
+
+async def _cached(key: tuple, ttl: float, load: Callable[[], Awaitable[object]]):
+    hit = _cache.get(key)
+    if hit and time.monotonic() - hit[0] < ttl:
+        return hit[1]
+    value = await load()
+    _cache[key] = (time.monotonic(), value)
+    return value
+
+
+async def _prices(provider: str, country: str) -> List[PriceEntry]:
+    return await _cached(('prices', provider, country), PRICES_TTL_SECONDS,
+                         lambda: providers.get_provider(provider).prices(country))
+
+
+async def _country_iso(provider: str) -> Dict[str, str]:
+    return await _cached(('countries', provider), COUNTRIES_TTL_SECONDS,
+                         lambda: providers.get_provider(provider).country_iso())
+
+
+def normalise_name(name: str) -> str:
+    return _NAME_RE.sub('', (name or '').lower())
+
+
+def service_keys(entry: PriceEntry) -> Set[str]:
+    """Normalised names a service is known by; numeric ids are provider specific"""
+    keys = {normalise_name(entry.name)}
+    if not entry.service.isdigit():
+        keys.add(normalise_name(entry.service))
+    keys.discard('')
+    return keys
+
+
+def _route(provider: str, entry: PriceEntry) -> Route:
+    return Route(provider, entry.service, entry.country, entry.option, entry.price, stock=entry.stock)
+
+
+def _in_stock(entry: PriceEntry) -> bool:
+    return entry.price > 0 and (entry.stock is None or entry.stock > 0)
+
+
+async def _matching_routes(provider: str, keys: Set[str], iso: str) -> List[Route]:
+    codes = [code for code, code_iso in (await _country_iso(provider)).items() if code_iso == iso]
+    if not codes:
+        return []
+    return [_route(provider, e) for e in await _prices(provider, codes[0]) if _in_stock(e) and service_keys(e) & keys]
+
+
+async def find_routes(provider: str, service: str, country: str, cross_provider: bool = True) -> List[Route]:
+    """Every in-stock way to buy `service` in `country`, unranked"""
+    origin = [e for e in await _prices(provider, country) if e.service == service]
+    routes = [_route(provider, e) for e in origin if _in_stock(e)]
+    if not cross_provider or not origin:
+        return routes
+
+    keys = set().union(*(service_keys(e) for e in origin))
+    iso = (await _country_iso(provider)).get(str(country))
+    if not keys or not iso:
+        return routes
+
+    others = [p for p in ROUTABLE_PROVIDERS if p != provider]
+    results = await asyncio.gather(*(_matching_routes(p, keys, iso) for p in others), return_exceptions=True)
+    for other, result in zip(others, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Route lookup on {other} failed: {result}")
+            continue
+        routes.extend(result)
+    return routes
@@ -2,7 +2,33 @@ from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Header,
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from wallet import WalletService
+from outbox import Outbox
+from giftcard_catalog import GiftCardCatalog, compute_ngn_pricing
+from webhook_inbox import WebhookInbox
+from payload_store import PayloadStore
+from providers import RETAIL_SERVERS, ProviderError, get_provider
+from pricing import (
+    aggregate_5sim_prices, aggregate_smspool_pricing, convert_tigersms_prices, daisysms_services,
+    period_user_metrics, reseller_5sim_services, reseller_daisysms_services, reseller_smspool_services,
+)
+import metrics
+import analytics
+import archive
+import datastore
+import providers
+import routing
+import rate_budget
+from circuit_breaker import board as breakers, health_score
+from price_index import PriceIndex
+from order_expiry import ExpirySweeper
+from otp_cadence import OtpCadence
+import request_timing
+from metrics import in_flight, cache_lookup
 from bson import ObjectId
 import os
 import logging
@@ -10,12 +36,12 @@ from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import bcrypt
 import jwt
 import httpx
-import requests
 import asyncio
+import time
 import hashlib
 import hmac
 import re
@@ -36,12 +62,29 @@ logger.info(f"Connecting to MongoDB: {mongo_url[:30]}...")  # Log first 30 chars
 
 try:
     client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
-    db = client[os.environ.get('DB_NAME', 'sms_relay_db')]
+    db = metrics.instrument_database(client[os.environ.get('DB_NAME', 'sms_relay_db')])
+    # Admin dashboards, listings and exports: secondaries, bounded staleness, own pool
+    analytics_client = datastore.analytics_client(mongo_url, serverSelectionTimeoutMS=5000)
+    analytics_db = metrics.instrument_database(analytics_client[os.environ.get('DB_NAME', 'sms_relay_db')])
+    wallet_service = WalletService(db.users)
+    outbox = Outbox(db)
+    giftcard_catalog = GiftCardCatalog(db.giftcard_catalog, db.giftcard_catalog_meta)
+    webhook_inbox = WebhookInbox(db.webhook_events)
+    payload_store = PayloadStore(db.provider_payloads, outbox)
+    otp_cadence = OtpCadence(db.otp_arrival_stats)
     logger.info("MongoDB client initialized")
 except Exception as e:
     logger.error(f"MongoDB connection error: {e}")
     client = None
     db = None
+    analytics_client = None
+    analytics_db = None
+    wallet_service = None
+    outbox = None
+    giftcard_catalog = None
+    webhook_inbox = None
+    payload_store = None
+    otp_cadence = None
 
 # Create the main app
 app = FastAPI()
@@ -203,7 +246,7 @@ PAYSCRIBE_BASE_URL = os.environ.get('PAYSCRIBE_BASE_URL', 'https://api.payscribe
 SMSPOOL_API_KEY = os.environ.get('SMSPOOL_API_KEY', 'ZNrdIWUS06ftzyb7ALO9XVWsfNhKmJT6')
 DAISYSMS_API_KEY = os.environ.get('DAISYSMS_API_KEY', 'eOIwvtJezbjbhLh7vz948uWMHgfELv')
 TIGERSMS_API_KEY = os.environ.get('TIGERSMS_API_KEY', 'mZGp2NQJswCEVaSISSUy0IHT1lwSrOVO')
-FIVESIM_BASE_URL = os.environ.get('FIVESIM_BASE_URL', 'https://5sim.net/v1')
+# Provider base URLs (DAISYSMS_BASE_URL, FIVESIM_BASE_URL, ...) are read by the adapters in providers/
 
 FIVESIM_API_KEY = os.environ.get('FIVESIM_API_KEY')
 
@@ -298,6 +341,7 @@ class PromoRedemption(BaseModel):
     order_id: Optional[str] = None
     amount_discounted: float = 0.0
     currency: str = 'NGN'
+    one_time_per_user: bool = True  # only these are covered by the unique (promo_id, user_id) index
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
@@ -340,6 +384,8 @@ class SMSOrder(BaseModel):
     area_code: Optional[str] = None
     carrier: Optional[str] = None
     phone_make: Optional[str] = None
+    # Auto-routed orders: the route that succeeded and the attempts before it
+    route: Optional[Dict[str, Any]] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     expires_at: Optional[datetime] = None
 
@@ -561,7 +607,7 @@ class ErcaspayPayment(BaseModel):
     transaction_reference: Optional[str] = None
     payment_reference: Optional[str] = None
     checkout_url: Optional[str] = None
-    ercaspay_response: Optional[Dict[str, Any]] = None
+    ercaspay_response_id: Optional[str] = None  # raw response in provider_payloads
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class PayscribeTempAccount(BaseModel):
@@ -577,8 +623,9 @@ class PayscribeTempAccount(BaseModel):
     bank_code: Optional[str] = None
     status: str = "pending"  # pending, paid, failed, expired
     expiry_date: Optional[str] = None
-    payscribe_response: Optional[Dict[str, Any]] = None
-    webhook_response: Optional[Dict[str, Any]] = None
+    account_id: Optional[str] = None  # Payscribe account id, used to match webhooks
+    payscribe_response_id: Optional[str] = None  # raw responses in provider_payloads
+    webhook_response_id: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: Optional[datetime] = None
 
@@ -664,6 +711,9 @@ class PurchaseNumberRequest(BaseModel):
     pool: Optional[str] = None
     # Optional 5sim operator selector
     operator: Optional[str] = None
+    # Opt-in failover to other pools, operators or providers when the first choice fails
+    auto_route: bool = False
+    max_price: Optional[float] = None  # In payment_currency; caps what auto-routing may charge
 
 class CalculatePriceRequest(BaseModel):
     server: str
@@ -789,6 +839,7 @@ class CreateStablecoinWalletRequest(BaseModel):
     label: Optional[str] = "My Wallet"
 
 class DataPurchaseRequest(BaseModel):
+    network: str
     plan_code: str
     recipient: str
     ref: Optional[str] = None
@@ -956,6 +1007,7 @@ async def _plisio_verify_hash(payload: dict) -> bool:
 # ============ Helper Functions ============
 
 async def _create_transaction_notification(user_id: str, title: str, message: str, metadata: Optional[dict] = None):
+    """Queue a user-scoped notification; the outbox writes it in the background"""
     notif = Notification(
         title=title,
         message=message,
@@ -969,7 +1021,34 @@ async def _create_transaction_notification(user_id: str, title: str, message: st
     doc['user_id'] = user_id  # scoped to user
     if metadata:
         doc['metadata'] = metadata
-    await db.notifications.insert_one(doc)
+    outbox.put('notifications', doc)
+    outbox.put_update('notification_inboxes', {'user_id': user_id}, {'$inc': {'unread_count': 1}}, upsert=True)
+
+
+async def _apply_deposit(credit_key: str, transaction: Transaction, notification: Optional[tuple] = None) -> bool:
+    """Credit a deposit exactly once and record its transaction.
+
+    Safe to call repeatedly for the same `credit_key` (webhook retries, webhook racing a
+    manual verify): the wallet credit is keyed, and the transaction id is derived from the
+    key so it is only inserted once. Returns True if this call applied the credit.
+    """
+    transaction_id = str(uuid.uuid5(uuid.NAMESPACE_URL, credit_key))
+    # The wallet only keeps its latest credit keys, so a retry that arrives after this key
+    # rolled off is caught by the transaction the first credit recorded
+    if await archive.count(db, 'transactions', {'id': transaction_id}, None):
+        return False
+    balances = await wallet_service.credit_once(transaction.user_id, transaction.amount, credit_key, transaction.currency)
+    if balances is None and not await db.users.count_documents({'id': transaction.user_id, 'applied_credits': credit_key}, limit=1):
+        raise ValueError(f"User {transaction.user_id} not found for deposit {credit_key}")
+
+    trans_dict = transaction.model_dump()
+    trans_dict['id'] = transaction_id
+    trans_dict['created_at'] = trans_dict['created_at'].isoformat()
+    await db.transactions.update_one({'id': trans_dict['id']}, {'$setOnInsert': trans_dict}, upsert=True)
+
+    if balances is not None and notification:
+        await _create_transaction_notification(transaction.user_id, *notification)
+    return balances is not None
 
 
 # Comprehensive country mapping
@@ -1046,11 +1125,15 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     try:
         token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0, 'password_hash': 0})
+        user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0, 'password_hash': 0, 'applied_credits': 0})
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         if user.get('is_blocked'):
             raise HTTPException(status_code=403, detail="Account blocked")
+        timing = request_timing.current()
+        if timing is not None:
+            timing.principal = f"user:{user['id']}"
+            timing.expose = bool(user.get('is_admin'))
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -1132,319 +1215,43 @@ async def create_paymentpoint_virtual_account(user: dict) -> Optional[VirtualAcc
         logger.error(f"Error creating virtual account: {str(e)}")
         return None
 
-# ============ SMS Provider Functions (Updated) ============
-
-async def purchase_number_smspool(service: str, country: str, **kwargs) -> Optional[Dict]:
-    """Purchase a number from SMS-pool.
-
-    Supports optional `pool` selection so that the frontend can choose
-    a specific pool for the given service/country.
-    """
-    try:
-        params = {'key': SMSPOOL_API_KEY, 'service': service, 'country': country}
-        pool = kwargs.get('pool')
-        if pool:
-            params['pool'] = pool
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                'https://api.smspool.net/purchase/sms',
-                params=params,
-                timeout=15.0
-            )
-            if response.status_code == 200:
-                return response.json()
-            else:
-                # Log the actual error response
-                try:
-                    error_data = response.json()
-                    logger.error(f"SMS-pool purchase failed (status {response.status_code}): {error_data}")
-                except:
-                    logger.error(f"SMS-pool purchase failed (status {response.status_code}): {response.text}")
-                return None
-    except Exception as e:
-        logger.error(f"SMS-pool purchase error: {str(e)}")
-        return None
-
-async def poll_otp_daisysms(order_id: str, activation_id: str):
-    """Background task to poll for OTP from DaisySMS"""
-    try:
-        config = await db.pricing_config.find_one({}, {'_id': 0})
-        api_key = config.get('daisysms_api_key') if config and config.get('daisysms_api_key') not in [None, '********'] else DAISYSMS_API_KEY
-        
-        # Poll for up to 5 minutes (100 attempts, 3 seconds each)
-        for attempt in range(100):
-            await asyncio.sleep(3)  # Wait 3 seconds between polls
-            
-            # Check if order still exists and is active
-            order = await db.sms_orders.find_one({'id': order_id}, {'_id': 0})
-            if not order or order['status'] != 'active':
-                logger.info(f"Order {order_id} no longer active, stopping poll")
-                break
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    'https://daisysms.com/stubs/handler_api.php',
-                    params={'api_key': api_key, 'action': 'getStatus', 'id': activation_id, 'text': 1},
-                    timeout=10.0
-                )
-                
-                if response.status_code == 200:
-                    result = response.text
-                    
-                    if 'STATUS_OK' in result:
-                        # Got the code! Format: STATUS_OK:12345
-                        parts = result.split(':')
-                        if len(parts) >= 2:
-                            otp_code = parts[1].strip()
-                            full_text = response.headers.get('X-Text', '')
-                            
-                            # Update order with OTP
-                            await db.sms_orders.update_one(
-                                {'id': order_id},
-                                {'$set': {
-                                    'otp': otp_code,
-                                    'sms_text': full_text,
-                                    'status': 'completed',
-                                    'can_cancel': False,
-                                    'received_at': datetime.now(timezone.utc).isoformat()
-                                }}
-                            )
-                            
-                            # Mark as done on DaisySMS
-                            await client.get(
-                                'https://daisysms.com/stubs/handler_api.php',
-                                params={'api_key': api_key, 'action': 'setStatus', 'id': activation_id, 'status': 6},
-                                timeout=10.0
-                            )
-                            
-                            logger.info(f"✓ OTP received for order {order_id}: {otp_code}")
-                            break
-                    
-                    elif 'STATUS_CANCEL' in result:
-                        # Rental was cancelled
-                        await db.sms_orders.update_one(
-                            {'id': order_id},
-                            {'$set': {'status': 'cancelled'}}
-                        )
-                        logger.info(f"Order {order_id} was cancelled")
-                        break
-                    
-                    elif 'NO_ACTIVATION' in result:
-                        logger.error(f"Invalid activation ID for order {order_id}")
-                        break
-                    
-                    # else: STATUS_WAIT_CODE - continue polling
-        
-        # If we exit loop without getting code, mark as expired
-        order = await db.sms_orders.find_one({'id': order_id}, {'_id': 0})
-        if order and order['status'] == 'active':
-            await db.sms_orders.update_one(
-                {'id': order_id},
-                {'$set': {'status': 'expired', 'can_cancel': False}}
-            )
-            logger.info(f"Order {order_id} expired without receiving OTP")
-            
-    except Exception as e:
-        logger.error(f"OTP polling error for order {order_id}: {str(e)}")
-
-async def purchase_number_daisysms(service: str, max_price: float, area_code: Optional[str] = None, 
-                                    carrier: Optional[str] = None, phone_make: Optional[str] = None) -> Optional[Dict]:
-    """Purchase number from DaisySMS with max_price protection"""
-    try:
-        # Get API key from config
-        config = await db.pricing_config.find_one({}, {'_id': 0})
-        api_key = config.get('daisysms_api_key') if config and config.get('daisysms_api_key') not in [None, '********'] else DAISYSMS_API_KEY
-        
-        params = {
-            'api_key': api_key,
-            'action': 'getNumber',
-            'service': service,
-            'max_price': max_price  # Prevent unexpected price increases
-        }
-        if area_code:
-            params['areas'] = area_code
-        if carrier:
-            params['carriers'] = carrier
-        if phone_make:
-            params['number'] = phone_make
-            
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                'https://daisysms.com/stubs/handler_api.php',
-                params=params,
-                timeout=15.0
-            )
-            if response.status_code == 200:
-                result_text = response.text
-                # Get actual price from X-Price header
-                actual_price = response.headers.get('X-Price')
-                
-                return {
-                    'text': result_text,
-                    'actual_price': float(actual_price) if actual_price else None,
-                    'status_code': 200
-                }
-            return None
-    except Exception as e:
-        logger.error(f"DaisySMS purchase error: {str(e)}")
-        return None
-
-async def purchase_number_tigersms(service: str, country: str, **kwargs) -> Optional[Dict]:
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                'https://api.tiger-sms.com/stubs/handler_api.php',
-                params={'api_key': TIGERSMS_API_KEY, 'action': 'getNumber', 'service': service, 'country': country},
-                timeout=15.0
-            )
-            if response.status_code == 200:
-                return response.json()
-            return None
-    except Exception as e:
-        logger.error(f"TigerSMS purchase error: {str(e)}")
-        return None
+# ============ SMS Providers ============
 
-async def poll_otp_5sim(order_id: str) -> Optional[str]:
-    """Poll 5sim for OTP using order ID."""
-    # Get key from config first, then env
-    config = await db.pricing_config.find_one({}, {'_id': 0})
-    fivesim_key = config.get('fivesim_api_key') if config and config.get('fivesim_api_key') not in [None, '', '********'] else FIVESIM_API_KEY
-    if not fivesim_key:
-        logger.error("FIVESIM_API_KEY not configured")
-        return None
-    try:
-        headers = {
-            'Authorization': f'Bearer {fivesim_key}',
-            'Accept': 'application/json'
-        }
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                f"{FIVESIM_BASE_URL}/user/orders",
-                headers=headers,
-                params={"category": "activation", "limit": 50},
-                timeout=10.0
-            )
-            if resp.status_code != 200:
-                logger.error(f"5sim status error {resp.status_code}: {resp.text}")
-                return None
-            data = resp.json()
-            orders = data.get('Data') or data
-            for o in orders:
-                if str(o.get('id')) == str(order_id):
-                    sms_list = o.get('sms') or []
-                    if sms_list:
-                        sms = sms_list[0]
-                        code = sms.get('code')
-                        if not code:
-                            import re
-                            text = sms.get('text') or ''
-                            m = re.search(r"\b(\d{4,8})\b", text)
-                            if m:
-                                code = m.group(1)
-                        return code
-            return None
-    except Exception as e:
-        logger.error(f"5sim OTP poll error: {str(e)}")
-        return None
+PROVIDER_KEY_SETTINGS = {
+    'daisysms': ('daisysms_api_key', DAISYSMS_API_KEY),
+    'tigersms': ('tigersms_api_key', TIGERSMS_API_KEY),
+    'smspool': ('smspool_api_key', SMSPOOL_API_KEY),
+    '5sim': ('fivesim_api_key', FIVESIM_API_KEY),
+}
+PROVIDER_KEY_CACHE_TTL_SECONDS = 15
+_provider_key_cache: Dict[str, tuple] = {}
+
+
+async def _provider_api_key(provider: str) -> Optional[str]:
+    """API key set in Admin → SMS Providers, falling back to the environment"""
+    cached = _provider_key_cache.get(provider)
+    if cached and time.monotonic() - cached[1] < PROVIDER_KEY_CACHE_TTL_SECONDS:
+        return cached[0]
+    setting, fallback = PROVIDER_KEY_SETTINGS[provider]
+    config = await db.pricing_config.find_one({}, {'_id': 0, setting: 1}) or {}
+    value = config.get(setting)
+    key = value if value not in (None, '', '********') else fallback
+    _provider_key_cache[provider] = (key, time.monotonic())
+    return key
 
-async def poll_otp_smspool(order_id: str) -> Optional[str]:
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                'https://api.smspool.net/sms/check',
-                params={'key': SMSPOOL_API_KEY, 'orderid': order_id},
-                timeout=10.0
-            )
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('sms')
-            return None
-    except Exception as e:
-        logger.error(f"SMS-pool OTP poll error: {str(e)}")
-        return None
 
-async def poll_otp_daisysms_simple(activation_id: str) -> Optional[str]:
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                'https://daisysms.com/stubs/handler_api.php',
-                params={'api_key': DAISYSMS_API_KEY, 'action': 'getStatus', 'id': activation_id},
-                timeout=10.0
-            )
-            if response.status_code == 200:
-                text = response.text
-                if 'STATUS_OK' in text:
-                    parts = text.split(':')
-                    if len(parts) > 1:
-                        return parts[1]
-            return None
-    except Exception as e:
-        logger.error(f"DaisySMS OTP poll error: {str(e)}")
-        return None
+providers.configure(_provider_api_key)
+RETAIL_PROVIDER_SERVERS = {provider: server for server, provider in RETAIL_SERVERS.items()}
+price_index = PriceIndex()
+PRICE_INDEX_REFRESH_INTERVAL = int(os.environ.get('PRICE_INDEX_REFRESH_INTERVAL_SECONDS', 300))
+ORDER_EXPIRY_SWEEP_INTERVAL = float(os.environ.get('ORDER_EXPIRY_SWEEP_INTERVAL_SECONDS', 15))
+ORDER_EXPIRY_CANCEL_CONCURRENCY = 8
+ORDER_LIFETIME_MINUTES = 10
 
-async def poll_otp_tigersms(activation_id: str) -> Optional[str]:
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                'https://api.tiger-sms.com/stubs/handler_api.php',
-                params={'api_key': TIGERSMS_API_KEY, 'action': 'getStatus', 'id': activation_id},
-                timeout=10.0
-            )
-            if response.status_code == 200:
-                text = response.text
-                if 'STATUS_OK' in text:
-                    parts = text.split(':')
-                    if len(parts) > 1:
-                        return parts[1]
-            return None
-    except Exception as e:
-        logger.error(f"TigerSMS OTP poll error: {str(e)}")
-        return None
 
 async def cancel_number_provider(provider: str, activation_id: str) -> bool:
     try:
-        if provider == 'smspool':
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    'https://api.smspool.net/request/cancel',
-                    params={'key': SMSPOOL_API_KEY, 'orderid': activation_id},
-                    timeout=10.0
-                )
-                return response.status_code == 200
-        elif provider == 'daisysms':
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    'https://daisysms.com/stubs/handler_api.php',
-                    params={'api_key': DAISYSMS_API_KEY, 'action': 'setStatus', 'id': activation_id, 'status': 8},
-                    timeout=10.0
-                )
-                return 'ACCESS_CANCEL' in response.text
-        elif provider == '5sim':
-            config = await db.pricing_config.find_one({}, {'_id': 0})
-            fivesim_key = config.get('fivesim_api_key') if config and config.get('fivesim_api_key') not in [None, '', '********'] else FIVESIM_API_KEY
-            if not fivesim_key:
-                logger.error("FIVESIM_API_KEY not configured for cancel")
-                return False
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(
-                    f"{FIVESIM_BASE_URL}/user/cancel/{activation_id}",
-                    headers={
-                        'Authorization': f'Bearer {fivesim_key}',
-                        'Accept': 'application/json'
-                    },
-                    timeout=10.0
-                )
-                return resp.status_code == 200
-
-        elif provider == 'tigersms':
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    'https://api.tiger-sms.com/stubs/handler_api.php',
-                    params={'api_key': TIGERSMS_API_KEY, 'action': 'setStatus', 'id': activation_id, 'status': 8},
-                    timeout=10.0
-                )
-                return 'ACCESS_CANCEL' in response.text
-        return False
+        return await get_provider(provider).cancel(activation_id)
     except Exception as e:
         logger.error(f"Cancel number error: {str(e)}")
         return False
@@ -1562,6 +1369,17 @@ async def get_data_plans_service(network: str, category: str = None) -> Optional
         logger.error(f"Error fetching data plans: {str(e)}")
         return None
 
+async def get_data_plan_price(network: str, plan_code: str) -> Optional[float]:
+    """Price in NGN of a network's data plan, or None if the plan is unknown"""
+    result = await get_data_plans_service(network.lower())
+    if not result or not result.get('status'):
+        return None
+    for group in (result.get('message') or {}).get('details') or []:
+        for plan in group.get('plans') or []:
+            if plan.get('plan_code') == plan_code:
+                return float(plan.get('amount') or 0)
+    return None
+
 async def purchase_data(plan_code: str, recipient: str, ref: str = None) -> Optional[Dict]:
     """Purchase data bundle via Payscribe"""
     try:
@@ -1613,111 +1431,182 @@ async def fund_bet_wallet(bet_id: str, customer_id: str, amount: float, ref: str
 
 # ============ Background Tasks ============
 
+def _seconds_since(created_at: Optional[str], default: float) -> float:
+    try:
+        return (datetime.now(timezone.utc) - datetime.fromisoformat(created_at)).total_seconds()
+    except (TypeError, ValueError):
+        return default
+
+
+@in_flight(metrics.OTP_POLLERS_ACTIVE)
 async def otp_polling_task(order_id: str):
     """Generic OTP polling for all providers with 10-minute lifetime.
 
     Behaviour:
-    - Poll provider for up to 10 minutes (600s).
+    - Poll provider for up to 10 minutes (600s), on the adaptive cadence learned for
+      the provider/service (fast while codes usually arrive, then backing off).
+    - Hold off while the provider asked us to slow down or its circuit is open.
     - After 5 minutes, allow user cancellation (can_cancel = True).
     - If OTP arrives: mark order completed and disable cancel.
-    - If no OTP by 10 minutes: auto-cancel with refund and mark order cancelled.
+
+    Orders still without an OTP once `expires_at` passes are cancelled and refunded by
+    the expiry sweeper, so that also happens for orders whose poller died with its worker.
     """
-    max_duration = 600  # 10 minutes total lifetime
-    poll_interval = 10
-    elapsed = 0
+    max_duration = ORDER_LIFETIME_MINUTES * 60
+    cancel_after = 300
+    started = time.monotonic()
+
+    order = await db.sms_orders.find_one({'id': order_id}, {'_id': 0})
+    if not order:
+        return
+    provider = order['provider']
+    schedule = await otp_cadence.schedule(provider, order.get('service') or '')
+
+    while True:
+        elapsed = time.monotonic() - started
+        delay = max(schedule.next_delay(elapsed), otp_cadence.hold_remaining(provider))
+        if elapsed < cancel_after:
+            delay = min(delay, cancel_after - elapsed + 0.5)
+        if elapsed + delay >= max_duration:
+            break
+        await asyncio.sleep(delay)
+        elapsed = time.monotonic() - started
 
-    while elapsed < max_duration:
         try:
             order = await db.sms_orders.find_one({'id': order_id}, {'_id': 0})
             if not order or order['status'] != 'active':
                 break
 
             otp = None
-            if order['provider'] == 'smspool' and order.get('activation_id'):
-                otp = await poll_otp_smspool(order['activation_id'])
-            elif order['provider'] == 'daisysms' and order.get('activation_id'):
-                otp = await poll_otp_daisysms_simple(order['activation_id'])
-            elif order['provider'] == 'tigersms' and order.get('activation_id'):
-                otp = await poll_otp_tigersms(order['activation_id'])
-            elif order['provider'] == '5sim' and order.get('activation_id'):
-                otp = await poll_otp_5sim(order['activation_id'])
+            # Skip this round while the provider's circuit is open or it asked us to back off
+            if (order.get('activation_id') and not breakers.is_open(provider, 'getStatus')
+                    and not otp_cadence.hold_remaining(provider)):
+                status = await get_provider(provider).status(order['activation_id'])
+                if status.retry_after:
+                    otp_cadence.hold(provider, status.retry_after)
+                otp = status.code
 
             if otp:
-                await db.sms_orders.update_one(
-                    {'id': order_id},
+                # Only an order still active completes; the sweeper or a cancel may have claimed it meanwhile
+                completed = await db.sms_orders.update_one(
+                    {'id': order_id, 'status': 'active'},
                     {'$set': {'otp': otp, 'status': 'completed', 'can_cancel': False}}
                 )
-                logger.info(f"OTP received for order {order_id}")
+                if completed.modified_count == 1:
+                    logger.info(f"OTP received for order {order_id}")
+                    await otp_cadence.record_arrival(provider, order.get('service') or '', _seconds_since(order.get('created_at'), elapsed))
                 break
 
             # After 5 minutes, allow manual cancellation from UI
-            if elapsed >= 300 and not order.get('can_cancel'):
+            if elapsed >= cancel_after and not order.get('can_cancel'):
                 await db.sms_orders.update_one(
                     {'id': order_id},
                     {'$set': {'can_cancel': True}}
                 )
 
-            await asyncio.sleep(poll_interval)
-            elapsed += poll_interval
-
         except Exception as e:
             logger.error(f"OTP polling error for order {order_id}: {str(e)}")
-            await asyncio.sleep(poll_interval)
-            elapsed += poll_interval
 
-    # After max_duration, if still active and no OTP, auto-cancel and refund
-    order = await db.sms_orders.find_one({'id': order_id}, {'_id': 0})
-    if order and order['status'] == 'active' and not (order.get('otp') or order.get('otp_code')):
-        try:
-            # Best-effort cancel with provider
-            if order.get('activation_id'):
-                try:
-                    success = await cancel_number_provider(order['provider'], order['activation_id'])
-                    if not success:
-                        logger.warning(f"Provider auto-cancel failed for order {order_id}")
-                except Exception as e:
-                    logger.error(f"Provider auto-cancel error for order {order_id}: {str(e)}")
-
-            # Refund NGN based on stored cost_usd and current FX rate
-            config = await db.pricing_config.find_one({}, {'_id': 0})
-            ngn_rate = config.get('ngn_to_usd_rate', 1500.0) if config else 1500.0
-            refund_ngn = float(order.get('cost_usd', 0) or 0) * ngn_rate
-
-            if refund_ngn > 0:
-                await db.users.update_one({'id': order['user_id']}, {'$inc': {'ngn_balance': refund_ngn}})
-
-                await _create_transaction_notification(
-                    order['user_id'],
-                    'Refund processed',
-                    f"₦{refund_ngn:,.2f} was refunded to your wallet (Order auto-cancelled).",
-                    metadata={'reference': order_id, 'type': 'refund'},
-                )
 
-                # Record refund transaction
-                transaction = Transaction(
-                    user_id=order['user_id'],
-                    type='refund',
-                    amount=refund_ngn,
-                    currency='NGN',
-                    status='completed',
-                    reference=order_id,
-                    metadata={
-                        'reason': 'auto_timeout_cancel',
-                        'service': order.get('service'),
-                        'provider': order.get('provider')
-                    }
-                )
-                trans_dict = transaction.model_dump()
-                trans_dict['created_at'] = trans_dict['created_at'].isoformat()
-                await db.transactions.insert_one(trans_dict)
+async def _release_expired_numbers(orders: List[dict], id_field: str):
+    """Best-effort upstream cancel of expired orders, a bounded number at a time"""
+    semaphore = asyncio.Semaphore(ORDER_EXPIRY_CANCEL_CONCURRENCY)
+
+    async def release(order: dict):
+        if not order.get(id_field):
+            return
+        async with semaphore:
+            if not await cancel_number_provider(order['provider'], order[id_field]):
+                logger.warning(f"Provider auto-cancel failed for order {order['id']}")
+
+    await asyncio.gather(*(release(order) for order in orders))
+
+
+def _refund_transaction_op(user_id: str, amount: float, order: dict, credit_key: str) -> UpdateOne:
+    """Upsert of the refund transaction, keyed like the credit so a retried sweep adds none"""
+    transaction = Transaction(
+        user_id=user_id,
+        type='refund',
+        amount=amount,
+        currency='NGN',
+        status='completed',
+        reference=order['id'],
+        metadata={'reason': 'auto_timeout_cancel', 'service': order.get('service'), 'provider': order.get('provider')},
+    )
+    trans_dict = transaction.model_dump()
+    trans_dict['id'] = str(uuid.uuid5(uuid.NAMESPACE_URL, credit_key))
+    trans_dict['created_at'] = trans_dict['created_at'].isoformat()
+    return UpdateOne({'id': trans_dict['id']}, {'$setOnInsert': trans_dict}, upsert=True)
+
+
+def _order_refund_key(order_id: str) -> str:
+    """Wallet credit key shared by every path that refunds an order, so only one refund applies"""
+    return f"order_refund:{order_id}"
+
+
+async def _adjust_reseller_totals(orders: List[dict]):
+    """Take refunded orders off their reseller's totals, once per order"""
+    totals: Dict[str, List[float]] = {}
+    for order in orders:
+        flagged = await db.reseller_orders.update_one(
+            {'id': order['id'], 'totals_adjusted': {'$ne': True}}, {'$set': {'totals_adjusted': True}}
+        )
+        if not flagged.modified_count:
+            continue
+        total = totals.setdefault(order['reseller_id'], [0.0, 0])
+        total[0] += order.get('cost_ngn', 0)
+        total[1] += 1
+    if totals:
+        await db.resellers.bulk_write([
+            UpdateOne({'id': reseller_id}, {'$inc': {'total_revenue_ngn': -revenue, 'total_orders': -count}})
+            for reseller_id, (revenue, count) in totals.items()
+        ], ordered=False)
+
+
+async def _expire_sms_orders(orders: List[dict]):
+    """Release and refund a batch of expired orders; the sweeper marks them cancelled"""
+    await _release_expired_numbers(orders, 'activation_id')
 
-            await db.sms_orders.update_one(
-                {'id': order_id},
-                {'$set': {'status': 'cancelled', 'can_cancel': False}}
+    # Refund NGN based on stored cost_usd and current FX rate
+    config = await db.pricing_config.find_one({}, {'_id': 0})
+    ngn_rate = config.get('ngn_to_usd_rate', 1500.0) if config else 1500.0
+    refunds = [(order, float(order.get('cost_usd', 0) or 0) * ngn_rate) for order in orders]
+    refunds = [(order, amount) for order, amount in refunds if amount > 0]
+    if not refunds:
+        return
+    credits = [(order['user_id'], amount, _order_refund_key(order['id']), 'NGN') for order, amount in refunds]
+    applied = set(await wallet_service.credit_once_many(credits))
+    await db.transactions.bulk_write(
+        [_refund_transaction_op(order['user_id'], amount, order, key) for (order, amount), (_, _, key, _) in zip(refunds, credits)],
+        ordered=False,
+    )
+    # Notify only for refunds this call applied, not ones a re-claimed batch already made
+    for order, amount in refunds:
+        if _order_refund_key(order['id']) in applied:
+            await _create_transaction_notification(
+                order['user_id'],
+                'Refund processed',
+                f"₦{amount:,.2f} was refunded to your wallet (Order auto-cancelled).",
+                metadata={'reference': order['id'], 'type': 'refund'},
             )
-            logger.info(f"Order {order_id} auto-cancelled after timeout")
-        except Exception as e:
-            logger.error(f"Auto-cancel refund error for order {order_id}: {str(e)}")
+
+
+async def _expire_reseller_orders(orders: List[dict]):
+    """Release and refund a batch of expired reseller orders; the sweeper marks them refunded"""
+    await _release_expired_numbers(orders, 'provider_order_id')
+    refunds = [order for order in orders if order.get('cost_ngn', 0) > 0]
+    if not refunds:
+        return
+    await wallet_service.credit_once_many(
+        (order['user_id'], order['cost_ngn'], _order_refund_key(order['id']), 'NGN') for order in refunds
+    )
+    await db.transactions.bulk_write(
+        [_refund_transaction_op(order['user_id'], order['cost_ngn'], order, _order_refund_key(order['id'])) for order in refunds],
+        ordered=False,
+    )
+    # Expired orders no longer count towards the reseller's totals, as with a manual cancel
+    await _adjust_reseller_totals(orders)
+
 
 # ============ API Routes ============
 
@@ -1992,14 +1881,10 @@ async def convert_ngn_to_usd(data: ConversionRequest, user: dict = Depends(get_c
     rate = config.get('ngn_to_usd_rate', 1500.0)
     usd_amount = data.amount_ngn / rate
     
-    if user.get('ngn_balance', 0) < data.amount_ngn:
+    balances = await wallet_service.exchange(user['id'], data.amount_ngn, 'NGN', usd_amount, 'USD')
+    if balances is None:
         raise HTTPException(status_code=400, detail="Insufficient NGN balance")
     
-    await db.users.update_one(
-        {'id': user['id']},
-        {'$inc': {'ngn_balance': -data.amount_ngn, 'usd_balance': usd_amount}}
-    )
-    
     transaction = Transaction(
         user_id=user['id'],
         type='conversion',
@@ -2012,7 +1897,14 @@ async def convert_ngn_to_usd(data: ConversionRequest, user: dict = Depends(get_c
     trans_dict['created_at'] = trans_dict['created_at'].isoformat()
     await db.transactions.insert_one(trans_dict)
     
-    return {'success': True, 'ngn_deducted': data.amount_ngn, 'usd_received': usd_amount, 'rate': rate}
+    return {
+        'success': True,
+        'ngn_deducted': data.amount_ngn,
+        'usd_received': usd_amount,
+        'rate': rate,
+        'new_balance_ngn': balances.get('ngn_balance', 0),
+        'new_balance_usd': balances.get('usd_balance', 0)
+    }
 
 # ============ SMS Service Discovery Routes ============
 
@@ -2020,170 +1912,59 @@ async def convert_ngn_to_usd(data: ConversionRequest, user: dict = Depends(get_c
 async def get_smspool_services(user: dict = Depends(get_current_user), country: str = None):
     """Fetch SMS-pool services with pricing in NGN (International Server)"""
     try:
-        # Get API key and markup from config
         config = await db.pricing_config.find_one({}, {'_id': 0})
-        api_key = config.get('smspool_api_key', SMSPOOL_API_KEY) if config else SMSPOOL_API_KEY
-        if api_key == '********':
-            api_key = SMSPOOL_API_KEY
         markup_percent = config.get('smspool_markup', 50.0) if config else 50.0
         ngn_rate = config.get('ngn_to_usd_rate', 1500.0) if config else 1500.0
+        smspool = get_provider('smspool')
         
         # If specific country requested, fetch services with REAL pricing
         if country:
-            async with httpx.AsyncClient() as client:
-                # 1) Fetch raw pricing entries (service + pool + price)
-                pricing_resp = await client.post(
-                    'https://api.smspool.net/request/pricing',
-                    data={'country': country},
-                    headers={'Authorization': f'Bearer {api_key}'},
-                    timeout=20.0
-                )
-
-                # 2) Fetch full service list so we can map IDs -> names (per country)
-                services_resp = await client.post(
-                    'https://api.smspool.net/service/retrieve_all',
-                    data={'country': country},
-                    headers={'Authorization': f'Bearer {api_key}'},
-                    timeout=20.0
-                )
-
-                # 3) Fetch pool list so we can expose pools per service (metadata only)
-                pools_resp = await client.post(
-                    'https://api.smspool.net/pool/retrieve_all',
-                    headers={'Authorization': f'Bearer {api_key}'},
-                    timeout=20.0
-                )
-
-                if pricing_resp.status_code == 200:
-                    pricing_list = pricing_resp.json() or []
-                else:
-                    pricing_list = []
-
-                # Build service ID -> name map (from service/retrieve_all)
-                services_map: Dict[str, str] = {}
-                if services_resp.status_code == 200:
-                    try:
-                        raw_services = services_resp.json() or []
-                        for s in raw_services:
-                            if isinstance(s, dict):
-                                sid = str(s.get('ID') or s.get('id') or '')
-                                name = s.get('name') or f'Service {sid}'
-                                if sid:
-                                    services_map[sid] = name
-                    except Exception as e:
-                        logger.error(f"Failed to parse SMS-pool service list: {str(e)}")
-
-                # Build pool metadata map (ID -> name/label)
-                pools_map: Dict[str, str] = {}
-                if pools_resp.status_code == 200:
-                    try:
-                        raw_pools = pools_resp.json() or []
-                        for p in raw_pools:
-                            if isinstance(p, dict):
-                                pid = str(p.get('id') or p.get('ID') or p.get('pool') or '')
-                                if pid:
-                                    pools_map[pid] = p.get('name') or p.get('label') or f'Pool {pid}'
-                    except Exception as e:
-                        logger.error(f"Failed to parse SMS-pool pool list: {str(e)}")
-
-                # Aggregate pricing per service, with all pools and a visible price
-                aggregated: Dict[str, Dict[str, Any]] = {}
-
-                # pricing_list format: [{service: 846, service_name: "Snapchat", country: 20, price: "0.02", pool: 7}, ...]
-                for item in pricing_list:
-                    if isinstance(item, dict):
-                        service_id_raw = item.get('service')
-                        if service_id_raw is None:
-                            continue
-                        service_id = str(service_id_raw)
-                        base_price_usd = float(item.get('price', 0) or 0)
-                        if base_price_usd <= 0:
-                            continue
-
-                        pool_id_raw = item.get('pool')
-                        pool_id = str(pool_id_raw) if pool_id_raw is not None else None
-
-                        # Apply our markup and convert to NGN
-                        final_price_usd = base_price_usd * (1 + markup_percent / 100)
-                        final_price_ngn = final_price_usd * ngn_rate
-
-                        # Initialize container for this service
-                        if service_id not in aggregated:
-                            service_name = services_map.get(service_id) or item.get(
-                                'service_name', f'Service {service_id}'
-                            )
-                            aggregated[service_id] = {
-                                'value': service_id,
-                                'label': service_name,
-                                'name': service_name,
-                                'price_usd': final_price_usd,
-                                'price_ngn': final_price_ngn,
-                                'base_price': base_price_usd,
-                                'pools': []  # will be filled below
-                            }
-                        # Track cheapest overall price for display
-                        svc = aggregated[service_id]
-                        if final_price_ngn < svc['price_ngn']:
-                            svc['price_ngn'] = final_price_ngn
-                            svc['price_usd'] = final_price_usd
-                            svc['base_price'] = base_price_usd
-
-                        # Attach this pool entry
-                        if pool_id:
-                            svc['pools'].append({
-                                'id': pool_id,
-                                'name': pools_map.get(pool_id, f'Pool {pool_id}'),
-                                'base_price': base_price_usd,
-                                'price_usd': final_price_usd,
-                                'price_ngn': final_price_ngn
-                            })
-
-                        # Cache the **cheapest** base price per service/country in USD
-                        await db.cached_services.update_one(
-                            {
-                                'provider': 'smspool',
-                                'service_code': service_id,
-                                'country_code': str(country)
-                            },
-                            {
-                                '$setOnInsert': {
-                                    'currency': 'USD'
-                                },
-                                '$min': {
-                                    'base_price': base_price_usd
-                                }
-                            },
-                            upsert=True
-                        )
+            # Pricing entries (service + pool + price), service names and pool names, concurrently
+            pricing_list, services_map, pools_map = await asyncio.gather(
+                smspool.raw_prices(country), smspool.service_names(country), smspool.pool_names(),
+                return_exceptions=True,
+            )
+            for label, result in (('pricing', pricing_list), ('service list', services_map), ('pool list', pools_map)):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to fetch SMS-pool {label}: {str(result)}")
+            if isinstance(pricing_list, Exception):
+                pricing_list = []
+            if isinstance(services_map, Exception):
+                services_map = {}
+            if isinstance(pools_map, Exception):
+                pools_map = {}
+
+            services = aggregate_smspool_pricing(pricing_list, services_map, pools_map, markup_percent, ngn_rate)
+
+            # Cache the **cheapest** base price per service/country in USD
+            if services:
+                await db.cached_services.bulk_write([
+                    UpdateOne(
+                        {'provider': 'smspool', 'service_code': svc['value'], 'country_code': str(country)},
+                        {'$setOnInsert': {'currency': 'USD'}, '$min': {'base_price': svc['base_price']}},
+                        upsert=True,
+                    )
+                    for svc in services
+                ], ordered=False)
 
-                services = list(aggregated.values())
-                services.sort(key=lambda x: x['name'])
-                logger.info(f"Loaded {len(services)} SMS-pool services for country {country}")
-                return {'success': True, 'services': services, 'country': country}
+            logger.info(f"Loaded {len(services)} SMS-pool services for country {country}")
+            return {'success': True, 'services': services, 'country': country}
         
         # Return all available countries
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                'https://api.smspool.net/country/retrieve_all',
-                headers={'Authorization': f'Bearer {api_key}'},
-                timeout=15.0
-            )
-            
-            if response.status_code == 200:
-                countries = response.json()
-                # Format for dropdown
-                country_options = [
-                    {
-                        'value': str(c['ID']),
-                        'label': f"{c['name']} ({c['short_name']})",
-                        'name': c['name'],
-                        'region': c.get('region', 'Other')
-                    }
-                    for c in countries
-                ]
-                country_options.sort(key=lambda x: x['name'])
-                
-                return {'success': True, 'countries': country_options}
+        countries = await smspool.countries()
+        # Format for dropdown
+        country_options = [
+            {
+                'value': str(c['ID']),
+                'label': f"{c['name']} ({c['short_name']})",
+                'name': c['name'],
+                'region': c.get('region', 'Other')
+            }
+            for c in countries
+        ]
+        country_options.sort(key=lambda x: x['name'])
+        
+        return {'success': True, 'countries': country_options}
     except Exception as e:
         logger.error(f"SMS-pool service fetch error: {str(e)}")
         return {'success': False, 'message': str(e)}
@@ -2210,98 +1991,43 @@ async def get_5sim_services(country: Optional[str] = None, user: dict = Depends(
         markup = float(config.get("fivesim_markup", 50.0) or 50.0)
         ngn_rate = float(config.get("ngn_to_usd_rate", 1500.0) or 1500.0)
 
-        async with httpx.AsyncClient() as client:
-            if country:
-                # Fetch prices for specific country
-                resp = await client.get(
-                    f"{FIVESIM_BASE_URL}/guest/prices",
-                    params={"country": country},
-                    timeout=20.0,
-                )
-                if resp.status_code != 200:
-                    logger.error(f"5sim prices error {resp.status_code}: {resp.text}")
-                    return {"success": False, "message": "Failed to fetch 5sim services"}
-
-                data = resp.json() or {}
-                country_block = data.get(country) or {}
-                services: Dict[str, Dict[str, Any]] = {}
-
-                # Structure: country -> product -> operator -> {cost, count, rate}
-                # NOTE: 5sim API returns 'cost' already in USD (not coins!)
-                for product, operators in country_block.items():
-                    for operator_name, info in operators.items():
-                        try:
-                            base_price_usd = float(info.get("cost", 0) or 0)  # Already in USD
-                        except Exception:
-                            base_price_usd = 0.0
-                        if base_price_usd <= 0:
-                            continue
-
-                        # Apply markup
-                        final_price_usd = base_price_usd * (1 + markup / 100)
-                        final_price_ngn = final_price_usd * ngn_rate
-
-                        key = product
-                        if key not in services:
-                            service_label = product.upper()
-                            services[key] = {
-                                "value": key,
-                                "label": service_label,
-                                "name": service_label,
-                                "price_usd": final_price_usd,
-                                "price_ngn": final_price_ngn,
-                                "base_price_usd": base_price_usd,
-                                "operators": [],
-                            }
-                        svc = services[key]
-                        # track cheapest price (show users the lowest available price)
-                        if final_price_usd < svc["price_usd"]:
-                            svc["price_usd"] = final_price_usd
-                            svc["price_ngn"] = final_price_usd * ngn_rate
-                            svc["base_price_usd"] = base_price_usd
-
-                        # Add operator with its price
-                        svc["operators"].append({
-                            "name": operator_name,
-                            "base_price_usd": base_price_usd,
-                            "price_usd": final_price_usd,
-                            "price_ngn": final_price_ngn,
-                        })
-
-                result_list = list(services.values())
-                result_list.sort(key=lambda x: x["name"])
-
-                # Cache cheapest base USD price per service/country for purchase endpoint
-                for svc in result_list:
-                    await db.cached_services.update_one(
-                        {
-                            'provider': '5sim',
-                            'service_code': svc['value'],
-                            'country_code': country,
-                        },
-                        {
-                            '$set': {
-                                'currency': 'USD',
-                                'base_price': svc['base_price_usd'],
-                            },
-                        },
+        fivesim = get_provider('5sim')
+        if country:
+            # Fetch prices for specific country
+            try:
+                data = await fivesim.raw_prices(country)
+            except Exception as e:
+                logger.error(f"5sim prices error: {str(e)}")
+                return {"success": False, "message": "Failed to fetch 5sim services"}
+
+            country_block = data.get(country) or {}
+            result_list = aggregate_5sim_prices(country_block, markup, ngn_rate)
+
+            # Cache cheapest base USD price per service/country for purchase endpoint
+            if result_list:
+                await db.cached_services.bulk_write([
+                    UpdateOne(
+                        {'provider': '5sim', 'service_code': svc['value'], 'country_code': country},
+                        {'$set': {'currency': 'USD', 'base_price': svc['base_price_usd']}},
                         upsert=True,
                     )
+                    for svc in result_list
+                ], ordered=False)
 
-                return {"success": True, "country": country, "services": result_list}
+            return {"success": True, "country": country, "services": result_list}
 
-            # No country: return list of countries
-            resp = await client.get(f"{FIVESIM_BASE_URL}/guest/prices", timeout=20.0)
-            if resp.status_code != 200:
-                logger.error(f"5sim prices error {resp.status_code}: {resp.text}")
-                return {"success": False, "message": "Failed to fetch 5sim countries"}
+        # No country: return list of countries
+        try:
+            data = await fivesim.raw_prices()
+        except Exception as e:
+            logger.error(f"5sim prices error: {str(e)}")
+            return {"success": False, "message": "Failed to fetch 5sim countries"}
 
-            data = resp.json() or {}
-            countries = [
-                {"value": code, "label": code.upper(), "name": code.upper()} for code in data.keys()
-            ]
-            countries.sort(key=lambda x: x["name"])
-            return {"success": True, "countries": countries}
+        countries = [
+            {"value": code, "label": code.upper(), "name": code.upper()} for code in data.keys()
+        ]
+        countries.sort(key=lambda x: x["name"])
+        return {"success": True, "countries": countries}
     except Exception as e:
         logger.error(f"5sim services fetch error: {str(e)}")
         return {"success": False, "message": str(e)}
@@ -2310,51 +2036,21 @@ async def get_5sim_services(country: Optional[str] = None, user: dict = Depends(
 async def get_daisysms_services(user: dict = Depends(get_current_user)):
     """Get DaisySMS services with LIVE pricing from API"""
     try:
-        # Get API key and markup from config
+        # Get markup from config
         config = await db.pricing_config.find_one({}, {'_id': 0})
-        api_key = config.get('daisysms_api_key') if config and config.get('daisysms_api_key') not in [None, '********'] else DAISYSMS_API_KEY
         markup_percent = config.get('daisysms_markup', 50.0) if config else 50.0
         ngn_rate = config.get('ngn_to_usd_rate', 1500.0) if config else 1500.0
         
         # Fetch LIVE prices from DaisySMS API
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                'https://daisysms.com/stubs/handler_api.php',
-                params={'api_key': api_key, 'action': 'getPricesVerification'},
-                timeout=15.0
-            )
-            
-            if response.status_code == 200:
-                prices_data = response.json()
-                
-                # Transform into services with LIVE pricing + markup
-                services = []
-                for service_code, countries in prices_data.items():
-                    if '187' in countries:  # USA country code
-                        usa_data = countries['187']
-                        # Use LIVE price from API
-                        base_price = float(usa_data.get('retail_price', usa_data.get('cost', 1.0)))
-                        
-                        # Apply markup
-                        final_price = base_price * (1 + markup_percent / 100)
-                        final_price_ngn = final_price * ngn_rate
-                        
-                        services.append({
-                            'value': service_code,
-                            'label': f"{usa_data.get('name', service_code)} - ${final_price:.2f}",
-                            'name': usa_data.get('name', service_code),
-                            'base_price': base_price,
-                            'final_price': final_price,
-                            'final_price_ngn': final_price_ngn,
-                            'count': usa_data.get('count', 0)
-                        })
-                
-                # Sort by name
-                services.sort(key=lambda x: x['name'])
-                
-                return {'success': True, 'services': services, 'markup_percent': markup_percent}
-        
-        return {'success': False, 'message': 'Failed to fetch services'}
+        try:
+            prices_data = await get_provider('daisysms').raw_prices()
+        except httpx.HTTPStatusError:
+            return {'success': False, 'message': 'Failed to fetch services'}
+
+        # Transform into services with LIVE pricing + markup
+        services = daisysms_services(prices_data, markup_percent, ngn_rate)
+
+        return {'success': True, 'services': services, 'markup_percent': markup_percent}
     except Exception as e:
         logger.error(f"Error fetching DaisySMS services: {str(e)}")
         return {'success': False, 'message': str(e)}
@@ -2388,75 +2084,117 @@ async def get_tigersms_services(user: dict = Depends(get_current_user), refresh:
                 return {'success': True, 'data': data, 'cached': True}
         
         # Fetch from API
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                'https://api.tiger-sms.com/stubs/handler_api.php',
-                params={'api_key': TIGERSMS_API_KEY, 'action': 'getPrices'},
-                timeout=30.0
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Get RUB to USD conversion rate
-                config = await db.pricing_config.find_one({}, {'_id': 0})
-                rub_to_usd = config.get('rub_to_usd_rate', 0.010) if config else 0.010
-                
-                # Cache in DB
-                cached_services = []
-                for country_code, services in data.items():
-                    for service_code, service_info in services.items():
-                        # Store original RUB price
-                        price_rub = float(service_info.get('cost', 0))
-                        cached_service = CachedService(
-                            provider='tigersms',
-                            service_code=service_code,
-                            service_name=service_info.get('name', service_code),
-                            country_code=country_code,
-                            country_name=get_country_name(country_code),
-                            base_price=price_rub,  # Store in RUB
-                            currency='RUB'
-                        )
-                        cached_services.append(cached_service.model_dump())
-                
-                if cached_services:
-                    await db.cached_services.delete_many({'provider': 'tigersms'})
-                    for service in cached_services:
-                        service['last_updated'] = service['last_updated'].isoformat()
-                    await db.cached_services.insert_many(cached_services)
-                
-                # Convert prices to USD for frontend
-                for country_code in data:
-                    for service_code in data[country_code]:
-                        price_rub = float(data[country_code][service_code].get('cost', 0))
-                        data[country_code][service_code]['cost'] = str(round(price_rub * rub_to_usd, 2))
-                        data[country_code][service_code]['cost_rub'] = f"{price_rub} ₽"
-                
-                return {'success': True, 'data': data, 'cached': False}
-            
+        try:
+            data = await get_provider('tigersms').raw_prices()
+        except httpx.HTTPStatusError:
             return {'success': False, 'message': 'Failed to fetch TigerSMS services'}
+        
+        # Get RUB to USD conversion rate
+        config = await db.pricing_config.find_one({}, {'_id': 0})
+        rub_to_usd = config.get('rub_to_usd_rate', 0.010) if config else 0.010
+        
+        # Cache in DB
+        cached_services = []
+        for country_code, services in data.items():
+            for service_code, service_info in services.items():
+                # Store original RUB price
+                price_rub = float(service_info.get('cost', 0))
+                cached_service = CachedService(
+                    provider='tigersms',
+                    service_code=service_code,
+                    service_name=service_info.get('name', service_code),
+                    country_code=country_code,
+                    country_name=get_country_name(country_code),
+                    base_price=price_rub,  # Store in RUB
+                    currency='RUB'
+                )
+                cached_services.append(cached_service.model_dump())
+        
+        if cached_services:
+            await db.cached_services.delete_many({'provider': 'tigersms'})
+            for service in cached_services:
+                service['last_updated'] = service['last_updated'].isoformat()
+            await db.cached_services.insert_many(cached_services)
+        
+        # Convert prices to USD for frontend
+        convert_tigersms_prices(data, rub_to_usd)
+        
+        return {'success': True, 'data': data, 'cached': False}
     except Exception as e:
         logger.error(f"TigerSMS service fetch error: {str(e)}")
         return {'success': False, 'message': str(e)}
 
 
-async def _apply_promo_discount(
-    *,
-    promo_code: Optional[str],
-    user_id: str,
-    final_price_ngn: float,
-    final_price_usd: float,
-    ngn_to_usd_rate: float,
-):
-    """Returns (discount_ngn, discount_usd, promo_doc_or_none)."""
-    if not promo_code:
-        return 0.0, 0.0, None
+@api_router.get("/services/best-price")
+async def get_best_price(service: str, country: str, limit: int = 20, user: dict = Depends(get_current_user)):
+    """Cheapest ways to buy a service in a country across every provider, pool and operator.
 
-    code_norm = promo_code.strip().upper()
+    `service` is a service name or code ("whatsapp", "wa"); `country` an ISO code ("US") or a
+    named provider country ("usa"). Served from the in-memory price index.
+    """
+    await price_index.ensure_ready()
+    iso = price_index.resolve_country(country)
+    if not iso:
+        raise HTTPException(status_code=404, detail="Unknown country")
+
+    config = await db.pricing_config.find_one({}, {'_id': 0}) or {}
+    ngn_rate = config.get('ngn_to_usd_rate', 1500.0)
+    results = []
+    for entry in price_index.lookup(service, iso):
+        final_price_usd = entry.price_usd * (1 + config.get(f'{entry.provider}_markup', 50.0) / 100)
+        results.append({
+            'server': RETAIL_PROVIDER_SERVERS[entry.provider],
+            'provider': entry.provider,
+            'service': entry.service,
+            'service_name': entry.service_name,
+            'country': entry.country,
+            'option': entry.option,
+            'stock': entry.stock,
+            'final_price_usd': round(final_price_usd, 4),
+            'final_price_ngn': round(final_price_usd * ngn_rate, 2),
+        })
+    results.sort(key=lambda r: r['final_price_usd'])
+    return {'success': True, 'service': service, 'country': iso, 'results': results[:max(1, min(limit, 100))]}
+
+
+async def run_price_index_refresh():
+    """Keep the best-price index in step with the providers' live prices"""
+    while True:
+        try:
+            await price_index.refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Price index refresh error: {e}")
+        await asyncio.sleep(PRICE_INDEX_REFRESH_INTERVAL)
+
+
+PROMO_CACHE_TTL_SECONDS = 30
+_promo_cache: Dict[str, tuple] = {}
+
+
+async def _get_active_promo(code_norm: str) -> Optional[dict]:
+    """Active promo definition by code, cached in memory for a short TTL (misses included)"""
+    cached = _promo_cache.get(code_norm)
+    if cached and time.monotonic() - cached[1] < PROMO_CACHE_TTL_SECONDS:
+        cache_lookup('promo', True)
+        return cached[0]
+    cache_lookup('promo', False)
     promo = await db.promo_codes.find_one({"code": code_norm, "active": True}, {"_id": 0})
-    if not promo:
-        raise HTTPException(status_code=400, detail="Invalid promo code")
+    _promo_cache[code_norm] = (promo, time.monotonic())
+    return promo
+
+
+def _invalidate_promo_cache():
+    _promo_cache.clear()
+
 
+async def _check_promo_eligibility(promo: dict, user_id: str):
+    """Raise if the promo is expired, used up, or already used by this user.
+
+    The usage limit here uses the cached `used_count` as a fast pre-check only; the
+    limit is enforced by the conditional increment in `_claim_promo_use`.
+    """
     expires_at = promo.get('expires_at')
     if expires_at:
         try:
@@ -2471,16 +2209,61 @@ async def _apply_promo_discount(
             raise HTTPException(status_code=400, detail="Promo code expired")
 
     max_total = promo.get('max_total_uses')
-    if max_total is not None:
-        used = await db.promo_redemptions.count_documents({"promo_id": promo['id']})
-        if used >= int(max_total):
-            raise HTTPException(status_code=400, detail="Promo code usage limit reached")
+    if max_total is not None and int(promo.get('used_count') or 0) >= int(max_total):
+        raise HTTPException(status_code=400, detail="Promo code usage limit reached")
 
     if promo.get('one_time_per_user', True):
-        prior = await db.promo_redemptions.find_one({"promo_id": promo['id'], "user_id": user_id}, {"_id": 0})
+        prior = await db.promo_redemptions.find_one({"promo_id": promo['id'], "user_id": user_id}, {"_id": 0, "id": 1})
         if prior:
             raise HTTPException(status_code=400, detail="Promo code already used")
 
+
+async def _claim_promo_use(promo: dict) -> bool:
+    """Atomically take one use of the promo. False when the usage limit has been reached"""
+    query = {'id': promo['id']}
+    max_total = promo.get('max_total_uses')
+    if max_total is not None:
+        query['$expr'] = {'$lt': [{'$ifNull': ['$used_count', 0]}, int(max_total)]}
+    res = await db.promo_codes.update_one(query, {'$inc': {'used_count': 1}})
+    return res.modified_count == 1
+
+
+async def _release_promo_use(promo: dict):
+    await db.promo_codes.update_one({'id': promo['id']}, {'$inc': {'used_count': -1}})
+
+
+async def _apply_promo_discount(
+    *,
+    promo_code: Optional[str],
+    user_id: str,
+    final_price_ngn: float,
+    final_price_usd: float,
+    ngn_to_usd_rate: float,
+):
+    """Returns (discount_ngn, discount_usd, promo_doc_or_none)."""
+    promo = await _resolve_promo(promo_code, user_id)
+    if not promo:
+        return 0.0, 0.0, None
+    discount_ngn, discount_usd = _promo_discount(promo, final_price_ngn, final_price_usd, ngn_to_usd_rate)
+    return discount_ngn, discount_usd, promo
+
+
+async def _resolve_promo(promo_code: Optional[str], user_id: str) -> Optional[dict]:
+    """The active promo for a code the user may still redeem; raises for invalid codes"""
+    if not promo_code:
+        return None
+
+    code_norm = promo_code.strip().upper()
+    promo = await _get_active_promo(code_norm)
+    if not promo:
+        raise HTTPException(status_code=400, detail="Invalid promo code")
+
+    await _check_promo_eligibility(promo, user_id)
+    return promo
+
+
+def _promo_discount(promo: dict, final_price_ngn: float, final_price_usd: float, ngn_to_usd_rate: float):
+    """Returns (discount_ngn, discount_usd) for a promo at a given price."""
     dtype = promo.get('discount_type')
     dval = float(promo.get('discount_value') or 0)
 
@@ -2503,7 +2286,7 @@ async def _apply_promo_discount(
     discount_ngn = min(discount_ngn, final_price_ngn)
     discount_usd = min(discount_usd, final_price_usd)
 
-    return float(discount_ngn), float(discount_usd), promo
+    return float(discount_ngn), float(discount_usd)
 
 
 @api_router.get("/services/unified")
@@ -2552,17 +2335,24 @@ async def get_unified_services(user: dict = Depends(get_current_user)):
 
 # ============ Price Calculation Route ============
 
+async def _daisysms_base_price(service: str) -> float:
+    """Live DaisySMS USD price for a service"""
+    try:
+        prices = await get_provider('daisysms').raw_prices()
+    except Exception as e:
+        logger.error(f"DaisySMS pricing error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch pricing")
+    usa_data = (prices.get(service) or {}).get('187')
+    if not usa_data:
+        raise HTTPException(status_code=404, detail="Service not found")
+    return float(usa_data.get('retail_price', usa_data.get('cost', 1.0)))
+
+
 @api_router.post("/orders/calculate-price")
 async def calculate_price(data: CalculatePriceRequest, user: dict = Depends(get_current_user)):
     """Calculate price with all markups"""
     try:
-        server_map = {
-            'us_server': 'daisysms',
-            'server1': 'smspool',
-            'server2': '5sim'
-        }
-        
-        provider = server_map.get(data.server)
+        provider = RETAIL_SERVERS.get(data.server)
         if not provider:
             raise HTTPException(status_code=400, detail="Invalid server")
         
@@ -2578,22 +2368,7 @@ async def calculate_price(data: CalculatePriceRequest, user: dict = Depends(get_
         # Get base price
         if provider == 'daisysms':
             # Use LIVE pricing from DaisySMS API
-            api_key = config.get('daisysms_api_key') if config and config.get('daisysms_api_key') not in [None, '********'] else DAISYSMS_API_KEY
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    'https://daisysms.com/stubs/handler_api.php',
-                    params={'api_key': api_key, 'action': 'getPricesVerification'},
-                    timeout=15.0
-                )
-                if response.status_code == 200:
-                    prices_data = response.json()
-                    if data.service in prices_data and '187' in prices_data[data.service]:
-                        usa_data = prices_data[data.service]['187']
-                        base_price_usd = float(usa_data.get('retail_price', usa_data.get('cost', 1.0)))
-                    else:
-                        raise HTTPException(status_code=404, detail="Service not found")
-                else:
-                    raise HTTPException(status_code=500, detail="Failed to fetch pricing")
+            base_price_usd = await _daisysms_base_price(data.service)
             
             # Apply advanced options markup (configurable from admin)
             advanced_markup = config.get('daisysms_advanced_markup', 20.0) if config else 20.0
@@ -2667,7 +2442,84 @@ async def calculate_price(data: CalculatePriceRequest, user: dict = Depends(get_
 
 # ============ SMS Order Routes (Updated) ============
 
+async def _insert_all_or_rollback(writes: List[tuple]) -> Optional[Exception]:
+    """Insert (collection_name, document) pairs concurrently.
+
+    If any insert fails, the ones that succeeded are deleted again and the first error
+    is returned so the caller can compensate (refund, release the number).
+    """
+    results = await asyncio.gather(
+        *(db[name].insert_one(doc) for name, doc in writes),
+        return_exceptions=True
+    )
+    errors = [r for r in results if isinstance(r, Exception)]
+    if not errors:
+        return None
+
+    await asyncio.gather(
+        *(db[name].delete_one({'id': doc['id']})
+          for (name, doc), r in zip(writes, results) if not isinstance(r, Exception)),
+        return_exceptions=True
+    )
+    return errors[0]
+
+
+AUTO_ROUTE_MAX_ATTEMPTS = 4
+
+
+def _quote_route(route: routing.Route, config: dict, promo: Optional[dict], charged_currency: str) -> dict:
+    """Markup, promo discount and the amount charged if the number comes from this route"""
+    markup = config.get(f'{route.provider}_markup', 50.0)
+    ngn_rate = config.get('ngn_to_usd_rate', 1500.0)
+    final_price_usd = route.base_price_usd * (1 + markup / 100)
+    final_price_ngn = final_price_usd * ngn_rate
+    discount_ngn, discount_usd = _promo_discount(promo, final_price_ngn, final_price_usd, ngn_rate) if promo else (0.0, 0.0)
+    final_price_ngn = float(final_price_ngn - discount_ngn)
+    final_price_usd = float(final_price_usd - discount_usd)
+    route.price = final_price_ngn if charged_currency == 'NGN' else final_price_usd
+    return {
+        'markup': markup,
+        'final_price_usd': final_price_usd,
+        'final_price_ngn': final_price_ngn,
+        'discount_ngn': discount_ngn,
+        'discount_usd': discount_usd,
+        'charged_amount': route.price,
+    }
+
+
+async def _alternative_routes(data: PurchaseNumberRequest, config: dict, promo: Optional[dict],
+                              primary: routing.Route, charged_currency: str) -> list:
+    """Priced fallbacks for an auto-routed purchase, best first"""
+    # DaisySMS number filters can't be honoured elsewhere, so they keep the order on its provider
+    filtered = bool(data.area_code or data.area_codes or data.carrier or data.preferred_number or data.phone_make)
+    try:
+        routes = await routing.find_routes(primary.provider, primary.service, primary.country, cross_provider=not filtered)
+    except Exception as e:
+        logger.error(f"Auto-route lookup failed for {primary.provider} {primary.service}/{primary.country}: {e}")
+        return []
+    quotes = {}
+    for route in routes:
+        if route.key == primary.key or route.key in quotes:
+            continue
+        # Providers whose purchase endpoint is tripped are not worth a try
+        if breakers.is_open(route.provider, 'getNumber'):
+            continue
+        quotes[route.key] = (route, _quote_route(route, config, promo, charged_currency))
+    ranked = routing.rank_routes(route for route, _ in quotes.values())
+    return [quotes[route.key] for route in ranked]
+
+
+PURCHASE_ERROR_MESSAGES = {
+    'max_price': "Price exceeded maximum. Please try again.",
+    'no_numbers': "No numbers available for this service.",
+    'too_many_active': "Too many active rentals. Please cancel some first.",
+    'no_balance': "Insufficient provider balance.",
+    'circuit_open': "This server is temporarily unavailable. Please try another server.",
+}
+
+
 @api_router.post("/orders/purchase")
+@in_flight(metrics.PURCHASES_IN_FLIGHT)
 async def purchase_number(
     data: PurchaseNumberRequest,
     background_tasks: BackgroundTasks,
@@ -2677,13 +2529,7 @@ async def purchase_number(
     if user.get('is_suspended'):
         raise HTTPException(status_code=403, detail="Account suspended")
     # Map server to provider
-    server_map = {
-        'us_server': 'daisysms',
-        'server1': 'smspool',
-        'server2': '5sim'
-    }
-    
-    provider = server_map.get(data.server)
+    provider = RETAIL_SERVERS.get(data.server)
     if not provider:
         raise HTTPException(status_code=400, detail="Invalid server selection")
     
@@ -2699,20 +2545,7 @@ async def purchase_number(
     # Calculate price
     if provider == 'daisysms':
         # Use LIVE pricing from DaisySMS API
-        async with httpx.AsyncClient() as client:
-            price_response = await client.get(
-                'https://daisysms.com/stubs/handler_api.php',
-                params={'api_key': (config.get('daisysms_api_key') if config and config.get('daisysms_api_key') not in [None, '********'] else DAISYSMS_API_KEY), 'action': 'getPricesVerification'},
-                timeout=10.0
-            )
-            if price_response.status_code == 200:
-                prices = price_response.json()
-                if data.service in prices and '187' in prices[data.service]:
-                    base_price_usd = float(prices[data.service]['187'].get('retail_price', prices[data.service]['187'].get('cost', 1.0)))
-                else:
-                    raise HTTPException(status_code=404, detail="Service not found")
-            else:
-                raise HTTPException(status_code=500, detail="Failed to fetch pricing")
+        base_price_usd = await _daisysms_base_price(data.service)
 
         # Apply advanced options markup (configurable from admin)
         advanced_markup = config.get('daisysms_advanced_markup', 20.0) if config else 20.0
@@ -2725,38 +2558,25 @@ async def purchase_number(
         # NOTE: 5sim API returns 'cost' already in USD (not coins!)
         if data.operator and data.operator != 'any':
             # Get operator-specific price from 5sim API
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(
-                    f"{FIVESIM_BASE_URL}/guest/prices",
-                    params={'country': data.country, 'product': data.service},
-                    timeout=15.0
-                )
-                if resp.status_code == 200:
-                    prices_data = resp.json()
-                    # Find operator price
-                    if data.country in prices_data and data.service in prices_data[data.country]:
-                        operators = prices_data[data.country][data.service]
-                        if data.operator in operators:
-                            # API cost is already in USD
-                            base_price_usd = float(operators[data.operator].get('cost', 0))
-                        else:
-                            # Fallback to cached service price
-                            cached_service = await db.cached_services.find_one({
-                                'provider': '5sim',
-                                'service_code': data.service,
-                                'country_code': data.country
-                            }, {'_id': 0})
-                            base_price_usd = float(cached_service.get('base_price', 0) or 0) if cached_service else 0
-                    else:
-                        raise HTTPException(status_code=404, detail="Service/country not found")
-                else:
-                    # Fallback to cached
-                    cached_service = await db.cached_services.find_one({
-                        'provider': '5sim',
-                        'service_code': data.service,
-                        'country_code': data.country
-                    }, {'_id': 0})
-                    base_price_usd = float(cached_service.get('base_price', 0) or 0) if cached_service else 0
+            try:
+                prices_data = await get_provider('5sim').raw_prices(data.country, data.service)
+            except Exception as e:
+                logger.error(f"5sim prices error: {str(e)}")
+                prices_data = None
+            operators = (prices_data or {}).get(data.country, {}).get(data.service)
+            if prices_data is not None and operators is None:
+                raise HTTPException(status_code=404, detail="Service/country not found")
+            if operators and data.operator in operators:
+                # API cost is already in USD
+                base_price_usd = float(operators[data.operator].get('cost', 0))
+            else:
+                # Fallback to cached service price
+                cached_service = await db.cached_services.find_one({
+                    'provider': '5sim',
+                    'service_code': data.service,
+                    'country_code': data.country
+                }, {'_id': 0})
+                base_price_usd = float(cached_service.get('base_price', 0) or 0) if cached_service else 0
         else:
             # No operator selected, use cached service price (cheapest)
             cached_service = await db.cached_services.find_one({
@@ -2785,163 +2605,108 @@ async def purchase_number(
         if cached_service['currency'] == 'RUB':
             base_price_usd = base_price_usd * config.get('rub_to_usd_rate', 0.010)
 
-    # Apply our markup (default 50%) - use consistent key format with calculate-price
-    markup_key = f'{provider}_markup'
-    markup = config.get(markup_key, 50.0)
-    final_price_usd = base_price_usd * (1 + markup / 100)
-    
-    # Convert to NGN if needed
-    ngn_rate = config.get('ngn_to_usd_rate', 1500.0)
-    final_price_ngn = final_price_usd * ngn_rate
-
-    # Apply promo code discount (case-insensitive)
-    discount_ngn, discount_usd, promo = await _apply_promo_discount(
-        promo_code=data.promo_code,
-        user_id=user['id'],
-        final_price_ngn=final_price_ngn,
-        final_price_usd=final_price_usd,
-        ngn_to_usd_rate=ngn_rate,
+    # Apply our markup (default 50%) and any promo discount
+    promo = await _resolve_promo(data.promo_code, user['id'])
+    charged_currency = 'NGN' if data.payment_currency == 'NGN' else 'USD'
+    primary = routing.Route(
+        provider, data.service, data.country,
+        option={'smspool': data.pool, '5sim': data.operator}.get(provider),
+        base_price_usd=base_price_usd,
     )
-    final_price_ngn = float(final_price_ngn - discount_ngn)
-    final_price_usd = float(final_price_usd - discount_usd)
-
-    # Check balance based on payment currency
-    if data.payment_currency == 'NGN':
-        if user.get('ngn_balance', 0) < final_price_ngn:
-            raise HTTPException(status_code=400, detail=f"Insufficient NGN balance. Need ₦{final_price_ngn:.2f}")
-    else:  # USD
-        if user.get('usd_balance', 0) < final_price_usd:
-            raise HTTPException(status_code=400, detail=f"Insufficient USD balance. Need ${final_price_usd:.2f}")
-
-    # Purchase from provider
-    result = None
-    actual_price = base_price_usd
-
-    if provider == 'smspool':
-        # For SMS-pool we can optionally pass a specific pool chosen by the user
-        result = await purchase_number_smspool(
-            data.service,
-            data.country,
-            pool=data.pool
-        )
-        if result and result.get('success'):
-            actual_price = result.get('price', base_price_usd)
-    elif provider == 'daisysms':
-        # Set max_price to prevent unexpected charges
-        max_price = base_price_usd * 2.0  # Allow price variance
-        area_codes = data.area_codes or data.area_code
-        preferred_num = data.preferred_number or data.phone_make
-
-        result = await purchase_number_daisysms(
-            data.service, max_price,
-            area_codes, data.carrier, preferred_num
-        )
-        if result and result.get('status_code') == 200:
-            actual_price = result.get('actual_price', base_price_usd)
-    elif provider == 'tigersms':
-        result = await purchase_number_tigersms(data.service, data.country)
-        if result and 'ACCESS_NUMBER' in str(result):
-            actual_price = base_price_usd
-    elif provider == '5sim':
-        # Use 5sim buy activation API - get key from config first, then env
-        config = await db.pricing_config.find_one({}, {'_id': 0})
-        fivesim_key = config.get('fivesim_api_key') if config and config.get('fivesim_api_key') not in [None, '', '********'] else FIVESIM_API_KEY
-        if not fivesim_key:
-            logger.error("FIVESIM_API_KEY not configured")
-            raise HTTPException(status_code=500, detail="Server API not configured. Please set 5sim API key in Admin → SMS Providers")
-        headers = {
-            'Authorization': f'Bearer {fivesim_key}',
-            'Accept': 'application/json'
-        }
-        operator = data.operator or 'any'
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                f"{FIVESIM_BASE_URL}/user/buy/activation/{data.country}/{operator}/{data.service}",
-                headers=headers,
-                timeout=15.0
-            )
-        if resp.status_code != 200:
-            text = resp.text
-            logger.error(f"5sim purchase error {resp.status_code}: {text}")
-            if 'no free phones' in text.lower():
-                raise HTTPException(status_code=400, detail="No available numbers for this service/country")
-            if 'not enough user balance' in text.lower():
-                raise HTTPException(status_code=400, detail="Provider balance insufficient")
-            raise HTTPException(status_code=400, detail="Failed to purchase number from server")
+    candidates = [(primary, _quote_route(primary, config, promo, charged_currency))]
+    user_balance = user.get('ngn_balance', 0) if charged_currency == 'NGN' else user.get('usd_balance', 0)
+
+    if data.auto_route:
+        candidates += await _alternative_routes(data, config, promo, primary, charged_currency)
+        affordable = [
+            (route, quote) for route, quote in candidates
+            if quote['charged_amount'] <= user_balance
+            and (data.max_price is None or quote['charged_amount'] <= data.max_price)
+        ]
+        if not affordable:
+            cheapest = min(quote['charged_amount'] for _, quote in candidates)
+            if cheapest > user_balance:
+                symbol = '₦' if charged_currency == 'NGN' else '$'
+                raise HTTPException(status_code=400, detail=f"Insufficient {charged_currency} balance. Need {symbol}{cheapest:.2f}")
+            raise HTTPException(status_code=400, detail="No number available within your maximum price")
+        candidates = affordable[:AUTO_ROUTE_MAX_ATTEMPTS]
+    elif candidates[0][1]['charged_amount'] > user_balance:
+        # Check balance based on payment currency
+        if charged_currency == 'NGN':
+            raise HTTPException(status_code=400, detail=f"Insufficient NGN balance. Need ₦{candidates[0][1]['final_price_ngn']:.2f}")
+        raise HTTPException(status_code=400, detail=f"Insufficient USD balance. Need ${candidates[0][1]['final_price_usd']:.2f}")
+
+    # Purchase from provider, falling through the candidate routes in order.
+    # Each adapter picks the options it understands.
+    purchase = None
+    attempts = []
+    for route, quote in candidates:
+        started = time.monotonic()
         try:
-            result = resp.json()
-        except Exception:
-            raise HTTPException(status_code=400, detail="Unexpected server response")
-        activation_id = str(result.get('id'))
-        phone_number = str(result.get('phone'))
-        # 5sim API returns price already in USD
-        actual_price = float(result.get('price') or 0)
-
-    if not result:
-        raise HTTPException(status_code=400, detail="Failed to purchase number from provider")
-    
-    # Parse response based on provider
-    phone_number = None
-    activation_id = None
-    
-    if provider == '5sim':
-        # 5sim already parsed above, extract values from result
-        activation_id = str(result.get('id', ''))
-        phone_number = str(result.get('phone', ''))
-    elif provider == 'smspool':
-        phone_number = str(result.get('number', ''))
-        activation_id = result.get('order_id')
-    elif provider == 'daisysms':
-        response_text = result.get('text', '')
-        if 'ACCESS_NUMBER' in response_text:
-            # Format: ACCESS_NUMBER:activation_id:phone_number
-            parts = response_text.split(':')
-            if len(parts) >= 3:
-                activation_id = parts[1].strip()
-                phone_number = parts[2].strip()
-        else:
-            # Handle error responses
-            if 'MAX_PRICE_EXCEEDED' in response_text:
-                raise HTTPException(status_code=400, detail="Price exceeded maximum. Please try again.")
-            elif 'NO_NUMBERS' in response_text:
-                raise HTTPException(status_code=400, detail="No numbers available for this service.")
-            elif 'TOO_MANY_ACTIVE_RENTALS' in response_text:
-                raise HTTPException(status_code=400, detail="Too many active rentals. Please cancel some first.")
-            elif 'NO_MONEY' in response_text:
-                raise HTTPException(status_code=400, detail="Insufficient provider balance.")
-            else:
-                raise HTTPException(status_code=400, detail=f"Provider error: {response_text}")
-    else:  # tigersms
-        response_text = str(result)
-        if 'ACCESS_NUMBER' in response_text:
-            parts = response_text.split(':')
-            if len(parts) >= 3:
-                activation_id = parts[1].strip()
-                phone_number = parts[2].strip()
+            purchase = await get_provider(route.provider).buy(
+                route.service,
+                route.country,
+                max_price=route.base_price_usd * 2.0 if route.provider == 'daisysms' else None,  # Allow price variance
+                area_codes=data.area_codes or data.area_code,
+                carrier=data.carrier,
+                preferred_number=data.preferred_number or data.phone_make,
+                pool=route.option,
+                operator=route.option,
+            )
+        except ProviderError as e:
+            if e.code != 'circuit_open':
+                routing.record_attempt(route, e.code, time.monotonic() - started)
+            logger.error(f"{route.provider} purchase failed ({e.code}): {e.message}")
+            attempts.append({**route.as_dict(), 'error': e.code})
+            last_error = e
+            continue
+        routing.record_attempt(route, None, time.monotonic() - started)
+        break
+
+    if purchase is None:
+        if last_error.code == 'not_configured' and len(candidates) == 1:
+            raise HTTPException(status_code=500, detail="Server API not configured. Please set the provider API key in Admin → SMS Providers")
+        if last_error.code == 'circuit_open':
+            raise HTTPException(status_code=503, detail=PURCHASE_ERROR_MESSAGES['circuit_open'])
+        raise HTTPException(status_code=400, detail=PURCHASE_ERROR_MESSAGES.get(last_error.code, "Failed to purchase number from provider"))
+
+    # Charge for the route that actually produced the number
+    provider = route.provider
+    base_price_usd = route.base_price_usd
+    markup = quote['markup']
+    final_price_usd = quote['final_price_usd']
+    discount_ngn = quote['discount_ngn']
+    discount_usd = quote['discount_usd']
+    order_route = {**route.as_dict(), 'attempts': attempts} if data.auto_route else None
+
+    activation_id = purchase.activation_id
+    phone_number = purchase.phone_number
+    actual_price = purchase.price_usd or base_price_usd
     
     if not activation_id or not phone_number:
         raise HTTPException(status_code=400, detail="Failed to get phone number from provider")
     
-    # Deduct from appropriate balance ONCE
-    if data.payment_currency == 'NGN':
-        await db.users.update_one({'id': user['id']}, {'$inc': {'ngn_balance': -final_price_ngn}})
-        charged_amount = final_price_ngn
-        charged_currency = 'NGN'
-    else:
-        await db.users.update_one({'id': user['id']}, {'$inc': {'usd_balance': -final_price_usd}})
-        charged_amount = final_price_usd
-        charged_currency = 'USD'
+    # Deduct from appropriate balance ONCE. The debit is conditional on the balance, so a
+    # concurrent purchase that drained the wallet in the meantime releases the number instead.
+    charged_amount = quote['charged_amount']
+    if await wallet_service.debit(user['id'], charged_amount, charged_currency) is None:
+        try:
+            await cancel_number_provider(provider, activation_id)
+        except Exception as e:
+            logger.error(f"Failed to release number {activation_id} after declined debit: {e}")
+        symbol = '₦' if charged_currency == 'NGN' else '$'
+        raise HTTPException(status_code=400, detail=f"Insufficient {charged_currency} balance. Need {symbol}{charged_amount:.2f}")
     
     # Calculate expiry (10 minutes total lifetime for all providers)
-    expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=ORDER_LIFETIME_MINUTES)
     
     order = SMSOrder(
         user_id=user['id'],
-        server=data.server,
+        server=RETAIL_PROVIDER_SERVERS.get(provider, data.server),
         provider=provider,
-        service=data.service,
+        service=route.service,
         service_name=data.service_name,
-        country=data.country,
+        country=route.country,
         phone_number=phone_number,
         activation_id=activation_id,
         status='active',
@@ -2953,7 +2718,8 @@ async def purchase_number(
         charged_currency=charged_currency,
         area_code=data.area_code,
         carrier=data.carrier,
-        phone_make=data.phone_make
+        phone_make=data.phone_make,
+        route=order_route,
     )
     
     order_dict = order.model_dump()
@@ -2964,7 +2730,6 @@ async def purchase_number(
     else:
         order_dict['created_at'] = datetime.now(timezone.utc).isoformat()
     order_dict['expires_at'] = expires_at.isoformat()
-    await db.sms_orders.insert_one(order_dict)
     
     # Create transaction record
     transaction = Transaction(
@@ -2974,15 +2739,25 @@ async def purchase_number(
         currency=charged_currency,
         status='completed',
         reference=order.id,
-        metadata={'service': data.service, 'country': data.country, 'provider': provider, 'phone': phone_number}
+        metadata={'service': route.service, 'country': route.country, 'provider': provider, 'phone': phone_number}
     )
     trans_dict = transaction.model_dump()
     trans_dict['created_at'] = trans_dict['created_at'].isoformat()
-    await db.transactions.insert_one(trans_dict)
-    
+    writes = [('sms_orders', order_dict), ('transactions', trans_dict)]
+
+    async def undo_purchase():
+        await wallet_service.credit(user['id'], charged_amount, charged_currency)
+        try:
+            await cancel_number_provider(provider, activation_id)
+        except Exception as e:
+            logger.error(f"Failed to release number {activation_id} after failed purchase: {e}")
 
-    # Record promo redemption AFTER order is created and user is charged
+    # Record promo redemption together with the order, after the user is charged.
+    # The use is claimed atomically so concurrent buyers cannot exceed max_total_uses.
     if promo:
+        if not await _claim_promo_use(promo):
+            await undo_purchase()
+            raise HTTPException(status_code=400, detail="Promo code usage limit reached")
         redemption = PromoRedemption(
             promo_id=promo['id'],
             code=promo['code'],
@@ -2990,10 +2765,23 @@ async def purchase_number(
             order_id=order.id,
             amount_discounted=discount_ngn if charged_currency == 'NGN' else discount_usd,
             currency=charged_currency,
+            one_time_per_user=promo.get('one_time_per_user', True),
         )
         red_dict = redemption.model_dump()
         red_dict['created_at'] = red_dict['created_at'].isoformat()
-        await db.promo_redemptions.insert_one(red_dict)
+        writes.append(('promo_redemptions', red_dict))
+
+    # The records are independent documents, so write them in one round of concurrent
+    # inserts. On failure undo the partial writes, refund and release the number.
+    write_error = await _insert_all_or_rollback(writes)
+    if write_error:
+        logger.error(f"Failed to record purchase {order.id} for user {user['id']}: {write_error}")
+        await undo_purchase()
+        if promo:
+            await _release_promo_use(promo)
+            if isinstance(write_error, DuplicateKeyError):
+                raise HTTPException(status_code=400, detail="Promo code already used")
+        raise HTTPException(status_code=500, detail="Failed to record order. You have not been charged.")
 
     # Start background OTP polling (generic for all providers)
     background_tasks.add_task(otp_polling_task, order.id)
@@ -3012,15 +2800,16 @@ async def purchase_number(
             'id': order.id,
             'phone_number': phone_number,
             'activation_id': activation_id,
-            'service': data.service,
-            'country': data.country,
+            'service': route.service,
+            'country': route.country,
             'status': 'active',
             'cost_usd': final_price_usd,
             'charged_amount': charged_amount,
             'charged_currency': charged_currency,
             'created_at': order_dict['created_at'],
             'expires_at': order_dict['expires_at'],
-            'can_cancel': True
+            'can_cancel': True,
+            'route': order_route,
         },
         'message': f'Number {phone_number} purchased successfully. Waiting for OTP...'
     }
@@ -3135,24 +2924,13 @@ async def cancel_order(order_id: str, user: dict = Depends(get_current_user)):
             refund_ngn = charged_amount * ngn_rate
         logger.info(f"Direct refund calculation: charged_amount={charged_amount}, charged_currency={charged_currency}, refund_ngn={refund_ngn}")
     
-    logger.info(f"Updating user {user['id']} balance by +{refund_ngn} NGN")
-    logger.info(f"Order user_id: {order.get('user_id')}, Current user_id: {user['id']}")
-    
-    # Check balance before update
-    user_before = await db.users.find_one({'id': user['id']}, {'_id': 0})
-    balance_before = user_before.get('ngn_balance', 0) if user_before else 0
-    logger.info(f"Balance before update: {balance_before}")
-    
-    result = await db.users.update_one({'id': user['id']}, {'$inc': {'ngn_balance': refund_ngn}})
-    logger.info(f"Balance update result: matched_count={result.matched_count}, modified_count={result.modified_count}")
-    
-    # Check balance after update
-    user_after = await db.users.find_one({'id': user['id']}, {'_id': 0})
-    balance_after = user_after.get('ngn_balance', 0) if user_after else 0
-    logger.info(f"Balance after update: {balance_after}, Expected: {balance_before + refund_ngn}")
+    # Flip the status first so two concurrent cancels cannot both refund
+    claimed = await db.sms_orders.update_one({'id': order['id'], 'status': 'active'}, {'$set': {'status': 'cancelled'}})
+    if claimed.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Order cannot be cancelled")
     
-    # Update order status
-    await db.sms_orders.update_one({'id': order['id']}, {'$set': {'status': 'cancelled'}})
+    balances = await wallet_service.credit(user['id'], refund_ngn, 'NGN')
+    logger.info(f"Refunded {refund_ngn} NGN to user {user['id']}, new balance: {balances.get('ngn_balance') if balances else None}")
     
     # Create refund transaction
     transaction = Transaction(
@@ -3170,12 +2948,115 @@ async def cancel_order(order_id: str, user: dict = Depends(get_current_user)):
     
     return {'success': True, 'message': 'Order cancelled and refunded', 'refund_amount': refund_ngn, 'currency': 'NGN'}
 
+# Fields the transaction lists render; raw provider data stays out of list responses
+TRANSACTION_LIST_PROJECTION = {
+    '_id': 0, 'id': 1, 'user_id': 1, 'user_email': 1, 'type': 1, 'amount': 1, 'amount_ngn': 1, 'amount_usd': 1,
+    'currency': 1, 'exchange_rate': 1, 'status': 1, 'reference': 1, 'description': 1,
+    'balance_before': 1, 'balance_after': 1, 'created_at': 1,
+    'metadata.provider': 1, 'metadata.service': 1, 'metadata.type': 1, 'metadata.payload_id': 1,
+}
+
+
 @api_router.get("/transactions/list")
 async def list_transactions(user: dict = Depends(get_current_user)):
-    transactions = await db.transactions.find({'user_id': user['id']}, {'_id': 0}).sort('created_at', -1).to_list(100)
+    transactions = await db.transactions.find({'user_id': user['id']}, TRANSACTION_LIST_PROJECTION).sort('created_at', -1).to_list(100)
     return {'transactions': transactions}
 
 # ============ Notifications ============
+#
+# User-scoped notifications (user_id set) carry their own read_at/dismissed_at and each
+# user has a `notification_inboxes` document with a maintained unread counter. Global
+# broadcasts are few; they are cached per worker and re-read only when the broadcast
+# version in `notification_meta` changes. Read state for broadcasts lives in the inbox
+# under `global_receipts.<notification_id>`.
+
+GLOBAL_NOTIFICATIONS_VERSION_CHECK_SECONDS = 5
+_global_notifications_cache = {'version': None, 'items': [], 'checked_at': 0.0}
+
+
+async def _bump_global_notifications_version():
+    await db.notification_meta.update_one({'id': 'global'}, {'$inc': {'version': 1}}, upsert=True)
+    _global_notifications_cache['checked_at'] = 0.0
+
+
+async def _get_global_notifications() -> List[dict]:
+    """Active broadcasts, newest first, from the per-version cache"""
+    now = time.monotonic()
+    cache = _global_notifications_cache
+    if cache['version'] is not None and now - cache['checked_at'] < GLOBAL_NOTIFICATIONS_VERSION_CHECK_SECONDS:
+        cache_lookup('global_notifications', True)
+        return cache['items']
+
+    meta = await db.notification_meta.find_one({'id': 'global'}, {'_id': 0, 'version': 1})
+    version = (meta or {}).get('version', 0)
+    cache_lookup('global_notifications', version == cache['version'])
+    if version != cache['version']:
+        items = await db.notifications.find(
+            {'active': True, 'user_id': {'$exists': False}}, {'_id': 0}
+        ).sort('created_at', -1).to_list(200)
+        cache['items'] = items
+        cache['version'] = version
+    cache['checked_at'] = now
+    return cache['items']
+
+
+async def _get_notification_inbox(user_id: str) -> dict:
+    """Per-user inbox state; built once from legacy receipts the first time it is needed"""
+    inbox = await db.notification_inboxes.find_one({'user_id': user_id}, {'_id': 0})
+    if inbox and inbox.get('migrated'):
+        return inbox
+
+    receipts = await db.notification_receipts.find({'user_id': user_id}, {'_id': 0}).to_list(None)
+    global_ids = {n['id'] for n in await _get_global_notifications()}
+    global_receipts = {}
+    for r in receipts:
+        fields = {k: r.get(k) for k in ('read_at', 'dismissed_at') if r.get(k)}
+        if not fields:
+            continue
+        if r['notification_id'] in global_ids:
+            global_receipts[r['notification_id']] = fields
+        else:
+            await db.notifications.update_one({'id': r['notification_id'], 'user_id': user_id}, {'$set': fields})
+
+    unread = await db.notifications.count_documents(
+        {'user_id': user_id, 'active': True, 'read_at': None, 'dismissed_at': None}
+    )
+    inbox = {'user_id': user_id, 'unread_count': unread, 'global_receipts': global_receipts, 'migrated': True}
+    await db.notification_inboxes.update_one({'user_id': user_id}, {'$set': inbox}, upsert=True)
+    return inbox
+
+
+async def _recount_unread(user_id: str):
+    """Reset a migrated inbox's unread counter from the user's notifications"""
+    unread = await db.notifications.count_documents(
+        {'user_id': user_id, 'active': True, 'read_at': None, 'dismissed_at': None}
+    )
+    await db.notification_inboxes.update_one({'user_id': user_id, 'migrated': True}, {'$set': {'unread_count': unread}})
+
+
+async def _set_notification_state(notification_id: str, user_id: str, field: str):
+    """Mark a notification read or dismissed for a user, keeping the unread counter in step"""
+    now = datetime.now(timezone.utc).isoformat()
+    # User-scoped: only the first read/dismiss of an unread, active notification decrements the counter
+    res = await db.notifications.update_one(
+        {'id': notification_id, 'user_id': user_id, 'active': True, 'read_at': None, 'dismissed_at': None},
+        {'$set': {field: now}}
+    )
+    if res.modified_count:
+        await db.notification_inboxes.update_one({'user_id': user_id}, {'$inc': {'unread_count': -1}})
+        return
+
+    own = await db.notifications.update_one({'id': notification_id, 'user_id': user_id}, {'$set': {field: now}})
+    if own.matched_count:
+        return
+
+    # Global broadcast
+    await db.notification_inboxes.update_one(
+        {'user_id': user_id},
+        {'$set': {f'global_receipts.{notification_id}.{field}': now}},
+        upsert=True
+    )
+
 
 @api_router.post('/admin/notifications')
 async def admin_create_notification(payload: dict, admin: dict = Depends(require_admin)):
@@ -3196,6 +3077,7 @@ async def admin_create_notification(payload: dict, admin: dict = Depends(require
     doc = notif.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.notifications.insert_one(doc)
+    await _bump_global_notifications_version()
     # Ensure no Mongo ObjectId leaks into response
     doc.pop('_id', None)
     return {'success': True, 'notification': doc}
@@ -3228,6 +3110,7 @@ async def admin_broadcast_notification(payload: dict, admin: dict = Depends(requ
     doc = notif.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.notifications.insert_one(doc)
+    await _bump_global_notifications_version()
     doc.pop('_id', None)
     return {'success': True, 'notification': doc}
 
@@ -3245,68 +3128,61 @@ async def admin_update_notification(notification_id: str, payload: dict, admin:
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail='Notification not found')
     notif = await db.notifications.find_one({'id': notification_id}, {'_id': 0})
+    if notif and not notif.get('user_id'):
+        await _bump_global_notifications_version()
+    elif notif and 'active' in payload:
+        # Only active notifications count as unread
+        await _recount_unread(notif['user_id'])
     return {'success': True, 'notification': notif}
 
 
 @api_router.get('/notifications')
 async def get_notifications(user: dict = Depends(get_current_user)):
     # return latest notifications with read/dismiss status
-    notifs = await db.notifications.find({'active': True, '$or': [{'user_id': {'$exists': False}}, {'user_id': user['id']}]}, {'_id': 0}).to_list(200)
-    notifs.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-
-    receipts = await db.notification_receipts.find({'user_id': user['id']}, {'_id': 0}).to_list(500)
-    receipt_map = {r['notification_id']: r for r in receipts}
+    inbox, global_notifs, own_notifs = await asyncio.gather(
+        _get_notification_inbox(user['id']),
+        _get_global_notifications(),
+        db.notifications.find({'user_id': user['id'], 'active': True}, {'_id': 0})
+        .sort('created_at', -1).limit(50).to_list(50),
+    )
+    global_receipts = inbox.get('global_receipts') or {}
 
     items = []
-    unread_count = 0
-    for n in notifs[:50]:
-        r = receipt_map.get(n['id'])
-        dismissed = bool(r and r.get('dismissed_at'))
-        read = bool(r and r.get('read_at'))
-        if not dismissed and not read:
-            unread_count += 1
-        items.append({
-            **n,
-            'read_at': r.get('read_at') if r else None,
-            'dismissed_at': r.get('dismissed_at') if r else None,
-        })
+    for n in global_notifs:
+        r = global_receipts.get(n['id']) or {}
+        items.append({**n, 'read_at': r.get('read_at'), 'dismissed_at': r.get('dismissed_at')})
+    for n in own_notifs:
+        items.append({**n, 'read_at': n.get('read_at'), 'dismissed_at': n.get('dismissed_at')})
+    items.sort(key=lambda x: x.get('created_at', ''), reverse=True)
 
-    return {'success': True, 'unread_count': unread_count, 'notifications': items}
+    global_unread = sum(1 for n in global_notifs if not global_receipts.get(n['id']))
+    unread_count = max(int(inbox.get('unread_count', 0) or 0), 0) + global_unread
+
+    return {'success': True, 'unread_count': unread_count, 'notifications': items[:50]}
 
 
 @api_router.post('/notifications/{notification_id}/read')
 async def mark_notification_read(notification_id: str, user: dict = Depends(get_current_user)):
-    now = datetime.now(timezone.utc).isoformat()
-    existing = await db.notification_receipts.find_one({'notification_id': notification_id, 'user_id': user['id']}, {'_id': 0})
-    if existing:
-        await db.notification_receipts.update_one({'id': existing['id']}, {'$set': {'read_at': now}})
-    else:
-        rec = NotificationReceipt(notification_id=notification_id, user_id=user['id'], read_at=now)
-        doc = rec.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.notification_receipts.insert_one(doc)
+    await _set_notification_state(notification_id, user['id'], 'read_at')
     return {'success': True}
 
 
 @api_router.post('/notifications/{notification_id}/dismiss')
 async def dismiss_notification(notification_id: str, user: dict = Depends(get_current_user)):
-    now = datetime.now(timezone.utc).isoformat()
-    existing = await db.notification_receipts.find_one({'notification_id': notification_id, 'user_id': user['id']}, {'_id': 0})
-    if existing:
-        await db.notification_receipts.update_one({'id': existing['id']}, {'$set': {'dismissed_at': now}})
-    else:
-        rec = NotificationReceipt(notification_id=notification_id, user_id=user['id'], dismissed_at=now)
-        doc = rec.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.notification_receipts.insert_one(doc)
+    await _set_notification_state(notification_id, user['id'], 'dismissed_at')
     return {'success': True}
 
 
 @api_router.delete('/admin/notifications/{notification_id}')
 async def admin_delete_notification(notification_id: str, admin: dict = Depends(require_admin)):
-    result = await db.notifications.delete_one({'id': notification_id})
-    if result.deleted_count == 0:
+    notif = await db.notifications.find_one_and_delete({'id': notification_id}, projection={'_id': 0})
+    if not notif:
         raise HTTPException(status_code=404, detail="Notification not found")
+    if notif.get('user_id'):
+        if notif.get('active') and not notif.get('read_at') and not notif.get('dismissed_at'):
+            await db.notification_inboxes.update_one({'user_id': notif['user_id']}, {'$inc': {'unread_count': -1}})
+    else:
+        await _bump_global_notifications_version()
     # Also delete related receipts
     await db.notification_receipts.delete_many({'notification_id': notification_id})
     return {'success': True}
@@ -3315,14 +3191,21 @@ async def admin_delete_notification(notification_id: str, admin: dict = Depends(
 @api_router.get('/notifications/login-popups')
 async def get_login_popups(user: dict = Depends(get_current_user)):
     # Only those marked show_on_login, not dismissed
-    popups = await db.notifications.find({'active': True, 'show_on_login': True, '$or': [{'user_id': {'$exists': False}}, {'user_id': user['id']}]}, {'_id': 0}).to_list(50)
-    popups.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-
-    receipts = await db.notification_receipts.find({'user_id': user['id']}, {'_id': 0}).to_list(500)
-    dismissed_ids = {r['notification_id'] for r in receipts if r.get('dismissed_at')}
+    inbox, global_notifs, own_popups = await asyncio.gather(
+        _get_notification_inbox(user['id']),
+        _get_global_notifications(),
+        db.notifications.find(
+            {'user_id': user['id'], 'active': True, 'show_on_login': True, 'dismissed_at': None}, {'_id': 0}
+        ).sort('created_at', -1).limit(3).to_list(3),
+    )
+    global_receipts = inbox.get('global_receipts') or {}
 
-    items = [p for p in popups if p.get('id') not in dismissed_ids]
-    return {'success': True, 'popups': items[:3]}
+    popups = [
+        n for n in global_notifs
+        if n.get('show_on_login') and not (global_receipts.get(n['id']) or {}).get('dismissed_at')
+    ] + own_popups
+    popups.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+    return {'success': True, 'popups': popups[:3]}
 
 # ============ Payscribe Routes ============
 @api_router.get("/payscribe/services")
@@ -3369,7 +3252,9 @@ async def create_promo_code(payload: dict, admin: dict = Depends(require_admin))
 
     doc = promo.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['used_count'] = 0
     await db.promo_codes.insert_one(doc)
+    _invalidate_promo_cache()
     # Remove _id added by MongoDB to avoid ObjectId serialization issues
     doc.pop('_id', None)
     return {"success": True, "promo": doc}
@@ -3406,6 +3291,7 @@ async def update_promo_code(promo_id: str, payload: dict, admin: dict = Depends(
     res = await db.promo_codes.update_one({"id": promo_id}, {"$set": update_fields})
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail="Promo code not found")
+    _invalidate_promo_cache()
 
     promo = await db.promo_codes.find_one({"id": promo_id}, {"_id": 0})
     return {"success": True, "promo": promo}
@@ -3419,29 +3305,11 @@ async def validate_promo_code(payload: dict, user: dict = Depends(get_current_us
         raise HTTPException(status_code=400, detail="Code is required")
 
     # We validate eligibility without requiring price context here.
-    promo = await db.promo_codes.find_one({"code": code, "active": True}, {"_id": 0})
+    promo = await _get_active_promo(code)
     if not promo:
         raise HTTPException(status_code=400, detail="Invalid promo code")
 
-    expires_at = promo.get('expires_at')
-    if expires_at:
-        exp = datetime.fromisoformat(expires_at)
-        if not exp.tzinfo:
-            exp = exp.replace(tzinfo=timezone.utc)
-        if datetime.now(timezone.utc) > exp:
-            raise HTTPException(status_code=400, detail="Promo code expired")
-
-    # Check usage limits
-    max_total = promo.get('max_total_uses')
-    if max_total:
-        used = await db.promo_redemptions.count_documents({"promo_id": promo['id']})
-        if used >= max_total:
-            raise HTTPException(status_code=400, detail="Promo code usage limit reached")
-
-    if promo.get('one_time_per_user', True):
-        prior = await db.promo_redemptions.find_one({"promo_id": promo['id'], "user_id": user['id']}, {"_id": 0})
-        if prior:
-            raise HTTPException(status_code=400, detail="Promo code already used")
+    await _check_promo_eligibility(promo, user['id'])
 
     return {
         "success": True,
@@ -3468,16 +3336,16 @@ async def get_admin_otp_orders(
     if user_id:
         query['user_id'] = user_id
     
-    orders_cursor = db.sms_orders.find(query, {'_id': 0}).sort('created_at', -1).skip(skip).limit(limit)
+    orders_cursor = analytics_db.sms_orders.find(query, {'_id': 0}).sort('created_at', -1).skip(skip).limit(limit)
     orders = await orders_cursor.to_list(limit)
     
-    total_count = await db.sms_orders.count_documents(query)
+    total_count = await analytics_db.sms_orders.count_documents(query)
     
     # Enrich with user emails
     user_ids = list(set(o.get('user_id') for o in orders if o.get('user_id')))
     users_map = {}
     if user_ids:
-        users_cursor = db.users.find({'id': {'$in': user_ids}}, {'_id': 0, 'id': 1, 'email': 1, 'full_name': 1})
+        users_cursor = analytics_db.users.find({'id': {'$in': user_ids}}, {'_id': 0, 'id': 1, 'email': 1, 'full_name': 1})
         users_list = await users_cursor.to_list(len(user_ids))
         for u in users_list:
             users_map[u['id']] = {'email': u.get('email'), 'full_name': u.get('full_name')}
@@ -3503,28 +3371,28 @@ async def get_admin_otp_orders(
 @api_router.get("/admin/otp-stats")
 async def get_admin_otp_stats(admin: dict = Depends(require_admin)):
     """Get OTP sales statistics."""
-    # Total orders by status
+    # Total orders by status, including archived orders
     status_counts = {}
     for status in ['active', 'completed', 'cancelled', 'expired', 'refunded']:
-        status_counts[status] = await db.sms_orders.count_documents({'status': status})
+        status_counts[status] = await archive.count(analytics_db, 'sms_orders', {'status': status}, None)
     
     # Total revenue (completed orders)
-    revenue_cursor = db.sms_orders.aggregate([
-        {'$match': {'status': 'completed'}},
-        {'$group': {'_id': None, 'total_ngn': {'$sum': '$price_ngn'}, 'total_usd': {'$sum': '$price_usd'}}}
-    ])
-    revenue = await revenue_cursor.to_list(1)
+    revenue = await archive.aggregate(
+        analytics_db, 'sms_orders', {'status': 'completed'},
+        [{'$group': {'_id': None, 'total_ngn': {'$sum': '$price_ngn'}, 'total_usd': {'$sum': '$price_usd'}}}],
+        None, 1,
+    )
     total_revenue_ngn = revenue[0]['total_ngn'] if revenue else 0
     total_revenue_usd = revenue[0]['total_usd'] if revenue else 0
     
     # Today's orders
     today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_orders = await db.sms_orders.count_documents({
+    today_orders = await analytics_db.sms_orders.count_documents({
         'created_at': {'$gte': today_start.isoformat()}
     })
     
     # Today's revenue
-    today_revenue_cursor = db.sms_orders.aggregate([
+    today_revenue_cursor = analytics_db.sms_orders.aggregate([
         {'$match': {'status': 'completed', 'created_at': {'$gte': today_start.isoformat()}}},
         {'$group': {'_id': None, 'total_ngn': {'$sum': '$price_ngn'}}}
     ])
@@ -3560,19 +3428,19 @@ async def get_admin_reseller_orders(
     if reseller_id:
         query['reseller_id'] = reseller_id
     
-    orders_cursor = db.reseller_orders.find(query, {'_id': 0}).sort('created_at', -1).skip(skip).limit(limit)
+    orders_cursor = analytics_db.reseller_orders.find(query, {'_id': 0}).sort('created_at', -1).skip(skip).limit(limit)
     orders = await orders_cursor.to_list(limit)
     
-    total_count = await db.reseller_orders.count_documents(query)
+    total_count = await analytics_db.reseller_orders.count_documents(query)
     
     # Enrich with reseller info
     reseller_ids = list(set(o.get('reseller_id') for o in orders if o.get('reseller_id')))
     resellers_map = {}
     if reseller_ids:
-        resellers_cursor = db.resellers.find({'id': {'$in': reseller_ids}}, {'_id': 0, 'id': 1, 'user_id': 1})
+        resellers_cursor = analytics_db.resellers.find({'id': {'$in': reseller_ids}}, {'_id': 0, 'id': 1, 'user_id': 1})
         resellers_list = await resellers_cursor.to_list(len(reseller_ids))
         user_ids = [r['user_id'] for r in resellers_list]
-        users_cursor = db.users.find({'id': {'$in': user_ids}}, {'_id': 0, 'id': 1, 'email': 1, 'full_name': 1})
+        users_cursor = analytics_db.users.find({'id': {'$in': user_ids}}, {'_id': 0, 'id': 1, 'email': 1, 'full_name': 1})
         users_list = await users_cursor.to_list(len(user_ids))
         users_map = {u['id']: u for u in users_list}
         for r in resellers_list:
@@ -3600,28 +3468,28 @@ async def get_admin_reseller_orders(
 @api_router.get("/admin/reseller-sales-stats")
 async def get_admin_reseller_sales_stats(admin: dict = Depends(require_admin)):
     """Get reseller sales statistics."""
-    # Total orders by status
+    # Total orders by status, including archived orders
     status_counts = {}
     for status in ['active', 'completed', 'cancelled', 'expired', 'refunded']:
-        status_counts[status] = await db.reseller_orders.count_documents({'status': status})
+        status_counts[status] = await archive.count(analytics_db, 'reseller_orders', {'status': status}, None)
     
     # Total revenue (completed orders)
-    revenue_cursor = db.reseller_orders.aggregate([
-        {'$match': {'status': 'completed'}},
-        {'$group': {'_id': None, 'total_ngn': {'$sum': '$cost_ngn'}, 'total_usd': {'$sum': '$cost_usd'}}}
-    ])
-    revenue = await revenue_cursor.to_list(1)
+    revenue = await archive.aggregate(
+        analytics_db, 'reseller_orders', {'status': 'completed'},
+        [{'$group': {'_id': None, 'total_ngn': {'$sum': '$cost_ngn'}, 'total_usd': {'$sum': '$cost_usd'}}}],
+        None, 1,
+    )
     total_revenue_ngn = revenue[0]['total_ngn'] if revenue else 0
     total_revenue_usd = revenue[0]['total_usd'] if revenue else 0
     
     # Today's orders
     today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_orders = await db.reseller_orders.count_documents({
+    today_orders = await analytics_db.reseller_orders.count_documents({
         'created_at': {'$gte': today_start.isoformat()}
     })
     
     # Today's revenue
-    today_revenue_cursor = db.reseller_orders.aggregate([
+    today_revenue_cursor = analytics_db.reseller_orders.aggregate([
         {'$match': {'status': 'completed', 'created_at': {'$gte': today_start.isoformat()}}},
         {'$group': {'_id': None, 'total_ngn': {'$sum': '$cost_ngn'}}}
     ])
@@ -3629,8 +3497,8 @@ async def get_admin_reseller_sales_stats(admin: dict = Depends(require_admin)):
     today_revenue_ngn = today_revenue[0]['total_ngn'] if today_revenue else 0
     
     # Total resellers
-    total_resellers = await db.resellers.count_documents({})
-    active_resellers = await db.resellers.count_documents({'is_active': True})
+    total_resellers = await analytics_db.resellers.count_documents({})
+    active_resellers = await analytics_db.resellers.count_documents({'is_active': True})
     
     return {
         "success": True,
@@ -3658,56 +3526,70 @@ async def admin_provider_balances(admin: dict = Depends(require_admin)):
         await db.pricing_config.insert_one(cfg)
         config = cfg
 
-    daisysms_key = config.get('daisysms_api_key') or DAISYSMS_API_KEY
-    smspool_key = config.get('smspool_api_key') or SMSPOOL_API_KEY
-    fivesim_key = config.get('fivesim_api_key') or FIVESIM_API_KEY
-
-    balances = {
-        'daisysms': None,
-        'smspool': None,
-        '5sim': None,
-    }
-
-    # DaisySMS balance
-    if daisysms_key and daisysms_key != '********':
-        try:
-            url = f"https://daisysms.com/stubs/handler_api.php?api_key={daisysms_key}&action=getBalance"
-            async with httpx.AsyncClient(timeout=15.0) as client_http:
-                r = await client_http.get(url)
-            if r.status_code == 200:
-                # example: ACCESS_BALANCE:10.00
-                txt = r.text.strip()
-                parts = txt.split(':')
-                balances['daisysms'] = {'raw': txt, 'balance': float(parts[1]) if len(parts) > 1 else None}
-        except Exception:
-            balances['daisysms'] = {'error': 'failed'}
-
-    # SMS-pool balance
-    if smspool_key and smspool_key != '********':
+    async def fetch_balance(provider: str):
         try:
-            url = f"https://api.smspool.net/request/balance?key={smspool_key}"
-            async with httpx.AsyncClient(timeout=15.0) as client_http:
-                r = await client_http.get(url)
-            if r.status_code == 200:
-                j = r.json()
-                balances['smspool'] = j
+            return {'balance': await get_provider(provider).balance()}
+        except ProviderError:
+            return None  # No API key configured
         except Exception:
-            balances['smspool'] = {'error': 'failed'}
+            return {'error': 'failed'}
 
-    # 5sim balance
-    if fivesim_key and fivesim_key != '********':
-        try:
-            async with httpx.AsyncClient(timeout=15.0) as client_http:
-                r = await client_http.get('https://5sim.net/v1/user/profile', headers={'Authorization': f'Bearer {fivesim_key}'})
-            if r.status_code == 200:
-                balances['5sim'] = r.json()
-            else:
-                balances['5sim'] = {'status_code': r.status_code}
-        except Exception:
-            balances['5sim'] = {'error': 'failed'}
+    names = ('daisysms', 'smspool', '5sim')
+    balances = dict(zip(names, await asyncio.gather(*(fetch_balance(name) for name in names))))
 
     return {'success': True, 'balances': balances}
 
+
+@api_router.get('/admin/analytics/{report}')
+async def admin_analytics_report(
+    report: str,
+    admin: dict = Depends(require_admin),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+):
+    """Heavy reports computed from the daily Parquet snapshots instead of the live database"""
+    compute = analytics.REPORTS.get(report)
+    if compute is None:
+        raise HTTPException(status_code=404, detail=f"Unknown report. Available: {', '.join(analytics.REPORTS)}")
+    try:
+        end = date.fromisoformat(end_date[:10]) if end_date else datetime.now(timezone.utc).date()
+        start = date.fromisoformat(start_date[:10]) if start_date else end - timedelta(days=30)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if (end - start).days > 366:
+        raise HTTPException(status_code=400, detail="Range is limited to one year")
+
+    config = await db.pricing_config.find_one({}, {'_id': 0, 'ngn_to_usd_rate': 1}) or {}
+    ngn_rate = float(config.get('ngn_to_usd_rate', 1500.0) or 1500.0)
+    rows = await asyncio.to_thread(compute, start, end, ngn_rate)
+    last_day = analytics.last_exported_day('transactions')
+    return {
+        'success': True,
+        'report': report,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'data_through': last_day.isoformat() if last_day else None,
+        'rows': rows,
+    }
+
+
+@api_router.get('/admin/provider-health')
+async def admin_provider_health(admin: dict = Depends(require_admin)):
+    """Circuit breaker state, error rate and latency per provider and endpoint (this worker)"""
+    health = breakers.health()
+    arrivals = await otp_cadence.arrival_counts()
+    for name in providers.PROVIDER_NAMES:
+        provider_health = health.setdefault(name, {'endpoints': {}})
+        if 'state' not in provider_health:
+            provider_health.update(breakers.get(name).snapshot())
+            provider_health['score'] = health_score(provider_health)
+        success_rate, latency = routing.stats.summary(name, None)
+        provider_health['purchase_success_rate'] = round(success_rate, 3)
+        provider_health['purchase_latency'] = round(latency, 3) if latency is not None else None
+        provider_health['rate_budget'] = rate_budget.budget(name).snapshot()
+        provider_health['otp_arrivals'] = arrivals.get(name, 0)
+    return {'success': True, 'providers': health}
+
 # ============ Crypto Deposits (Plisio) ============
 
 @api_router.post('/crypto/plisio/create-invoice')
@@ -3784,7 +3666,7 @@ async def plisio_create_invoice(payload: dict, user: dict = Depends(get_current_
         'amount_crypto': data.get('amount') or data.get('amount_to_pay'),
         'qr': data.get('qr_code') or data.get('qr'),
         'invoice_url': data.get('invoice_url'),
-        'raw': data,
+        'raw_id': payload_store.put('plisio_invoice', data, order_id),
     }
     await db.crypto_invoices.insert_one(invoice_doc)
 
@@ -3823,51 +3705,54 @@ async def plisio_webhook(request: Request):
     if not order_number:
         return {'success': True}
 
+    status_val = (payload.get('status') or payload.get('invoice_status') or '').lower()
+    event_id = f"{order_number}:{payload.get('txn_id') or ''}:{status_val}"
+    await webhook_inbox.ingest('plisio', event_id, payload)
+    return {'success': True}
+
+
+async def _process_plisio_event(payload: dict) -> str:
+    order_number = payload.get('order_number') or payload.get('order') or payload.get('order_id')
     invoice = await db.crypto_invoices.find_one({'id': order_number}, {'_id': 0})
     if not invoice:
-        return {'success': True}
+        return 'ignored: invoice not found'
 
     status_val = (payload.get('status') or payload.get('invoice_status') or '').lower()
     paid = status_val in ['completed', 'paid', 'success', 'finished']
 
     update_fields = {
         'plisio_status': status_val,
-        'webhook': payload,
+        'webhook_id': payload_store.put('plisio_webhook', payload, order_number),
         'last_webhook_at': datetime.now(timezone.utc).isoformat(),
     }
 
-    if paid and invoice.get('status') != 'paid':
-        # Credit USD
+    if paid:
+        # Credit USD before marking the invoice paid: the credit is keyed, so a retry after a
+        # failure in between credits exactly once instead of finding a paid, uncredited invoice
         amount_usd = float(invoice.get('amount_usd') or 0)
-        await db.users.update_one({'id': invoice['user_id']}, {'$inc': {'usd_balance': amount_usd}})
-
-        # Transaction
-        transaction = Transaction(
-            user_id=invoice['user_id'],
-            type='deposit_usd',
-            amount=amount_usd,
-            currency='USD',
-            status='completed',
-            reference=str(invoice.get('invoice_id') or invoice.get('id')),
-            metadata={'provider': 'plisio', 'currency': invoice.get('currency')}
-        )
-        trans_dict = transaction.model_dump()
-        trans_dict['created_at'] = trans_dict['created_at'].isoformat()
-        await db.transactions.insert_one(trans_dict)
-
-        await _create_transaction_notification(
-            invoice['user_id'],
-            'Crypto deposit confirmed',
-            f"Your wallet was credited ${amount_usd:,.2f}.",
-            metadata={'reference': trans_dict.get('id'), 'type': 'deposit_usd', 'provider': 'plisio'},
+        credited = await _apply_deposit(
+            f"plisio:{invoice['id']}",
+            Transaction(
+                user_id=invoice['user_id'],
+                type='deposit_usd',
+                amount=amount_usd,
+                currency='USD',
+                status='completed',
+                reference=str(invoice.get('invoice_id') or invoice.get('id')),
+                metadata={'provider': 'plisio', 'currency': invoice.get('currency')}
+            ),
+            ('Crypto deposit confirmed', f"Your wallet was credited ${amount_usd:,.2f}.",
+             {'reference': invoice.get('invoice_id') or invoice.get('id'), 'type': 'deposit_usd', 'provider': 'plisio'}),
         )
-
         update_fields['status'] = 'paid'
         update_fields['paid_at'] = datetime.now(timezone.utc).isoformat()
+        await db.crypto_invoices.update_one({'id': order_number, 'status': {'$ne': 'paid'}}, {'$set': update_fields})
+        return 'credited' if credited else 'already credited'
 
-    await db.crypto_invoices.update_one({'id': order_number}, {'$set': update_fields})
+    # A late non-final status must not move a paid invoice backwards
+    await db.crypto_invoices.update_one({'id': order_number, 'status': {'$ne': 'paid'}}, {'$set': update_fields})
+    return f'status {status_val}'
 
-    return {'success': True}
 
 
 @api_router.post('/crypto/plisio/cancel/{deposit_id}')
@@ -4052,7 +3937,7 @@ async def ercaspay_initiate_payment(payload: ErcaspayInitiateRequest, user: dict
         transaction_reference=transaction_ref,
         payment_reference=payment_ref,
         checkout_url=checkout_url,
-        ercaspay_response=result
+        ercaspay_response_id=payload_store.put('ercaspay_checkout', result, payment_ref)
     )
     
     payment_dict = payment_record.model_dump()
@@ -4069,128 +3954,106 @@ async def ercaspay_initiate_payment(payload: ErcaspayInitiateRequest, user: dict
     }
 
 
+ERCASPAY_STATUS_MAP = {
+    'successful': 'paid',
+    'success': 'paid',
+    'paid': 'paid',
+    'completed': 'paid',
+    'failed': 'failed',
+    'cancelled': 'failed',
+    'canceled': 'failed',
+    'expired': 'expired',
+    'pending': 'pending'
+}
+
+
+def _ercaspay_deposit(payment: dict, transaction_ref: Optional[str] = None) -> tuple:
+    """Credit key, transaction and notification for a paid Ercaspay payment"""
+    credit_amount = float(payment.get('amount', 0))
+    metadata = {'provider': 'ercaspay', 'payment_method': payment.get('payment_method')}
+    if transaction_ref:
+        metadata['transaction_reference'] = transaction_ref
+    transaction = Transaction(
+        user_id=payment['user_id'],
+        type='deposit_ngn',
+        amount=credit_amount,
+        currency='NGN',
+        status='completed',
+        reference=payment.get('payment_reference'),
+        metadata=metadata
+    )
+    notification = (
+        'Deposit successful',
+        f"₦{credit_amount:,.2f} has been credited to your wallet via {payment.get('payment_method', 'Ercaspay')}.",
+        {'reference': payment.get('payment_reference'), 'type': 'deposit_ngn', 'provider': 'ercaspay'},
+    )
+    return f"ercaspay:{payment['id']}", transaction, notification
+
+
 @api_router.post('/ercaspay/webhook')
 async def ercaspay_webhook(request: Request):
-    """Handle Ercaspay webhook callbacks for payment status updates."""
+    """Handle Ercaspay webhook callbacks: store the event and ack; a worker applies it."""
     try:
         payload = await request.json()
     except Exception:
         return {'status': 'error', 'message': 'Invalid JSON'}
-    
-    logger.info(f"Ercaspay webhook received: {payload}")
+    if not isinstance(payload, dict):
+        return {'status': 'error', 'message': 'Invalid JSON'}
     
     # Ercaspay sends data directly in payload (not nested under 'data')
     # Sample: {"amount": 100, "transaction_reference": "ERCS|...", "payment_reference": "R5md...", "status": "SUCCESSFUL", ...}
-    
-    # Handle both nested format (if 'data' exists) and flat format (direct payload)
     data = payload.get('data', payload)  # Use payload itself if 'data' key doesn't exist
-    
-    # Extract references - Ercaspay uses snake_case in webhooks
     payment_ref = data.get('payment_reference') or data.get('paymentReference')
     transaction_ref = data.get('transaction_reference') or data.get('transactionReference')
-    status = data.get('status', '').upper()  # Ercaspay sends status in UPPERCASE (e.g., "SUCCESSFUL")
-    amount = data.get('amount', 0)
+    status = (data.get('status') or '').upper()  # Ercaspay sends status in UPPERCASE (e.g., "SUCCESSFUL")
     
     if not payment_ref and not transaction_ref:
         logger.warning("Ercaspay webhook missing reference")
         return {'status': 'ignored', 'message': 'Missing reference'}
     
-    # Find the payment record
-    query = {}
-    if payment_ref:
-        query['payment_reference'] = payment_ref
-    elif transaction_ref:
-        query['transaction_reference'] = transaction_ref
+    event_id = f"{payment_ref or transaction_ref}:{status}"
+    if not await webhook_inbox.ingest('ercaspay', event_id, payload):
+        logger.info(f"Ercaspay webhook {event_id} already received")
+    return {'status': 'ok'}
+
+
+async def _process_ercaspay_event(payload: dict) -> str:
+    data = payload.get('data', payload)
+    payment_ref = data.get('payment_reference') or data.get('paymentReference')
+    transaction_ref = data.get('transaction_reference') or data.get('transactionReference')
+    status = (data.get('status') or '').lower()
     
+    # Find the payment record
+    query = {'payment_reference': payment_ref} if payment_ref else {'transaction_reference': transaction_ref}
     payment = await db.ercaspay_payments.find_one(query, {'_id': 0})
-    
     if not payment:
         logger.warning(f"Ercaspay payment not found: {payment_ref or transaction_ref}")
-        return {'status': 'ignored', 'message': 'Payment not found'}
-    
-    # Don't process already completed payments
-    if payment.get('status') == 'paid':
-        logger.info(f"Ercaspay webhook: Payment {payment_ref} already processed")
-        return {'status': 'ok', 'message': 'Already processed'}
-    
-    # Map Ercaspay status to our status (Ercaspay sends UPPERCASE like "SUCCESSFUL")
-    status_lower = status.lower()
-    status_map = {
-        'successful': 'paid',
-        'success': 'paid',
-        'paid': 'paid',
-        'completed': 'paid',
-        'failed': 'failed',
-        'cancelled': 'failed',
-        'canceled': 'failed',
-        'expired': 'expired',
-        'pending': 'pending'
-    }
-    
-    new_status = status_map.get(status_lower, 'pending')
-    logger.info(f"Ercaspay webhook: Mapping status '{status}' -> '{new_status}' for payment {payment_ref}")
+        return 'ignored: payment not found'
     
+    new_status = ERCASPAY_STATUS_MAP.get(status, 'pending')
     update_fields = {
         'status': new_status,
-        'ercaspay_response': payload,
+        'ercaspay_response_id': payload_store.put('ercaspay_webhook', payload, payment.get('payment_reference')),
         'updated_at': datetime.now(timezone.utc).isoformat()
     }
     
-    # If payment successful, credit user wallet
-    if new_status == 'paid':
-        user = await db.users.find_one({'id': payment['user_id']}, {'_id': 0})
-        if user:
-            credit_amount = float(payment.get('amount', 0))
-            
-            if credit_amount <= 0:
-                logger.error(f"Ercaspay webhook: Invalid credit amount {credit_amount} for payment {payment_ref}")
-                return {'status': 'error', 'message': 'Invalid amount'}
-            
-            # Credit NGN balance
-            result = await db.users.update_one(
-                {'id': payment['user_id']},
-                {'$inc': {'ngn_balance': credit_amount}}
-            )
-            
-            if result.modified_count == 0:
-                logger.error(f"Ercaspay webhook: Failed to credit user {payment['user_id']} for payment {payment_ref}")
-            else:
-                logger.info(f"Ercaspay webhook: Successfully credited ₦{credit_amount} to user {payment['user_id']}")
-            
-            # Create transaction record
-            transaction = Transaction(
-                user_id=payment['user_id'],
-                type='deposit_ngn',
-                amount=credit_amount,
-                currency='NGN',
-                status='completed',
-                reference=payment.get('payment_reference'),
-                metadata={
-                    'provider': 'ercaspay',
-                    'payment_method': payment.get('payment_method'),
-                    'transaction_reference': transaction_ref
-                }
-            )
-            trans_dict = transaction.model_dump()
-            trans_dict['created_at'] = trans_dict['created_at'].isoformat()
-            await db.transactions.insert_one(trans_dict)
-            
-            # Create notification
-            await _create_transaction_notification(
-                payment['user_id'],
-                'Deposit successful',
-                f"₦{credit_amount:,.2f} has been credited to your wallet via {payment.get('payment_method', 'Ercaspay')}.",
-                metadata={'reference': payment.get('payment_reference'), 'type': 'deposit_ngn', 'provider': 'ercaspay'},
-            )
-            
-            logger.info(f"Ercaspay payment successful: {payment_ref}, credited ₦{credit_amount} to user {payment['user_id']}")
-        else:
-            logger.error(f"Ercaspay webhook: User {payment['user_id']} not found for payment {payment_ref}")
+    if new_status != 'paid':
+        # A late failure/pending event must not move a paid payment backwards
+        await db.ercaspay_payments.update_one({'id': payment['id'], 'status': {'$ne': 'paid'}}, {'$set': update_fields})
+        return f'status {new_status}'
     
-    await db.ercaspay_payments.update_one(query, {'$set': update_fields})
-    logger.info(f"Ercaspay webhook: Updated payment {payment_ref} status to {new_status}")
+    if float(payment.get('amount', 0)) <= 0:
+        logger.error(f"Ercaspay webhook: Invalid credit amount {payment.get('amount')} for payment {payment_ref}")
+        return 'error: invalid amount'
     
-    return {'status': 'ok'}
+    # Credit before marking the payment paid: the credit is keyed, so a retry after a failure
+    # in between credits exactly once instead of finding a paid, uncredited payment
+    credited = await _apply_deposit(*_ercaspay_deposit(payment, transaction_ref))
+    await db.ercaspay_payments.update_one({'id': payment['id'], 'status': {'$ne': 'paid'}}, {'$set': update_fields})
+    if credited:
+        logger.info(f"Ercaspay payment successful: {payment_ref}, credited ₦{payment.get('amount')} to user {payment['user_id']}")
+    return 'credited' if credited else 'already credited'
+
 
 
 @api_router.get('/ercaspay/verify/{payment_ref}')
@@ -4243,42 +4106,12 @@ async def ercaspay_webhook_internal(payment: dict, verify_result: dict):
         return  # Already processed
     
     if status in ['successful', 'success', 'paid', 'completed']:
-        credit_amount = float(payment.get('amount', 0))
-        
-        # Credit NGN balance
-        await db.users.update_one(
-            {'id': payment['user_id']},
-            {'$inc': {'ngn_balance': credit_amount}}
-        )
-        
-        # Create transaction record
-        transaction = Transaction(
-            user_id=payment['user_id'],
-            type='deposit_ngn',
-            amount=credit_amount,
-            currency='NGN',
-            status='completed',
-            reference=payment.get('payment_reference'),
-            metadata={
-                'provider': 'ercaspay',
-                'payment_method': payment.get('payment_method')
-            }
-        )
-        trans_dict = transaction.model_dump()
-        trans_dict['created_at'] = trans_dict['created_at'].isoformat()
-        await db.transactions.insert_one(trans_dict)
-        
-        # Create notification
-        await _create_transaction_notification(
-            payment['user_id'],
-            'Deposit successful',
-            f"₦{credit_amount:,.2f} has been credited to your wallet.",
-            metadata={'reference': payment.get('payment_reference'), 'type': 'deposit_ngn', 'provider': 'ercaspay'},
-        )
+        # Same credit key as the webhook path, so whichever lands second is a no-op
+        await _apply_deposit(*_ercaspay_deposit(payment))
         
         # Update payment status
         await db.ercaspay_payments.update_one(
-            {'id': payment['id']},
+            {'id': payment['id'], 'status': {'$ne': 'paid'}},
             {'$set': {'status': 'paid', 'updated_at': datetime.now(timezone.utc).isoformat()}}
         )
         
@@ -4288,7 +4121,7 @@ async def ercaspay_webhook_internal(payment: dict, verify_result: dict):
 @api_router.get('/admin/ercaspay/payments')
 async def admin_list_ercaspay_payments(admin: dict = Depends(require_admin)):
     """List all Ercaspay payments for admin view."""
-    projection = {'_id': 0}
+    projection = {'_id': 0, 'ercaspay_response': 0}
     payments = (
         await db.ercaspay_payments
         .find({}, projection)
@@ -4298,6 +4131,15 @@ async def admin_list_ercaspay_payments(admin: dict = Depends(require_admin)):
     return {'payments': payments}
 
 
+@api_router.get('/admin/provider-payloads/{payload_id}')
+async def admin_get_provider_payload(payload_id: str, admin: dict = Depends(require_admin)):
+    """Raw provider payload referenced from a transaction, payment or invoice."""
+    doc = await payload_store.get(payload_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail='Payload not found')
+    return {'success': True, 'payload': doc}
+
+
 # ============ Payscribe Temporary Virtual Account Integration ============
 
 @api_router.post('/payscribe/create-temp-account')
@@ -4388,7 +4230,8 @@ async def payscribe_create_temp_account(payload: PayscribeCreateAccountRequest,
         bank_code=account.get('bank_code'),
         status='pending',
         expiry_date=expiry_date,
-        payscribe_response=result
+        account_id=account.get('id'),
+        payscribe_response_id=payload_store.put('payscribe_account', result, ref)
     )
     
     payment_dict = payment_record.model_dump()
@@ -4459,132 +4302,105 @@ async def payscribe_webhook(request: Request):
         payload = await request.json()
     except Exception:
         return {'status': 'error', 'message': 'Invalid JSON'}
+    if not isinstance(payload, dict):
+        return {'status': 'error', 'message': 'Invalid JSON'}
     
-    logger.info(f"Payscribe webhook received: {payload}")
-    
-    # Extract payment info from Payscribe webhook
+    event_id = payload.get('event_id') or payload.get('trans_id') or payload.get('transaction_hash')
+    if not event_id:
+        event_id = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    if not await webhook_inbox.ingest('payscribe', str(event_id), payload):
+        logger.info(f"Payscribe webhook {event_id} already received")
+    return {'status': 'ok', 'message': 'Payment received'}
+
+
+async def _process_payscribe_event(payload: dict) -> str:
     event_type = payload.get('event_type', '')
-    event_id = payload.get('event_id', '')
     trans_id = payload.get('trans_id', '')
-    amount = float(payload.get('amount', 0))
+    amount = float(payload.get('amount', 0) or 0)
     
     # Get customer/account info
-    customer = payload.get('customer', {})
+    customer = payload.get('customer', {}) or {}
     account_number = customer.get('number', '')  # This is the virtual account number
     account_id = customer.get('account_id', '')
-    account_type = customer.get('account_type', '')
     
     # Get transaction details
-    transaction_data = payload.get('transaction', {})
+    transaction_data = payload.get('transaction', {}) or {}
     sender_name = transaction_data.get('sender_name', '')
     sender_account = transaction_data.get('sender_account', '')
     narration = transaction_data.get('narration', '')
     
-    logger.info(f"Payscribe webhook: event={event_type}, account_number={account_number}, amount={amount}, sender={sender_name}")
-    
     # Find payment record by account number (primary) or account_id (fallback)
     payment = None
     if account_number:
-        payment = await db.payscribe_temp_accounts.find_one({'account_number': account_number}, {'_id': 0})
+        payment = await db.payscribe_temp_accounts.find_one(
+            {'account_number': account_number}, {'_id': 0, 'payscribe_response': 0, 'webhook_response': 0}
+        )
     
     if not payment and account_id:
-        # Try finding by account_id stored in payscribe_response
+        # Older records only have the account id inside the stored payscribe_response
         payment = await db.payscribe_temp_accounts.find_one(
-            {'payscribe_response.message.details.account.id': account_id}, 
-            {'_id': 0}
+            {'$or': [{'account_id': account_id}, {'payscribe_response.message.details.account.id': account_id}]},
+            {'_id': 0, 'payscribe_response': 0, 'webhook_response': 0}
         )
     
     if not payment:
         logger.warning(f"Payscribe payment not found for account_number={account_number}, account_id={account_id}")
-        return {'status': 'ignored', 'message': 'Payment not found'}
+        return 'ignored: payment not found'
     
     ref = payment.get('reference', trans_id)  # Use our stored reference or trans_id from webhook
     
-    # Don't process already completed payments
-    if payment.get('status') == 'paid':
-        logger.info(f"Payscribe webhook: Payment {ref} already processed")
-        return {'status': 'ok', 'message': 'Already processed'}
-    
     # For accounts.payment.status event, receiving a webhook means payment was successful
-    # The event_type "accounts.payment.status" indicates a payment was received
-    new_status = 'paid' if event_type == 'accounts.payment.status' else 'pending'
-    
-    logger.info(f"Payscribe webhook: Setting status to '{new_status}' for payment {ref}")
-    
-    update_fields = {
-        'status': new_status,
-        'webhook_response': payload,
-        'updated_at': datetime.now(timezone.utc).isoformat()
-    }
-    
-    # If payment successful, credit user wallet
-    if new_status == 'paid':
-        user = await db.users.find_one({'id': payment['user_id']}, {'_id': 0})
-        if user:
-            # Use the amount from webhook (actual payment) or fallback to stored amount
-            credit_amount = amount if amount > 0 else float(payment.get('amount', 0))
-            
-            if credit_amount <= 0:
-                logger.error(f"Payscribe webhook: Invalid credit amount {credit_amount} for payment {ref}")
-                return {'status': 'error', 'message': 'Invalid amount'}
-            
-            # Credit NGN balance
-            result = await db.users.update_one(
-                {'id': payment['user_id']},
-                {'$inc': {'ngn_balance': credit_amount}}
-            )
-            
-            if result.modified_count == 0:
-                logger.error(f"Payscribe webhook: Failed to credit user {payment['user_id']} for payment {ref}")
-            else:
-                logger.info(f"Payscribe webhook: Successfully credited ₦{credit_amount} to user {payment['user_id']}")
-            
-            # Create transaction record
-            transaction = Transaction(
-                user_id=payment['user_id'],
-                type='deposit_ngn',
-                amount=credit_amount,
-                currency='NGN',
-                status='completed',
-                reference=ref,
-                metadata={
-                    'provider': 'payscribe',
-                    'payment_method': 'bank-transfer',
-                    'account_number': payment.get('account_number'),
-                    'bank_name': payment.get('bank_name'),
-                    'sender_name': sender_name,
-                    'sender_account': sender_account,
-                    'narration': narration,
-                    'trans_id': trans_id
-                }
-            )
-            trans_dict = transaction.model_dump()
-            trans_dict['created_at'] = trans_dict['created_at'].isoformat()
-            await db.transactions.insert_one(trans_dict)
-            
-            # Create notification
-            await _create_transaction_notification(
-                payment['user_id'],
-                'Deposit successful',
-                f"₦{credit_amount:,.2f} has been credited to your wallet via Payscribe Bank Transfer from {sender_name}.",
-                metadata={'reference': ref, 'type': 'deposit_ngn', 'provider': 'payscribe'},
-            )
-            
-            logger.info(f"Payscribe payment successful: {ref}, credited ₦{credit_amount} to user {payment['user_id']}")
-        else:
-            logger.error(f"Payscribe webhook: User {payment['user_id']} not found for payment {ref}")
-    
-    # Update by account_number since that's how we found the record
-    await db.payscribe_temp_accounts.update_one({'account_number': account_number}, {'$set': update_fields})
-    logger.info(f"Payscribe webhook: Updated payment {ref} (account: {account_number}) status to {new_status}")
+    if event_type != 'accounts.payment.status':
+        return f'ignored: event {event_type}'
+    
+    # Use the amount from webhook (actual payment) or fallback to stored amount
+    credit_amount = amount if amount > 0 else float(payment.get('amount', 0))
+    if credit_amount <= 0:
+        logger.error(f"Payscribe webhook: Invalid credit amount {credit_amount} for payment {ref}")
+        return 'error: invalid amount'
+    
+    # Credit before marking the payment paid: the credit is keyed, so a retry after a failure
+    # in between credits exactly once instead of finding a paid, uncredited payment
+    credited = await _apply_deposit(
+        f"payscribe:{payment.get('id') or ref}",
+        Transaction(
+            user_id=payment['user_id'],
+            type='deposit_ngn',
+            amount=credit_amount,
+            currency='NGN',
+            status='completed',
+            reference=ref,
+            metadata={
+                'provider': 'payscribe',
+                'payment_method': 'bank-transfer',
+                'account_number': payment.get('account_number'),
+                'bank_name': payment.get('bank_name'),
+                'sender_name': sender_name,
+                'sender_account': sender_account,
+                'narration': narration,
+                'trans_id': trans_id
+            }
+        ),
+        ('Deposit successful',
+         f"₦{credit_amount:,.2f} has been credited to your wallet via Payscribe Bank Transfer from {sender_name}.",
+         {'reference': ref, 'type': 'deposit_ngn', 'provider': 'payscribe'}),
+    )
     
-    return {'status': 'ok', 'message': f'Payment processed successfully'}
+    await db.payscribe_temp_accounts.update_one(
+        {'account_number': payment.get('account_number'), 'status': {'$ne': 'paid'}},
+        {'$set': {'status': 'paid', 'webhook_response_id': payload_store.put('payscribe_webhook', payload, ref),
+                  'updated_at': datetime.now(timezone.utc).isoformat()}}
+    )
+    if credited:
+        logger.info(f"Payscribe payment successful: {ref}, credited ₦{credit_amount} to user {payment['user_id']}")
+    return 'credited' if credited else 'already credited'
+
 
 
 @api_router.get('/admin/payscribe/temp-accounts')
 async def admin_list_payscribe_temp_accounts(admin: dict = Depends(require_admin)):
     """List all Payscribe temporary virtual accounts for admin view."""
-    projection = {'_id': 0}
+    projection = {'_id': 0, 'payscribe_response': 0}
     accounts = (
         await db.payscribe_temp_accounts
         .find({}, projection)
@@ -4592,6 +4408,12 @@ async def admin_list_payscribe_temp_accounts(admin: dict = Depends(require_admin
         .to_list(500)
     )
     
+    # The admin detail view shows the webhook body
+    webhook_payloads = await payload_store.get_many(acc.get('webhook_response_id') for acc in accounts)
+    for acc in accounts:
+        if acc.get('webhook_response_id') in webhook_payloads:
+            acc['webhook_response'] = webhook_payloads[acc['webhook_response_id']]
+    
     # Enrich with user emails
     for acc in accounts:
         user = await db.users.find_one({'id': acc.get('user_id')}, {'_id': 0, 'email': 1, 'full_name': 1})
@@ -4619,9 +4441,12 @@ async def admin_purge(payload: dict, admin: dict = Depends(require_admin)):
     # Delete notification receipts and user-scoped notifications; keep global announcements/updates
     await db.notification_receipts.delete_many({})
     await db.notifications.delete_many({'user_id': {'$exists': True}})
+    await db.notification_inboxes.delete_many({})
 
-    # Delete promo redemptions (promo codes remain)
+    # Delete promo redemptions (promo codes remain, with their usage reset to match)
     await db.promo_redemptions.delete_many({})
+    await db.promo_codes.update_many({}, {'$set': {'used_count': 0}})
+    _invalidate_promo_cache()
 
     return {'success': True}
 
@@ -4631,7 +4456,7 @@ async def admin_list_deposits(admin: dict = Depends(require_admin)):
     """List all crypto deposits (Plisio) for admin view."""
     projection = {'_id': 0}
     deposits = (
-        await db.crypto_invoices
+        await analytics_db.crypto_invoices
         .find({}, projection)
         .sort('created_at', -1)
         .to_list(500)
@@ -4646,7 +4471,7 @@ async def admin_virtual_accounts(admin: dict = Depends(require_admin)):
     We derive these from user documents that have virtual_account_number set,
     since create_paymentpoint_virtual_account stores details on the user record.
     """
-    users = await db.users.find(
+    users = await analytics_db.users.find(
         {
             'virtual_account_number': {'$exists': True, '$ne': ''},
         },
@@ -4685,10 +4510,9 @@ async def admin_virtual_accounts(admin: dict = Depends(require_admin)):
 @api_router.get('/admin/transactions')
 async def admin_list_transactions(admin: dict = Depends(require_admin)):
     """List all user transactions for admin view."""
-    projection = {'_id': 0}
     txns = (
-        await db.transactions
-        .find({}, projection)
+        await analytics_db.transactions
+        .find({}, TRANSACTION_LIST_PROJECTION)
         .sort('created_at', -1)
         .to_list(500)
     )
@@ -4697,17 +4521,18 @@ async def admin_list_transactions(admin: dict = Depends(require_admin)):
 async def buy_airtime(request: BillPaymentRequest, user: dict = Depends(get_current_user)):
     """Purchase airtime via Payscribe"""
     try:
-        # Check balance
-        if user.get('ngn_balance', 0) < request.amount:
+        # Reserve the amount; released again if vending fails
+        if await wallet_service.debit(user['id'], request.amount, 'NGN') is None:
             raise HTTPException(status_code=400, detail="Insufficient NGN balance")
         
         # Call Payscribe airtime vending
-        result = await vend_airtime(request.provider, request.amount, request.recipient, request.metadata.get('ref') if request.metadata else None)
+        try:
+            result = await vend_airtime(request.provider, request.amount, request.recipient, request.metadata.get('ref') if request.metadata else None)
+        except Exception:
+            await wallet_service.credit(user['id'], request.amount, 'NGN')
+            raise
         
         if result and result.get('status'):
-            # Deduct from user balance
-            await db.users.update_one({'id': user['id']}, {'$inc': {'ngn_balance': -request.amount}})
-            
             # Create transaction record
             transaction = Transaction(
                 user_id=user['id'],
@@ -4731,6 +4556,7 @@ async def buy_airtime(request: BillPaymentRequest, user: dict = Depends(get_curr
             
             return {'success': True, 'message': 'Airtime purchase successful', 'details': result}
 
+        await wallet_service.credit(user['id'], request.amount, 'NGN')
         raise HTTPException(status_code=400, detail=result.get('description') if result else "Airtime purchase failed")
     except HTTPException:
         raise
@@ -4787,14 +4613,21 @@ async def get_stablecoin_wallets(user: dict = Depends(get_current_user)):
 async def buy_data(request: DataPurchaseRequest, user: dict = Depends(get_current_user)):
     """Purchase data bundle via Payscribe"""
     try:
-        # Validate user has sufficient balance (we'll get amount from plan lookup)
-        result = await purchase_data(request.plan_code, request.recipient, request.ref)
+        amount = await get_data_plan_price(request.network, request.plan_code)
+        if not amount or amount <= 0:
+            raise HTTPException(status_code=400, detail="Unknown data plan")
+        
+        # Reserve the plan price; released again if vending fails
+        if await wallet_service.debit(user['id'], amount, 'NGN') is None:
+            raise HTTPException(status_code=400, detail="Insufficient NGN balance")
+        
+        try:
+            result = await purchase_data(request.plan_code, request.recipient, request.ref)
+        except Exception:
+            await wallet_service.credit(user['id'], amount, 'NGN')
+            raise
         
         if result and result.get('status'):
-            # Deduct from user balance
-            amount = result.get('message', {}).get('details', {}).get('amount', 0)
-            await db.users.update_one({'id': user['id']}, {'$inc': {'ngn_balance': -amount}})
-            
             # Create transaction record
             transaction = Transaction(
                 user_id=user['id'],
@@ -4818,6 +4651,7 @@ async def buy_data(request: DataPurchaseRequest, user: dict = Depends(get_curren
             
             return {'success': True, 'message': 'Data purchase successful', 'details': result}
         
+        await wallet_service.credit(user['id'], amount, 'NGN')
         raise HTTPException(status_code=400, detail="Data purchase failed")
     except HTTPException:
         raise
@@ -4850,13 +4684,18 @@ async def fund_betting_wallet(request: BettingFundRequest, user: dict = Depends(
         if not validation or not validation.get('status'):
             raise HTTPException(status_code=400, detail="Invalid betting account")
 
+        # Reserve the amount; released again if funding fails
+        if await wallet_service.debit(user['id'], request.amount, 'NGN') is None:
+            raise HTTPException(status_code=400, detail="Insufficient NGN balance")
+
         # Fund wallet
-        result = await fund_bet_wallet(request.bet_id, request.customer_id, request.amount, request.ref)
+        try:
+            result = await fund_bet_wallet(request.bet_id, request.customer_id, request.amount, request.ref)
+        except Exception:
+            await wallet_service.credit(user['id'], request.amount, 'NGN')
+            raise
 
         if result and result.get('status'):
-            # Deduct from user balance
-            await db.users.update_one({'id': user['id']}, {'$inc': {'ngn_balance': -request.amount}})
-
             # Create transaction record
             transaction = Transaction(
                 user_id=user['id'],
@@ -4880,6 +4719,7 @@ async def fund_betting_wallet(request: BettingFundRequest, user: dict = Depends(
 
             return {'success': True, 'message': 'Betting wallet funded successfully', 'details': result}
 
+        await wallet_service.credit(user['id'], request.amount, 'NGN')
         raise HTTPException(status_code=400, detail="Betting wallet funding failed")
     except HTTPException:
         raise
@@ -4910,7 +4750,7 @@ async def admin_list_users(admin: dict = Depends(require_admin)):
 @api_router.get("/admin/users/{user_id}")
 async def admin_get_user(user_id: str, admin: dict = Depends(require_admin)):
     """Get single user details for admin."""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0, "applied_credits": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"success": True, "user": user}
@@ -4953,8 +4793,8 @@ async def admin_update_user(user_id: str, data: AdminUserUpdate, admin: dict = D
     
     await db.users.update_one({"id": user_id}, {"$set": update_fields})
     
-    # Create audit log
-    await db.admin_audit_logs.insert_one({
+    # Create audit log (batched, but persisted before we respond)
+    await outbox.put_durable('admin_audit_logs', {
         "id": str(uuid.uuid4()),
         "admin_id": admin['id'],
         "action": "update_user",
@@ -4963,7 +4803,7 @@ async def admin_update_user(user_id: str, data: AdminUserUpdate, admin: dict = D
         "created_at": datetime.now(timezone.utc).isoformat()
     })
     
-    updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0, "applied_credits": 0})
     return {"success": True, "user": updated_user}
 
 
@@ -5000,8 +4840,7 @@ async def admin_top_services(
     }
 
     # Aggregate transactions by service using metadata.service when available
-    pipeline = [
-        {"$match": {**match_stage, "type": "purchase", "status": "completed"}},
+    stages = [
         {
             "$group": {
                 "_id": {"service": "$metadata.service"},
@@ -5013,8 +4852,9 @@ async def admin_top_services(
         {"$limit": 20},
     ]
 
-    cursor = db.transactions.aggregate(pipeline)
-    rows = await cursor.to_list(20)
+    rows = await archive.aggregate(
+        analytics_db, 'transactions', {**match_stage, "type": "purchase", "status": "completed"}, stages, start, 20
+    )
 
     services = []
     for row in rows:
@@ -5299,6 +5139,8 @@ async def update_pricing_config(data: UpdatePricingRequest, admin: dict = Depend
     update_fields['updated_at'] = datetime.now(timezone.utc).isoformat()
     
     await db.pricing_config.update_one({}, {'$set': update_fields}, upsert=True)
+    # Provider keys are cached briefly per worker; this one picks up the change now
+    _provider_key_cache.clear()
     
     return {'success': True, 'updated': update_fields}
 
@@ -5310,9 +5152,9 @@ async def get_admin_stats(
 ):
     """Admin metrics dashboard stats for a selected period (default last 7 days)."""
     # Base user + order counts (all-time)
-    total_users = await db.users.count_documents({})
-    total_orders = await db.sms_orders.count_documents({})
-    active_orders = await db.sms_orders.count_documents({'status': 'active'})
+    total_users = await analytics_db.users.count_documents({})
+    total_orders = await archive.count(analytics_db, 'sms_orders', {}, None)
+    active_orders = await analytics_db.sms_orders.count_documents({'status': 'active'})
 
     # Resolve date range
     now = datetime.now(timezone.utc)
@@ -5345,22 +5187,18 @@ async def get_admin_stats(
     }
 
     # Total deposits (NGN + USD) in period
-    deposits_cursor = db.transactions.aggregate([
-        {
-            '$match': {
-                **period_match,
-                'type': {'$in': ['deposit_ngn', 'deposit_usd']},
-                'status': 'completed',
-            }
-        },
+    deposit_totals = await archive.aggregate(analytics_db, 'transactions', {
+        **period_match,
+        'type': {'$in': ['deposit_ngn', 'deposit_usd']},
+        'status': 'completed',
+    }, [
         {
             '$group': {
                 '_id': '$currency',
                 'total': {'$sum': '$amount'},
             }
         },
-    ])
-    deposit_totals = await deposits_cursor.to_list(10)
+    ], start, 10)
     total_deposits_ngn = 0.0
     total_deposits_usd_native = 0.0
     for row in deposit_totals:
@@ -5385,22 +5223,18 @@ async def get_admin_stats(
     total_deposits_usd = (total_deposits_ngn / ngn_rate) + total_deposits_usd_native
 
     # Total sales (OTP spend) in period - purchase transactions
-    sales_cursor = db.transactions.aggregate([
-        {
-            '$match': {
-                **period_match,
-                'type': 'purchase',
-                'status': 'completed',
-            }
-        },
+    sales_totals = await archive.aggregate(analytics_db, 'transactions', {
+        **period_match,
+        'type': 'purchase',
+        'status': 'completed',
+    }, [
         {
             '$group': {
                 '_id': '$currency',
                 'total': {'$sum': '$amount'},
             }
         },
-    ])
-    sales_totals = await sales_cursor.to_list(5)
+    ], start, 5)
     total_sales_usd = 0.0
     total_sales_ngn = 0.0
     for row in sales_totals:
@@ -5414,42 +5248,29 @@ async def get_admin_stats(
             total_sales_ngn += amt
 
     # API cost from sms_orders (cost_usd) in period
-    api_cost_cursor = db.sms_orders.aggregate([
-        {
-            '$match': {
-                'created_at': {
-                    '$gte': start.isoformat(),
-                    '$lte': end.isoformat(),
-                }
-            }
-        },
+    api_cost_rows = await archive.aggregate(analytics_db, 'sms_orders', period_match, [
         {
             '$group': {
                 '_id': None,
                 'total_cost_usd': {'$sum': {'$ifNull': ['$cost_usd', 0]}},
             }
         },
-    ])
-    api_cost_rows = await api_cost_cursor.to_list(1)
+    ], start, 1)
     api_cost_usd = float(api_cost_rows[0].get('total_cost_usd', 0) or 0) if api_cost_rows else 0.0
 
     # Calculate total refunds from refund transactions
-    refund_cursor = db.transactions.aggregate([
-        {
-            '$match': {
-                **period_match,
-                'type': 'refund',
-                'status': 'completed',
-            }
-        },
+    refund_totals = await archive.aggregate(analytics_db, 'transactions', {
+        **period_match,
+        'type': 'refund',
+        'status': 'completed',
+    }, [
         {
             '$group': {
                 '_id': '$currency',
                 'total': {'$sum': '$amount'},
             }
         },
-    ])
-    refund_totals = await refund_cursor.to_list(5)
+    ], start, 5)
     total_refunds_ngn = 0.0
     total_refunds_usd = 0.0
     for row in refund_totals:
@@ -5463,15 +5284,15 @@ async def get_admin_stats(
             total_refunds_ngn += amt
 
     # Count cancelled/refunded orders
-    cancelled_orders = await db.sms_orders.count_documents({
+    cancelled_orders = await archive.count(analytics_db, 'sms_orders', {
         'created_at': {'$gte': start.isoformat(), '$lte': end.isoformat()},
         'status': {'$in': ['cancelled', 'refunded']}
-    })
+    }, start)
 
     # ================= Additional metrics for ads, users & risk =================
 
     # Fetch new and old users for the period
-    new_users_cursor = db.users.find(
+    new_users_cursor = analytics_db.users.find(
         {
             'created_at': {
                 '$gte': start.isoformat(),
@@ -5484,7 +5305,7 @@ async def get_admin_stats(
     new_user_ids = {u['id'] for u in new_users if u.get('id')}
     new_users_count = len(new_user_ids)
 
-    old_users_cursor = db.users.find(
+    old_users_cursor = analytics_db.users.find(
         {
             'created_at': {'$lt': start.isoformat()}
         },
@@ -5494,75 +5315,30 @@ async def get_admin_stats(
     old_user_ids = {u['id'] for u in old_users if u.get('id')}
 
     # All deposit transactions in period
-    deposit_txs_cursor = db.transactions.find(
-        {
-            **period_match,
-            'type': {'$in': ['deposit_ngn', 'deposit_usd']},
-            'status': 'completed',
-        },
-        {'_id': 0, 'user_id': 1, 'currency': 1, 'amount': 1},
-    )
-    deposit_txs = await deposit_txs_cursor.to_list(20000)
-
-    depositors_all: set[str] = set()
-    new_depositors: set[str] = set()
-    old_depositors: set[str] = set()
-    new_deposits_ngn = 0.0
-    old_deposits_ngn = 0.0
-
-    for tx in deposit_txs:
-        uid = tx.get('user_id')
-        if not uid:
-            continue
-        depositors_all.add(uid)
-        amt = float(tx.get('amount', 0) or 0)
-        cur = tx.get('currency')
-        amt_ngn = amt * ngn_rate if cur == 'USD' else amt
-        if uid in new_user_ids:
-            new_depositors.add(uid)
-            new_deposits_ngn += amt_ngn
-        elif uid in old_user_ids:
-            old_depositors.add(uid)
-            old_deposits_ngn += amt_ngn
-
-    new_depositors_count = len(new_depositors)
-    old_depositors_count = len(old_depositors)
+    deposit_txs = await archive.aggregate(analytics_db, 'transactions', {
+        **period_match,
+        'type': {'$in': ['deposit_ngn', 'deposit_usd']},
+        'status': 'completed',
+    }, [{'$project': {'_id': 0, 'user_id': 1, 'currency': 1, 'amount': 1}}, {'$limit': 20000}], start, 20000)
 
     # All purchase transactions in period
-    purchase_txs_cursor = db.transactions.find(
-        {
-            **period_match,
-            'type': 'purchase',
-            'status': 'completed',
-        },
-        {'_id': 0, 'user_id': 1, 'currency': 1, 'amount': 1, 'metadata': 1},
-    )
-    purchase_txs = await purchase_txs_cursor.to_list(20000)
-
-    buyers_all: set[str] = set()
-    whatsapp_sales_ngn = 0.0
-    signal_sales_ngn = 0.0
-    total_sales_ngn_from_txs = 0.0
-
-    WHATSAPP_CODES = {'wa', 'whatsapp'}
-    SIGNAL_CODES = {'signal', 'sg', 'si'}
-
-    for tx in purchase_txs:
-        uid = tx.get('user_id')
-        if not uid:
-            continue
-        buyers_all.add(uid)
-        amt = float(tx.get('amount', 0) or 0)
-        cur = tx.get('currency')
-        amt_ngn = amt * ngn_rate if cur == 'USD' else amt
-        total_sales_ngn_from_txs += amt_ngn
-        meta = tx.get('metadata') or {}
-        service_code = str(meta.get('service', '')).lower()
-        if service_code in WHATSAPP_CODES:
-            whatsapp_sales_ngn += amt_ngn
-        if service_code in SIGNAL_CODES:
-            signal_sales_ngn += amt_ngn
-
+    purchase_txs = await archive.aggregate(analytics_db, 'transactions', {
+        **period_match,
+        'type': 'purchase',
+        'status': 'completed',
+    }, [{'$project': {'_id': 0, 'user_id': 1, 'currency': 1, 'amount': 1, 'metadata': 1}}, {'$limit': 20000}], start, 20000)
+
+    period = period_user_metrics(deposit_txs, purchase_txs, new_user_ids, old_user_ids, ngn_rate)
+    depositors_all = period['depositors_all']
+    buyers_all = period['buyers_all']
+    new_deposits_ngn = period['new_deposits_ngn']
+    old_deposits_ngn = period['old_deposits_ngn']
+    whatsapp_sales_ngn = period['whatsapp_sales_ngn']
+    signal_sales_ngn = period['signal_sales_ngn']
+    total_sales_ngn_from_txs = period['total_sales_ngn']
+
+    new_depositors_count = len(period['new_depositors'])
+    old_depositors_count = len(period['old_depositors'])
     period_depositors_count = len(depositors_all)
     period_buyers_count = len(buyers_all)
 
@@ -5580,28 +5356,15 @@ async def get_admin_stats(
     )
 
     # New vs old buyers in this period
-    new_buyers_ids = buyers_all & new_user_ids
-    old_buyers_ids = buyers_all & old_user_ids
-    new_buyers_count = len(new_buyers_ids)
-    old_buyers_count = len(old_buyers_ids)
+    new_buyers_count = len(period['new_buyers'])
+    old_buyers_count = len(period['old_buyers'])
     repeat_buyer_rate = (
         (old_buyers_count / period_buyers_count) * 100.0 if period_buyers_count > 0 else 0.0
     )
 
     # Old users buying without depositing in this period
-    old_buyers_without_deposit = old_buyers_ids - depositors_all
-    old_buyers_without_deposit_count = len(old_buyers_without_deposit)
-    old_buyers_without_deposit_sales_ngn = 0.0
-    if old_buyers_without_deposit_count:
-        old_set = set(old_buyers_without_deposit)
-        for tx in purchase_txs:
-            uid = tx.get('user_id')
-            if uid not in old_set:
-                continue
-            amt = float(tx.get('amount', 0) or 0)
-            cur = tx.get('currency')
-            amt_ngn = amt * ngn_rate if cur == 'USD' else amt
-            old_buyers_without_deposit_sales_ngn += amt_ngn
+    old_buyers_without_deposit_count = len(period['old_buyers_without_deposit'])
+    old_buyers_without_deposit_sales_ngn = period['old_buyers_without_deposit_sales_ngn']
 
     # Service risk metrics
     total_sales_ngn_effective = total_sales_ngn_from_txs or total_sales_ngn
@@ -5613,20 +5376,15 @@ async def get_admin_stats(
     )
 
     # Average selling price per OTP
-    otp_count_period = await db.sms_orders.count_documents(
-        {
-            'created_at': {
-                '$gte': start.isoformat(),
-                '$lte': end.isoformat(),
-            }
-        }
-    )
+    otp_count_period = await archive.count(analytics_db, 'sms_orders', period_match, start)
     avg_selling_price_ngn = (
         total_sales_ngn_effective / otp_count_period if otp_count_period > 0 else 0.0
     )
 
     # Price spike exposure: orders where provider cost > sell price
-    price_spike_exposure_count = await db.sms_orders.count_documents(
+    price_spike_exposure_count = await archive.count(
+        analytics_db,
+        'sms_orders',
         {
             'created_at': {
                 '$gte': start.isoformat(),
@@ -5634,11 +5392,12 @@ async def get_admin_stats(
             },
             'provider_cost': {'$gt': 0},
             '$expr': {'$gt': ['$provider_cost', '$cost_usd']},
-        }
+        },
+        start,
     )
 
     # Active unfulfilled numbers value
-    active_unfulfilled_cursor = db.sms_orders.aggregate([
+    active_unfulfilled_cursor = analytics_db.sms_orders.aggregate([
         {
             '$match': {
                 'status': 'active',
@@ -5661,7 +5420,7 @@ async def get_admin_stats(
         active_unfulfilled_value_ngn = total_cost_unfulfilled_usd * ngn_rate
 
     # Available liquidity: total NGN wallet balance - unfulfilled exposure
-    wallet_cursor = db.users.aggregate([
+    wallet_cursor = analytics_db.users.aggregate([
         {
             '$group': {
                 '_id': None,
@@ -5681,10 +5440,9 @@ async def get_admin_stats(
     # (see block above for calculations)
 
     # All-time revenue (for backward compatibility)
-    revenue_result = await db.transactions.aggregate([
-        {'$match': {'type': 'purchase', 'status': 'completed'}},
+    revenue_result = await archive.aggregate(analytics_db, 'transactions', {'type': 'purchase', 'status': 'completed'}, [
         {'$group': {'_id': None, 'total': {'$sum': '$amount'}}},
-    ]).to_list(1)
+    ], None, 1)
     total_revenue = revenue_result[0]['total'] if revenue_result else 0
 
     return {
@@ -5742,52 +5500,68 @@ async def get_admin_stats(
 
 @api_router.post("/webhooks/paymentpoint")
 async def paymentpoint_webhook(request: Request, paymentpoint_signature: Optional[str] = Header(None)):
+    body = await request.body()
+    calculated_signature = hmac.new(
+        PAYMENTPOINT_SECRET.encode('utf-8'),
+        body,
+        hashlib.sha256
+    ).hexdigest()
+    
+    if paymentpoint_signature and not hmac.compare_digest(calculated_signature, paymentpoint_signature):
+        logger.warning("Invalid PaymentPoint webhook signature")
+        return {'status': 'error', 'message': 'Invalid signature'}
+    
     try:
-        body = await request.body()
-        calculated_signature = hmac.new(
-            PAYMENTPOINT_SECRET.encode('utf-8'),
-            body,
-            hashlib.sha256
-        ).hexdigest()
-        
-        if paymentpoint_signature and calculated_signature != paymentpoint_signature:
-            logger.warning("Invalid PaymentPoint webhook signature")
-            return {'status': 'error', 'message': 'Invalid signature'}
-        
-        import json
         data = json.loads(body)
-        
-        if data.get('notification_status') == 'payment_successful':
-            amount = data.get('settlement_amount', 0)
-            customer_email = data.get('customer', {}).get('email')
-            
-            if customer_email and amount > 0:
-                user = await db.users.find_one({'email': customer_email}, {'_id': 0})
-                if user:
-                    await db.users.update_one(
-                        {'id': user['id']},
-                        {'$inc': {'ngn_balance': amount}}
-                    )
-                    
-                    transaction = Transaction(
-                        user_id=user['id'],
-                        type='deposit_ngn',
-                        amount=amount,
-                        currency='NGN',
-                        status='completed',
-                        reference=data.get('transaction_id'),
-                        metadata=data
-                    )
-                    trans_dict = transaction.model_dump()
-                    trans_dict['created_at'] = trans_dict['created_at'].isoformat()
-                    await db.transactions.insert_one(trans_dict)
-                    
-                    logger.info(f"Credited {amount} NGN to user {user['id']}")
-        
-        return {'status': 'success'}
-    except Exception as e:
-        logger.error(f"PaymentPoint webhook error: {str(e)}")
-        return {'status': 'error', 'message': str(e)}
+    except Exception:
+        return {'status': 'error', 'message': 'Invalid JSON'}
+    if not isinstance(data, dict):
+        return {'status': 'error', 'message': 'Invalid JSON'}
+    
+    event_id = f"{data.get('transaction_id')}:{data.get('notification_status')}" if data.get('transaction_id') \
+        else hashlib.sha256(body).hexdigest()
+    await webhook_inbox.ingest('paymentpoint', event_id, data)
+    return {'status': 'success'}
+
+
+async def _process_paymentpoint_event(data: dict) -> str:
+    if data.get('notification_status') != 'payment_successful':
+        return f"ignored: {data.get('notification_status')}"
+    
+    amount = data.get('settlement_amount', 0)
+    customer_email = (data.get('customer') or {}).get('email')
+    transaction_id = data.get('transaction_id')
+    if not customer_email or not amount or amount <= 0:
+        return 'ignored: missing customer or amount'
+    if not transaction_id:
+        logger.error(f"PaymentPoint webhook without transaction_id for {customer_email}; not credited")
+        return 'error: missing transaction_id'
+    
+    user = await db.users.find_one({'email': customer_email}, {'_id': 0, 'id': 1})
+    if not user:
+        return 'ignored: user not found'
+    
+    credited = await _apply_deposit(
+        f"paymentpoint:{transaction_id}",
+        Transaction(
+            user_id=user['id'],
+            type='deposit_ngn',
+            amount=amount,
+            currency='NGN',
+            status='completed',
+            reference=transaction_id,
+            metadata={
+                'provider': 'paymentpoint',
+                'customer_email': customer_email,
+                'settlement_amount': amount,
+                'payload_id': payload_store.put('paymentpoint_webhook', data, transaction_id),
+            }
+        ),
+    )
+    if credited:
+        logger.info(f"Credited {amount} NGN to user {user['id']}")
+    return 'credited' if credited else 'already credited'
+
 
 
 # ============ RESELLER API ENDPOINTS ============
@@ -5814,28 +5588,11 @@ async def verify_reseller_api_key(request: Request) -> dict:
     if not reseller:
         raise HTTPException(status_code=401, detail="Invalid or inactive API key")
     
+    timing = request_timing.current()
+    if timing is not None:
+        timing.principal = f"reseller:{reseller.get('id')}"
     return reseller
 
-def calculate_reseller_price(base_price_ngn: float, markup_percent: float, reseller: dict, pricing_config: dict) -> float:
-    """Calculate the price for a reseller based on their plan"""
-    # Get the reseller's markup multiplier
-    multiplier = reseller.get('custom_markup_multiplier')
-    if multiplier is None:
-        # Use plan multiplier
-        plan_multipliers = {
-            'Free': 1.0,      # Same as normal users (100% markup)
-            'Basic': 0.5,     # 50% of normal markup
-            'Pro': 0.3,       # 30% of normal markup
-            'Enterprise': 0.2 # 20% of normal markup (custom)
-        }
-        multiplier = plan_multipliers.get(reseller.get('plan_name', 'Free'), 1.0)
-    
-    # Calculate: base_price + (markup * multiplier)
-    markup_amount = base_price_ngn * (markup_percent / 100)
-    reseller_markup = markup_amount * multiplier
-    return base_price_ngn + reseller_markup
-
-
 # Reseller API v1 endpoints
 @api_router.get("/reseller/v1/balance")
 async def reseller_get_balance(request: Request):
@@ -5890,45 +5647,27 @@ async def reseller_get_countries(request: Request, server: str):
         # DaisySMS is US only
         countries = [{'code': '187', 'name': 'United States', 'flag': '🇺🇸'}]
     elif server == 'all_country_1':
-        # SMS-pool countries - use environment variable
-        smspool_key = SMSPOOL_API_KEY
-        if smspool_key:
-            try:
-                resp = requests.get(
-                    'https://api.smspool.net/country/retrieve_all',
-                    headers={'Authorization': f'Bearer {smspool_key}'},
-                    timeout=15
-                )
-                if resp.ok:
-                    data = resp.json()
-                    for c in data:
-                        countries.append({
-                            'code': str(c.get('ID') or c.get('short_name', '')),
-                            'name': c.get('name', ''),
-                            'flag': ''
-                        })
-            except Exception as e:
-                logger.error(f"SMS-pool countries error: {e}")
+        # SMS-pool countries
+        try:
+            for c in await get_provider('smspool').countries():
+                countries.append({
+                    'code': str(c.get('ID') or c.get('short_name', '')),
+                    'name': c.get('name', ''),
+                    'flag': ''
+                })
+        except Exception as e:
+            logger.error(f"SMS-pool countries error: {e}")
     elif server == 'all_country_2':
-        # 5sim countries - use environment variable
-        fivesim_key = FIVESIM_API_KEY
-        if fivesim_key:
-            try:
-                resp = requests.get(
-                    'https://5sim.net/v1/guest/countries',
-                    headers={'Authorization': f'Bearer {fivesim_key}'},
-                    timeout=15
-                )
-                if resp.ok:
-                    data = resp.json()
-                    for code, info in data.items():
-                        countries.append({
-                            'code': code,
-                            'name': info.get('text_en', code),
-                            'flag': ''
-                        })
-            except Exception as e:
-                logger.error(f"5sim countries error: {e}")
+        # 5sim countries
+        try:
+            for code, info in (await get_provider('5sim').countries()).items():
+                countries.append({
+                    'code': code,
+                    'name': info.get('text_en', code),
+                    'flag': ''
+                })
+        except Exception as e:
+            logger.error(f"5sim countries error: {e}")
     
     return {
         'success': True,
@@ -5952,111 +5691,38 @@ async def reseller_get_services(request: Request, server: str, country: Optional
     ngn_rate = pricing.get('ngn_to_usd_rate', 1500)
     
     if server == 'usa':
-        # DaisySMS - use environment variable
-        daisy_key = DAISYSMS_API_KEY
+        # DaisySMS
         markup = pricing.get('daisysms_markup', 20)
-        if daisy_key:
-            try:
-                resp = requests.get(
-                    f'https://daisysms.com/stubs/handler_api.php?api_key={daisy_key}&action=getPricesVerification&country=187',
-                    timeout=15
-                )
-                if resp.ok:
-                    data = resp.json()
-                    # DaisySMS format: {"service_code": {"187": {...}}, ...}
-                    for service_code, country_data in data.items():
-                        if isinstance(country_data, dict) and '187' in country_data:
-                            info = country_data['187']
-                            base_usd = float(info.get('cost', 0))
-                            base_ngn = base_usd * ngn_rate
-                            reseller_price = calculate_reseller_price(base_ngn, markup, reseller, pricing)
-                            services.append({
-                                'code': service_code,
-                                'name': info.get('name', service_code),
-                                'price_ngn': round(reseller_price, 2),
-                                'price_usd': round(reseller_price / ngn_rate, 4),
-                                'available': True
-                            })
-            except Exception as e:
-                logger.error(f"DaisySMS services error: {e}")
+        try:
+            prices_data = await get_provider('daisysms').raw_prices()
+            services = reseller_daisysms_services(prices_data, markup, ngn_rate, reseller)
+        except Exception as e:
+            logger.error(f"DaisySMS services error: {e}")
                 
     elif server == 'all_country_1':
-        # SMS-pool - use environment variable
+        # SMS-pool
         if not country:
             raise HTTPException(status_code=400, detail="Country required for this server")
-        smspool_key = SMSPOOL_API_KEY
         markup = pricing.get('smspool_markup', 20)
-        if smspool_key:
-            try:
-                # Fetch pricing data
-                pricing_resp = requests.post(
-                    'https://api.smspool.net/request/pricing',
-                    data={'country': country},
-                    headers={'Authorization': f'Bearer {smspool_key}'},
-                    timeout=15
-                )
-                
-                pricing_list = pricing_resp.json() if pricing_resp.ok else []
-                
-                # Aggregate prices by service (take lowest price per service)
-                service_prices = {}
-                for item in pricing_list:
-                    service_id = str(item.get('service', ''))
-                    service_name = item.get('service_name', f'Service {service_id}')
-                    price = float(item.get('price', 0) or 0)
-                    
-                    if service_id and price > 0:
-                        if service_id not in service_prices or price < service_prices[service_id]['price']:
-                            service_prices[service_id] = {
-                                'name': service_name,
-                                'price': price
-                            }
-                
-                # Convert to services list
-                for service_id, info in service_prices.items():
-                    base_usd = info['price']
-                    base_ngn = base_usd * ngn_rate
-                    reseller_price = calculate_reseller_price(base_ngn, markup, reseller, pricing)
-                    services.append({
-                        'code': service_id,
-                        'name': info['name'],
-                        'price_ngn': round(reseller_price, 2),
-                        'price_usd': round(reseller_price / ngn_rate, 4),
-                        'available': True,
-                    })
-            except Exception as e:
-                logger.error(f"SMS-pool services error: {e}")
+        try:
+            pricing_list = await get_provider('smspool').raw_prices(country)
+
+            # Lowest price per service
+            services = reseller_smspool_services(pricing_list, markup, ngn_rate, reseller)
+        except Exception as e:
+            logger.error(f"SMS-pool services error: {e}")
                 
     elif server == 'all_country_2':
-        # 5sim - use environment variable
+        # 5sim
         # NOTE: 5sim API returns prices directly in USD (not coins)
         if not country:
             raise HTTPException(status_code=400, detail="Country required for this server")
-        fivesim_key = FIVESIM_API_KEY
         markup = pricing.get('fivesim_markup', 50)  # Use fivesim_markup
-        if fivesim_key:
-            try:
-                resp = requests.get(
-                    f'https://5sim.net/v1/guest/products/{country}/any',
-                    headers={'Authorization': f'Bearer {fivesim_key}'},
-                    timeout=15
-                )
-                if resp.ok:
-                    data = resp.json()
-                    for service_code, info in data.items():
-                        # Price is already in USD
-                        base_usd = float(info.get('Price', 0))
-                        base_ngn = base_usd * ngn_rate
-                        reseller_price = calculate_reseller_price(base_ngn, markup, reseller, pricing)
-                        services.append({
-                            'code': service_code,
-                            'name': service_code.replace('_', ' ').title(),
-                            'price_ngn': round(reseller_price, 2),
-                            'price_usd': round(reseller_price / ngn_rate, 4),
-                            'available': True
-                        })
-            except Exception as e:
-                logger.error(f"5sim services error: {e}")
+        try:
+            products = await get_provider('5sim').products(country)
+            services = reseller_5sim_services(products, markup, ngn_rate, reseller)
+        except Exception as e:
+            logger.error(f"5sim services error: {e}")
     
     return {
         'success': True,
@@ -6067,6 +5733,7 @@ async def reseller_get_services(request: Request, server: str, country: Optional
 
 
 @api_router.post("/reseller/v1/buy")
+@in_flight(metrics.PURCHASES_IN_FLIGHT)
 async def reseller_buy_number(request: Request):
     """Purchase a number through reseller API"""
     reseller = await verify_reseller_api_key(request)
@@ -6095,97 +5762,39 @@ async def reseller_buy_number(request: Request):
     pricing = await db.pricing_config.find_one({}, {'_id': 0}) or {}
     ngn_rate = pricing.get('ngn_to_usd_rate', 1500)
     
-    # Get user balance
-    user = await db.users.find_one({'id': reseller['user_id']}, {'_id': 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_balance = user.get('ngn_balance', 0)
-    
     # Calculate reseller price based on their plan
     if price:
         reseller_price = float(price)
     else:
         raise HTTPException(status_code=400, detail="price is required")
     
-    if user_balance < reseller_price:
+    # Reserve the funds up front; they are released again if the provider purchase fails
+    if await wallet_service.debit(reseller['user_id'], reseller_price, 'NGN') is None:
+        user = await db.users.find_one({'id': reseller['user_id']}, {'_id': 0, 'ngn_balance': 1})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_balance = user.get('ngn_balance', 0)
         raise HTTPException(status_code=400, detail=f"Insufficient balance. Required: ₦{reseller_price:.2f}, Available: ₦{user_balance:.2f}")
     
     # Execute purchase with provider
-    provider_order_id = None
-    phone_number = None
-    provider_cost = 0
-    
     try:
-        if provider == 'daisysms':
-            daisy_key = DAISYSMS_API_KEY
-            if not daisy_key:
-                raise HTTPException(status_code=500, detail="Server not configured")
-            
-            params = {
-                'api_key': daisy_key,
-                'action': 'getNumber',
-                'service': service,
-                'country': '187'
-            }
-            resp = requests.get('https://daisysms.com/stubs/handler_api.php', params=params, timeout=30)
-            
-            if resp.ok and resp.text.startswith('ACCESS_NUMBER'):
-                parts = resp.text.split(':')
-                provider_order_id = parts[1]
-                phone_number = parts[2]
-            else:
-                raise HTTPException(status_code=400, detail=f"Failed to purchase number")
-                
-        elif provider == 'smspool':
-            smspool_key = SMSPOOL_API_KEY
-            if not smspool_key:
-                raise HTTPException(status_code=500, detail="Server not configured")
-            
-            resp = requests.post(
-                'https://api.smspool.net/purchase/sms',
-                headers={'Authorization': f'Bearer {smspool_key}'},
-                data={'country': country, 'service': service},
-                timeout=30
-            )
-            if resp.ok:
-                data = resp.json()
-                if data.get('success') == 1:
-                    provider_order_id = str(data.get('order_id'))
-                    phone_number = data.get('phonenumber') or data.get('number')
-                else:
-                    raise HTTPException(status_code=400, detail=data.get('message', 'Purchase failed'))
-            else:
-                raise HTTPException(status_code=400, detail="Failed to purchase number")
-                
-        elif provider == '5sim':
-            fivesim_key = FIVESIM_API_KEY
-            if not fivesim_key:
-                raise HTTPException(status_code=500, detail="Server not configured")
-            
-            resp = requests.get(
-                f'https://5sim.net/v1/user/buy/activation/{country}/any/{service}',
-                headers={'Authorization': f'Bearer {fivesim_key}'},
-                timeout=30
-            )
-            if resp.ok:
-                data = resp.json()
-                provider_order_id = str(data.get('id'))
-                phone_number = data.get('phone')
-            else:
-                raise HTTPException(status_code=400, detail="Failed to purchase number")
-    except HTTPException:
-        raise
+        purchase = await get_provider(provider).buy(service, country or '187')
+        provider_order_id = purchase.activation_id
+        phone_number = purchase.phone_number
+        provider_cost = purchase.price_usd or 0
+    except ProviderError as e:
+        await wallet_service.credit(reseller['user_id'], reseller_price, 'NGN')
+        logger.error(f"Reseller {provider} purchase failed ({e.code}): {e.message}")
+        if e.code == 'not_configured':
+            raise HTTPException(status_code=500, detail="Server not configured")
+        raise HTTPException(status_code=400, detail=PURCHASE_ERROR_MESSAGES.get(e.code, "Failed to purchase number"))
     except Exception as e:
+        await wallet_service.credit(reseller['user_id'], reseller_price, 'NGN')
+        if isinstance(e, HTTPException):
+            raise
         logger.error(f"Reseller buy error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
-    # Deduct balance
-    await db.users.update_one(
-        {'id': reseller['user_id']},
-        {'$inc': {'ngn_balance': -reseller_price}}
-    )
-    
     # Create reseller order record
     order = ResellerOrder(
         reseller_id=reseller['id'],
@@ -6200,7 +5809,8 @@ async def reseller_buy_number(request: Request):
         status='active',
         cost_ngn=reseller_price,
         reseller_price_ngn=reseller_price,
-        provider_cost=provider_cost
+        provider_cost=provider_cost,
+        expires_at=datetime.now(timezone.utc) + timedelta(minutes=ORDER_LIFETIME_MINUTES),
     )
     order_dict = order.model_dump()
     order_dict['created_at'] = order_dict['created_at'].isoformat()
@@ -6227,88 +5837,138 @@ async def reseller_buy_number(request: Request):
     }
 
 
-@api_router.get("/reseller/v1/status")
-async def reseller_get_status(request: Request, provider_order_id: str):
-    """Check order status and get OTP if received"""
-    reseller = await verify_reseller_api_key(request)
-    
-    # Find the order
-    order = await db.reseller_orders.find_one({
-        'reseller_id': reseller['id'],
-        'provider_order_id': provider_order_id
-    }, {'_id': 0})
-    
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    pricing = await db.pricing_config.find_one({}, {'_id': 0}) or {}
-    provider = order.get('provider')
-    otp = order.get('otp')
-    sms_text = order.get('sms_text')
-    status = order.get('status')
+RESELLER_BATCH_STATUS_MAX = 500
+RESELLER_BATCH_MAX_WAIT = 30
+RESELLER_BATCH_POLL_INTERVAL = 3
+
+
+async def _check_reseller_orders_upstream(provider: str, provider_order_ids: List[str]) -> Dict[str, dict]:
+    """Check one provider for OTPs on a group of orders. Returns {provider_order_id: {'otp', 'sms_text'}}"""
+    if breakers.is_open(provider, 'getStatus'):
+        return {}
+    try:
+        statuses = await get_provider(provider).status_many(provider_order_ids)
+    except Exception as e:
+        logger.error(f"{provider} batch status error: {e}")
+        return {}
+    return {
+        provider_order_id: {'otp': status.code, 'sms_text': status.text}
+        for provider_order_id, status in statuses.items()
+        if status.code
+    }
+
+
+async def _refresh_reseller_orders(orders: List[dict]) -> List[dict]:
+    """Fetch OTPs for active orders, grouped per provider, and persist any that completed"""
+    pending: Dict[str, List[str]] = {}
+    for order in orders:
+        if order.get('status') == 'active' and not order.get('otp') and order.get('provider_order_id'):
+            pending.setdefault(order.get('provider'), []).append(order['provider_order_id'])
+
+    if not pending:
+        return orders
+
+    providers = list(pending.keys())
+    results = await asyncio.gather(*(_check_reseller_orders_upstream(p, pending[p]) for p in providers))
+    found_by_provider = dict(zip(providers, results))
+
+    updates = []
+    for order in orders:
+        found = found_by_provider.get(order.get('provider'), {}).get(order.get('provider_order_id'))
+        if not found or not found.get('otp') or order.get('otp'):
+            continue
+        order.update({'otp': found['otp'], 'sms_text': found.get('sms_text'), 'status': 'completed'})
+        updates.append(UpdateOne(
+            {'id': order['id'], 'status': 'active'},
+            {'$set': {'otp': order['otp'], 'sms_text': order['sms_text'], 'status': 'completed'}}
+        ))
+
+    if updates:
+        await db.reseller_orders.bulk_write(updates, ordered=False)
+    return orders
+
+
+def _reseller_status_payload(order: dict) -> dict:
+    return {
+        'order_id': order.get('id'),
+        'provider_order_id': order.get('provider_order_id'),
+        'phone_number': order.get('phone_number'),
+        'status': order.get('status'),
+        'otp': order.get('otp'),
+        'sms_text': order.get('sms_text')
+    }
+
+
+@api_router.get("/reseller/v1/status")
+async def reseller_get_status(request: Request, provider_order_id: str):
+    """Check order status and get OTP if received"""
+    reseller = await verify_reseller_api_key(request)
     
-    # Check provider for OTP if not already received
-    if not otp and status == 'active':
-        try:
-            if provider == 'daisysms':
-                daisy_key = DAISYSMS_API_KEY
-                resp = requests.get(
-                    f'https://daisysms.com/stubs/handler_api.php?api_key={daisy_key}&action=getStatus&id={provider_order_id}',
-                    timeout=15
-                )
-                if resp.ok:
-                    text = resp.text
-                    if text.startswith('STATUS_OK:'):
-                        otp = text.split(':')[1]
-                        status = 'completed'
-                        
-            elif provider == 'smspool':
-                smspool_key = SMSPOOL_API_KEY
-                resp = requests.post(
-                    'https://api.smspool.net/sms/check',
-                    headers={'Authorization': f'Bearer {smspool_key}'},
-                    data={'orderid': provider_order_id},
-                    timeout=15
-                )
-                if resp.ok:
-                    data = resp.json()
-                    if data.get('sms'):
-                        otp = data.get('sms')
-                        sms_text = data.get('full_sms')
-                        status = 'completed'
-                        
-            elif provider == '5sim':
-                fivesim_key = FIVESIM_API_KEY
-                resp = requests.get(
-                    f'https://5sim.net/v1/user/check/{provider_order_id}',
-                    headers={'Authorization': f'Bearer {fivesim_key}'},
-                    timeout=15
-                )
-                if resp.ok:
-                    data = resp.json()
-                    sms_list = data.get('sms', [])
-                    if sms_list:
-                        otp = sms_list[0].get('code')
-                        sms_text = sms_list[0].get('text')
-                        status = 'completed'
-            
-            # Update order if OTP received
-            if otp:
-                await db.reseller_orders.update_one(
-                    {'id': order['id']},
-                    {'$set': {'otp': otp, 'sms_text': sms_text, 'status': status}}
-                )
-        except Exception as e:
-            logger.error(f"Status check error: {e}")
+    # Find the order
+    order = await db.reseller_orders.find_one({
+        'reseller_id': reseller['id'],
+        'provider_order_id': provider_order_id
+    }, {'_id': 0})
+    
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    await _refresh_reseller_orders([order])
+    
+    return {'success': True, **_reseller_status_payload(order)}
+
+
+@api_router.post("/reseller/v1/status/batch")
+async def reseller_get_status_batch(request: Request):
+    """Check status of many orders at once.
+
+    Body: {"provider_order_ids": [...], "wait": seconds}. With `wait` > 0 the call
+    long-polls and returns as soon as any of the listed orders changes.
+    """
+    reseller = await verify_reseller_api_key(request)
+    
+    try:
+        body = await request.json()
+    except:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
     
+    provider_order_ids = body.get('provider_order_ids')
+    if not isinstance(provider_order_ids, list) or not provider_order_ids:
+        raise HTTPException(status_code=400, detail="provider_order_ids must be a non-empty list")
+    
+    provider_order_ids = list(dict.fromkeys(str(pid) for pid in provider_order_ids))
+    if len(provider_order_ids) > RESELLER_BATCH_STATUS_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {RESELLER_BATCH_STATUS_MAX} orders per request")
+    
+    try:
+        wait = min(max(float(body.get('wait') or 0), 0), RESELLER_BATCH_MAX_WAIT)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="wait must be a number of seconds")
+    
+    query = {'reseller_id': reseller['id'], 'provider_order_id': {'$in': provider_order_ids}}
+    projection = {'_id': 0, 'id': 1, 'provider': 1, 'provider_order_id': 1, 'phone_number': 1,
+                  'status': 1, 'otp': 1, 'sms_text': 1}
+    
+    orders = await db.reseller_orders.find(query, projection).to_list(RESELLER_BATCH_STATUS_MAX)
+    initial = {o['provider_order_id']: (o.get('status'), o.get('otp')) for o in orders}
+    
+    deadline = asyncio.get_event_loop().time() + wait
+    while True:
+        await _refresh_reseller_orders(orders)
+        changed = any(initial.get(o['provider_order_id']) != (o.get('status'), o.get('otp')) for o in orders)
+        remaining = deadline - asyncio.get_event_loop().time()
+        if changed or remaining <= 0 or not any(o.get('status') == 'active' for o in orders):
+            break
+        await asyncio.sleep(min(RESELLER_BATCH_POLL_INTERVAL, remaining))
+        # Re-read so changes made elsewhere (e.g. cancellations) are picked up too
+        orders = await db.reseller_orders.find(query, projection).to_list(RESELLER_BATCH_STATUS_MAX)
+    
+    found_ids = {o['provider_order_id'] for o in orders}
     return {
         'success': True,
-        'order_id': order.get('id'),
-        'provider_order_id': provider_order_id,
-        'phone_number': order.get('phone_number'),
-        'status': status,
-        'otp': otp,
-        'sms_text': sms_text
+        'changed': changed,
+        'orders': [_reseller_status_payload(o) for o in orders],
+        'not_found': [pid for pid in provider_order_ids if pid not in found_ids]
     }
 
 
@@ -6341,64 +6001,36 @@ async def reseller_cancel_order(request: Request):
     if order.get('otp'):
         raise HTTPException(status_code=400, detail="Cannot cancel order with received OTP")
     
-    pricing = await db.pricing_config.find_one({}, {'_id': 0}) or {}
+    # Claim the order so the expiry sweeper, the poller or a second cancel cannot act on it too
+    claimed = await db.reseller_orders.update_one(
+        {'id': order['id'], 'status': 'active', 'otp': None},
+        {'$set': {'status': 'cancelling', 'cancel_started_at': datetime.now(timezone.utc).isoformat()}}
+    )
+    if claimed.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Order cannot be cancelled")
+    
     provider = order.get('provider')
     cancelled = False
     
     try:
-        if provider == 'daisysms':
-            daisy_key = DAISYSMS_API_KEY
-            resp = requests.get(
-                f'https://daisysms.com/stubs/handler_api.php?api_key={daisy_key}&action=setStatus&id={provider_order_id}&status=8',
-                timeout=15
-            )
-            if resp.ok and 'ACCESS_CANCEL' in resp.text:
-                cancelled = True
-                
-        elif provider == 'smspool':
-            smspool_key = SMSPOOL_API_KEY
-            resp = requests.post(
-                'https://api.smspool.net/sms/cancel',
-                headers={'Authorization': f'Bearer {smspool_key}'},
-                data={'orderid': provider_order_id},
-                timeout=15
-            )
-            if resp.ok:
-                data = resp.json()
-                if data.get('success') == 1:
-                    cancelled = True
-                    
-        elif provider == '5sim':
-            fivesim_key = FIVESIM_API_KEY
-            resp = requests.get(
-                f'https://5sim.net/v1/user/cancel/{provider_order_id}',
-                headers={'Authorization': f'Bearer {fivesim_key}'},
-                timeout=15
-            )
-            if resp.ok:
-                cancelled = True
+        cancelled = await get_provider(provider).cancel(provider_order_id)
     except Exception as e:
         logger.error(f"Cancel error: {e}")
     
     if cancelled:
-        # Refund balance
+        # Refund balance, keyed like the expiry refund so an order is only refunded once
         refund_amount = order.get('cost_ngn', 0)
-        await db.users.update_one(
-            {'id': reseller['user_id']},
-            {'$inc': {'ngn_balance': refund_amount}}
-        )
+        if refund_amount > 0:
+            await wallet_service.credit_once(reseller['user_id'], refund_amount, _order_refund_key(order['id']))
         
         # Update order status
         await db.reseller_orders.update_one(
-            {'id': order['id']},
-            {'$set': {'status': 'refunded'}}
+            {'id': order['id'], 'status': 'cancelling'},
+            {'$set': {'status': 'refunded', 'can_cancel': False}}
         )
         
         # Decrement reseller's total_revenue since order was canceled
-        await db.resellers.update_one(
-            {'id': reseller['id']},
-            {'$inc': {'total_revenue_ngn': -refund_amount, 'total_orders': -1}}
-        )
+        await _adjust_reseller_totals([order])
         
         return {
             'success': True,
@@ -6406,6 +6038,7 @@ async def reseller_cancel_order(request: Request):
             'refund_amount_ngn': refund_amount
         }
     else:
+        await db.reseller_orders.update_one({'id': order['id'], 'status': 'cancelling'}, {'$set': {'status': 'active'}})
         raise HTTPException(status_code=400, detail="Failed to cancel order with provider")
 
 
@@ -6521,17 +6154,10 @@ async def upgrade_reseller_plan(plan_name: str, user: dict = Depends(get_current
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     
-    # Check balance for monthly fee
-    user_data = await db.users.find_one({'id': user['id']}, {'_id': 0})
-    if user_data.get('ngn_balance', 0) < plan.get('monthly_fee_ngn', 0):
-        raise HTTPException(status_code=400, detail="Insufficient balance for plan upgrade")
-    
     # Deduct fee and upgrade
     if plan.get('monthly_fee_ngn', 0) > 0:
-        await db.users.update_one(
-            {'id': user['id']},
-            {'$inc': {'ngn_balance': -plan['monthly_fee_ngn']}}
-        )
+        if await wallet_service.debit(user['id'], plan['monthly_fee_ngn'], 'NGN') is None:
+            raise HTTPException(status_code=400, detail="Insufficient balance for plan upgrade")
     
     await db.resellers.update_one(
         {'id': reseller['id']},
@@ -6674,56 +6300,124 @@ async def admin_create_reseller_plan(request: Request, user: dict = Depends(get_
 
 # ============ EXCHANGE RATE SERVICE ============
 
-# Cache for exchange rates
-exchange_rate_cache = {
-    'rates': {},
-    'last_updated': None
+FX_API_URL = "https://api.frankfurter.app/latest"
+FX_CURRENCIES = "EUR,GBP,CAD,AUD,NGN,BRL,MXN,INR,JPY,KRW,ZAR,AED,SAR,SGD,HKD,CHF,SEK,NOK,DKK,PLN,TRY"
+FX_REFRESH_AFTER = timedelta(minutes=45)   # refreshed in the background before the 1h mark
+FX_BACKOFF_BASE_SECONDS = 30
+FX_BACKOFF_MAX_SECONDS = 1800
+FX_FALLBACK_RATES = {
+    'usd_rates': {'USD': 1.0, 'EUR': 0.92, 'GBP': 0.79, 'CAD': 1.36, 'NGN': 1650},
+    'ngn_rates': {'USD': 1650, 'EUR': 1793, 'GBP': 2089, 'CAD': 1213, 'NGN': 1},
+    'base_ngn_per_usd': 1650
 }
 
-async def get_exchange_rates():
-    """Fetch exchange rates from a free API (frankfurter.app) and cache them"""
-    global exchange_rate_cache
-    
-    # Check if cache is valid (less than 1 hour old)
-    if (exchange_rate_cache['last_updated'] and 
-        datetime.now(timezone.utc) - exchange_rate_cache['last_updated'] < timedelta(hours=1)):
-        return exchange_rate_cache['rates']
-    
-    try:
-        # Fetch rates from frankfurter.app (free, no API key needed)
+
+class ExchangeRateService:
+    """Stale-while-revalidate FX rates.
+
+    Callers always get the current snapshot immediately. Refreshes run in the
+    background, at most one per worker at a time, with exponential backoff on upstream
+    failure. The last good snapshot is kept in `exchange_rate_snapshots` so a cold worker
+    starts from it (or from a fresher one another worker already fetched).
+    """
+
+    def __init__(self):
+        self.rates: Optional[dict] = None
+        self.last_updated: Optional[datetime] = None
+        self.failures = 0
+        self.next_attempt_at: Optional[datetime] = None
+        self._loaded_snapshot = False
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _is_stale(self) -> bool:
+        return not self.last_updated or datetime.now(timezone.utc) - self.last_updated >= FX_REFRESH_AFTER
+
+    async def _load_snapshot(self) -> bool:
+        """Adopt the persisted snapshot if it is newer than ours"""
+        snap = await db.exchange_rate_snapshots.find_one({'id': 'latest'}, {'_id': 0})
+        if not snap or not snap.get('rates'):
+            return False
+        updated = datetime.fromisoformat(snap['last_updated'])
+        if self.last_updated and updated <= self.last_updated:
+            return False
+        self.rates = snap['rates']
+        self.last_updated = updated
+        return True
+
+    async def _fetch(self) -> dict:
         async with httpx.AsyncClient(timeout=10.0) as client:
-            # Get USD base rates for major currencies
-            response = await client.get(
-                "https://api.frankfurter.app/latest",
-                params={"from": "USD", "to": "EUR,GBP,CAD,AUD,NGN,BRL,MXN,INR,JPY,KRW,ZAR,AED,SAR,SGD,HKD,CHF,SEK,NOK,DKK,PLN,TRY"}
+            response = await client.get(FX_API_URL, params={"from": "USD", "to": FX_CURRENCIES})
+        response.raise_for_status()
+        rates = response.json().get('rates', {})
+        rates['USD'] = 1.0  # Add USD itself
+
+        # Calculate NGN rates for each currency (currency -> NGN)
+        ngn_rate = rates.get('NGN', 1650)  # Fallback if NGN not available
+        return {
+            'usd_rates': rates,
+            'ngn_rates': {currency: ngn_rate / rate if rate > 0 else 0 for currency, rate in rates.items()},
+            'base_ngn_per_usd': ngn_rate
+        }
+
+    async def refresh(self):
+        now = datetime.now(timezone.utc)
+        if self.next_attempt_at and now < self.next_attempt_at:
+            return
+        try:
+            # Another worker may already have refreshed
+            if await self._load_snapshot() and not self._is_stale():
+                return
+            rates = await self._fetch()
+            self.rates = rates
+            self.last_updated = datetime.now(timezone.utc)
+            self.failures = 0
+            self.next_attempt_at = None
+            await db.exchange_rate_snapshots.update_one(
+                {'id': 'latest'},
+                {'$set': {'id': 'latest', 'rates': rates, 'last_updated': self.last_updated.isoformat()}},
+                upsert=True
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                rates = data.get('rates', {})
-                rates['USD'] = 1.0  # Add USD itself
-                
-                # Calculate NGN rates for each currency (currency -> NGN)
-                ngn_rate = rates.get('NGN', 1650)  # Fallback if NGN not available
-                
-                # Store both raw rates and NGN conversion rates
-                exchange_rate_cache['rates'] = {
-                    'usd_rates': rates,
-                    'ngn_rates': {currency: ngn_rate / rate if rate > 0 else 0 for currency, rate in rates.items()},
-                    'base_ngn_per_usd': ngn_rate
-                }
-                exchange_rate_cache['last_updated'] = datetime.now(timezone.utc)
-                
-                return exchange_rate_cache['rates']
-    except Exception as e:
-        print(f"Failed to fetch exchange rates: {e}")
-    
-    # Return fallback rates if API fails
-    return {
-        'usd_rates': {'USD': 1.0, 'EUR': 0.92, 'GBP': 0.79, 'CAD': 1.36, 'NGN': 1650},
-        'ngn_rates': {'USD': 1650, 'EUR': 1793, 'GBP': 2089, 'CAD': 1213, 'NGN': 1},
-        'base_ngn_per_usd': 1650
-    }
+        except Exception as e:
+            self.failures += 1
+            delay = min(FX_BACKOFF_BASE_SECONDS * (2 ** (self.failures - 1)), FX_BACKOFF_MAX_SECONDS)
+            self.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            logger.warning(f"Exchange rate refresh failed ({self.failures} in a row), retrying in {delay}s: {e}")
+
+    def _schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self.refresh())
+
+    async def get_rates(self) -> dict:
+        if not self._loaded_snapshot:
+            self._loaded_snapshot = True
+            try:
+                await self._load_snapshot()
+            except Exception as e:
+                logger.error(f"Failed to load exchange rate snapshot: {e}")
+        stale = self._is_stale()
+        cache_lookup('exchange_rates', not stale)
+        if stale:
+            self._schedule_refresh()
+        return self.rates or FX_FALLBACK_RATES
+
+    async def run(self, interval_seconds: int = 60):
+        """Background loop keeping the snapshot fresh ahead of expiry"""
+        while True:
+            try:
+                if self._is_stale():
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"Exchange rate loop error: {e}")
+            await asyncio.sleep(interval_seconds)
+
+
+exchange_rate_service = ExchangeRateService()
+
+
+async def get_exchange_rates():
+    """Current FX snapshot (USD base rates and NGN conversions); never waits on the FX API"""
+    return await exchange_rate_service.get_rates()
 
 
 @api_router.get("/exchange-rates")
@@ -6743,28 +6437,39 @@ async def get_all_exchange_rates(user: dict = Depends(get_current_user)):
             "wallet_usd_to_ngn": wallet_rate,
             "giftcard_usd_to_ngn": giftcard_rate
         },
-        "cached_at": exchange_rate_cache.get('last_updated', datetime.now(timezone.utc)).isoformat() if exchange_rate_cache.get('last_updated') else None
+        "cached_at": exchange_rate_service.last_updated.isoformat() if exchange_rate_service.last_updated else None
     }
 
 
 # ============ RELOADLY GIFT CARDS ============
 
+RELOADLY_TOKEN_REFRESH_AHEAD = timedelta(minutes=10)  # refresh in the background inside this window
+RELOADLY_TOKEN_MIN_VALIDITY = timedelta(minutes=1)    # below this, refresh before using the token
+
+
 # Reloadly Auth Service - handles token caching
 class ReloadlyAuthService:
+    """OAuth tokens for Reloadly, cached per (client_id, audience).
+
+    Sandbox/live and gift-cards/top-ups each use a different audience, so each gets its
+    own token. Tokens are refreshed in the background shortly before they expire, and a
+    per-key lock makes concurrent callers share a single token request.
+    """
+
     def __init__(self):
-        self.access_token = None
-        self.token_expiry = None
         self.auth_url = "https://auth.reloadly.com/oauth/token"
-    
-    async def get_config(self):
-        """Get Reloadly config from database or env"""
-        config = await db.pricing_config.find_one({})
-        if config:
+        self._tokens: Dict[tuple, tuple] = {}   # (client_id, audience) -> (token, expiry)
+        self._locks: Dict[tuple, asyncio.Lock] = {}
+        self._refresh_tasks: Dict[tuple, asyncio.Task] = {}
+
+    def build_config(self, pricing_config: Optional[dict]) -> dict:
+        """Reloadly settings from an already loaded pricing_config document (or env)"""
+        if pricing_config:
             return {
-                'client_id': config.get('reloadly_client_id') or os.environ.get('RELOADLY_CLIENT_ID', ''),
-                'client_secret': config.get('reloadly_client_secret') or os.environ.get('RELOADLY_CLIENT_SECRET', ''),
-                'is_sandbox': config.get('giftcard_is_sandbox', True),
-                'markup_percent': config.get('giftcard_markup_percent', 0)
+                'client_id': pricing_config.get('reloadly_client_id') or os.environ.get('RELOADLY_CLIENT_ID', ''),
+                'client_secret': pricing_config.get('reloadly_client_secret') or os.environ.get('RELOADLY_CLIENT_SECRET', ''),
+                'is_sandbox': pricing_config.get('giftcard_is_sandbox', True),
+                'markup_percent': pricing_config.get('giftcard_markup_percent', 0)
             }
         return {
             'client_id': os.environ.get('RELOADLY_CLIENT_ID', ''),
@@ -6772,87 +6477,107 @@ class ReloadlyAuthService:
             'is_sandbox': True,
             'markup_percent': 0
         }
-    
+
+    async def get_config(self):
+        """Get Reloadly config from database or env"""
+        return self.build_config(await db.pricing_config.find_one({}, {'_id': 0}))
+
     def get_api_base_url(self, is_sandbox: bool) -> str:
         return "https://giftcards-sandbox.reloadly.com" if is_sandbox else "https://giftcards.reloadly.com"
-    
-    async def get_access_token(self) -> str:
-        """Get valid access token, refreshing if needed"""
-        config = await self.get_config()
-        api_base_url = self.get_api_base_url(config['is_sandbox'])
-        
-        # Check if token is still valid (with 5-minute buffer)
-        if (self.access_token and self.token_expiry and 
-            datetime.now(timezone.utc) < self.token_expiry - timedelta(minutes=5)):
-            return self.access_token
-        
-        # Request new token
-        async with httpx.AsyncClient() as client:
+
+    def get_topups_api_url(self, is_sandbox: bool) -> str:
+        """Get the Topups API base URL for balance checking"""
+        return "https://topups-sandbox.reloadly.com" if is_sandbox else "https://topups.reloadly.com"
+
+    async def _request_token(self, config: dict, audience: str) -> tuple:
+        async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.post(
                 self.auth_url,
                 json={
                     "client_id": config['client_id'],
                     "client_secret": config['client_secret'],
-                    "audience": api_base_url,
+                    "audience": audience,
                     "grant_type": "client_credentials"
                 }
             )
-        
+
         if response.status_code != 200:
             raise HTTPException(status_code=500, detail=f"Failed to get Reloadly access token: {response.text}")
-        
+
         token_data = response.json()
-        self.access_token = token_data["access_token"]
         expires_in = token_data.get("expires_in", 86400)
-        self.token_expiry = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
-        
-        return self.access_token
-    
-    async def get_headers(self) -> dict:
-        """Get headers for Reloadly API requests"""
-        token = await self.get_access_token()
-        return {
+        return token_data["access_token"], datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+
+    async def _refresh(self, config: dict, audience: str) -> str:
+        key = (config['client_id'], audience)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Someone else may have refreshed while we waited for the lock
+            cached = self._tokens.get(key)
+            if cached and datetime.now(timezone.utc) < cached[1] - RELOADLY_TOKEN_REFRESH_AHEAD:
+                return cached[0]
+            self._tokens[key] = await self._request_token(config, audience)
+            return self._tokens[key][0]
+
+    async def _refresh_in_background(self, config: dict, audience: str):
+        try:
+            await self._refresh(config, audience)
+        except Exception as e:
+            logger.warning(f"Background Reloadly token refresh failed: {e}")
+
+    async def get_access_token(self, config: Optional[dict] = None, audience: Optional[str] = None) -> str:
+        """Get valid access token, refreshing if needed"""
+        if config is None:
+            config = await self.get_config()
+        if audience is None:
+            audience = self.get_api_base_url(config['is_sandbox'])
+        key = (config['client_id'], audience)
+
+        cached = self._tokens.get(key)
+        now = datetime.now(timezone.utc)
+        cache_lookup('reloadly_token', bool(cached and now < cached[1] - RELOADLY_TOKEN_MIN_VALIDITY))
+        if cached and now < cached[1] - RELOADLY_TOKEN_MIN_VALIDITY:
+            if now >= cached[1] - RELOADLY_TOKEN_REFRESH_AHEAD:
+                task = self._refresh_tasks.get(key)
+                if not task or task.done():
+                    self._refresh_tasks[key] = asyncio.create_task(self._refresh_in_background(config, audience))
+            return cached[0]
+        return await self._refresh(config, audience)
+
+    async def get_session(self) -> tuple:
+        """Headers, gift-card API URL and the pricing_config document, from one config read"""
+        pricing_config = await db.pricing_config.find_one({}, {'_id': 0})
+        config = self.build_config(pricing_config)
+        api_url = self.get_api_base_url(config['is_sandbox'])
+        token = await self.get_access_token(config, api_url)
+        headers = {
             "Authorization": f"Bearer {token}",
             "Accept": "application/com.reloadly.giftcards-v1+json",
             "Content-Type": "application/json"
         }
-    
+        return headers, api_url, pricing_config or {}
+
+    async def get_headers(self) -> dict:
+        """Get headers for Reloadly API requests"""
+        headers, _, _ = await self.get_session()
+        return headers
+
     async def get_api_url(self) -> str:
         """Get the API base URL based on sandbox/live setting"""
         config = await self.get_config()
         return self.get_api_base_url(config['is_sandbox'])
-    
-    def get_topups_api_url(self, is_sandbox: bool) -> str:
-        """Get the Topups API base URL for balance checking"""
-        return "https://topups-sandbox.reloadly.com" if is_sandbox else "https://topups.reloadly.com"
-    
-    async def get_balance_headers(self) -> dict:
+
+    async def get_balance_headers(self, config: Optional[dict] = None) -> dict:
         """Get headers for Reloadly Topups/Balance API requests"""
-        config = await self.get_config()
-        api_base_url = self.get_topups_api_url(config['is_sandbox'])
-        
-        # Request token with topups audience
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.auth_url,
-                json={
-                    "client_id": config['client_id'],
-                    "client_secret": config['client_secret'],
-                    "audience": api_base_url,
-                    "grant_type": "client_credentials"
-                }
-            )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Failed to get Reloadly balance token: {response.text}")
-        
-        token_data = response.json()
+        if config is None:
+            config = await self.get_config()
+        token = await self.get_access_token(config, self.get_topups_api_url(config['is_sandbox']))
         return {
-            "Authorization": f"Bearer {token_data['access_token']}",
+            "Authorization": f"Bearer {token}",
             "Accept": "application/com.reloadly.topups-v1+json",
             "Content-Type": "application/json"
         }
-    
+
     async def get_topups_url(self) -> str:
         """Get the Topups API base URL based on sandbox/live setting"""
         config = await self.get_config()
@@ -6860,6 +6585,73 @@ class ReloadlyAuthService:
 
 reloadly_auth = ReloadlyAuthService()
 
+# ============ Gift Card Catalog Mirror ============
+
+GIFTCARD_CATALOG_SYNC_INTERVAL = int(os.environ.get('GIFTCARD_CATALOG_SYNC_INTERVAL_SECONDS', 6 * 3600))
+GIFTCARD_CATALOG_CHECK_INTERVAL = 300   # how often workers look for a due sync or a newer snapshot
+GIFTCARD_CATALOG_SYNC_LEASE = 900
+
+
+async def _fetch_reloadly_products_page(page: int, size: int) -> dict:
+    headers, api_url, _ = await reloadly_auth.get_session()
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        response = await client.get(f"{api_url}/products", headers=headers, params={"page": page, "size": size})
+    if response.status_code != 200:
+        raise Exception(f"Reloadly products page {page} failed: {response.status_code} {response.text[:200]}")
+    return response.json()
+
+
+async def run_giftcard_catalog_sync():
+    """Keep the local catalog in step with Reloadly.
+
+    One worker at a time holds the sync lease and pulls the full catalog; every other
+    worker reloads from Mongo when it sees a newer snapshot. Switching between sandbox and
+    live forces an immediate resync since the two catalogs differ.
+    """
+    worker_id = str(uuid.uuid4())
+    try:
+        await giftcard_catalog.load_from_db()
+    except Exception as e:
+        logger.error(f"Gift card catalog load error: {e}")
+
+    while True:
+        try:
+            config = await reloadly_auth.get_config()
+            source = reloadly_auth.get_api_base_url(config['is_sandbox'])
+            if config.get('client_id') and config.get('client_secret'):
+                meta = await db.giftcard_catalog_meta.find_one({'id': 'sync'}, {'_id': 0}) or {}
+                force = meta.get('source') != source
+                if await giftcard_catalog.acquire_sync_lease(worker_id, GIFTCARD_CATALOG_SYNC_LEASE,
+                                                             GIFTCARD_CATALOG_SYNC_INTERVAL, force=force):
+                    try:
+                        await giftcard_catalog.sync(_fetch_reloadly_products_page, source=source)
+                    finally:
+                        await db.giftcard_catalog_meta.update_one(
+                            {'id': 'sync', 'lease_owner': worker_id}, {'$unset': {'lease_until': ''}}
+                        )
+                elif meta.get('last_synced_at') and meta.get('last_synced_at') != giftcard_catalog.synced_at:
+                    await giftcard_catalog.load_from_db()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Gift card catalog sync error: {e}")
+        await asyncio.sleep(GIFTCARD_CATALOG_CHECK_INTERVAL)
+
+
+async def _priced_giftcard_catalog(config: dict) -> bool:
+    """Make sure catalog prices reflect the current FX snapshot and gift card settings"""
+    live_rates = await get_exchange_rates()
+    last_updated = exchange_rate_service.last_updated
+    repriced = giftcard_catalog.ensure_pricing(
+        live_rates.get('usd_rates', {}),
+        config.get('giftcard_usd_to_ngn_rate', 1650),
+        config.get('giftcard_markup_percent', 0),
+        last_updated.isoformat() if last_updated else None,
+    )
+    if repriced:
+        giftcard_catalog.schedule_persist_pricing()
+    return repriced
+
 
 @api_router.get("/admin/reloadly/balance")
 async def get_reloadly_balance(admin: dict = Depends(require_admin)):
@@ -6875,8 +6667,8 @@ async def get_reloadly_balance(admin: dict = Depends(require_admin)):
                 "balance": None
             }
         
-        headers = await reloadly_auth.get_balance_headers()
-        topups_url = await reloadly_auth.get_topups_url()
+        headers = await reloadly_auth.get_balance_headers(config)
+        topups_url = reloadly_auth.get_topups_api_url(config['is_sandbox'])
         
         async with httpx.AsyncClient() as client:
             response = await client.get(
@@ -6929,8 +6721,22 @@ async def get_giftcard_products(
 ):
     """Get available gift card products from Reloadly"""
     try:
-        headers = await reloadly_auth.get_headers()
-        api_url = await reloadly_auth.get_api_url()
+        headers, api_url, config = await reloadly_auth.get_session()
+        
+        # Served from the local mirror once it holds the catalog for the active environment
+        local = giftcard_catalog.ready and giftcard_catalog.source == api_url
+        cache_lookup('giftcard_catalog', local)
+        if local:
+            await _priced_giftcard_catalog(config)
+            data = giftcard_catalog.search(country_code=country_code, product_name=product_name, page=page, size=size)
+            return {
+                "success": True,
+                "products": data["content"],
+                "total_elements": data["totalElements"],
+                "total_pages": data["totalPages"],
+                "page": page,
+                "size": size
+            }
         
         params = {
             "page": page,
@@ -6958,48 +6764,14 @@ async def get_giftcard_products(
         
         # Get live exchange rates and admin config
         live_rates = await get_exchange_rates()
-        config = await db.pricing_config.find_one({})
         
         # Admin configured USD to NGN rate and markup
         admin_usd_to_ngn = config.get('giftcard_usd_to_ngn_rate', 1650) if config else 1650
         markup_percent = config.get('giftcard_markup_percent', 0) if config else 0
-        markup_multiplier = 1 + (markup_percent / 100)
-        
-        # Get live USD rates for currency conversion
         usd_rates = live_rates.get('usd_rates', {})
         
         for product in products:
-            recipient_currency = product.get("recipientCurrencyCode", "USD")
-            
-            # Step 1: Convert currency to USD using live rate
-            # usd_rates contains how many units of currency per 1 USD
-            # e.g., EUR: 0.92 means 1 USD = 0.92 EUR, so 1 EUR = 1/0.92 USD
-            if recipient_currency == "USD":
-                currency_to_usd = 1.0
-            elif recipient_currency in usd_rates and usd_rates[recipient_currency] > 0:
-                # 1 currency unit = 1/rate USD
-                currency_to_usd = 1.0 / usd_rates[recipient_currency]
-            else:
-                # Fallback: assume 1:1 with USD
-                currency_to_usd = 1.0
-            
-            # Step 2: Apply admin's USD to NGN rate with markup
-            # Final rate: currency -> USD -> NGN (with markup)
-            final_ngn_rate = currency_to_usd * admin_usd_to_ngn * markup_multiplier
-            
-            # Add NGN equivalent pricing
-            if product.get("fixedRecipientDenominations"):
-                product["denominations_ngn"] = [round(d * final_ngn_rate, 2) for d in product["fixedRecipientDenominations"]]
-            if product.get("minRecipientDenomination"):
-                product["min_ngn"] = round(product["minRecipientDenomination"] * final_ngn_rate, 2)
-            if product.get("maxRecipientDenomination"):
-                product["max_ngn"] = round(product["maxRecipientDenomination"] * final_ngn_rate, 2)
-            
-            # Store rate info for frontend
-            product["currency_to_usd_rate"] = round(currency_to_usd, 4)
-            product["admin_usd_to_ngn_rate"] = admin_usd_to_ngn
-            product["final_ngn_rate"] = round(final_ngn_rate, 2)
-            product["markup_percent"] = markup_percent
+            product.update(compute_ngn_pricing(product, usd_rates, admin_usd_to_ngn, markup_percent))
         
         return {
             "success": True,
@@ -7019,22 +6791,24 @@ async def get_giftcard_products(
 async def get_giftcard_product_detail(product_id: int, user: dict = Depends(get_current_user)):
     """Get detailed information about a specific gift card product"""
     try:
-        headers = await reloadly_auth.get_headers()
-        api_url = await reloadly_auth.get_api_url()
+        headers, api_url, config = await reloadly_auth.get_session()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{api_url}/products/{product_id}",
-                headers=headers
-            )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=f"Reloadly API error: {response.text}")
-        
-        product = response.json()
+        product = None
+        if giftcard_catalog.source == api_url and giftcard_catalog.get(product_id):
+            product = {k: v for k, v in giftcard_catalog.get(product_id).items() if k not in ('pricing', 'synced_at')}
+        if product is None:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                response = await client.get(
+                    f"{api_url}/products/{product_id}",
+                    headers=headers
+                )
+            
+            if response.status_code != 200:
+                raise HTTPException(status_code=response.status_code, detail=f"Reloadly API error: {response.text}")
+            
+            product = response.json()
         
         # Add NGN pricing with markup
-        config = await db.pricing_config.find_one({})
         usd_to_ngn_rate = config.get('usd_to_ngn_rate', 1650) if config else 1650
         markup_percent = config.get('giftcard_markup_percent', 0) if config else 0
         markup_multiplier = 1 + (markup_percent / 100)
@@ -7060,8 +6834,7 @@ async def get_giftcard_product_detail(product_id: int, user: dict = Depends(get_
 async def get_giftcard_countries(user: dict = Depends(get_current_user)):
     """Get all countries with available gift cards"""
     try:
-        headers = await reloadly_auth.get_headers()
-        api_url = await reloadly_auth.get_api_url()
+        headers, api_url, config = await reloadly_auth.get_session()
         
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.get(
@@ -7089,22 +6862,22 @@ async def create_giftcard_order(order_req: GiftCardOrderRequest, user: dict = De
             raise HTTPException(status_code=401, detail="User ID not found")
         
         # Get the product details first to calculate cost
-        headers = await reloadly_auth.get_headers()
-        api_url = await reloadly_auth.get_api_url()
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            product_resp = await client.get(
-                f"{api_url}/products/{order_req.product_id}",
-                headers=headers
-            )
-        
-        if product_resp.status_code != 200:
-            raise HTTPException(status_code=400, detail="Invalid product ID")
-        
-        product = product_resp.json()
+        headers, api_url, config = await reloadly_auth.get_session()
+        
+        product = giftcard_catalog.get(order_req.product_id) if giftcard_catalog.source == api_url else None
+        if product is None:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                product_resp = await client.get(
+                    f"{api_url}/products/{order_req.product_id}",
+                    headers=headers
+                )
+            
+            if product_resp.status_code != 200:
+                raise HTTPException(status_code=400, detail="Invalid product ID")
+            
+            product = product_resp.json()
         
         # Get exchange rate and markup
-        config = await db.pricing_config.find_one({})
         usd_to_ngn_rate = config.get('giftcard_usd_to_ngn_rate', 1650) if config else 1650
         markup_percent = config.get('giftcard_markup_percent', 0) if config else 0
         markup_multiplier = 1 + (markup_percent / 100)
@@ -7114,14 +6887,12 @@ async def create_giftcard_order(order_req: GiftCardOrderRequest, user: dict = De
         total_usd = (order_req.unit_price * order_req.quantity) + sender_fee
         total_ngn = round(total_usd * usd_to_ngn_rate * markup_multiplier, 2)
         
-        # Check user's NGN balance
-        user_data = await db.users.find_one({'id': user_id})
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        current_balance = user_data.get('ngn_balance', 0)
-        if current_balance < total_ngn:
-            raise HTTPException(status_code=400, detail=f"Insufficient NGN balance. Required: ₦{total_ngn:,.2f}, Available: ₦{current_balance:,.2f}")
+        # Reserve the NGN amount; released again if Reloadly rejects the order
+        balances = await wallet_service.debit(user_id, total_ngn, 'NGN')
+        if balances is None:
+            raise HTTPException(status_code=400, detail=f"Insufficient NGN balance. Required: ₦{total_ngn:,.2f}, Available: ₦{user.get('ngn_balance', 0):,.2f}")
+        new_balance = balances.get('ngn_balance', 0)
+        current_balance = new_balance + total_ngn
         
         # Place order with Reloadly
         order_payload = {
@@ -7139,27 +6910,26 @@ async def create_giftcard_order(order_req: GiftCardOrderRequest, user: dict = De
         if order_req.sender_name:
             order_payload["senderName"] = order_req.sender_name
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{api_url}/orders",
-                headers=headers,
-                json=order_payload
-            )
-        
-        if response.status_code not in [200, 201]:
-            error_detail = response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
-            raise HTTPException(status_code=response.status_code, detail=f"Reloadly order failed: {error_detail}")
-        
-        order_data = response.json()
+        try:
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                response = await client.post(
+                    f"{api_url}/orders",
+                    headers=headers,
+                    json=order_payload
+                )
+            
+            if response.status_code not in [200, 201]:
+                error_detail = response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
+                raise HTTPException(status_code=response.status_code, detail=f"Reloadly order failed: {error_detail}")
+            
+            order_data = response.json()
+        except Exception:
+            await wallet_service.credit(user_id, total_ngn, 'NGN')
+            raise
         
-        # Deduct from user's balance
-        await db.users.update_one(
-            {'id': user_id},
-            {'$inc': {'ngn_balance': -total_ngn}}
-        )
+        order_payload_id = payload_store.put('reloadly_order', order_data, str(order_data.get('transactionId')))
         
         # Record the transaction
-        new_balance = current_balance - total_ngn
         transaction = {
             'user_id': user_id,
             'type': 'giftcard_purchase',
@@ -7180,7 +6950,7 @@ async def create_giftcard_order(order_req: GiftCardOrderRequest, user: dict = De
                 'recipient_phone': order_req.recipient_phone,
                 'quantity': order_req.quantity,
                 'unit_price': order_req.unit_price,
-                'reloadly_response': order_data
+                'payload_id': order_payload_id
             },
             'created_at': datetime.now(timezone.utc).isoformat()
         }
@@ -7200,7 +6970,7 @@ async def create_giftcard_order(order_req: GiftCardOrderRequest, user: dict = De
             'recipient_email': order_req.recipient_email,
             'recipient_phone': order_req.recipient_phone,
             'status': order_data.get('status', 'PENDING'),
-            'reloadly_data': order_data,
+            'reloadly_data_id': order_payload_id,
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         await db.giftcard_orders.insert_one(giftcard_order)
@@ -7211,7 +6981,7 @@ async def create_giftcard_order(order_req: GiftCardOrderRequest, user: dict = De
             "transaction_id": order_data.get('transactionId'),
             "status": order_data.get('status'),
             "amount_charged_ngn": total_ngn,
-            "new_balance_ngn": current_balance - total_ngn
+            "new_balance_ngn": new_balance
         }
     except HTTPException:
         raise
@@ -7233,7 +7003,7 @@ async def get_user_giftcard_orders(
         
         skip = (page - 1) * size
         orders = await db.giftcard_orders.find(
-            {'user_id': user_id}
+            {'user_id': user_id}, {'reloadly_data': 0}
         ).sort('created_at', -1).skip(skip).limit(size).to_list(size)
         
         total = await db.giftcard_orders.count_documents({'user_id': user_id})
@@ -7257,8 +7027,7 @@ async def get_user_giftcard_orders(
 async def get_giftcard_order_status(transaction_id: int, user: dict = Depends(get_current_user)):
     """Get status of a specific gift card order"""
     try:
-        headers = await reloadly_auth.get_headers()
-        api_url = await reloadly_auth.get_api_url()
+        headers, api_url, config = await reloadly_auth.get_session()
         
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.get(
@@ -7281,8 +7050,7 @@ async def get_giftcard_order_status(transaction_id: int, user: dict = Depends(ge
 async def get_giftcard_redeem_code(transaction_id: int, user: dict = Depends(get_current_user)):
     """Get the redeem code for a completed gift card order"""
     try:
-        headers = await reloadly_auth.get_headers()
-        api_url = await reloadly_auth.get_api_url()
+        headers, api_url, config = await reloadly_auth.get_session()
         
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.get(
@@ -7310,13 +7078,13 @@ async def get_admin_giftcard_orders(
     """Get all gift card orders (admin only)"""
     try:
         skip = (page - 1) * size
-        orders = await db.giftcard_orders.find({}).sort('created_at', -1).skip(skip).limit(size).to_list(size)
-        total = await db.giftcard_orders.count_documents({})
+        orders = await analytics_db.giftcard_orders.find({}, {'reloadly_data': 0}).sort('created_at', -1).skip(skip).limit(size).to_list(size)
+        total = await analytics_db.giftcard_orders.count_documents({})
         
         # Enrich with user info
         for order in orders:
             order['_id'] = str(order['_id'])
-            user_data = await db.users.find_one({'id': order.get('user_id')}, {'_id': 0, 'email': 1, 'full_name': 1})
+            user_data = await analytics_db.users.find_one({'id': order.get('user_id')}, {'_id': 0, 'email': 1, 'full_name': 1})
             if user_data:
                 order['user_email'] = user_data.get('email')
                 order['user_name'] = user_data.get('full_name')
@@ -7371,15 +7139,15 @@ async def get_admin_service_stats(
                 'total_usd': {'$sum': '$total_usd'}
             }}
         ]
-        giftcard_stats = await db.giftcard_orders.aggregate(giftcard_pipeline).to_list(1)
+        giftcard_stats = await analytics_db.giftcard_orders.aggregate(giftcard_pipeline).to_list(1)
         giftcard_data = giftcard_stats[0] if giftcard_stats else {'total_count': 0, 'total_ngn': 0, 'total_usd': 0}
         
         # Currency conversion stats
-        conversion_pipeline = [
-            {'$match': {
-                'type': 'currency_conversion',
-                'created_at': {'$gte': start_str, '$lte': end_str}
-            }},
+        conversion_match = {
+            'type': 'currency_conversion',
+            'created_at': {'$gte': start_str, '$lte': end_str}
+        }
+        conversion_stages = [
             {'$group': {
                 '_id': None,
                 'total_count': {'$sum': 1},
@@ -7387,22 +7155,22 @@ async def get_admin_service_stats(
                 'total_ngn_received': {'$sum': '$amount_ngn'}
             }}
         ]
-        conversion_stats = await db.transactions.aggregate(conversion_pipeline).to_list(1)
+        conversion_stats = await archive.aggregate(analytics_db, 'transactions', conversion_match, conversion_stages, start, 1)
         conversion_data = conversion_stats[0] if conversion_stats else {'total_count': 0, 'total_usd_converted': 0, 'total_ngn_received': 0}
         
         # Wallet funding stats
-        funding_pipeline = [
-            {'$match': {
-                'type': {'$in': ['crypto_deposit', 'bank_deposit', 'card_deposit']},
-                'created_at': {'$gte': start_str, '$lte': end_str}
-            }},
+        funding_match = {
+            'type': {'$in': ['crypto_deposit', 'bank_deposit', 'card_deposit']},
+            'created_at': {'$gte': start_str, '$lte': end_str}
+        }
+        funding_stages = [
             {'$group': {
                 '_id': '$type',
                 'count': {'$sum': 1},
                 'total_ngn': {'$sum': {'$abs': '$amount_ngn'}}
             }}
         ]
-        funding_stats = await db.transactions.aggregate(funding_pipeline).to_list(10)
+        funding_stats = await archive.aggregate(analytics_db, 'transactions', funding_match, funding_stages, start, 10)
         
         return {
             "success": True,
@@ -7439,15 +7207,6 @@ async def convert_usd_to_ngn(request: Request, user: dict = Depends(get_current_
         if not user_id:
             raise HTTPException(status_code=401, detail="User ID not found")
             
-        user_data = await db.users.find_one({'id': user_id})
-        
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        current_usd = user_data.get('usd_balance', 0)
-        if current_usd < amount_usd:
-            raise HTTPException(status_code=400, detail=f"Insufficient USD balance. Available: ${current_usd:.2f}")
-        
         # Get WALLET-specific exchange rate from config
         config = await db.pricing_config.find_one({})
         usd_to_ngn_rate = config.get('wallet_usd_to_ngn_rate', 1650) if config else 1650
@@ -7455,20 +7214,11 @@ async def convert_usd_to_ngn(request: Request, user: dict = Depends(get_current_
         # Calculate NGN amount
         amount_ngn = round(amount_usd * usd_to_ngn_rate, 2)
         
-        # Get balance before for transaction record
-        balance_usd_before = current_usd
-        balance_ngn_before = user_data.get('ngn_balance', 0)
-        
         # Update balances
-        await db.users.update_one(
-            {'id': user_id},
-            {
-                '$inc': {
-                    'usd_balance': -amount_usd,
-                    'ngn_balance': amount_ngn
-                }
-            }
-        )
+        balances = await wallet_service.exchange(user_id, amount_usd, 'USD', amount_ngn, 'NGN')
+        if balances is None:
+            raise HTTPException(status_code=400, detail=f"Insufficient USD balance. Available: ${user.get('usd_balance', 0):.2f}")
+        balance_ngn_after = balances.get('ngn_balance', 0)
         
         # Record transaction with balance before/after
         transaction = {
@@ -7479,8 +7229,8 @@ async def convert_usd_to_ngn(request: Request, user: dict = Depends(get_current_
             'currency': 'NGN',
             'amount_usd': -amount_usd,
             'amount_ngn': amount_ngn,
-            'balance_before': balance_ngn_before,
-            'balance_after': balance_ngn_before + amount_ngn,
+            'balance_before': balance_ngn_after - amount_ngn,
+            'balance_after': balance_ngn_after,
             'exchange_rate': usd_to_ngn_rate,
             'description': f"Converted ${amount_usd:.2f} USD to ₦{amount_ngn:,.2f} NGN",
             'status': 'completed',
@@ -7488,17 +7238,14 @@ async def convert_usd_to_ngn(request: Request, user: dict = Depends(get_current_
         }
         await db.transactions.insert_one(transaction)
         
-        # Get updated balances
-        updated_user = await db.users.find_one({'id': user_id})
-        
         return {
             "success": True,
             "message": f"Successfully converted ${amount_usd:.2f} to ₦{amount_ngn:,.2f}",
             "amount_usd_deducted": amount_usd,
             "amount_ngn_added": amount_ngn,
             "exchange_rate": usd_to_ngn_rate,
-            "new_balance_usd": updated_user.get('usd_balance', 0),
-            "new_balance_ngn": updated_user.get('ngn_balance', 0)
+            "new_balance_usd": balances.get('usd_balance', 0),
+            "new_balance_ngn": balance_ngn_after
         }
     except HTTPException:
         raise
@@ -7522,8 +7269,70 @@ async def get_exchange_rate(user: dict = Depends(get_current_user)):
     }
 
 
+# ============ Metrics ============
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint. Requires `Authorization: Bearer <METRICS_TOKEN>`; disabled while the token is unset"""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Metrics are disabled: METRICS_TOKEN is not configured")
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    metrics.OUTBOX_QUEUE_DEPTH.set(outbox.depth)
+    try:
+        metrics.WEBHOOK_QUEUE_DEPTH.set(await webhook_inbox.pending_count())
+    except Exception as e:
+        logger.error(f"Webhook queue depth error: {e}")
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
 app.include_router(api_router)
 
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep cardinality bounded
+        route = request.scope.get('route')
+        metrics.HTTP_REQUEST_DURATION.labels(
+            request.method, getattr(route, 'path', 'unmatched'), str(status_code)
+        ).observe(time.perf_counter() - start)
+
+
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 2000))
+
+
+@app.middleware("http")
+async def attribute_request_time(request: Request, call_next):
+    """Split wall time into mongo/upstream/app/queue; Server-Timing for admins, log slow requests"""
+    timing = request_timing.begin(request_timing.queue_seconds_from_header(request.headers.get('X-Request-Start')))
+    response = await call_next(request)
+    breakdown = timing.breakdown()
+    if timing.expose:
+        response.headers['Server-Timing'] = timing.server_timing_header()
+        response.headers['Timing-Allow-Origin'] = '*'   # lets the admin UI read it cross-origin
+    if breakdown['total'] * 1000 >= SLOW_REQUEST_MS:
+        route = request.scope.get('route')
+        logger.warning("Slow request %s", json.dumps({
+            'method': request.method,
+            'route': getattr(route, 'path', request.url.path),
+            'status': response.status_code,
+            'principal': timing.principal,
+            **{f'{name}_ms': round(seconds * 1000, 1) for name, seconds in breakdown.items()},
+            'top': [{'op': name, 'ms': round(seconds * 1000, 1), 'count': count} for name, seconds, count in timing.top()],
+        }))
+    return response
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -7532,6 +7341,182 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+background_workers: List[asyncio.Task] = []
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    outbox.start()
+    background_workers.append(asyncio.create_task(exchange_rate_service.run()))
+    background_workers.append(asyncio.create_task(run_giftcard_catalog_sync()))
+    background_workers.append(asyncio.create_task(run_price_index_refresh()))
+    for sweeper in (
+        ExpirySweeper('sms', db.sms_orders, _expire_sms_orders, 'cancelled', ORDER_EXPIRY_SWEEP_INTERVAL),
+        ExpirySweeper('reseller', db.reseller_orders, _expire_reseller_orders, 'refunded', ORDER_EXPIRY_SWEEP_INTERVAL),
+    ):
+        background_workers.append(asyncio.create_task(sweeper.run()))
+    webhook_inbox.register('ercaspay', _process_ercaspay_event)
+    webhook_inbox.register('payscribe', _process_payscribe_event)
+    webhook_inbox.register('plisio', _process_plisio_event)
+    webhook_inbox.register('paymentpoint', _process_paymentpoint_event)
+    webhook_inbox.start()
+    background_workers.append(asyncio.create_task(migrate_legacy_payloads()))
+    background_workers.append(asyncio.create_task(backfill_order_expiry()))
+    archiver = archive.Archiver(db, after_archive={'notifications': _recount_unread_after_archive})
+    background_workers.append(asyncio.create_task(archiver.run()))
+    background_workers.append(asyncio.create_task(analytics.run_exports(analytics_db)))
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create the indexes hot query paths rely on"""
+    indexes = [
+        (db.reseller_orders, [('reseller_id', 1), ('provider_order_id', 1)], {}),
+        (db.reseller_orders, [('status', 1), ('expires_at', 1)], {}),
+        (db.reseller_orders, 'expiry_claim', {'sparse': True}),
+        (db.sms_orders, [('status', 1), ('expires_at', 1)], {}),
+        (db.sms_orders, 'expiry_claim', {'sparse': True}),
+        (db.notifications, [('user_id', 1), ('created_at', -1)], {}),
+        (db.notification_inboxes, 'user_id', {'unique': True}),
+        (db.transactions, 'id', {}),
+        (db.promo_codes, 'code', {}),
+        (db.giftcard_catalog, 'productId', {'unique': True}),
+        (db.giftcard_catalog_meta, 'id', {'unique': True}),
+        (db.webhook_events, [('provider', 1), ('event_id', 1)], {'unique': True}),
+        (db.webhook_events, [('status', 1), ('next_attempt_at', 1)], {}),
+        (db.provider_payloads, 'id', {'unique': True}),
+        (db.otp_arrival_stats, [('provider', 1), ('service', 1)], {'unique': True}),
+        (db.payscribe_temp_accounts, 'account_number', {}),
+        (db.payscribe_temp_accounts, 'account_id', {'sparse': True}),
+        (db.promo_redemptions, [('promo_id', 1), ('user_id', 1)],
+         {'unique': True, 'partialFilterExpression': {'one_time_per_user': True}, 'name': 'promo_user_once'}),
+    ]
+    # One at a time, so an index that fails (e.g. duplicates blocking a unique one) does not skip the rest
+    for collection, keys, options in indexes:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception as e:
+            logger.error(f"Index creation error on {collection.name} {keys}: {e}")
+
+
+@app.on_event("startup")
+async def backfill_promo_used_counts():
+    """One-off: seed used_count on promos created before it was maintained"""
+    try:
+        missing = await db.promo_codes.find({'used_count': {'$exists': False}}, {'_id': 0, 'id': 1}).to_list(None)
+        if not missing:
+            return
+        ids = [p['id'] for p in missing]
+        counts = await db.promo_redemptions.aggregate([
+            {'$match': {'promo_id': {'$in': ids}}},
+            {'$group': {'_id': '$promo_id', 'count': {'$sum': 1}}}
+        ]).to_list(None)
+        count_map = {c['_id']: c['count'] for c in counts}
+        await db.promo_codes.bulk_write([
+            UpdateOne({'id': pid, 'used_count': {'$exists': False}}, {'$set': {'used_count': count_map.get(pid, 0)}})
+            for pid in ids
+        ])
+    except Exception as e:
+        logger.error(f"Promo used_count backfill error: {e}")
+
+
+# Raw payloads that older records still embed: (collection, field, reference field, payload kind)
+LEGACY_PAYLOAD_FIELDS = [
+    ('ercaspay_payments', 'ercaspay_response', 'ercaspay_response_id', 'ercaspay_response'),
+    ('payscribe_temp_accounts', 'payscribe_response', 'payscribe_response_id', 'payscribe_account'),
+    ('payscribe_temp_accounts', 'webhook_response', 'webhook_response_id', 'payscribe_webhook'),
+    ('crypto_invoices', 'raw', 'raw_id', 'plisio_invoice'),
+    ('crypto_invoices', 'webhook', 'webhook_id', 'plisio_webhook'),
+    ('transactions', 'metadata.reloadly_response', 'metadata.payload_id', 'reloadly_order'),
+    ('giftcard_orders', 'reloadly_data', 'reloadly_data_id', 'reloadly_order'),
+]
+
+
+async def migrate_legacy_payloads(batch_size: int = 200):
+    """One-off: move embedded raw provider payloads into provider_payloads"""
+    try:
+        for collection, field, ref_field, kind in LEGACY_PAYLOAD_FIELDS:
+            moved = 0
+            while True:
+                docs = await db[collection].find({field: {'$exists': True}}, {'_id': 1, 'id': 1, field: 1}).to_list(batch_size)
+                if not docs:
+                    break
+                ops = []
+                for doc in docs:
+                    payload = doc
+                    for part in field.split('.'):
+                        payload = (payload or {}).get(part)
+                    update = {'$unset': {field: ''}}
+                    if payload is not None:
+                        update['$set'] = {ref_field: await payload_store.save(kind, payload, doc.get('id'))}
+                        if field == 'payscribe_response':
+                            accounts = ((payload.get('message') or {}).get('details') or {}).get('account') or [{}]
+                            update['$set']['account_id'] = accounts[0].get('id')
+                    ops.append(UpdateOne({'_id': doc['_id']}, update))
+                await db[collection].bulk_write(ops, ordered=False)
+                moved += len(ops)
+            if moved:
+                logger.info(f"Moved {moved} legacy {collection}.{field} payloads to provider_payloads")
+
+        # PaymentPoint deposits stored the whole webhook body as metadata
+        while True:
+            txns = await db.transactions.find(
+                {'metadata.notification_status': {'$exists': True}}, {'_id': 1, 'id': 1, 'metadata': 1}
+            ).to_list(batch_size)
+            if not txns:
+                break
+            ops = []
+            for txn in txns:
+                data = txn['metadata']
+                ops.append(UpdateOne({'_id': txn['_id']}, {'$set': {'metadata': {
+                    'provider': 'paymentpoint',
+                    'customer_email': (data.get('customer') or {}).get('email'),
+                    'settlement_amount': data.get('settlement_amount'),
+                    'payload_id': await payload_store.save('paymentpoint_webhook', data, txn.get('id')),
+                }}}))
+            await db.transactions.bulk_write(ops, ordered=False)
+    except Exception as e:
+        logger.error(f"Legacy payload migration error: {e}")
+
+
+async def _recount_unread_after_archive(notifications: List[dict]):
+    """Archived unread notifications no longer count towards their users' unread badge"""
+    user_ids = {n['user_id'] for n in notifications if n.get('active') and not n.get('read_at') and not n.get('dismissed_at')}
+    for user_id in user_ids:
+        await _recount_unread(user_id)
+
+
+async def backfill_order_expiry(batch_size: int = 500):
+    """One-off: give active orders created before expiry tracking an `expires_at`"""
+    try:
+        for collection in (db.sms_orders, db.reseller_orders):
+            while True:
+                orders = await collection.find(
+                    {'status': 'active', 'expires_at': None}, {'_id': 1, 'created_at': 1}
+                ).to_list(batch_size)
+                if not orders:
+                    break
+                ops = []
+                for order in orders:
+                    try:
+                        created_at = datetime.fromisoformat(str(order.get('created_at')).replace('Z', '+00:00'))
+                    except ValueError:
+                        created_at = datetime.now(timezone.utc)
+                    if created_at.tzinfo is None:
+                        created_at = created_at.replace(tzinfo=timezone.utc)
+                    expires_at = created_at + timedelta(minutes=ORDER_LIFETIME_MINUTES)
+                    ops.append(UpdateOne({'_id': order['_id']}, {'$set': {'expires_at': expires_at.isoformat()}}))
+                await collection.bulk_write(ops, ordered=False)
+    except Exception as e:
+        logger.error(f"Order expiry backfill error: {e}")
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_workers:
+        task.cancel()
+    await webhook_inbox.stop()
+    await outbox.stop()
+    await providers.close_all()
+    analytics_client.close()
     client.close()
\ No newline at end of file
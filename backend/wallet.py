@@ -0,0 +1,97 @@
+"""Wallet balance movements.
+
+Every movement is a single atomic `find_one_and_update` on the user document. Debits
+carry the balance check in the query filter (`ngn_balance >= amount`), so concurrent
+purchases can never overdraw a wallet and callers get the resulting balances back
+without re-reading the user.
+"""
+import asyncio
+from typing import Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+BALANCE_FIELDS = {'NGN': 'ngn_balance', 'USD': 'usd_balance'}
+BALANCE_PROJECTION = {'_id': 0, 'ngn_balance': 1, 'usd_balance': 1}
+APPLIED_CREDITS_KEPT = 200   # idempotency keys remembered per wallet for credit_once
+CREDIT_MANY_CONCURRENCY = 16
+
+
+def balance_field(currency: str) -> str:
+    try:
+        return BALANCE_FIELDS[currency.upper()]
+    except (KeyError, AttributeError):
+        raise ValueError(f"Unsupported wallet currency: {currency}")
+
+
+class WalletService:
+    """Atomic debit/credit/exchange on `users` balances"""
+
+    def __init__(self, users_collection):
+        self.users = users_collection
+
+    async def _apply(self, query: dict, inc: dict) -> Optional[dict]:
+        return await self.users.find_one_and_update(
+            query,
+            {'$inc': inc},
+            projection=BALANCE_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def debit(self, user_id: str, amount: float, currency: str = 'NGN', allow_negative: bool = False) -> Optional[dict]:
+        """Take `amount` from the wallet.
+
+        Returns the new balances, or None when the user does not exist or the balance does
+        not cover the amount. `allow_negative` skips the balance condition and is only meant
+        for charges that were already settled upstream.
+        """
+        field = balance_field(currency)
+        query = {'id': user_id}
+        if not allow_negative:
+            query[field] = {'$gte': amount}
+        return await self._apply(query, {field: -amount})
+
+    async def credit(self, user_id: str, amount: float, currency: str = 'NGN') -> Optional[dict]:
+        """Add `amount` to the wallet. Returns the new balances, or None if the user does not exist"""
+        return await self._apply({'id': user_id}, {balance_field(currency): amount})
+
+    async def credit_once(self, user_id: str, amount: float, key: str, currency: str = 'NGN') -> Optional[dict]:
+        """Credit only if `key` has not been applied to this wallet before.
+
+        The key is recorded on the user document in the same update as the `$inc`, so a
+        retried webhook or a webhook racing a manual verify can never credit twice.
+        Returns the new balances, or None when the key was already applied.
+        """
+        return await self.users.find_one_and_update(
+            {'id': user_id, 'applied_credits': {'$ne': key}},
+            {
+                '$inc': {balance_field(currency): amount},
+                '$push': {'applied_credits': {'$each': [key], '$slice': -APPLIED_CREDITS_KEPT}},
+            },
+            projection=BALANCE_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def credit_once_many(self, credits: Iterable[Tuple[str, float, str, str]]) -> List[str]:
+        """`credit_once` for many (user_id, amount, key, currency), a bounded number at a time.
+
+        Returns the keys whose credit this call applied; keys already applied, by an earlier
+        call or a concurrent `credit_once`, are left out.
+        """
+        semaphore = asyncio.Semaphore(CREDIT_MANY_CONCURRENCY)
+
+        async def apply(user_id: str, amount: float, key: str, currency: str) -> Optional[str]:
+            async with semaphore:
+                return key if await self.credit_once(user_id, amount, key, currency) is not None else None
+
+        applied = await asyncio.gather(*(apply(*credit) for credit in credits))
+        return [key for key in applied if key is not None]
+
+    async def exchange(self, user_id: str, debit_amount: float, debit_currency: str,
+                       credit_amount: float, credit_currency: str) -> Optional[dict]:
+        """Move value between the user's own balances in one update. None when the debit side is not covered"""
+        debit_field = balance_field(debit_currency)
+        credit_field = balance_field(credit_currency)
+        return await self._apply(
+            {'id': user_id, debit_field: {'$gte': debit_amount}},
+            {debit_field: -debit_amount, credit_field: credit_amount},
+        )
@@ -0,0 +1,142 @@
+"""Durable inbox for payment provider webhooks.
+
+The HTTP handler only verifies the request, stores the raw event under a unique
+(provider, event_id) key and acks. Provider retries of the same event hit the unique
+index and are acked without being stored twice.
+
+Worker tasks claim pending events with a lease, run the provider's handler and mark
+them processed. A failed event is retried with backoff. An event whose worker died
+mid-way is picked up again once its lease expires, so handlers must be idempotent.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+WORKER_COUNT = 4
+POLL_INTERVAL_SECONDS = 2.0
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 900
+
+Handler = Callable[[dict], Awaitable[Optional[str]]]
+
+
+class WebhookInbox:
+    def __init__(self, collection, workers: int = WORKER_COUNT, poll_interval: float = POLL_INTERVAL_SECONDS):
+        self.collection = collection
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, Handler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def register(self, provider: str, handler: Handler):
+        self._handlers[provider] = handler
+
+    async def ingest(self, provider: str, event_id: str, payload: dict) -> bool:
+        """Persist an event. Returns False if it was already received (a provider retry)"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({
+                'id': str(uuid.uuid4()),
+                'provider': provider,
+                'event_id': event_id,
+                'payload': payload,
+                'status': 'pending',
+                'attempts': 0,
+                'received_at': now.isoformat(),
+                'next_attempt_at': now.isoformat(),
+            })
+        except DuplicateKeyError:
+            return False
+        if self._wakeup:
+            self._wakeup.set()
+        return True
+
+    async def pending_count(self) -> int:
+        return await self.collection.count_documents({'status': {'$in': ['pending', 'processing']}})
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        now_iso = now.isoformat()
+        return await self.collection.find_one_and_update(
+            {'$or': [
+                {'status': 'pending', 'next_attempt_at': {'$lte': now_iso}},
+                {'status': 'processing', 'lease_until': {'$lt': now_iso}},
+            ]},
+            {
+                '$set': {'status': 'processing', 'lease_until': (now + timedelta(seconds=LEASE_SECONDS)).isoformat()},
+                '$inc': {'attempts': 1},
+            },
+            sort=[('received_at', 1)],
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _process(self, event: dict):
+        handler = self._handlers.get(event['provider'])
+        try:
+            if handler is None:
+                raise RuntimeError(f"No webhook handler registered for {event['provider']}")
+            result = await handler(event['payload'])
+            await self.collection.update_one(
+                {'id': event['id']},
+                {'$set': {'status': 'processed', 'result': result, 'processed_at': datetime.now(timezone.utc).isoformat()},
+                 '$unset': {'lease_until': ''}}
+            )
+        except Exception as e:
+            attempts = event.get('attempts', 1)
+            failed = attempts >= MAX_ATTEMPTS
+            delay = min(RETRY_BASE_SECONDS * (2 ** (attempts - 1)), RETRY_MAX_SECONDS)
+            logger.error(f"Webhook {event['provider']}/{event['event_id']} attempt {attempts} failed: {e}")
+            await self.collection.update_one(
+                {'id': event['id']},
+                {'$set': {
+                    'status': 'failed' if failed else 'pending',
+                    'last_error': str(e)[:500],
+                    'next_attempt_at': (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat(),
+                }, '$unset': {'lease_until': ''}}
+            )
+
+    async def _run(self, worker: int):
+        while True:
+            # Cleared before looking, so an ingest that lands after an empty claim still wakes us
+            self._wakeup.clear()
+            try:
+                event = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook worker {worker} claim error: {e}")
+                event = None
+            if event:
+                await self._process(event)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -112,6 +112,7 @@ export function BuyDataSection({ axiosConfig, fetchProfile, fetchTransactions })
       const response = await axios.post(
         `${API}/api/payscribe/buy-data`,
         {
+          network: network.value,
           plan_code: selectedPlan.plan_code,
           recipient: phoneNumber
         },
@@ -426,6 +426,7 @@ const AdminPanel = ({ user, setUser }) => {
   });
 
   const [providerBalances, setProviderBalances] = useState(null);
+  const [providerHealth, setProviderHealth] = useState(null);
   const [selectedUser, setSelectedUser] = useState(null);
   const [editUser, setEditUser] = useState(null);
 
@@ -490,6 +491,15 @@ const AdminPanel = ({ user, setUser }) => {
     }
   };
 
+  const fetchProviderHealth = async () => {
+    try {
+      const resp = await axios.get(`${API}/admin/provider-health`, axiosConfig);
+      if (resp.data.success) setProviderHealth(resp.data.providers);
+    } catch (e) {
+      console.error('Failed to fetch provider health');
+    }
+  };
+
   const fetchReloadlyBalance = async () => {
     setReloadlyBalance(prev => ({ ...prev, loading: true, error: null }));
     try {
@@ -592,6 +602,7 @@ const AdminPanel = ({ user, setUser }) => {
     fetchUsers();
     fetchPromoCodes();
     fetchProviderBalances();
+    fetchProviderHealth();
     fetchAdminNotifications();
     fetchResellers();
     fetchResellerPlans();
@@ -3734,6 +3745,49 @@ const AdminPanel = ({ user, setUser }) => {
                   </CardContent>
                 </Card>
 
+                {/* Provider Health */}
+                <Card className="border border-slate-200 shadow-sm bg-white">
+                  <CardHeader className="pb-3">
+                    <div className="flex items-center justify-between">
+                      <div>
+                        <CardTitle className="text-sm font-semibold">Provider Health</CardTitle>
+                        <CardDescription className="text-xs">Circuit breaker state, error rate and latency (this server worker)</CardDescription>
+                      </div>
+                      <Button variant="outline" className="h-8 px-3 text-xs" onClick={fetchProviderHealth}>
+                        <RefreshCw className="w-3 h-3 mr-1.5" />
+                        Refresh
+                      </Button>
+                    </div>
+                  </CardHeader>
+                  <CardContent>
+                    {!providerHealth ? (
+                      <p className="text-xs text-slate-500">Loading health…</p>
+                    ) : (
+                      <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
+                        {Object.entries(providerHealth).map(([name, h]) => (
+                          <div key={name} className="p-4 rounded-xl border border-slate-200 bg-gradient-to-br from-slate-50 to-white">
+                            <div className="flex items-center justify-between mb-1">
+                              <div className="text-xs text-slate-500">{name}</div>
+                              <span className={`text-[10px] font-semibold px-2 py-0.5 rounded-full ${h.state === 'open' ? 'bg-red-100 text-red-700' : h.state === 'half_open' ? 'bg-amber-100 text-amber-700' : 'bg-emerald-100 text-emerald-700'}`}>
+                                {h.state === 'half_open' ? 'recovering' : h.state}
+                              </span>
+                            </div>
+                            <div className="text-xl font-bold text-slate-900">{Math.round((h.score ?? 0) * 100)}%</div>
+                            <div className="text-[11px] text-slate-500 mt-1">
+                              {Math.round((h.failure_rate ?? 0) * 100)}% errors · p95 {h.latency_p95 ?? '-'}s · {h.calls ?? 0} calls
+                            </div>
+                            {Object.entries(h.endpoints || {}).filter(([, e]) => e.state !== 'closed').map(([action, e]) => (
+                              <div key={action} className="text-[11px] text-red-600 mt-1">
+                                {action}: {e.state}{e.retry_in_seconds != null ? ` (retry in ${e.retry_in_seconds}s)` : ''}
+                              </div>
+                            ))}
+                          </div>
+                        ))}
+                      </div>
+                    )}
+                  </CardContent>
+                </Card>
+
                 {/* Markup & Exchange Rates */}
                 <Card className="border border-slate-200 shadow-sm bg-white">
                   <CardHeader className="pb-3">
@@ -0,0 +1,53 @@
+"""
+Test snapshot-backed analytics reports:
+1. GET /api/admin/analytics/{report} answers for every report
+2. Unknown reports and bad dates are rejected
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://otpsync.preview.emergentagent.com')
+
+
+class TestAnalyticsReports:
+    """Test GET /api/admin/analytics/{report}"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Login and get auth token"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"email": "admin@smsrelay.com", "password": "admin123"}
+        )
+        assert response.status_code == 200, f"Login failed: {response.text}"
+        self.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    @pytest.mark.parametrize("report", ["cohort-deposits", "service-revenue", "refund-rates"])
+    def test_report(self, report):
+        """Each report returns rows for the default period"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/{report}", headers=self.headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["report"] == report
+        assert isinstance(data["rows"], list)
+        print(f"✓ {report}: {len(data['rows'])} rows (data through {data['data_through']})")
+
+    def test_refund_rates_shape(self):
+        """Refund rates are shares between 0 and 1"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/refund-rates", headers=self.headers)
+        assert response.status_code == 200, response.text
+        for row in response.json()["rows"]:
+            assert 0 <= row["refund_rate"] <= 1
+            assert row["refunded"] <= row["orders"]
+        print("✓ Refund rates within bounds")
+
+    def test_rejects_bad_input(self):
+        """Unknown reports return 404 and malformed dates 400"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/nope", headers=self.headers)
+        assert response.status_code == 404
+        response = requests.get(
+            f"{BASE_URL}/api/admin/analytics/refund-rates", headers=self.headers, params={"start_date": "yesterday"}
+        )
+        assert response.status_code == 400
+        print("✓ Bad input rejected")
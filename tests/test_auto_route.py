@@ -0,0 +1,56 @@
+"""
+Test auto-routed purchases:
+1. A max_price below every route's price is refused before any provider is charged
+2. The legacy (non auto-routed) purchase still validates the server key
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://otpsync.preview.emergentagent.com')
+
+
+class TestAutoRoute:
+    """Test POST /api/orders/purchase with auto_route"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Login and get auth token"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"email": "admin@smsrelay.com", "password": "admin123"}
+        )
+        assert response.status_code == 200, f"Login failed: {response.text}"
+        self.headers = {
+            "Authorization": f"Bearer {response.json()['token']}",
+            "Content-Type": "application/json"
+        }
+
+    def test_max_price_too_low(self):
+        """No route is tried when all of them cost more than max_price"""
+        response = requests.post(
+            f"{BASE_URL}/api/orders/purchase",
+            headers=self.headers,
+            json={
+                "server": "us_server",
+                "service": "wa",
+                "country": "187",
+                "payment_currency": "NGN",
+                "auto_route": True,
+                "max_price": 0.01,
+            }
+        )
+        assert response.status_code == 400, response.text
+        detail = response.json()["detail"]
+        assert "maximum price" in detail or "Insufficient" in detail
+        print(f"✓ Auto-route refused: {detail}")
+
+    def test_invalid_server(self):
+        """Unknown server keys are rejected with or without auto_route"""
+        response = requests.post(
+            f"{BASE_URL}/api/orders/purchase",
+            headers=self.headers,
+            json={"server": "nope", "service": "wa", "country": "187", "auto_route": True}
+        )
+        assert response.status_code == 400
+        print("✓ Invalid server rejected")
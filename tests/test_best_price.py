@@ -0,0 +1,51 @@
+"""
+Test best-price lookup:
+1. GET /api/services/best-price returns results ranked by final price
+2. Unknown countries are rejected
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://otpsync.preview.emergentagent.com')
+
+
+class TestBestPrice:
+    """Test GET /api/services/best-price"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Login and get auth token"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"email": "admin@smsrelay.com", "password": "admin123"}
+        )
+        assert response.status_code == 200, f"Login failed: {response.text}"
+        self.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def test_ranked_results(self):
+        """Results across providers come cheapest first"""
+        response = requests.get(
+            f"{BASE_URL}/api/services/best-price",
+            headers=self.headers,
+            params={"service": "whatsapp", "country": "US"}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["country"] == "US"
+        prices = [r["final_price_usd"] for r in data["results"]]
+        assert prices == sorted(prices)
+        for result in data["results"]:
+            assert result["server"] in ("us_server", "server1", "server2")
+            assert result["final_price_ngn"] > 0
+        print(f"✓ {len(prices)} ranked offers")
+
+    def test_unknown_country(self):
+        """Countries that no provider knows return 404"""
+        response = requests.get(
+            f"{BASE_URL}/api/services/best-price",
+            headers=self.headers,
+            params={"service": "whatsapp", "country": "atlantis"}
+        )
+        assert response.status_code == 404
+        print("✓ Unknown country rejected")
@@ -0,0 +1,80 @@
+"""
+Test deposit crediting survives a failed attempt:
+1. A webhook whose credit fails leaves the payment unpaid
+2. The retried event credits the deposit exactly once and marks the payment paid
+
+Runs the backend's event handler in-process against the configured MongoDB
+(MONGO_URL / DB_NAME), since a credit failure cannot be provoked over HTTP.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+
+import pytest
+
+pytest.importorskip('motor')
+pytest.importorskip('fastapi')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+
+class TestDepositRetry:
+    """Test a failed deposit credit is retried, not lost"""
+
+    def test_failed_credit_is_retried(self, monkeypatch):
+        """An Ercaspay event whose first credit fails still credits on retry, once"""
+        import server
+        if server.db is None:
+            pytest.skip("MongoDB client not configured")
+
+        user_id = f"TEST_{uuid.uuid4().hex[:12]}"
+        payment_id = str(uuid.uuid4())
+        payment_ref = f"TEST_{uuid.uuid4().hex[:12]}"
+        payload = {"payment_reference": payment_ref, "transaction_reference": "ERCS|TEST", "status": "SUCCESSFUL"}
+
+        credit_once = server.wallet_service.credit_once
+        failures = []
+
+        async def credit_failing_once(*args, **kwargs):
+            if not failures:
+                failures.append(args)
+                raise RuntimeError("simulated credit failure")
+            return await credit_once(*args, **kwargs)
+
+        monkeypatch.setattr(server.wallet_service, 'credit_once', credit_failing_once)
+
+        async def scenario():
+            try:
+                await server.db.command('ping')
+            except Exception:
+                pytest.skip("MongoDB not reachable")
+            await server.db.users.insert_one({'id': user_id, 'email': f"{user_id}@test.local", 'ngn_balance': 0.0, 'usd_balance': 0.0})
+            await server.db.ercaspay_payments.insert_one({
+                'id': payment_id, 'user_id': user_id, 'amount': 500.0, 'status': 'pending',
+                'payment_reference': payment_ref, 'payment_method': 'bank-transfer',
+            })
+            try:
+                with pytest.raises(RuntimeError):
+                    await server._process_ercaspay_event(payload)
+                payment = await server.db.ercaspay_payments.find_one({'id': payment_id})
+                assert payment['status'] != 'paid'
+
+                assert await server._process_ercaspay_event(payload) == 'credited'
+                assert await server._process_ercaspay_event(payload) == 'already credited'
+
+                user = await server.db.users.find_one({'id': user_id})
+                payment = await server.db.ercaspay_payments.find_one({'id': payment_id})
+                transactions = await server.db.transactions.count_documents({'user_id': user_id})
+                return user['ngn_balance'], payment['status'], transactions
+            finally:
+                await server.db.users.delete_one({'id': user_id})
+                await server.db.ercaspay_payments.delete_one({'id': payment_id})
+                await server.db.transactions.delete_many({'user_id': user_id})
+
+        balance, status, transactions = asyncio.run(scenario())
+        assert balance == 500.0
+        assert status == 'paid'
+        assert transactions == 1
+        print("✓ Failed credit retried and applied once")
@@ -0,0 +1,48 @@
+"""
+Test metrics endpoint:
+1. GET /api/metrics serves the Prometheus text format to the configured token
+2. Route latency is labelled by route template
+3. Requests without the token are refused
+"""
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://otpsync.preview.emergentagent.com')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+class TestMetrics:
+    """Test GET /api/metrics"""
+
+    def _get_metrics(self):
+        return requests.get(f"{BASE_URL}/api/metrics", headers={"Authorization": f"Bearer {METRICS_TOKEN}"})
+
+    def test_metrics_require_token(self):
+        """Metrics are never served without the token"""
+        response = requests.get(f"{BASE_URL}/api/metrics")
+        assert response.status_code in (401, 403)
+        print("✓ Metrics protected by token")
+
+    def test_metrics_exposition_format(self):
+        """Metrics are served as Prometheus text"""
+        if not METRICS_TOKEN:
+            pytest.skip("METRICS_TOKEN not set")
+        response = self._get_metrics()
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert "# TYPE http_request_duration_seconds histogram" in body
+        assert "# TYPE upstream_request_duration_seconds histogram" in body
+        assert "otp_pollers_active" in body
+        print("✓ Metrics exposition format OK")
+
+    def test_route_template_label(self):
+        """Requests are recorded under their route template"""
+        if not METRICS_TOKEN:
+            pytest.skip("METRICS_TOKEN not set")
+        requests.get(f"{BASE_URL}/api/services/tigersms")
+        response = self._get_metrics()
+        assert 'route="/api/services/tigersms"' in response.text
+        print("✓ Route latency recorded")
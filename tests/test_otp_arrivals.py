@@ -0,0 +1,62 @@
+"""
+Test OTP arrival learning:
+1. GET /api/admin/provider-health reports recorded OTP arrivals per provider
+2. A purchased number that receives its code adds an arrival for its provider
+"""
+import time
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://otpsync.preview.emergentagent.com')
+OTP_WAIT_SECONDS = 120
+
+
+class TestOtpArrivals:
+    """Test that received OTPs are recorded into the arrival statistics"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Login and get auth token"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"email": "admin@smsrelay.com", "password": "admin123"}
+        )
+        assert response.status_code == 200, f"Login failed: {response.text}"
+        self.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def _arrivals(self, provider):
+        response = requests.get(f"{BASE_URL}/api/admin/provider-health", headers=self.headers)
+        assert response.status_code == 200, response.text
+        return response.json()["providers"][provider]["otp_arrivals"]
+
+    def test_arrivals_reported(self):
+        """Every provider reports a non-negative arrival count"""
+        for provider in ("daisysms", "smspool", "5sim"):
+            assert self._arrivals(provider) >= 0
+        print("✓ Arrival counts reported")
+
+    def test_received_otp_is_recorded(self):
+        """The arrival count grows once a purchased number receives its code"""
+        before = self._arrivals("daisysms")
+        response = requests.post(
+            f"{BASE_URL}/api/orders/purchase",
+            headers=self.headers,
+            json={"server": "us_server", "service": "wa", "country": "187", "payment_currency": "NGN"}
+        )
+        if response.status_code != 200:
+            pytest.skip(f"Purchase unavailable in this environment: {response.text}")
+        order_id = response.json()["order"]["id"]
+
+        deadline = time.time() + OTP_WAIT_SECONDS
+        status = "active"
+        while time.time() < deadline and status == "active":
+            time.sleep(5)
+            orders = requests.get(f"{BASE_URL}/api/orders/list", headers=self.headers).json()["orders"]
+            status = next((o["status"] for o in orders if o["id"] == order_id), "missing")
+        if status != "completed":
+            pytest.skip(f"No OTP arrived for order {order_id} (status {status})")
+
+        assert self._arrivals("daisysms") > before
+        print("✓ OTP arrival recorded")
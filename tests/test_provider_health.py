@@ -0,0 +1,41 @@
+"""
+Test provider health endpoint:
+1. GET /api/admin/provider-health lists every provider with its breaker state and score
+2. Non-admins are refused
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://otpsync.preview.emergentagent.com')
+
+
+class TestProviderHealth:
+    """Test GET /api/admin/provider-health"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Login and get auth token"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"email": "admin@smsrelay.com", "password": "admin123"}
+        )
+        assert response.status_code == 200, f"Login failed: {response.text}"
+        self.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def test_health_shape(self):
+        """Every provider reports a state and a 0..1 score"""
+        response = requests.get(f"{BASE_URL}/api/admin/provider-health", headers=self.headers)
+        assert response.status_code == 200, response.text
+        providers = response.json()["providers"]
+        for name in ("daisysms", "smspool", "5sim"):
+            assert providers[name]["state"] in ("closed", "open", "half_open")
+            assert 0 <= providers[name]["score"] <= 1
+            assert "endpoints" in providers[name]
+        print("✓ Provider health reported")
+
+    def test_requires_admin(self):
+        """Anonymous requests are refused"""
+        response = requests.get(f"{BASE_URL}/api/admin/provider-health")
+        assert response.status_code in (401, 403)
+        print("✓ Provider health requires admin")
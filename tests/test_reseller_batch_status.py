@@ -0,0 +1,78 @@
+"""
+Test reseller batch status endpoint:
+1. POST /api/reseller/v1/status/batch requires an API key
+2. Validates the provider_order_ids list and its size limit
+3. Unknown ids are reported in not_found
+"""
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://otpsync.preview.emergentagent.com')
+
+# Test credentials
+ADMIN_EMAIL = "admin@smsrelay.com"
+ADMIN_PASSWORD = "admin123"
+
+
+class TestResellerBatchStatus:
+    """Test POST /api/reseller/v1/status/batch"""
+
+    @pytest.fixture
+    def reseller_api_key(self):
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}
+        )
+        token = response.json()["token"]
+        profile = requests.get(
+            f"{BASE_URL}/api/reseller/profile",
+            headers={"Authorization": f"Bearer {token}"}
+        ).json()
+        if not profile.get("is_reseller"):
+            pytest.skip("Admin account is not registered as a reseller")
+        return profile["api_key"]
+
+    def test_batch_status_requires_api_key(self):
+        """Batch status endpoint requires API key"""
+        response = requests.post(
+            f"{BASE_URL}/api/reseller/v1/status/batch",
+            json={"provider_order_ids": ["1"]}
+        )
+        assert response.status_code in [401, 403]
+        print("✓ Batch status endpoint requires API key")
+
+    def test_batch_status_rejects_empty_list(self, reseller_api_key):
+        """Empty provider_order_ids is rejected"""
+        response = requests.post(
+            f"{BASE_URL}/api/reseller/v1/status/batch",
+            json={"provider_order_ids": []},
+            headers={"X-API-KEY": reseller_api_key}
+        )
+        assert response.status_code == 400
+        print("✓ Empty id list rejected")
+
+    def test_batch_status_rejects_oversized_batch(self, reseller_api_key):
+        """More than the allowed number of ids is rejected"""
+        response = requests.post(
+            f"{BASE_URL}/api/reseller/v1/status/batch",
+            json={"provider_order_ids": [str(i) for i in range(501)]},
+            headers={"X-API-KEY": reseller_api_key}
+        )
+        assert response.status_code == 400
+        print("✓ Oversized batch rejected")
+
+    def test_batch_status_reports_unknown_ids(self, reseller_api_key):
+        """Unknown ids come back in not_found"""
+        response = requests.post(
+            f"{BASE_URL}/api/reseller/v1/status/batch",
+            json={"provider_order_ids": ["TEST_missing_1", "TEST_missing_2"]},
+            headers={"X-API-KEY": reseller_api_key}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] == True
+        assert data["orders"] == []
+        assert set(data["not_found"]) == {"TEST_missing_1", "TEST_missing_2"}
+        print("✓ Unknown ids reported in not_found")
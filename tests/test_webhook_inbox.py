@@ -0,0 +1,47 @@
+"""
+Test payment webhook ingestion:
+1. Webhooks are acked immediately, including provider retries of the same event
+2. Malformed payloads are rejected without being queued
+"""
+
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://otpsync.preview.emergentagent.com')
+
+
+class TestWebhookInbox:
+    """Test fast-ack webhook endpoints"""
+
+    def test_ercaspay_retry_is_acked(self):
+        """The same Ercaspay event delivered twice is acked both times"""
+        payload = {
+            "payment_reference": f"TEST_{uuid.uuid4().hex[:12]}",
+            "transaction_reference": "ERCS|TEST",
+            "status": "SUCCESSFUL",
+            "amount": 100
+        }
+        for _ in range(2):
+            response = requests.post(f"{BASE_URL}/api/ercaspay/webhook", json=payload)
+            assert response.status_code == 200
+            assert response.json()["status"] == "ok"
+        print("✓ Duplicate Ercaspay webhook acked")
+
+    def test_ercaspay_missing_reference_ignored(self):
+        """An Ercaspay webhook without references is ignored"""
+        response = requests.post(f"{BASE_URL}/api/ercaspay/webhook", json={"status": "SUCCESSFUL"})
+        assert response.status_code == 200
+        assert response.json()["status"] == "ignored"
+        print("✓ Missing reference ignored")
+
+    def test_payscribe_invalid_json(self):
+        """Payscribe webhook rejects a non-JSON body"""
+        response = requests.post(
+            f"{BASE_URL}/api/payscribe/webhook",
+            data="not json",
+            headers={"Content-Type": "application/json"}
+        )
+        assert response.status_code == 200
+        assert response.json()["status"] == "error"
+        print("✓ Invalid JSON rejected")